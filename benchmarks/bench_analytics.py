@@ -0,0 +1,94 @@
+### STORY ANALYTICS BENCHMARK ###
+# Times the analytics table (story_analytics.py) over a synthetic library:
+# building the columns from story logs, saving and loading the .storycol cache,
+# and grouped reports, against the same counts computed by looping over the
+# story_log dicts (what a report costs without the table).
+#
+# Usage: python benchmarks/bench_analytics.py [--segments 1000000] [--per-story 200]
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import story_analytics
+from story_analytics import StoryTable, build_report
+from bench_pipeline import _story_log
+
+GENRES = ["Fantasy", "Sci-Fi", "Noir", "Romance", "Horror"]
+FORMATS = ["Narrative", "Screenplay", "Teleplay"]
+LANGUAGES = ["English", "Spanish", "French"]
+
+
+def _library(segments: int, per_story: int, seed: int = 5) -> list[tuple[str, list[dict], dict]]:
+    rng = random.Random(seed)
+    story_log = _story_log(per_story)
+    stories = []
+    for i in range(max(1, segments // per_story)):
+        metadata = {"story_genre": rng.choice(GENRES), "story_format": rng.choice(FORMATS), "story_language": rng.choice(LANGUAGES)}
+        stories.append((f"story_{i}.json", story_log, metadata))
+    return stories
+
+
+def _dict_report(stories: list[tuple[str, list[dict], dict]]) -> dict:
+    """The grouped counts of StoryTable.summarize(["genre", "format"]), by looping over dicts."""
+    groups = {}
+    for _, story_log, metadata in stories:
+        key = (metadata["story_genre"], metadata["story_format"])
+        row = groups.setdefault(key, {"segments": 0, "ai": 0, "bonus": 0, "words": 0})
+        for segment in story_log:
+            row["segments"] += 1
+            row["ai"] += segment["contributor"] == "AI"
+            row["bonus"] += segment["type"] == "Bonus Idea"
+            row["words"] += len(segment["text"].split())
+    return groups
+
+
+def run_benchmark(segments: int = 1_000_000, per_story: int = 200) -> dict:
+    """Returns {"segments", "backend", build/save/load/report times, "dict_report_seconds"}."""
+    stories = _library(segments, per_story)
+    table = StoryTable()
+    started = time.perf_counter()
+    table._append(stories)
+    build_seconds = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.storycol")
+        started = time.perf_counter()
+        table.save(path)
+        save_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        table = StoryTable.load(path)
+        load_seconds = time.perf_counter() - started
+        cache_bytes = os.path.getsize(path)
+
+    started = time.perf_counter()
+    build_report(table, ["genre", "format", "language"])
+    report_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    _dict_report(stories)
+    dict_seconds = time.perf_counter() - started
+    return {
+        "segments": len(table),
+        "backend": "numpy" if story_analytics.np is not None else "array",
+        "build_seconds": round(build_seconds, 3),
+        "save_seconds": round(save_seconds, 3),
+        "load_seconds": round(load_seconds, 3),
+        "report_seconds": round(report_seconds, 3),
+        "dict_report_seconds": round(dict_seconds, 3),
+        "cache_bytes_per_segment": round(cache_bytes / max(1, len(table)), 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the story analytics table.")
+    parser.add_argument("--segments", type=int, default=1_000_000)
+    parser.add_argument("--per-story", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.segments, args.per_story), indent=2))
@@ -0,0 +1,212 @@
+### STORY API BENCHMARK ###
+# Load-tests the headless HTTP API (story_api_server.py):
+#   - requests per second and latency for creating stories, appending segments and
+#     reading them back over keep-alive connections,
+#   - suggestion requests against the local mock upstream, with several clients
+#     asking for the same story version at once (one upstream call per version),
+#   - memory per idle story: while live, and once evicted to the session store,
+#     next to what the same story costs as a Streamlit session (which stays in
+#     memory as long as the browser tab is open),
+#   - one Streamlit script rerun (every GUI interaction runs the whole script),
+#     when streamlit is installed.
+#
+# Usage: python benchmarks/bench_api.py [--stories 200] [--idle-stories 2000] [--latency-ms 50]
+
+import os
+import sys
+import gc
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from story_api_server import StoryApiServer
+from session_store import SessionStore
+from diagnostics import deep_size
+from bench_pipeline import _story_log, start_mock_upstream
+
+SETUP = {"main_character_name": "Ada", "main_character_role": "pilot", "story_language": "English",
+         "story_genre": "Sci-Fi", "story_format": "Narrative"}
+
+
+def _percentile(samples: list[float], fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else 0.0
+
+
+def _timings(latencies: list[float], elapsed: float) -> dict:
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def _started_server(directory: str, **kwargs):
+    server_state = StoryApiServer(SessionStore(directory), **kwargs)
+    server = await server_state.start("127.0.0.1", 0)
+    return server_state, server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+
+def bench_requests(stories: int = 200, segments: int = 5, concurrency: int = 16) -> dict:
+    """Create, append and read over HTTP with `concurrency` keep-alive clients."""
+    import httpx
+
+    async def run() -> dict:
+        with tempfile.TemporaryDirectory() as directory:
+            server_state, server, url = await _started_server(directory)
+            samples = {"create": [], "append": [], "get": []}
+            elapsed = {}
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def timed(kind: str, method: str, path: str, **kwargs):
+                    async with semaphore:
+                        started = time.perf_counter()
+                        response = await client.request(method, path, **kwargs)
+                        samples[kind].append(time.perf_counter() - started)
+                        response.raise_for_status()
+                        return response.json()
+
+                started = time.perf_counter()
+                created = await asyncio.gather(*(timed("create", "POST", "/stories", json={**SETUP, "opening": "The ship woke."})
+                                                 for _ in range(stories)))
+                elapsed["create"] = time.perf_counter() - started
+                ids = [story["story_id"] for story in created]
+                texts = [segment["text"] for segment in _story_log(segments)]
+
+                async def append_all(story_id: str):
+                    for version, text in enumerate(texts, start=1):
+                        await timed("append", "POST", f"/stories/{story_id}/segments", json={"text": text, "expected_version": version})
+
+                started = time.perf_counter()
+                await asyncio.gather(*(append_all(story_id) for story_id in ids))
+                elapsed["append"] = time.perf_counter() - started
+                started = time.perf_counter()
+                await asyncio.gather(*(timed("get", "GET", f"/stories/{story_id}") for story_id in ids))
+                elapsed["get"] = time.perf_counter() - started
+            server_state.shutdown()
+            server.close()
+            await server.wait_closed()
+            return {kind: _timings(samples[kind], elapsed[kind]) for kind in samples}
+
+    return asyncio.run(run())
+
+
+def bench_suggestions(stories: int = 20, clients_per_story: int = 5, latency_ms: float = 50.0) -> dict:
+    """Every client of a story asks for its suggestions at once, for two story versions."""
+    import httpx
+
+    mock = start_mock_upstream(latency_ms)
+
+    async def run() -> dict:
+        with tempfile.TemporaryDirectory() as directory:
+            server_state, server, url = await _started_server(directory)
+            latencies = []
+            async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+                ids = [(await client.post("/stories", json={**SETUP, "opening": "The ship woke."})).json()["story_id"]
+                       for _ in range(stories)]
+
+                async def ask(story_id: str):
+                    started = time.perf_counter()
+                    response = await client.post(f"/stories/{story_id}/suggestions")
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                for version in (1, 2):
+                    await asyncio.gather(*(ask(story_id) for story_id in ids for _ in range(clients_per_story)))
+                    for story_id in ids:
+                        await client.post(f"/stories/{story_id}/segments", json={"text": "Then the lights went out.", "expected_version": version})
+                elapsed = time.perf_counter() - started
+            upstream_calls = sum(live.state["api_usage"]["gemini_calls"] for live in server_state.stories.values())
+            server_state.shutdown()
+            server.close()
+            await server.wait_closed()
+            return {**_timings(latencies, elapsed), "upstream_calls": upstream_calls}
+
+    try:
+        return asyncio.run(run())
+    finally:
+        mock.terminate()
+        mock.join()
+
+
+def bench_idle_memory(stories: int = 2000, segments: int = 20) -> dict:
+    """Traced memory per story while live and after eviction, against the same story kept as GUI session state."""
+    texts = [segment["text"] for segment in _story_log(segments)]
+
+    async def run() -> dict:
+        with tempfile.TemporaryDirectory() as directory:
+            server_state = StoryApiServer(SessionStore(directory), evict_after=3600)
+            ids = []
+            gc.collect()
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+            for _ in range(stories):
+                created = json.loads((await server_state.dispatch("POST", "/stories", {}, json.dumps(SETUP).encode())).body)
+                ids.append(created["story_id"])
+                for text in texts:
+                    await server_state.dispatch("POST", f"/stories/{created['story_id']}/segments", {}, json.dumps({"text": text}).encode())
+            gc.collect()
+            live_bytes = tracemalloc.get_traced_memory()[0] - baseline
+            session_state = server_state.stories[ids[0]].state
+            server_state.evict_after = 0
+            server_state._evict()
+            gc.collect()
+            evicted_bytes = tracemalloc.get_traced_memory()[0] - baseline - sys.getsizeof(ids) - sum(sys.getsizeof(i) for i in ids)
+            tracemalloc.stop()
+            disk_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+            return {
+                "stories": stories,
+                "live_bytes_per_story": round(live_bytes / stories),
+                "evicted_bytes_per_story": round(max(0, evicted_bytes) / stories),
+                "disk_bytes_per_story": round(disk_bytes / stories),
+                # The same state as a Streamlit session: resident until the tab closes
+                "session_state_bytes": deep_size(session_state),
+            }
+
+    return asyncio.run(run())
+
+
+def bench_streamlit_rerun(runs: int = 3) -> dict:
+    """Seconds per full script run of the GUI (what each click costs a Streamlit session)."""
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return {"skipped": "streamlit is not installed"}
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "story_verse_gui.py")
+    app = AppTest.from_file(script, default_timeout=60)
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        app.run()
+        samples.append(time.perf_counter() - started)
+    return {"rerun_seconds": round(min(samples), 3), "interactions_per_second_per_session": round(1 / min(samples), 2)}
+
+
+def run_benchmark(stories: int = 200, idle_stories: int = 2000, latency_ms: float = 50.0, streamlit: bool = True) -> dict:
+    """Returns {"requests", "suggestions", "idle_memory", "streamlit"}."""
+    return {
+        "requests": bench_requests(stories),
+        "suggestions": bench_suggestions(max(1, stories // 10), latency_ms=latency_ms),
+        "idle_memory": bench_idle_memory(idle_stories),
+        "streamlit": bench_streamlit_rerun() if streamlit else {"skipped": "disabled"},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the story HTTP API.")
+    parser.add_argument("--stories", type=int, default=200)
+    parser.add_argument("--idle-stories", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--no-streamlit", action="store_true", help="Skip the Streamlit rerun measurement.")
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.stories, args.idle_stories, args.latency_ms, not args.no_streamlit), indent=2))
@@ -0,0 +1,95 @@
+### STORY ARCHIVE BENCHMARK ###
+# Compares story archives (story_archive.py) with the JSON written by
+# save_story_to_file: file size, write time, and the cost of reading one random
+# segment or a 20-round range (the JSON side has to load the whole file for either).
+#
+# Usage: python benchmarks/bench_archive.py [--sizes 1000 10000 100000] [--lookups 500]
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from story_archive import StoryArchive, write_archive
+from bench_pipeline import _story_log, _per_call
+
+DEFAULT_SIZES = (1000, 10_000, 100_000)
+
+
+def _percentile(samples: list[float], fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def bench_size(size: int, directory: str, lookups: int = 500, seed: int = 3) -> dict:
+    story_log = _story_log(size)
+    json_path = os.path.join(directory, f"story_{size}.json")
+    archive_path = os.path.join(directory, f"story_{size}.storyarc")
+
+    def save_json():
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(story_log, f, indent=4) # As save_story_to_file writes it
+
+    json_write_seconds = _per_call(save_json, max_calls=20)
+    archive_write_seconds = _per_call(lambda: write_archive(story_log, archive_path), max_calls=20)
+
+    def load_json():
+        with open(json_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    json_load_seconds = _per_call(load_json, max_calls=20)
+
+    rng = random.Random(seed)
+    positions = [rng.randrange(size) for _ in range(lookups)]
+    segment_samples, range_samples = [], []
+    open_started = time.perf_counter()
+    with StoryArchive(archive_path) as archive:
+        open_seconds = time.perf_counter() - open_started
+        for position in positions: # Random positions, mostly missing the block cache
+            started = time.perf_counter()
+            segment = archive.segment(position)
+            segment_samples.append(time.perf_counter() - started)
+            assert segment == story_log[position]
+        for position in positions[:100]:
+            started = time.perf_counter()
+            archive.rounds(position, position + 19)
+            range_samples.append(time.perf_counter() - started)
+        full_seconds = _per_call(archive.story_log, max_calls=20)
+
+    json_bytes = os.path.getsize(json_path)
+    archive_bytes = os.path.getsize(archive_path)
+    text_bytes = sum(len(segment["text"].encode("utf-8")) for segment in story_log)
+    return {
+        "json_bytes": json_bytes,
+        "archive_bytes": archive_bytes,
+        "text_bytes": text_bytes,
+        "size_ratio": round(archive_bytes / json_bytes, 4),
+        "json_write_ms": round(json_write_seconds * 1000, 3),
+        "archive_write_ms": round(archive_write_seconds * 1000, 3),
+        "json_load_ms": round(json_load_seconds * 1000, 3),     # = cost of one segment from JSON
+        "archive_open_ms": round(open_seconds * 1000, 3),
+        "segment_p50_ms": round(_percentile(segment_samples, 0.5) * 1000, 4),
+        "segment_p99_ms": round(_percentile(segment_samples, 0.99) * 1000, 4),
+        "range_p50_ms": round(_percentile(range_samples, 0.5) * 1000, 4),
+        "archive_full_decode_ms": round(full_seconds * 1000, 3),
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, lookups: int = 500) -> dict:
+    """Returns {size: {sizes, write/load times, random access latencies}}."""
+    with tempfile.TemporaryDirectory() as directory:
+        return {str(size): bench_size(size, directory, lookups) for size in sizes}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark story archives against JSON story logs.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--lookups", type=int, default=500)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.sizes, args.lookups), indent=2))
@@ -0,0 +1,83 @@
+### COVER VARIANTS BENCHMARK ###
+# Time to the first and to the last cover variant (cover_variants.py) against
+# the mock upstream, for the ways a set of variants can be requested:
+#   - sequential: one Imagen request per style, one after the other,
+#   - styles: the same requests in parallel under the concurrency cap, each
+#     variant shown as soon as it arrives,
+#   - samples: one request for several samples of the concept.
+# The mock answers a multi-sample request as fast as a single one; real Imagen
+# takes longer per extra sample, so "samples" is a lower bound here.
+#
+# Usage: python benchmarks/bench_covers.py [--latency-ms 3000] [--count 4]
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cover_variants import generate_variants, variant_prompts
+from story_co_writer_ai import new_usage_counters
+from worker_pool import run_job
+from bench_pipeline import start_mock_upstream
+
+CONCEPT = "A lighthouse keeper reading a letter by lantern light as a storm breaks"
+POSTER_MOOD = "📖 Book Cover: Evocative, literary"
+ERA_STYLE = "1940s Noir"
+
+
+async def _sequential(count: int, usage: dict, roll: float) -> list[float]:
+    started, arrivals = time.perf_counter(), []
+    for variant in variant_prompts(CONCEPT, POSTER_MOOD, ERA_STYLE, count):
+        await run_job("image", {"prompt": variant["prompt"], "roll": roll}, usage)
+        arrivals.append(time.perf_counter() - started)
+    return arrivals
+
+
+async def _generated(mode: str, count: int, usage: dict, roll: float) -> list[float]:
+    async def run_image(prompt: str) -> str:
+        return await run_job("image", {"prompt": prompt, "roll": roll}, usage)
+
+    async def run_samples(prompt: str, sample_count: int) -> list[str]:
+        return await run_job("image_samples", {"prompt": prompt, "sample_count": sample_count}, usage)
+
+    started, arrivals = time.perf_counter(), []
+    async for _ in generate_variants(run_image, run_samples, CONCEPT, POSTER_MOOD, ERA_STYLE, count, mode):
+        arrivals.append(time.perf_counter() - started)
+    return arrivals
+
+
+def run_benchmark(latency_ms: float = 3000.0, count: int = 4) -> dict:
+    """Returns {mode: {"first_variant_ms", "all_variants_ms", "variants", "image_requests"}}."""
+    results = {}
+    mock = start_mock_upstream(latency_ms)
+    try:
+        for mode in ("sequential", "styles", "samples"):
+            usage = new_usage_counters()
+            roll = time.time() # Fresh variants, not the job store's results from the previous mode
+            if mode == "sequential":
+                arrivals = asyncio.run(_sequential(count, usage, roll))
+            else:
+                arrivals = asyncio.run(_generated(mode, count, usage, roll))
+            results[mode] = {
+                "first_variant_ms": round(arrivals[0] * 1000, 1),
+                "all_variants_ms": round(arrivals[-1] * 1000, 1),
+                "variants": len(arrivals),
+                "image_requests": usage["imagen_calls"],
+            }
+    finally:
+        mock.terminate()
+        mock.join()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sequential, parallel and multi-sample cover variants.")
+    parser.add_argument("--latency-ms", type=float, default=3000.0)
+    parser.add_argument("--count", type=int, default=4)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.latency_ms, args.count), indent=2))
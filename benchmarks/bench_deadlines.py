@@ -0,0 +1,86 @@
+### LATENCY BUDGET BENCHMARK ###
+# Round times against a slow upstream, with and without deadlines (deadlines.py).
+# A round here is what the GUI runs per click: the batched generation job, then
+# the visual concept's image. Without a deadline a slow upstream stacks both
+# calls' latency (up to the client's 60 s timeout each); with one, the round
+# shortens its context, serves the offline model or skips the image to stay
+# within its budget. Rounds of one latency run concurrently.
+#
+# Usage: python benchmarks/bench_deadlines.py [--latencies-ms 50 8000 30000] [--rounds 4]
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from deadlines import Deadline, IMAGE_MIN_SECONDS, deadline_phase
+from story_co_writer_ai import new_usage_counters
+from story_co_writer_non_ai_foundation import get_full_story_text
+from worker_pool import run_job
+from bench_pipeline import _story_log, start_mock_upstream
+
+DEFAULT_LATENCIES_MS = (50, 8000, 30000)
+
+
+async def _round(story_context: str, log_path: str, bounded: bool) -> dict:
+    usage = new_usage_counters()
+    deadline = Deadline("round") if bounded else None
+    payload = {"story_context": story_context, "language": "English", "genre": "Noir", "story_format": "Narrative"}
+    started = time.perf_counter()
+    result = await run_job("round", payload, usage, deadline=deadline)
+    concept = next((text for text, _ in result["suggestions"] if text.startswith("Visual Concept:")), "A rain-soaked street")
+    if deadline is None or deadline.allows(IMAGE_MIN_SECONDS):
+        with deadline_phase(deadline, "image"):
+            await run_job("image", {"prompt": concept}, usage, deadline=deadline)
+    else:
+        deadline.degrade("image_skipped")
+    seconds = time.perf_counter() - started
+    if deadline is not None:
+        deadline.finish("bench", log_path)
+    return {"seconds": seconds, "degraded": deadline.degraded if deadline else []}
+
+
+def _rounds(latency_ms: float, rounds: int, story_context: str, log_path: str, bounded: bool) -> dict:
+    async def drive() -> list[dict]:
+        return await asyncio.gather(*(_round(story_context, log_path, bounded) for _ in range(rounds)))
+
+    outcomes = asyncio.run(drive())
+    seconds = sorted(outcome["seconds"] for outcome in outcomes)
+    degraded = {}
+    for outcome in outcomes:
+        for what in outcome["degraded"]:
+            degraded[what] = degraded.get(what, 0) + 1
+    return {"p50_seconds": round(seconds[len(seconds) // 2], 3), "max_seconds": round(seconds[-1], 3), "degraded": degraded}
+
+
+def run_benchmark(latencies_ms=DEFAULT_LATENCIES_MS, rounds: int = 4, segments: int = 200) -> dict:
+    """Returns {latency_ms: {"with_deadlines", "without_deadlines"}} plus the budget."""
+    story_context = get_full_story_text(_story_log(segments))
+    results = {"round_budget": Deadline("round").budget}
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = os.path.join(directory, "deadlines.jsonl")
+        for latency_ms in latencies_ms:
+            mock = start_mock_upstream(latency_ms)
+            try:
+                results[str(latency_ms)] = {
+                    "with_deadlines": _rounds(latency_ms, rounds, story_context, log_path, True),
+                    "without_deadlines": _rounds(latency_ms, rounds, story_context, log_path, False),
+                }
+            finally:
+                mock.terminate()
+                mock.join()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark round times with and without latency budgets.")
+    parser.add_argument("--latencies-ms", type=float, nargs="+", default=list(DEFAULT_LATENCIES_MS))
+    parser.add_argument("--rounds", type=int, default=4)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.latencies_ms, args.rounds), indent=2))
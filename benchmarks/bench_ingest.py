@@ -0,0 +1,120 @@
+### STORY INGEST BENCHMARK ###
+# Bulk ingest of legacy story logs (story_ingest.py) over a synthetic library
+# in the mixed shapes found on disk: bare logs with the non-AI types, GUI records
+# with older field names, segments without "round", a few invalid records and
+# corrupt files.
+#   - throughput in files and segments per second, per pool size,
+#   - a second run over the same library (everything skipped via the manifest),
+#   - peak memory of streaming one large story file against json.load.
+#
+# Usage: python benchmarks/bench_ingest.py [--files 2000] [--workers 1 2 4] [--large-segments 200000]
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from story_ingest import ingest_library, iter_story_file
+from bench_pipeline import _story_log
+
+LEGACY_TYPES = ["continuation", "plot_twist", "character_idea", "bonus_idea", "free_form"]
+GUI_TYPES = ["Continuation", "Bonus Idea", "User Input"]
+
+
+def _legacy_log(rng: random.Random, segments: int) -> list:
+    story_log = [{"text": "It began at the harbour.", "contributor": "User", "round": 0}]
+    for position, segment in enumerate(_story_log(segments, seed=rng.randrange(1 << 30)), 1):
+        entry = {"text": segment["text"], "contributor": "AI", "type": rng.choice(LEGACY_TYPES)}
+        if entry["type"] == "free_form":
+            entry["contributor"] = "User"
+        if rng.random() > 0.2: # Some logs predate "round"
+            entry["round"] = position
+        story_log.append(entry)
+    if rng.random() < 0.1:
+        story_log.append({"text": ""})
+    return story_log
+
+
+def _gui_record(rng: random.Random, segments: int) -> dict:
+    story_log = [{"round": position, "text": segment["text"], "contributor": "AI", "type": rng.choice(GUI_TYPES)}
+                 for position, segment in enumerate(_story_log(segments, seed=rng.randrange(1 << 30)), 1)]
+    return {"main_character_name": "Ada", "genre": rng.choice(["Mystery", "Fantasy"]), "format": "Novel", "story_log": story_log}
+
+
+def write_library(directory: str, files: int, seed: int = 3) -> int:
+    """Writes `files` story files; returns how many are corrupt."""
+    rng = random.Random(seed)
+    corrupt = 0
+    for number in range(files):
+        path = os.path.join(directory, f"batch{number % 10}", f"story_{number}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if rng.random() < 0.01:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write('[{"text": "cut off')
+            corrupt += 1
+            continue
+        data = _legacy_log(rng, rng.randint(5, 60)) if rng.random() < 0.6 else _gui_record(rng, rng.randint(5, 60))
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+    return corrupt
+
+
+def bench_streaming(segments: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "large.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"story_genre": "Mystery", "story_log": _story_log(segments)}, f, indent=4)
+        megabytes = os.path.getsize(path) / 2**20
+
+        tracemalloc.start()
+        count = sum(1 for _ in iter_story_file(path, {}))
+        streamed_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        with open(path, "r", encoding="utf-8") as f:
+            loaded = len(json.load(f)["story_log"])
+        loaded_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    assert count == loaded == segments
+    return {"file_mb": round(megabytes, 1), "stream_peak_mb": round(streamed_peak / 2**20, 1), "json_load_peak_mb": round(loaded_peak / 2**20, 1)}
+
+
+def run_benchmark(files: int = 2000, worker_counts=(1, 2, 4), large_segments: int = 200_000) -> dict:
+    """Returns {"workers": {count: {...}}, "resume": {...}, "streaming": {...}}."""
+    results = {"workers": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        library = os.path.join(directory, "library")
+        corrupt = write_library(library, files)
+        for workers in worker_counts:
+            output = os.path.join(directory, f"out{workers}")
+            totals = ingest_library([library], output, max_workers=workers)
+            results["workers"][str(workers)] = {
+                "files_per_second": totals["files_per_second"],
+                "segments_per_second": totals["segments_per_second"],
+                "ingested": totals["ingested"],
+                "failed": totals["failed"],
+                "rejected": sum(totals["rejected"].values()),
+            }
+            assert totals["failed"] == corrupt
+        started = time.perf_counter()
+        totals = ingest_library([library], output, max_workers=worker_counts[-1])
+        results["resume"] = {"seconds": round(time.perf_counter() - started, 3), "skipped": totals["skipped"]}
+    results["streaming"] = bench_streaming(large_segments)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bulk ingest of legacy story logs.")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--large-segments", type=int, default=200_000)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.files, args.workers, args.large_segments), indent=2))
@@ -0,0 +1,233 @@
+### STORY PIPELINE BENCHMARK ###
+# Measures the hot paths of a story round, from prompt to disk:
+#   - prompt construction (generate_gemini_suggestions' instructions + story block),
+#   - response parsing (suggestions and combined round responses),
+#   - get_full_story_text and appending a segment (update_story_log) as the story grows,
+#   - save_story_to_file / load_story_from_file size scaling,
+#   - session snapshot serialisation (full frame, delta frame, restore),
+#   - end-to-end rounds against the local mock upstream.
+# Story sizes run from 10 to 100k segments; per-size numbers are the cost of one
+# call at that size.
+#
+# Usage: python benchmarks/bench_pipeline.py [--sizes 10 100 1000 10000 100000] [--rounds 200]
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_upstream import canned_round_text
+from bench_workers import _free_port, _serve_mock, _payload
+
+DEFAULT_SIZES = (10, 100, 1000, 10_000, 100_000)
+WORDS = ("the keeper lantern harbour storm letter shadow door stair tide ship bell "
+         "whisper ledger map key silence night dawn rope salt").split()
+
+
+def _story_log(segments: int, seed: int = 11) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {"round": i, "text": " ".join(rng.choices(WORDS, k=rng.randint(12, 30))).capitalize() + ".",
+         "contributor": rng.choice(["AI", "User"]), "type": rng.choice(["Continuation", "Bonus Idea", "User Input"])}
+        for i in range(segments)
+    ]
+
+
+def _per_call(function, min_seconds: float = 0.05, max_calls: int = 10_000) -> float:
+    """Seconds per call, repeating until min_seconds have elapsed (or max_calls)."""
+    calls, started = 0, time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds or calls >= max_calls:
+            return elapsed / calls
+
+
+def bench_prompts(sizes) -> dict:
+    from story_co_writer_ai import build_suggestions_instructions, format_story_block
+    from story_co_writer_non_ai_foundation import get_full_story_text
+    results = {}
+    for size in sizes:
+        context = get_full_story_text(_story_log(size))
+        seconds = _per_call(lambda: (
+            build_suggestions_instructions("English", "Mystery", "Novel", "", "Gothic", "1940s Noir"),
+            format_story_block(context)
+        ))
+        results[str(size)] = {"build_ms": round(seconds * 1000, 4), "context_kb": round(len(context) / 1024, 1)}
+    return results
+
+
+def bench_parsing(responses: int = 2000) -> dict:
+    from story_co_writer_ai import parse_suggestions, parse_endings
+    rng = random.Random(5)
+    texts = [canned_round_text(rng) for _ in range(200)]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull): # Padding warnings
+        started = time.perf_counter()
+        for i in range(responses):
+            parse_suggestions(texts[i % len(texts)])
+        suggestions_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for i in range(responses):
+            parse_endings(texts[i % len(texts)], combined=True)
+        endings_seconds = time.perf_counter() - started
+    return {
+        "suggestions_per_second": round(responses / suggestions_seconds, 1),
+        "endings_per_second": round(responses / endings_seconds, 1),
+    }
+
+
+def bench_story_growth(sizes, appends: int = 50) -> dict:
+    from story_co_writer_non_ai_foundation import get_full_story_text
+    from story_records import append_story_segment
+    from suggestion_diversity import SketchIndex
+    results = {}
+    for size in sizes:
+        story_log = _story_log(size)
+        full_text_seconds = _per_call(lambda: get_full_story_text(story_log), max_calls=200)
+        state = {
+            "round_number": size, "story_version": size, "story_log": story_log,
+            "current_story": get_full_story_text(story_log), "sketch_index": SketchIndex(),
+        }
+        new_segments = [segment["text"] for segment in _story_log(appends, seed=size)]
+        started = time.perf_counter()
+        for text in new_segments:
+            append_story_segment(state, text, "AI", "Continuation")
+        append_seconds = (time.perf_counter() - started) / appends
+        results[str(size)] = {
+            "full_story_text_ms": round(full_text_seconds * 1000, 4),
+            "append_segment_ms": round(append_seconds * 1000, 4),
+        }
+    return results
+
+
+def bench_story_files(sizes) -> dict:
+    from story_co_writer_non_ai_foundation import save_story_to_file, load_story_from_file
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        path = os.path.join(directory, "story.json")
+        for size in sizes:
+            story_log = _story_log(size)
+            save_seconds = _per_call(lambda: save_story_to_file(story_log, path), max_calls=50)
+            load_seconds = _per_call(lambda: load_story_from_file(path), max_calls=50)
+            megabytes = os.path.getsize(path) / 2**20
+            results[str(size)] = {
+                "save_ms": round(save_seconds * 1000, 3),
+                "load_ms": round(load_seconds * 1000, 3),
+                "save_mb_per_second": round(megabytes / save_seconds, 1),
+                "load_mb_per_second": round(megabytes / load_seconds, 1),
+            }
+    return results
+
+
+def bench_session_snapshots(sizes) -> dict:
+    from session_store import SessionStore, new_resume_token
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            store = SessionStore(directory)
+            token = new_resume_token()
+            story_log = _story_log(size)
+            state = {"story_log": story_log, "current_story": "", "round_number": size, "story_version": size,
+                     "api_usage": {"gemini_calls": size}, "story_genre": "Mystery", "story_format": "Novel"}
+            started = time.perf_counter()
+            store.save(token, state)
+            full_seconds = time.perf_counter() - started
+            delta_samples = []
+            for i in range(20):
+                story_log.append({"round": size + i, "text": "A new segment.", "contributor": "User", "type": "User Input"})
+                state["round_number"] += 1
+                started = time.perf_counter()
+                store.save(token, state)
+                delta_samples.append(time.perf_counter() - started)
+            restored = {}
+            restore_seconds = _per_call(lambda: store.restore(token, restored), max_calls=20)
+            results[str(size)] = {
+                "save_full_ms": round(full_seconds * 1000, 3),
+                "save_delta_ms": round(sorted(delta_samples)[len(delta_samples) // 2] * 1000, 3),
+                "restore_ms": round(restore_seconds * 1000, 3),
+            }
+    return results
+
+
+def start_mock_upstream(latency_ms: float) -> multiprocessing.Process:
+    """Starts the mock upstream in a child process and points the engine at it (terminate() when done)."""
+    port = _free_port()
+    import story_co_writer_ai
+    story_co_writer_ai.API_BASE_URL = f"http://127.0.0.1:{port}/v1beta"
+    story_co_writer_ai.API_KEY = "mock"
+    story_co_writer_ai.set_reporters(lambda *_: None, lambda *_: None)
+    mock = multiprocessing.Process(target=_serve_mock, args=(port, latency_ms), daemon=True)
+    mock.start()
+    for _ in range(100): # Wait for the mock to accept connections
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return mock
+
+
+def bench_rounds(rounds: int = 200, latency_ms: float = 50.0, concurrency: int = 8) -> dict:
+    """End-to-end in-process rounds (prompt, call, parse, diversity) against the mock upstream."""
+    mock = start_mock_upstream(latency_ms)
+    from worker_pool import run_job
+
+    async def drive() -> list[float]:
+        latencies, semaphore = [], asyncio.Semaphore(concurrency)
+
+        async def one(i: int):
+            async with semaphore:
+                started = time.perf_counter()
+                await run_job("round", _payload(i), usage={}) # In-process unless STORY_SHARED_STORE is set
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(one(i) for i in range(rounds)))
+        return latencies
+
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            latencies = sorted(asyncio.run(drive()))
+            elapsed = time.perf_counter() - started
+    finally:
+        mock.terminate()
+        mock.join()
+    return {
+        "rounds_per_second": round(rounds / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+        # What the pipeline adds on top of the upstream's latency
+        "overhead_p50_ms": round(latencies[len(latencies) // 2] * 1000 - latency_ms, 1),
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, rounds: int = 200, latency_ms: float = 50.0) -> dict:
+    """Returns {"prompts", "parsing", "story_growth", "story_files", "session_snapshots", "rounds"}."""
+    return {
+        "prompts": bench_prompts(sizes),
+        "parsing": bench_parsing(),
+        "story_growth": bench_story_growth(sizes),
+        "story_files": bench_story_files(sizes),
+        "session_snapshots": bench_session_snapshots(sizes),
+        "rounds": bench_rounds(rounds, latency_ms),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the story pipeline's hot paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.sizes, args.rounds, args.latency_ms), indent=2))
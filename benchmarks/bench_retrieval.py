@@ -0,0 +1,58 @@
+### STORY RETRIEVAL BENCHMARK ###
+# Costs and recall of retrieval-based context selection (story_retrieval.py) on
+# synthetic stories of growing length:
+#   - index update per appended segment (should not grow with the story),
+#   - time to assemble a context within the byte budget,
+#   - whether a backstory told in the first segment reaches the prompt once the
+#     latest segment refers back to it, against sending the tail of the story.
+#
+# Usage: python benchmarks/bench_retrieval.py [--sizes 1000 10000 100000]
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from story_retrieval import StoryRetrievalIndex, RETRIEVAL_CONTEXT_BYTES
+from bench_pipeline import _story_log
+
+DEFAULT_SIZES = (1000, 10_000, 100_000)
+BACKSTORY = "Ada Vance lost her brother Tomas to the storm off Port Sable, and she still carries his brass compass."
+CALLBACK = "Ada turned the brass compass over and thought of Tomas."
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, appends: int = 200) -> dict:
+    """Returns {size: {"append_us", "context_ms", "context_bytes", "backstory_in_context", "backstory_in_tail"}}."""
+    results = {}
+    for size in sizes:
+        story_log = [{"text": BACKSTORY}] + _story_log(size) + [{"text": CALLBACK}]
+        index = StoryRetrievalIndex()
+        index.sync(story_log[:-appends - 1])
+        started = time.perf_counter()
+        for segment in story_log[-appends - 1:]:
+            index.add(segment["text"])
+        append_seconds = (time.perf_counter() - started) / (appends + 1)
+
+        started = time.perf_counter()
+        context = index.story_context(story_log, "Ada")
+        context_seconds = time.perf_counter() - started
+        tail = " ".join(segment["text"] for segment in story_log)[-RETRIEVAL_CONTEXT_BYTES:]
+        results[str(size)] = {
+            "append_us": round(append_seconds * 1e6, 2),
+            "context_ms": round(context_seconds * 1000, 3),
+            "context_bytes": len(context.encode("utf-8")),
+            "backstory_in_context": BACKSTORY in context,
+            "backstory_in_tail": BACKSTORY in tail,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark retrieval-based story context selection.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.sizes), indent=2))
@@ -0,0 +1,153 @@
+### STORY ROOMS LOAD TEST ###
+# Drives shared writing rooms (story_rooms.py) the way a busy writing session does:
+#   - fan-out: a writer thread appends segments while 100 members per room wait
+#     on their subscriptions and apply each event to their own copy of the story;
+#     measures delivery latency, deliveries per second and event size against the
+#     full story text a naive push would resend,
+#   - deduplicated generation: every member of a room asks for suggestions for the
+#     same story version at once, against the local mock upstream; counts the
+#     upstream calls actually made.
+#
+# Usage: python benchmarks/bench_rooms.py [--rooms 4] [--subscribers 100] [--segments 200]
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from story_rooms import StoryRoom, apply_room_events
+from bench_pipeline import _story_log, start_mock_upstream
+from bench_workers import _payload
+
+
+def _member_state() -> dict:
+    return {"story_log": [], "current_story": "", "round_number": 0, "story_version": 0,
+            "suggestions_with_commentary": [], "sketch_index": None}
+
+
+def _percentile(samples: list[float], fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else 0.0
+
+
+def bench_fanout(rooms: int = 4, subscribers: int = 100, segments: int = 200, interval_ms: float = 2.0) -> dict:
+    room_list = [StoryRoom(f"bench{i}") for i in range(rooms)]
+    published: dict[tuple[str, int], float] = {} # (room, seq) -> publish time
+    texts = [segment["text"] for segment in _story_log(segments)]
+
+    def write():
+        for text in texts:
+            for room in room_list:
+                event = room.append(text, "AI", "Continuation")
+                published[(room.room_id, event["seq"])] = time.perf_counter()
+            time.sleep(interval_ms / 1000)
+
+    async def member(room: StoryRoom, subscription, state: dict, latencies: list[float]):
+        while state["story_version"] < segments:
+            events = await subscription.wait(timeout=5)
+            received = time.perf_counter()
+            apply_room_events(state, events)
+            for event in events:
+                sent = published.get((room.room_id, event["seq"]))
+                if sent is not None:
+                    latencies.append(received - sent)
+
+    async def run() -> tuple[list[float], list[dict], float]:
+        latencies, states, tasks = [], [], []
+        for room in room_list:
+            for _ in range(subscribers):
+                subscription = room.subscribe()
+                state = _member_state()
+                apply_room_events(state, subscription.poll()) # Joining: the (empty) snapshot
+                states.append(state)
+                tasks.append(asyncio.create_task(member(room, subscription, state, latencies)))
+        await asyncio.sleep(0.05) # Let every member start waiting
+        writer = threading.Thread(target=write)
+        started = time.perf_counter()
+        writer.start()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        writer.join()
+        return latencies, states, elapsed
+
+    latencies, states, elapsed = asyncio.run(run())
+    final_story = room_list[0]._state["current_story"]
+    event_bytes = [len(json.dumps(event)) for event in room_list[0].events_since(0) if event["kind"] == "segment"]
+    return {
+        "members": rooms * subscribers,
+        "deliveries": len(latencies),
+        "deliveries_per_second": round(len(latencies) / elapsed, 1),
+        "delivery_p50_ms": round(_percentile(latencies, 0.5) * 1000, 3),
+        "delivery_p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "consistent": all(state["current_story"] == final_story for state in states),
+        "event_bytes_mean": round(sum(event_bytes) / len(event_bytes), 1),
+        # What pushing the whole story on every change would cost at the end
+        "full_text_bytes_final": len(final_story.encode("utf-8")),
+    }
+
+
+def bench_generation(subscribers: int = 100, rounds: int = 5, latency_ms: float = 50.0) -> dict:
+    from story_co_writer_ai import new_usage_counters
+    from worker_pool import run_job
+    from ending_pregen import BackgroundLoop
+
+    mock = start_mock_upstream(latency_ms)
+    background = BackgroundLoop()
+    room = StoryRoom("benchgen")
+    usage = new_usage_counters()
+    waits = []
+
+    async def generate(payload: dict) -> dict:
+        return await run_job("round", payload, usage=usage)
+
+    async def member(i: int):
+        started = time.perf_counter()
+        generation, _ = room.generation_for(room.story_version, lambda: background.submit(generate(_payload(i))))
+        await asyncio.wrap_future(generation)
+        waits.append(time.perf_counter() - started)
+
+    async def run():
+        for round_num in range(rounds):
+            await asyncio.gather(*(member(i) for i in range(subscribers)))
+            room.append(f"Round {round_num} happened.", "User")
+
+    try:
+        started = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - started
+    finally:
+        background.shutdown()
+        mock.terminate()
+        mock.join()
+    return {
+        "requests": subscribers * rounds,
+        "upstream_calls": usage["gemini_calls"],
+        "generations_shared": room.counters["generations_shared"],
+        "wait_p50_ms": round(_percentile(waits, 0.5) * 1000, 1),
+        "wait_p99_ms": round(_percentile(waits, 0.99) * 1000, 1),
+        "seconds": round(elapsed, 3),
+    }
+
+
+def run_benchmark(rooms: int = 4, subscribers: int = 100, segments: int = 200, latency_ms: float = 50.0) -> dict:
+    """Returns {"fanout", "generation"}."""
+    return {
+        "fanout": bench_fanout(rooms, subscribers, segments),
+        "generation": bench_generation(subscribers, latency_ms=latency_ms),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test shared story rooms.")
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument("--segments", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.rooms, args.subscribers, args.segments, args.latency_ms), indent=2))
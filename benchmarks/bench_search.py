@@ -0,0 +1,86 @@
+### SEARCH INDEX BENCHMARK ###
+# Builds a synthetic story library in memory and measures story_search query
+# latency (single term, multi-term, facet-filtered, facet-only) at 100k segments.
+#
+# Usage: python benchmarks/bench_search.py [--segments 100000] [--queries 200]
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from story_search import StorySearchIndex
+
+GENRES = ["Fantasy", "Sci-Fi", "Mystery", "Romance", "Thriller", "Historical"]
+FORMATS = ["Novel", "Short Story", "Screenplay", "Television Script", "Play"]
+ERAS = ["1920s Modernist", "1940s Noir", "1950s Stage Drama", "1960s Beatnik", "1980s Television", "1990s Speculative Fiction", ""]
+ROLES = ["Hero", "Villain", "Wanderer"]
+TYPES = ["Continuation", "Bonus Idea", "User Input"]
+
+
+def build_library(segments: int, segments_per_story: int = 40, vocabulary: int = 20000, seed: int = 7) -> StorySearchIndex:
+    """Indexes `segments` synthetic segments with a Zipf-like word distribution."""
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary)] + ["librarian", "villain", "ledger", "lighthouse", "dragon"]
+    cumulative, total = [], 0.0
+    for rank in range(len(words)):
+        total += 1 / (rank + 1)
+        cumulative.append(total)
+    index = StorySearchIndex()
+    for story in range(segments // segments_per_story):
+        metadata = {
+            "story_genre": rng.choice(GENRES),
+            "story_format": rng.choice(FORMATS),
+            "era_style": rng.choice(ERAS),
+            "main_character_role": rng.choice(ROLES),
+            "story_language": "English",
+        }
+        story_log = []
+        for segment in range(segments_per_story):
+            text = " ".join(rng.choices(words, cum_weights=cumulative, k=rng.randint(12, 30)))
+            story_log.append({"round": segment, "text": text, "contributor": rng.choice(["AI", "User"]), "type": rng.choice(TYPES)})
+        index.add_story(f"story_{story}.json", story_log, metadata)
+    return index
+
+
+def _percentiles(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {"p50_ms": round(pick(0.50) * 1000, 3), "p95_ms": round(pick(0.95) * 1000, 3), "p99_ms": round(pick(0.99) * 1000, 3)}
+
+
+def run_benchmark(segments: int = 100_000, queries: int = 200) -> dict:
+    """Returns build time and per-query-shape latency percentiles."""
+    started = time.perf_counter()
+    index = build_library(segments)
+    build_seconds = time.perf_counter() - started
+
+    rng = random.Random(11)
+    shapes = {
+        "single_term": lambda: (f"w{rng.randint(0, 2000)}", None),
+        "multi_term": lambda: (f"librarian w{rng.randint(0, 500)} w{rng.randint(0, 5000)}", None),
+        "faceted": lambda: ("villain librarian", {"format": "Screenplay", "era": "noir"}),
+        "facet_only": lambda: ("", {"genre": rng.choice(GENRES), "role": "Villain"}),
+    }
+    results = {"segments": len(index.docs), "build_seconds": round(build_seconds, 3)}
+    for name, make_query in shapes.items():
+        timings = []
+        for _ in range(queries):
+            text, filters = make_query()
+            started = time.perf_counter()
+            index.search(text, filters, limit=10)
+            timings.append(time.perf_counter() - started)
+        results[name] = _percentiles(timings)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark story_search query latency.")
+    parser.add_argument("--segments", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.segments, args.queries), indent=4))
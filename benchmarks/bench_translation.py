@@ -0,0 +1,71 @@
+### STORY TRANSLATION BENCHMARK ###
+# What another-language edition costs with segment-level translation
+# (story_translation.py) against the mock upstream: the first full translation,
+# then one more round appended and the edition refreshed, against resending the
+# whole story each time. Costs are upstream calls and prompt tokens.
+#
+# Usage: python benchmarks/bench_translation.py [--segments 200 1000] [--latency-ms 50]
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from story_translation import TranslationCache, translate_record
+from story_co_writer_ai import new_usage_counters
+from story_co_writer_non_ai_foundation import get_full_story_text
+from token_accounting import estimate_tokens
+from bench_pipeline import _story_log, start_mock_upstream
+
+DEFAULT_SEGMENTS = (200, 1000)
+
+
+def _edition(record: dict, cache: TranslationCache) -> dict:
+    usage = new_usage_counters()
+    started = time.perf_counter()
+    _, stats = asyncio.run(translate_record(record, "French", usage, cache))
+    return {
+        "calls": stats["calls"],
+        "prompt_tokens": usage["prompt_tokens"],
+        "translated": stats["translated"],
+        "failed": stats["failed"],
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def run_benchmark(segments=DEFAULT_SEGMENTS, latency_ms: float = 50.0) -> dict:
+    """Returns {segments: {"full", "after_one_round", "whole_story_prompt_tokens"}}."""
+    mock = start_mock_upstream(latency_ms)
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for size in segments:
+                cache = TranslationCache(os.path.join(directory, str(size)))
+                story_log = _story_log(size)
+                record = {"story_language": "English", "story_genre": "Noir", "story_format": "Narrative", "story_log": story_log}
+                full = _edition(record, cache)
+                record["story_log"] = story_log + [{"round": size, "text": "Then the lights went out.", "contributor": "User", "type": "User Input"}]
+                results[str(size)] = {
+                    "full": full,
+                    "after_one_round": _edition(record, cache),
+                    # What resending current_story for every edition costs, per edition
+                    "whole_story_prompt_tokens": estimate_tokens(get_full_story_text(record["story_log"]), "English"),
+                }
+    finally:
+        mock.terminate()
+        mock.join()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark incremental story translation.")
+    parser.add_argument("--segments", type=int, nargs="+", default=list(DEFAULT_SEGMENTS))
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.segments, args.latency_ms), indent=2))
@@ -0,0 +1,148 @@
+### WARM POOL BENCHMARK ###
+# The warm pool of opening rounds (warm_pool.py):
+#   - first_round: time to a shown opening round (suggestions plus the concept's
+#     image) against the mock upstream, generated live vs served from the pool,
+#   - demand: a simulated day of "Create Story" clicks over every setup
+#     combination, a few setups far more popular than the rest, with the pool
+#     adapting its stock under its refill rate budget: how many clicks it served
+#     and how many generated sets went unused.
+#
+# Usage: python benchmarks/bench_warm_pool.py [--latency-ms 2000] [--rounds 5] [--clicks 2000]
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import itertools
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from warm_pool import WarmPool, opening_payload, setup_key, NAME_PLACEHOLDER, ROLE_PLACEHOLDER
+from story_co_writer_ai import new_usage_counters
+from image_pipeline import ImagePipeline
+from worker_pool import run_job
+from bench_pipeline import start_mock_upstream
+
+# The setup buttons of the GUI
+GENRES = ["Fantasy", "Sci-Fi", "Mystery", "Romance", "Thriller", "Historical"]
+FORMATS = ["Novel", "Short Story", "Screenplay", "Television Script", "Play"]
+LANGUAGES = ["English", "Spanish", "French", "German", "Hindi", "Chinese"]
+ERAS = ["", "1920s Modernist", "1940s Noir", "1950s Stage Drama", "1960s Beatnik", "1980s Television", "1990s Speculative Fiction"]
+WRITER = {"main_character_name": "Ada", "main_character_role": "Hero"}
+
+
+def _setup(genre: str, story_format: str, language: str, era_style: str) -> dict:
+    return {**WRITER, "story_genre": genre, "story_format": story_format, "story_language": language, "era_style": era_style, "aesthetic_style": ""}
+
+
+def _concept(suggestions: list) -> str:
+    return next((text for text, _ in suggestions if text.startswith("Visual Concept:")), "Visual Concept: A door").replace("Visual Concept: ", "")
+
+
+async def _live_round(setup: dict, images: ImagePipeline) -> float:
+    started = time.perf_counter()
+    payload = opening_payload(setup_key(setup))
+    result = await run_job("round", payload, new_usage_counters())
+    concept = _concept(result["suggestions"])
+    images.store(concept, await run_job("image", {"prompt": concept, "roll": payload["roll"]}, new_usage_counters()))
+    return time.perf_counter() - started
+
+
+async def _pooled_round(setup: dict, pool: WarmPool, images: ImagePipeline) -> float:
+    started = time.perf_counter()
+    pooled = pool.take(setup)
+    concept = _concept(pooled["suggestions"])
+    images.store(concept, pooled["image_url"])
+    images.lookup(concept)
+    return time.perf_counter() - started
+
+
+def bench_first_round(latency_ms: float, rounds: int) -> dict:
+    setup = _setup("Mystery", "Novel", "English", "1940s Noir")
+    mock = start_mock_upstream(latency_ms)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            images = ImagePipeline(os.path.join(directory, "images"))
+            pool = WarmPool(os.path.join(directory, "pool"), max_stock=rounds, refills_per_minute=6000)
+            live = [asyncio.run(_live_round(setup, images)) for _ in range(rounds)]
+
+            async def run_round(payload: dict) -> dict:
+                return await run_job("round", payload, new_usage_counters())
+
+            async def run_image(prompt: str) -> str:
+                return await run_job("image", {"prompt": prompt, "roll": time.time()}, new_usage_counters())
+
+            for _ in range(rounds * 2): # Enough clicks for the setup's target to reach `rounds`
+                pool.take(setup)
+            started = time.perf_counter()
+            stocked = asyncio.run(pool.refill(run_round, run_image))
+            refill_seconds = time.perf_counter() - started
+            pooled = [asyncio.run(_pooled_round(setup, pool, images)) for _ in range(min(rounds, stocked))]
+    finally:
+        mock.terminate()
+        mock.join()
+    live.sort()
+    pooled.sort()
+    return {
+        "without_pool_p50_ms": round(live[len(live) // 2] * 1000, 1),
+        "with_pool_p50_ms": round(pooled[len(pooled) // 2] * 1000, 3) if pooled else 0.0,
+        "refill_seconds_per_set": round(refill_seconds / max(stocked, 1), 3),
+    }
+
+
+def bench_demand(clicks: int, click_interval_seconds: float, refills_per_minute: float, seed: int = 7) -> dict:
+    """Clicks follow a Zipf-like popularity over every setup; refills finish between clicks."""
+    setups = [_setup(*combination) for combination in itertools.product(GENRES, FORMATS, LANGUAGES, ERAS)]
+    rng = random.Random(seed)
+    rng.shuffle(setups)
+    weights = [1 / (rank + 1) for rank in range(len(setups))]
+    now = [0.0]
+    canned = {
+        "suggestions": [[f"{NAME_PLACEHOLDER} the {ROLE_PLACEHOLDER} wakes to a knock.", "A quiet start."],
+                        ["Visual Concept: A door ajar in the rain", "Mood."]],
+        "endings": [f"{NAME_PLACEHOLDER} walks away."],
+    }
+
+    async def run_round(payload: dict) -> dict:
+        return canned
+
+    async def run_image(prompt: str) -> str:
+        return "data:image/png;base64,AA=="
+
+    served = 0
+    with tempfile.TemporaryDirectory() as directory:
+        pool = WarmPool(directory, refills_per_minute=refills_per_minute, clock=lambda: now[0])
+        for setup in rng.choices(setups, weights, k=clicks):
+            now[0] += rng.expovariate(1 / click_interval_seconds)
+            served += pool.take(setup) is not None
+            asyncio.run(pool.refill(run_round, run_image))
+        report = pool.report()
+    return {
+        "setups": len(setups),
+        "hit_rate": round(served / clicks, 3),
+        "sets_generated": report["refills"],
+        "sets_unused": sum(row["stock"] for row in report["setups"]) + report["expired"],
+        "setups_stocked": sum(1 for row in report["setups"] if row["target"]),
+    }
+
+
+def run_benchmark(latency_ms: float = 2000.0, rounds: int = 5, clicks: int = 2000, click_interval_seconds: float = 40.0) -> dict:
+    """Returns {"first_round": {...}, "demand": {refills per minute: {...}}}."""
+    return {
+        "first_round": bench_first_round(latency_ms, rounds),
+        "demand": {str(rate): bench_demand(clicks, click_interval_seconds, rate) for rate in (1.0, 6.0)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark opening rounds with and without the warm pool.")
+    parser.add_argument("--latency-ms", type=float, default=2000.0)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--clicks", type=int, default=2000)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.latency_ms, args.rounds, args.clicks), indent=2))
@@ -0,0 +1,115 @@
+### WORKER POOL LOAD TEST ###
+# Measures suggestion-round throughput of the multi-worker mode (worker_pool.py)
+# with 1, 2, 4 and 8 worker processes. Upstream calls go to the local mock
+# (benchmarks/mock_upstream.py), so numbers reflect the job store and worker
+# overhead at a fixed upstream latency rather than real API speed.
+#
+# Usage: python benchmarks/bench_workers.py [--jobs 400] [--latency-ms 200] [--workers 1 2 4 8]
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_upstream import MockUpstream
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve_mock(port: int, latency_ms: float):
+    async def serve():
+        server = await MockUpstream(latency_ms).start(port=port)
+        async with server:
+            await server.serve_forever()
+    asyncio.run(serve())
+
+
+def _payload(i: int) -> dict:
+    return {
+        "session": f"bench{i % 50}",
+        "story_context": f"Segment {i}: the keeper lit the lantern and watched the harbour.",
+        "language": "English",
+        "genre": "Mystery",
+        "story_format": "Novel",
+        "recent_segments": [f"The keeper climbed the stairs for the {i}th time."],
+    }
+
+
+async def _drive(store, jobs: int) -> list[float]:
+    from worker_pool import run_job
+
+    latencies = []
+
+    async def one(i: int):
+        started = time.perf_counter()
+        await run_job("round", _payload(i), usage={}, store=store)
+        latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(jobs)))
+    return latencies
+
+
+def run_benchmark(jobs: int = 400, latency_ms: float = 200.0, worker_counts=(1, 2, 4, 8), concurrency: int = 8) -> dict:
+    """Returns {"workers": {count: {"jobs_per_second", "p50_ms", "p95_ms"}}, ...}."""
+    port = _free_port()
+    os.environ["GEMINI_API_BASE_URL"] = f"http://127.0.0.1:{port}/v1beta"
+    os.environ["GEMINI_API_KEY"] = "mock"
+    import story_co_writer_ai
+    story_co_writer_ai.API_BASE_URL = os.environ["GEMINI_API_BASE_URL"]
+    story_co_writer_ai.API_KEY = "mock"
+    story_co_writer_ai.set_reporters(lambda *_: None, lambda *_: None)
+    from shared_store import SharedStore
+    from worker_pool import start_workers, stop_workers
+
+    mock = multiprocessing.Process(target=_serve_mock, args=(port, latency_ms), daemon=True)
+    mock.start()
+    for _ in range(100): # Wait for the mock to accept connections
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+
+    results = {}
+    try:
+        for count in worker_counts:
+            with tempfile.TemporaryDirectory() as directory:
+                store_path = os.path.join(directory, "bench_shared.db")
+                store = SharedStore(store_path)
+                workers = start_workers(count, store_path, concurrency)
+                try:
+                    started = time.perf_counter()
+                    latencies = sorted(asyncio.run(_drive(store, jobs)))
+                    elapsed = time.perf_counter() - started
+                finally:
+                    stop_workers(workers)
+                results[count] = {
+                    "jobs_per_second": round(jobs / elapsed, 1),
+                    "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+                    "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+                }
+    finally:
+        mock.terminate()
+        mock.join()
+    return {"jobs": jobs, "upstream_latency_ms": latency_ms, "concurrency_per_worker": concurrency, "workers": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the worker pool against the mock upstream.")
+    parser.add_argument("--jobs", type=int, default=400)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.jobs, args.latency_ms, args.workers, args.concurrency), indent=2))
@@ -0,0 +1,168 @@
+### MOCK UPSTREAM ###
+# A local stand-in for the Gemini/Imagen REST API used by load tests and
+# benchmarks. It answers generateContent (honouring candidateCount),
+# streamGenerateContent (SSE), Imagen predict and cachedContents requests with
+# canned, well-formed responses after a configurable latency. Translation prompts
+# (story_translation.py) get every tagged passage back, marked as translated.
+#
+# Point the engine at it with:
+#   GEMINI_API_BASE_URL=http://127.0.0.1:8765/v1beta GEMINI_API_KEY=mock
+#
+# Usage: python benchmarks/mock_upstream.py [--port 8765] [--latency-ms 200]
+
+import re
+import sys
+import json
+import base64
+import random
+import asyncio
+import argparse
+import itertools
+
+# A 1x1 PNG, enough for image code paths
+TINY_PNG = base64.b64encode(bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de"
+    "0000000c4944415408d763f8cfc000000301010018dd8db00000000049454e44ae426082"
+)).decode("ascii")
+
+_WORDS = ("shadow lantern harbour letter silver stranger storm archive whisper "
+          "engine orchard signal clockwork lighthouse ledger mirror").split()
+
+
+def _sentence(rng: random.Random, words: int = 14) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def canned_round_text(rng: random.Random) -> str:
+    """A response in the combined suggestions + endings format."""
+    lines = []
+    for i in range(1, 4):
+        lines += [f"{i}. {_sentence(rng)}", f"Commentary: {_sentence(rng, 8)}"]
+    lines += [f"Bonus Idea: {_sentence(rng)}", f"Commentary: {_sentence(rng, 8)}"]
+    lines += [f"Visual Concept: {_sentence(rng, 18)}", "Endings:"]
+    lines += [f"Ending {i}: {_sentence(rng, 20)}" for i in range(1, 4)]
+    return "\n".join(lines)
+
+
+_TAGGED_SEGMENT = re.compile(r'<seg id="(\d+)">(.*?)</seg>', re.DOTALL)
+
+
+def canned_translation_text(prompt_text: str) -> str:
+    """A reply to a translation prompt: each tagged passage, prefixed, in the same tags."""
+    return "\n".join(f'<seg id="{segment_id}">[translated] {text}</seg>' for segment_id, text in _TAGGED_SEGMENT.findall(prompt_text))
+
+
+def _usage(prompt_chars: int, output_chars: int, cached: bool) -> dict:
+    prompt_tokens = prompt_chars // 4
+    return {
+        "promptTokenCount": prompt_tokens,
+        "cachedContentTokenCount": prompt_tokens // 2 if cached else 0,
+        "candidatesTokenCount": output_chars // 4,
+    }
+
+
+class MockUpstream:
+    """Counts requests and serves canned responses."""
+
+    def __init__(self, latency_ms: float = 200.0, image_latency_ms: float | None = None, seed: int = 1):
+        self.latency = latency_ms / 1000
+        self.image_latency = (image_latency_ms if image_latency_ms is not None else latency_ms) / 1000
+        self.rng = random.Random(seed)
+        self.cache_ids = itertools.count(1)
+        self.requests = {"generate": 0, "stream": 0, "predict": 0, "cache": 0, "other": 0}
+
+    def _generate(self, body: dict) -> dict:
+        count = max(1, body.get("generationConfig", {}).get("candidateCount", 1))
+        prompt = "".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+        if '<seg id="' in prompt:
+            texts = [canned_translation_text(prompt)] * count
+        else:
+            texts = [canned_round_text(self.rng) for _ in range(count)]
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}} for text in texts],
+            "usageMetadata": _usage(len(prompt), sum(map(len, texts)), bool(body.get("cachedContent"))),
+        }
+
+    async def handle(self, method: str, path: str, body: dict):
+        """Returns (status, content type, body bytes or list of SSE chunks)."""
+        route = path.split("?", 1)[0]
+        if route.endswith(":generateContent"):
+            self.requests["generate"] += 1
+            await asyncio.sleep(self.latency)
+            return 200, "application/json", json.dumps(self._generate(body)).encode("utf-8")
+        if route.endswith(":streamGenerateContent"):
+            self.requests["stream"] += 1
+            text = canned_round_text(self.rng)
+            chunks = [text[i:i + 80] for i in range(0, len(text), 80)]
+            events = []
+            for chunk in chunks:
+                events.append(f"data: {json.dumps({'candidates': [{'content': {'parts': [{'text': chunk}]}}]})}\r\n\r\n".encode("utf-8"))
+            return 200, "text/event-stream", events
+        if route.endswith(":predict"):
+            self.requests["predict"] += 1
+            await asyncio.sleep(self.image_latency)
+            count = body.get("parameters", {}).get("sampleCount", 1)
+            return 200, "application/json", json.dumps({"predictions": [{"bytesBase64Encoded": TINY_PNG, "mimeType": "image/png"}] * count}).encode("utf-8")
+        if "/cachedContents" in route:
+            self.requests["cache"] += 1
+            if method == "DELETE":
+                return 200, "application/json", b"{}"
+            name = f"cachedContents/mock{next(self.cache_ids)}"
+            return 200, "application/json", json.dumps({"name": name, "usageMetadata": {"totalTokenCount": 4096}}).encode("utf-8")
+        self.requests["other"] += 1
+        return 404, "application/json", b'{"error": {"code": 404, "message": "not found"}}'
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                raw = await reader.readexactly(int(headers.get("content-length", 0)))
+                body = json.loads(raw) if raw else {}
+                status, content_type, payload = await self.handle(method, path, body)
+                if isinstance(payload, list): # SSE stream
+                    writer.write(f"HTTP/1.1 {status} OK\r\nContent-Type: {content_type}\r\nTransfer-Encoding: chunked\r\n\r\n".encode("latin-1"))
+                    for event in payload:
+                        writer.write(f"{len(event):x}\r\n".encode("latin-1") + event + b"\r\n")
+                        await writer.drain()
+                        await asyncio.sleep(self.latency / max(1, len(payload)))
+                    writer.write(b"0\r\n\r\n")
+                else:
+                    writer.write(f"HTTP/1.1 {status} OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        """Starts serving; port 0 picks a free port (see server.sockets[0].getsockname())."""
+        return await asyncio.start_server(self._serve_connection, host, port, backlog=1024)
+
+
+async def _main(port: int, latency_ms: float):
+    upstream = MockUpstream(latency_ms)
+    server = await upstream.start(port=port)
+    print(f"Mock upstream on http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1beta ({latency_ms} ms latency)", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve canned Gemini/Imagen responses for load tests.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.port, args.latency_ms))
+    except KeyboardInterrupt:
+        sys.exit(0)
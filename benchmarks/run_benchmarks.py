@@ -0,0 +1,191 @@
+### BENCHMARK RUNNER ###
+# Runs the benchmark suites, saves the results as JSON and compares them with a
+# baseline so a change that slows a hot path is caught. Every suite module
+# exposes run_benchmark(**kwargs); its nested results are flattened into metrics
+# named like "pipeline/story_growth/100000/append_segment_ms". The unit suffix
+# decides the direction: *_ms / *_seconds must not grow, *_per_second must not
+# shrink. Other numbers are recorded but not compared.
+#
+# Usage:
+#   python benchmarks/run_benchmarks.py                      # all suites, compare with baseline
+#   python benchmarks/run_benchmarks.py --quick --suites pipeline
+#   python benchmarks/run_benchmarks.py --update-baseline    # accept the current numbers
+#
+# Exits with status 1 when a metric regresses past its threshold.
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import argparse
+import platform
+import importlib
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIRECTORY))
+sys.path.insert(0, BENCHMARK_DIRECTORY)
+
+RESULTS_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, "results")
+BASELINE_PATH = os.path.join(BENCHMARK_DIRECTORY, "baseline.json")
+DEFAULT_THRESHOLD = 0.25  # Allowed relative slowdown before a metric counts as regressed
+NOISE_FLOOR_MS = 0.5      # Timings this close to the baseline are never regressions
+# Tail latencies are noisy on shared machines; a baseline's "thresholds" override these
+DEFAULT_THRESHOLDS = {"*/p99_ms": 1.0, "*/p95_ms": 0.5}
+
+# suite -> (module, full-run kwargs, --quick kwargs)
+SUITES = {
+    "pipeline": ("bench_pipeline", {}, {"sizes": (10, 100, 1000, 10_000), "rounds": 50}),
+    "search": ("bench_search", {}, {"segments": 10_000, "queries": 50}),
+    "workers": ("bench_workers", {}, {"jobs": 100, "worker_counts": (1, 2)}),
+    "archive": ("bench_archive", {}, {"sizes": (1000, 10_000), "lookups": 200}),
+    "rooms": ("bench_rooms", {}, {"rooms": 1, "subscribers": 100, "segments": 50}),
+    "translation": ("bench_translation", {}, {"segments": (200,)}),
+    "analytics": ("bench_analytics", {}, {"segments": 200_000}),
+    "api": ("bench_api", {}, {"stories": 50, "idle_stories": 200, "streamlit": False}),
+    "deadlines": ("bench_deadlines", {}, {"latencies_ms": (50, 12000), "rounds": 2}),
+    "retrieval": ("bench_retrieval", {}, {"sizes": (1000, 10_000)}),
+    "covers": ("bench_covers", {}, {"latency_ms": 500}),
+    "warm_pool": ("bench_warm_pool", {}, {"latency_ms": 300, "rounds": 2, "clicks": 300}),
+    "ingest": ("bench_ingest", {}, {"files": 300, "worker_counts": (1, 2), "large_segments": 20_000}),
+}
+
+
+def flatten(results, prefix: str = "") -> dict[str, float]:
+    """Flattens nested results into {"a/b/c": number}."""
+    metrics = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            metrics.update(flatten(value, f"{prefix}/{key}" if prefix else str(key)))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        metrics[prefix] = results
+    return metrics
+
+
+def metric_direction(name: str) -> str | None:
+    """'lower' or 'higher' is better, or None for informational numbers."""
+    leaf = name.rsplit("/", 1)[-1]
+    if leaf.endswith("_per_second"):
+        return "higher"
+    if leaf.endswith("_ms") or leaf.endswith("_seconds"):
+        return "lower"
+    return None
+
+
+def _threshold_for(name: str, thresholds: dict[str, float], default: float) -> float:
+    for pattern, threshold in thresholds.items():
+        if fnmatch.fnmatch(name, pattern):
+            return threshold
+    return default
+
+
+def compare(current: dict[str, float], baseline: dict[str, float], thresholds: dict[str, float] | None = None, default_threshold: float = DEFAULT_THRESHOLD) -> list[dict]:
+    """
+    Compares metrics with a baseline.
+
+    Args:
+        current (dict): Flattened current metrics.
+        baseline (dict): Flattened baseline metrics.
+        thresholds (dict): Optional {fnmatch pattern: allowed relative change} overrides.
+        default_threshold (float): Allowed relative change for other metrics.
+
+    Returns:
+        list[dict]: {"metric", "baseline", "current", "change", "threshold", "status"} rows, status
+                    being "regressed", "improved" or "ok".
+    """
+    rows = []
+    for name in sorted(current):
+        direction = metric_direction(name)
+        base = baseline.get(name)
+        if direction is None or not base:
+            continue
+        value = current[name]
+        change = (value - base) / base
+        threshold = _threshold_for(name, thresholds or {}, default_threshold)
+        worse = change > threshold if direction == "lower" else change < -threshold
+        better = change < -threshold if direction == "lower" else change > threshold
+        if direction == "lower" and name.endswith("_ms") and abs(value - base) < NOISE_FLOOR_MS:
+            worse = better = False
+        status = "regressed" if worse else "improved" if better else "ok"
+        rows.append({"metric": name, "baseline": base, "current": value, "change": round(change, 4), "threshold": threshold, "status": status})
+    return rows
+
+
+def run_suites(names: list[str], quick: bool = False) -> dict:
+    """Runs the named suites and returns {suite: results}."""
+    results = {}
+    for name in names:
+        module_name, full_kwargs, quick_kwargs = SUITES[name]
+        print(f"Running {name}...", file=sys.stderr)
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        results[name] = module.run_benchmark(**(quick_kwargs if quick else full_kwargs))
+        print(f"  done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the Story-Verse benchmark suites.")
+    parser.add_argument("--suites", nargs="+", choices=list(SUITES), default=list(SUITES))
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes (for CI and pre-commit checks).")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=None, help=f"Allowed relative slowdown (default {DEFAULT_THRESHOLD}).")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the new baseline.")
+    parser.add_argument("--out", default="", help="Results file (default results/<timestamp>.json).")
+    args = parser.parse_args(argv)
+
+    suites = run_suites(args.suites, args.quick)
+    metrics = flatten(suites)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "quick": args.quick,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "suites": suites,
+        "metrics": metrics,
+    }
+
+    os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    out_path = args.out or os.path.join(RESULTS_DIRECTORY, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results saved to '{out_path}'.")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        # Keep metrics of suites not run this time, and any hand-tuned thresholds
+        merged = {**baseline.get("metrics", {}), **metrics}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({**baseline, "updated": report["timestamp"], "quick": args.quick, "platform": report["platform"], "metrics": merged}, f, indent=2, sort_keys=True)
+        print(f"✅ Baseline updated: '{args.baseline}'.")
+        return 0
+
+    if not baseline:
+        print(f"No baseline at '{args.baseline}'; run with --update-baseline to create one.")
+        return 0
+    if baseline.get("quick", args.quick) != args.quick:
+        print("Warning: baseline and this run differ in --quick; sizes may not match.")
+    default_threshold = args.threshold if args.threshold is not None else baseline.get("default_threshold", DEFAULT_THRESHOLD)
+    thresholds = {**baseline.get("thresholds", {}), **{k: v for k, v in DEFAULT_THRESHOLDS.items() if k not in baseline.get("thresholds", {})}}
+    rows = compare(metrics, baseline.get("metrics", {}), thresholds, default_threshold)
+
+    print(f"\n{'metric':<60} {'baseline':>12} {'current':>12} {'change':>8}  status")
+    for row in rows:
+        if row["status"] != "ok":
+            print(f"{row['metric']:<60} {row['baseline']:>12.4g} {row['current']:>12.4g} {row['change']:>+8.1%}  {row['status']}")
+    regressed = [row for row in rows if row["status"] == "regressed"]
+    improved = sum(row["status"] == "improved" for row in rows)
+    print(f"\n{len(rows)} metrics compared: {len(regressed)} regressed, {improved} improved.")
+    if regressed:
+        print("❌ Performance regression past threshold.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
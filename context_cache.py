@@ -0,0 +1,157 @@
+### STORY CONTEXT CACHE ###
+# Reuses the stable part of the suggestions prompt through Gemini's cachedContents
+# API. The cached context holds the instructions (persona, style, format template)
+# plus the committed story up to the last checkpoint; each round then only sends
+# the part of the story written since that checkpoint.
+
+import time
+
+import story_co_writer_ai
+from story_co_writer_ai import format_story_block
+from token_accounting import estimate_tokens
+
+# Gemini refuses to cache contexts below a minimum size, so short stories are sent
+# in full. Token counts come from the calibrated local estimator.
+CACHE_MIN_TOKENS = 4096
+
+# Re-checkpoint once the uncached tail grows past this many characters, so the
+# tail we resend every round stays short.
+CACHE_REFRESH_TAIL_CHARS = 2000
+
+# Upstream lifetime of a cached context. Refreshed well before it expires; an
+# abandoned session's cache simply lapses.
+CACHE_TTL_SECONDS = 900
+CACHE_EXPIRY_MARGIN_SECONDS = 60
+
+
+def new_cache_counters() -> dict:
+    """Returns an empty record of cache lifecycle events for a session."""
+    return {"caches_created": 0, "caches_deleted": 0, "cache_tokens_stored": 0, "cache_errors": 0}
+
+
+class StoryContextCache:
+    """
+    Per-session handle on one upstream cached context. Store it in the session
+    (e.g. st.session_state.context_cache) and call close() when the story ends.
+    """
+
+    def __init__(self, refresh_tail_chars: int = CACHE_REFRESH_TAIL_CHARS, ttl_seconds: int = CACHE_TTL_SECONDS, min_tokens: int = CACHE_MIN_TOKENS):
+        self.refresh_tail_chars = refresh_tail_chars
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self.name = ""             # cachedContents/... of the live cache, "" if none
+        self.instructions = ""     # Instruction text baked into the live cache
+        self.checkpoint = ""       # Story context baked into the live cache
+        self.expires_at = 0.0
+        self.counters = new_cache_counters()
+
+    def _is_usable(self, instructions: str, story_context: str) -> bool:
+        """True if the live cache is still a prefix of this request and not about to expire."""
+        return (
+            bool(self.name)
+            and instructions == self.instructions
+            and story_context.startswith(self.checkpoint)
+            and len(story_context) - len(self.checkpoint) <= self.refresh_tail_chars
+            and time.time() < self.expires_at - CACHE_EXPIRY_MARGIN_SECONDS
+        )
+
+    async def prepare(self, instructions: str, story_context: str, usage: dict | None = None) -> dict:
+        """
+        Decides how to send the next request, creating or refreshing the upstream
+        cache as needed.
+
+        Args:
+            instructions (str): The stable instruction text (build_suggestions_instructions).
+            story_context (str): The full story context for this round.
+            usage (dict): Optional usage record; cache creations are counted as upstream calls.
+
+        Returns:
+            dict: {"prompt": str, "model": str, "cached_content": str}. When no cache
+                  applies, "prompt" is the full prompt and "cached_content" is "".
+        """
+        full_prompt = instructions + format_story_block(story_context)
+
+        if not self._is_usable(instructions, story_context):
+            await self.close()
+            if estimate_tokens(full_prompt) >= self.min_tokens:
+                await self._create(instructions, story_context, usage)
+
+        if not self.name:
+            return {"prompt": full_prompt, "model": "", "cached_content": ""}
+
+        tail = story_context[len(self.checkpoint):]
+        if tail.strip():
+            prompt = f"The story continues:\n---\n{tail}\n---\nRespond using the format above, continuing from the end of the story."
+        else:
+            prompt = "Respond using the format above, continuing from the end of the story."
+        return {"prompt": prompt, "model": story_co_writer_ai.CACHED_GEMINI_MODEL, "cached_content": self.name}
+
+    async def _create(self, instructions: str, story_context: str, usage: dict | None = None):
+        """Creates a cached context holding instructions + story_context."""
+        api_key = story_co_writer_ai._resolve_api_key()
+        if not api_key:
+            return
+        payload = {
+            "model": f"models/{story_co_writer_ai.CACHED_GEMINI_MODEL}",
+            "contents": [{"role": "user", "parts": [{"text": instructions + format_story_block(story_context)}]}],
+            "ttl": f"{self.ttl_seconds}s",
+        }
+        story_co_writer_ai._record_usage(usage, "gemini_calls", payload["contents"][0]["parts"][0]["text"])
+        try:
+            response = await story_co_writer_ai.get_http_client().post(
+                f"{story_co_writer_ai.API_BASE_URL}/cachedContents?key={api_key}",
+                headers={'Content-Type': 'application/json'},
+                json=payload,
+                timeout=30.0
+            )
+            response.raise_for_status()
+            result = response.json()
+        except Exception as error:
+            # Caching is an optimisation only: fall back to sending the full prompt.
+            print(f"Warning: could not create context cache: {error}")
+            self.counters["cache_errors"] += 1
+            return
+
+        self.name = result.get("name", "")
+        self.instructions = instructions
+        self.checkpoint = story_context
+        self.expires_at = time.time() + self.ttl_seconds
+        self.counters["caches_created"] += 1
+        self.counters["cache_tokens_stored"] += result.get("usageMetadata", {}).get("totalTokenCount", 0)
+
+    async def close(self):
+        """Deletes the live upstream cache, if any. Safe to call more than once."""
+        if not self.name:
+            return
+        name, self.name = self.name, ""
+        self.instructions = ""
+        self.checkpoint = ""
+        api_key = story_co_writer_ai._resolve_api_key()
+        try:
+            response = await story_co_writer_ai.get_http_client().delete(f"{story_co_writer_ai.API_BASE_URL}/{name}?key={api_key}", timeout=30.0)
+            response.raise_for_status()
+            self.counters["caches_deleted"] += 1
+        except Exception as error:
+            # The TTL will reclaim it upstream anyway.
+            print(f"Warning: could not delete context cache {name}: {error}")
+            self.counters["cache_errors"] += 1
+
+
+def summarize_token_usage(usage: dict) -> dict:
+    """
+    Splits a usage record's prompt tokens into billed-at-full-rate and cached tokens.
+
+    Args:
+        usage (dict): A usage record from story_co_writer_ai.new_usage_counters.
+
+    Returns:
+        dict: {"billed_prompt_tokens", "cached_tokens", "output_tokens", "cache_hit_ratio"}.
+    """
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    cached_tokens = usage.get("cached_tokens", 0)
+    return {
+        "billed_prompt_tokens": prompt_tokens - cached_tokens,
+        "cached_tokens": cached_tokens,
+        "output_tokens": usage.get("output_tokens", 0),
+        "cache_hit_ratio": (cached_tokens / prompt_tokens) if prompt_tokens else 0.0,
+    }
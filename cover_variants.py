@@ -0,0 +1,115 @@
+### COVER VARIANTS ###
+# Several takes on a round's visual concept, so a writer who dislikes the cover
+# can pick another without re-rolling the whole suggestion set. Two modes:
+#   - "styles" (default): one Imagen request per style, the concept as written
+#     and dressed in the format's poster mood (FORMAT_POSTER_MOODS), the story's
+#     era, and shot choices, run in parallel under a concurrency cap, each
+#     variant yielded as soon as it arrives,
+#   - "samples": one request asking for several samples of the concept
+#     (parameters.sampleCount), which all arrive together.
+# The variants stay with the session until the writer picks one; the pick
+# becomes the concept's cached image and the others are dropped right away.
+#
+# Usage: python cover_variants.py prompts "A lighthouse at dusk" --mood "Broadway Poster: spotlight" --era "1940s Noir"
+
+import os
+import re
+import sys
+import asyncio
+import argparse
+
+COVER_VARIANT_COUNT = int(os.getenv("STORY_COVER_VARIANTS", "4"))
+COVER_VARIANT_CONCURRENCY = 3 # Imagen requests in flight per writer
+COVER_VARIANT_MODE = os.getenv("STORY_COVER_VARIANT_MODE", "styles") # "styles" or "samples"
+
+_DECORATION = re.compile(r"[*_`]|[^\w\s.,:;'\"“”()!?&-]")
+
+
+def poster_style(mood: str) -> str:
+    """A FORMAT_POSTER_MOODS entry as plain prompt text (no emoji or markdown)."""
+    return re.sub(r"\s+", " ", _DECORATION.sub("", mood)).strip(" :")
+
+
+def variant_prompts(concept: str, poster_mood: str = "", era_style: str = "", count: int = COVER_VARIANT_COUNT, include_described: bool = True) -> list[dict]:
+    """
+    The prompts of the "styles" mode, the concept as written first.
+
+    Args:
+        concept (str): The round's visual concept.
+        poster_mood (str): The story format's FORMAT_POSTER_MOODS entry.
+        era_style (str): The story's era/style reference.
+        count (int): Variants wanted.
+        include_described (bool): False when the round's own image already shows the concept as written.
+
+    Returns:
+        list[dict]: Up to `count` {"label", "prompt"} entries.
+    """
+    concept = concept.strip().rstrip(".")
+    style = poster_style(poster_mood)
+    variants = [{"label": "As described", "prompt": concept}] if include_described else []
+    if style:
+        variants.append({"label": "Poster", "prompt": f"{concept}. Cover art styled as a {style}"})
+    if era_style:
+        variants.append({"label": era_style, "prompt": f"{concept}. In the visual style of {era_style}"})
+    variants += [
+        {"label": "Close-up", "prompt": f"{concept}. Close-up, dramatic lighting, shallow depth of field"},
+        {"label": "Wide shot", "prompt": f"{concept}. Wide establishing shot, atmospheric"},
+        {"label": "Painted", "prompt": f"{concept}. Painterly book-cover illustration"},
+    ]
+    return variants[:max(1, count)]
+
+
+async def generate_variants(run_image, run_samples, concept: str, poster_mood: str = "", era_style: str = "", count: int = COVER_VARIANT_COUNT,
+                            mode: str = COVER_VARIANT_MODE, concurrency: int = COVER_VARIANT_CONCURRENCY, include_described: bool = True):
+    """
+    Generates cover variants, yielding each as soon as it arrives.
+
+    Args:
+        run_image: async (prompt) -> image URL; one request (e.g. an "image" job).
+        run_samples: async (prompt, count) -> list of image URLs; one multi-sample request.
+        concept (str): The round's visual concept.
+        poster_mood (str), era_style (str): Style sources for the "styles" mode.
+        count (int): Variants wanted.
+        mode (str): "styles" (parallel requests, progressive) or "samples" (one request).
+        concurrency (int): Requests in flight at once in "styles" mode.
+        include_described (bool): See variant_prompts.
+
+    Yields:
+        tuple[int, str, str]: (variant index, label, image URL), in order of arrival.
+                              Failed variants yield their placeholder URL.
+    """
+    if mode == "samples":
+        for index, url in enumerate(await run_samples(concept, count)):
+            yield index, f"Sample {index + 1}", url
+        return
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int, variant: dict) -> tuple[int, str, str]:
+        async with semaphore:
+            return index, variant["label"], await run_image(variant["prompt"])
+
+    tasks = [asyncio.ensure_future(one(index, variant)) for index, variant in enumerate(variant_prompts(concept, poster_mood, era_style, count, include_described))]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks: # The caller stopped early (e.g. its deadline)
+            task.cancel()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Show the cover variant prompts for a visual concept.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prompts_parser = commands.add_parser("prompts", help="Print the prompt of every variant.")
+    prompts_parser.add_argument("concept")
+    prompts_parser.add_argument("--mood", default="", help="The format's poster mood.")
+    prompts_parser.add_argument("--era", default="")
+    prompts_parser.add_argument("--count", type=int, default=COVER_VARIANT_COUNT)
+    args = parser.parse_args(argv)
+    for variant in variant_prompts(args.concept, args.mood, args.era, args.count):
+        print(f"{variant['label']}: {variant['prompt']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
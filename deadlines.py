@@ -0,0 +1,228 @@
+### LATENCY BUDGETS ###
+# Every user action (a suggestion round, a roll of endings, a set of cover
+# variants) gets a latency budget. Its Deadline is handed down through prompt
+# building, the Gemini call, parsing and the image call, and the time left
+# decides how each step runs:
+#   - upstream calls time out at the deadline instead of after 60 s,
+#   - with little time left the story context is cut to the economy length,
+#   - with almost none left the offline model answers instead of Gemini,
+#   - the round's image is skipped when it could not finish in time.
+#
+# The deadline is an absolute wall-clock time, so it crosses into worker
+# processes inside the job payload (see worker_pool.run_job). Each finished
+# action appends one JSON line (elapsed time, seconds per phase, the phase the
+# budget ran out in, what was degraded), checked against the round-time SLO with:
+#   python deadlines.py report deadline_misses.jsonl [--slo-seconds 20]
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+
+DEADLINE_LOG_PATH = os.getenv("STORY_DEADLINE_LOG", "deadline_misses.jsonl")
+
+# Seconds per user action, from the click to the rendered result
+ACTION_BUDGETS = {
+    "round": float(os.getenv("STORY_ROUND_BUDGET_SECONDS", "20")),
+    "suggestions": float(os.getenv("STORY_ROUND_BUDGET_SECONDS", "20")),
+    "endings": float(os.getenv("STORY_ENDINGS_BUDGET_SECONDS", "20")),
+    "covers": float(os.getenv("STORY_COVERS_BUDGET_SECONDS", "30")),
+    "translate": float(os.getenv("STORY_TRANSLATE_BUDGET_SECONDS", "60")), # An edition's missing segments
+}
+DEFAULT_BUDGET_SECONDS = 20.0
+SHORT_CONTEXT_SECONDS = 8.0  # Below this, send the economy-length context
+MIN_CALL_SECONDS = 2.0       # Below this, serve the offline model instead of calling Gemini
+IMAGE_MIN_SECONDS = 6.0      # Below this, the round goes without its image
+RESERVE_SECONDS = 0.25       # Kept back from upstream timeouts for parsing and rendering
+
+_log_lock = threading.Lock()
+
+
+class Deadline:
+    """The latency budget of one user action, shared by every phase that serves it."""
+
+    __slots__ = ("action", "budget", "started", "expires_at", "phases", "missed_in", "degraded")
+
+    def __init__(self, action: str, budget: float | None = None, expires_at: float | None = None):
+        self.action = action
+        self.budget = ACTION_BUDGETS.get(action, DEFAULT_BUDGET_SECONDS) if budget is None else budget
+        self.started = time.time()
+        self.expires_at = self.started + self.budget if expires_at is None else expires_at
+        self.phases: dict[str, float] = {} # phase -> seconds spent
+        self.missed_in = ""                # The phase during which the budget ran out
+        self.degraded: list[str] = []      # e.g. "short_context", "offline", "gemini_timeout", "image_skipped"
+
+    def remaining(self) -> float:
+        """Seconds left (0 once expired)."""
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+    def allows(self, seconds: float) -> bool:
+        """Whether at least `seconds` are left."""
+        return self.remaining() >= seconds
+
+    def timeout(self) -> float:
+        """The timeout for an upstream call made now, keeping RESERVE_SECONDS for what follows it."""
+        return max(0.1, self.remaining() - RESERVE_SECONDS)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Times a phase; the first phase to end past the deadline is recorded as the miss."""
+        started = time.time()
+        try:
+            yield self
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.time() - started
+            if not self.missed_in and self.expired():
+                self.missed_in = name
+
+    def degrade(self, what: str):
+        """Records a step served in a cheaper way to stay within the budget."""
+        if what not in self.degraded:
+            self.degraded.append(what)
+
+    # --- Crossing Processes ---
+
+    def to_payload(self) -> float:
+        """The job payload's "deadline" field."""
+        return self.expires_at
+
+    @classmethod
+    def from_payload(cls, payload: dict, action: str = "") -> "Deadline | None":
+        """The deadline a job payload carries, or None."""
+        expires_at = payload.get("deadline")
+        if not expires_at:
+            return None
+        return cls(action, budget=max(0.0, expires_at - time.time()), expires_at=expires_at)
+
+    def report(self) -> dict:
+        """What a worker sends back with the job's result (see merge)."""
+        return {"phases": self.phases, "missed_in": self.missed_in, "degraded": self.degraded}
+
+    def merge(self, report: dict | None):
+        """Adds the phases a worker timed for this deadline."""
+        if not report:
+            return
+        for name, seconds in report.get("phases", {}).items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        if not self.missed_in:
+            self.missed_in = report.get("missed_in", "")
+        for what in report.get("degraded", []):
+            self.degrade(what)
+
+    def finish(self, session: str = "", path: str = DEADLINE_LOG_PATH) -> dict:
+        """
+        Ends the action and appends its record to the deadline log.
+
+        Returns:
+            dict: The logged entry ("action", "session", "budget_ms", "elapsed_ms", "missed",
+                  "missed_in", "phases_ms", "degraded").
+        """
+        elapsed = time.time() - self.started
+        entry = {
+            "time": round(time.time(), 3),
+            "action": self.action,
+            "session": session,
+            "budget_ms": round(self.budget * 1000, 1),
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "missed": elapsed > self.budget,
+            "missed_in": self.missed_in or ("render" if elapsed > self.budget else ""),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            "degraded": self.degraded,
+        }
+        if path:
+            with _log_lock, open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        return entry
+
+
+def deadline_phase(deadline: Deadline | None, name: str):
+    """deadline.phase(name), or nothing when the caller has no deadline."""
+    return deadline.phase(name) if deadline is not None else contextlib.nullcontext()
+
+
+# --- Offline Report ---
+
+def _percentile(values: list[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def summarize_deadlines(path: str) -> list[dict]:
+    """
+    Aggregates a deadline log by action.
+
+    Returns:
+        list[dict]: {"action", "requests", "budget_ms", "p50_ms", "p95_ms", "p99_ms", "miss_rate",
+                     "missed_in": {phase: count}, "phase_p95_ms": {phase: ms}, "degraded": {what: count}} rows.
+    """
+    groups: dict[str, list[dict]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            groups.setdefault(entry["action"], []).append(entry)
+    rows = []
+    for action, entries in sorted(groups.items()):
+        elapsed = sorted(entry["elapsed_ms"] for entry in entries)
+        missed_in, degraded, phases = {}, {}, {}
+        for entry in entries:
+            if entry["missed_in"]:
+                missed_in[entry["missed_in"]] = missed_in.get(entry["missed_in"], 0) + 1
+            for what in entry["degraded"]:
+                degraded[what] = degraded.get(what, 0) + 1
+            for name, ms in entry["phases_ms"].items():
+                phases.setdefault(name, []).append(ms)
+        rows.append({
+            "action": action,
+            "requests": len(entries),
+            "budget_ms": max(entry["budget_ms"] for entry in entries),
+            "p50_ms": _percentile(elapsed, 0.5),
+            "p95_ms": _percentile(elapsed, 0.95),
+            "p99_ms": _percentile(elapsed, 0.99),
+            "miss_rate": round(sum(entry["missed"] for entry in entries) / len(entries), 3),
+            "missed_in": missed_in,
+            "phase_p95_ms": {name: _percentile(sorted(values), 0.95) for name, values in sorted(phases.items())},
+            "degraded": degraded,
+        })
+    return rows
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Check Story-Verse actions against their latency budgets.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report_parser = commands.add_parser("report", help="Summarize a deadline log; exits 1 when an action's p99 breaks the SLO.")
+    report_parser.add_argument("log", nargs="?", default=DEADLINE_LOG_PATH)
+    report_parser.add_argument("--slo-seconds", type=float, default=0.0, help="p99 SLO for every action (default: each action's budget).")
+    args = parser.parse_args(argv)
+
+    try:
+        rows = summarize_deadlines(args.log)
+    except OSError as error:
+        print(f"❌ Could not read deadline log '{args.log}': {error}")
+        return 1
+    breaches = 0
+    print(f"{'action':<12} {'reqs':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'slo ms':>9} {'miss%':>6}  missed in / degraded")
+    for row in rows:
+        slo_ms = args.slo_seconds * 1000 if args.slo_seconds else row["budget_ms"]
+        breached = row["p99_ms"] > slo_ms
+        breaches += breached
+        phases = ", ".join(f"{name} {count}" for name, count in sorted(row["missed_in"].items(), key=lambda item: -item[1]))
+        degraded = ", ".join(f"{what} {count}" for what, count in sorted(row["degraded"].items(), key=lambda item: -item[1]))
+        print(f"{row['action']:<12} {row['requests']:>6} {row['p50_ms']:>9.0f} {row['p95_ms']:>9.0f} {row['p99_ms']:>9.0f} "
+              f"{slo_ms:>9.0f} {row['miss_rate']:>6.1%}  {phases or '-'} / {degraded or '-'}{'  ❌ SLO' if breached else ''}")
+    if breaches:
+        print(f"❌ {breaches} action(s) over their p99 SLO.")
+        return 1
+    print("✅ Every action within its p99 SLO.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+### MEMORY DIAGNOSTICS ###
+# Leak hunting for long-running app servers. Off by default; enable with
+# STORY_DIAGNOSTICS=1. When on:
+#   - tracemalloc samples the heap every STORY_DIAGNOSTICS_INTERVAL seconds and
+#     keeps the top allocation sites (growth since start and since the last sample),
+#   - every session reports its state size per key (images, story_log, ...),
+#   - live asyncio tasks and open upstream HTTP connections are counted,
+#   - each sample is appended as one JSON line to STORY_DIAGNOSTICS_DUMP.
+# "Growth since start" is measured against a baseline snapshot that is retaken
+# every STORY_DIAGNOSTICS_BASELINE_SECONDS (or from the admin page), so an old
+# heap is not kept in memory for the life of the server.
+# The GUI shows the live report on a hidden admin page (?admin=diagnostics&token=...),
+# only when STORY_ADMIN_TOKEN is set.
+#
+# Usage: python diagnostics.py trend diagnostics.jsonl
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import tracemalloc
+import types
+import weakref
+from collections import deque
+
+DIAGNOSTICS_ENABLED = os.getenv("STORY_DIAGNOSTICS", "") == "1"
+DIAGNOSTICS_DUMP_PATH = os.getenv("STORY_DIAGNOSTICS_DUMP", "diagnostics.jsonl")
+SAMPLE_INTERVAL_SECONDS = float(os.getenv("STORY_DIAGNOSTICS_INTERVAL", "300"))
+BASELINE_MAX_AGE_SECONDS = float(os.getenv("STORY_DIAGNOSTICS_BASELINE_SECONDS", str(24 * 3600)))
+ADMIN_TOKEN = os.getenv("STORY_ADMIN_TOKEN", "") # The admin page is off without one
+
+TRACEMALLOC_FRAMES = 8        # Stack depth kept per allocation (more frames = more overhead)
+TOP_ALLOCATION_SITES = 15
+HISTORY_SAMPLES = 96          # In-memory samples kept for the admin page
+SESSION_MEASURE_SECONDS = 30  # A session's state is measured at most this often
+SESSION_FORGET_SECONDS = 3600 # Sessions not seen for this long drop out of the report
+MAX_MEASURE_OBJECTS = 200_000 # Stops deep sizing of pathological structures
+
+
+def deep_size(value, _seen: set | None = None, _budget: list | None = None) -> int:
+    """
+    Approximate bytes held by a value and everything it references (containers
+    and objects' __dict__), counting shared objects once.
+
+    Args:
+        value: Any object.
+
+    Returns:
+        int: The size in bytes (a lower bound once MAX_MEASURE_OBJECTS objects were visited).
+    """
+    seen = set() if _seen is None else _seen
+    budget = [MAX_MEASURE_OBJECTS] if _budget is None else _budget
+    stack, total = [value], 0
+    while stack and budget[0] > 0:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        budget[0] -= 1
+        try:
+            total += sys.getsizeof(item)
+        except TypeError:
+            continue
+        if isinstance(item, (str, bytes, bytearray, int, float, bool, type(None))):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        elif hasattr(item, "__dict__") and not isinstance(item, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            stack.append(vars(item))
+    return total
+
+
+def _rss_bytes() -> int | None:
+    """Current resident set size (Linux), or None where unavailable."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# The sampler's own bookkeeping and module imports are not leaks
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+]
+
+def _take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+
+def _format_site(statistic) -> str:
+    frame = statistic.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+class MemoryDiagnostics:
+    """Samples the heap, sessions, tasks and connections of one server process."""
+
+    def __init__(self, dump_path: str = DIAGNOSTICS_DUMP_PATH, interval: float = SAMPLE_INTERVAL_SECONDS,
+                 baseline_max_age: float = BASELINE_MAX_AGE_SECONDS):
+        self.dump_path = dump_path
+        self.interval = interval
+        self.baseline_max_age = baseline_max_age
+        self.history: deque[dict] = deque(maxlen=HISTORY_SAMPLES)
+        self.sessions: dict[str, dict] = {} # token -> {"seen", "measured", "total_bytes", "keys"}
+        self._loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = weakref.WeakSet()
+        self._baseline = None
+        self._baseline_taken = 0.0
+        self._previous = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts tracemalloc and the periodic sampler (idempotent)."""
+        if self._thread is not None:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.reset_baseline()
+        self._thread = threading.Thread(target=self._run, name="story-diagnostics", daemon=True)
+        self._thread.start()
+        print(f"✅ Memory diagnostics on: sampling every {self.interval:.0f}s into '{self.dump_path}'.")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def reset_baseline(self, snapshot=None):
+        """Measures "growth since start" from now on (from `snapshot` if given)."""
+        if snapshot is None:
+            snapshot = _take_snapshot() if tracemalloc.is_tracing() else None
+        self._baseline = self._previous = snapshot
+        self._baseline_taken = time.time()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as error: # The sampler must never take the server down
+                print(f"Warning: diagnostics sample failed: {error}")
+
+    # --- Inputs from the app ---
+
+    def watch_loop(self, loop: asyncio.AbstractEventLoop | None = None):
+        """Registers an event loop whose tasks should be counted (defaults to the running one)."""
+        try:
+            self._loops.add(loop or asyncio.get_running_loop())
+        except RuntimeError:
+            pass # No running loop in this thread
+
+    def observe_session(self, token: str, state):
+        """
+        Records the size of a session's state per key (throttled per session).
+
+        Args:
+            token (str): The session's resume token.
+            state: st.session_state or any mapping.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self.sessions.setdefault(token, {"seen": now, "measured": 0.0, "total_bytes": 0, "keys": {}})
+            entry["seen"] = now
+            if now - entry["measured"] < SESSION_MEASURE_SECONDS:
+                return
+            entry["measured"] = now
+        sizes = {}
+        for key in list(state.keys()):
+            try:
+                sizes[str(key)] = deep_size(state[key])
+            except (KeyError, RuntimeError): # Changed by a concurrent rerun
+                continue
+        with self._lock:
+            entry["keys"] = dict(sorted(sizes.items(), key=lambda item: -item[1]))
+            entry["total_bytes"] = sum(sizes.values())
+            for stale in [t for t, e in self.sessions.items() if now - e["seen"] > SESSION_FORGET_SECONDS]:
+                del self.sessions[stale]
+
+    # --- Measurements ---
+
+    def task_counts(self) -> dict:
+        """Live asyncio tasks per watched loop, plus the engine's HTTP client loops."""
+        import story_co_writer_ai
+        loops = set(self._loops) | set(story_co_writer_ai._http_clients.keys())
+        total, pending_by_name = 0, {}
+        for loop in loops:
+            if loop.is_closed():
+                continue
+            for _ in range(3): # all_tasks iterates a WeakSet another thread may be changing
+                try:
+                    tasks = [task for task in asyncio.all_tasks(loop) if not task.done()]
+                    break
+                except RuntimeError:
+                    tasks = []
+            total += len(tasks)
+            for task in tasks:
+                name = getattr(task.get_coro(), "__qualname__", "?")
+                pending_by_name[name] = pending_by_name.get(name, 0) + 1
+        top = dict(sorted(pending_by_name.items(), key=lambda item: -item[1])[:10])
+        return {"loops": len(loops), "live_tasks": total, "by_coroutine": top}
+
+    def connection_counts(self) -> dict:
+        """Open upstream HTTP connections of the engine's pooled clients."""
+        import story_co_writer_ai
+        clients = list(story_co_writer_ai._http_clients.values())
+        open_connections = idle = 0
+        for client in clients:
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            for connection in getattr(pool, "connections", []):
+                open_connections += 1
+                try:
+                    idle += bool(connection.is_idle())
+                except Exception:
+                    pass
+        return {"clients": len(clients), "open": open_connections, "idle": idle}
+
+    def top_allocations(self, snapshot, against, limit: int = TOP_ALLOCATION_SITES) -> list[dict]:
+        """Allocation sites with the largest growth between two snapshots."""
+        statistics = snapshot.compare_to(against, "lineno")
+        return [
+            {"site": _format_site(stat), "size_bytes": stat.size, "growth_bytes": stat.size_diff, "count": stat.count}
+            for stat in sorted(statistics, key=lambda stat: -stat.size_diff)[:limit]
+        ]
+
+    def sample(self) -> dict:
+        """Takes one sample, keeps it in history and appends it to the dump file."""
+        snapshot = _take_snapshot() if tracemalloc.is_tracing() else None
+        current, peak = tracemalloc.get_traced_memory() if snapshot is not None else (0, 0)
+        with self._lock:
+            sessions = sorted(
+                ({"session": token[:8], "total_bytes": entry["total_bytes"], "top_keys": dict(list(entry["keys"].items())[:5])}
+                 for token, entry in self.sessions.items()),
+                key=lambda entry: -entry["total_bytes"]
+            )
+        sample = {
+            "ts": round(time.time(), 1),
+            "rss_bytes": _rss_bytes(),
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "sessions": len(sessions),
+            "session_bytes": sum(entry["total_bytes"] for entry in sessions),
+            "largest_sessions": sessions[:10],
+            "tasks": self.task_counts(),
+            "connections": self.connection_counts(),
+            "growth_since_start": self.top_allocations(snapshot, self._baseline) if snapshot and self._baseline else [],
+            "growth_since_last": self.top_allocations(snapshot, self._previous) if snapshot and self._previous else [],
+        }
+        if snapshot is not None:
+            self._previous = snapshot
+            if time.time() - self._baseline_taken >= self.baseline_max_age:
+                self.reset_baseline(snapshot)
+        sample["baseline_ts"] = round(self._baseline_taken, 1)
+        self.history.append(sample)
+        if self.dump_path:
+            with open(self.dump_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(sample) + "\n")
+        return sample
+
+
+_diagnostics: MemoryDiagnostics | None = None
+
+def get_diagnostics() -> MemoryDiagnostics | None:
+    """The process-wide diagnostics, started on first use; None unless STORY_DIAGNOSTICS=1."""
+    global _diagnostics
+    if not DIAGNOSTICS_ENABLED:
+        return None
+    if _diagnostics is None:
+        _diagnostics = MemoryDiagnostics()
+        _diagnostics.start()
+    return _diagnostics
+
+
+# --- Offline Trend ---
+
+def summarize_trend(path: str) -> dict:
+    """
+    Reads a diagnostics dump and reports growth between its first and last samples.
+
+    Returns:
+        dict: {"samples", "hours", "rss_growth_bytes", "traced_growth_bytes",
+               "sessions_first", "sessions_last", "tasks_last", "persistent_sites"} where
+               persistent_sites are sites among the top growers in at least half the samples.
+    """
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                samples.append(json.loads(line))
+            except ValueError:
+                continue
+    if not samples:
+        return {"samples": 0}
+    first, last = samples[0], samples[-1]
+    appearances = {}
+    for sample in samples:
+        for site in sample.get("growth_since_last", []):
+            if site["growth_bytes"] > 0:
+                appearances[site["site"]] = appearances.get(site["site"], 0) + 1
+    persistent = sorted((site for site, count in appearances.items() if count * 2 >= len(samples)), key=lambda site: -appearances[site])
+    return {
+        "samples": len(samples),
+        "hours": round((last["ts"] - first["ts"]) / 3600, 2),
+        "rss_growth_bytes": (last["rss_bytes"] or 0) - (first["rss_bytes"] or 0),
+        "traced_growth_bytes": last["traced_bytes"] - first["traced_bytes"],
+        "sessions_first": first["sessions"],
+        "sessions_last": last["sessions"],
+        "tasks_last": last["tasks"]["live_tasks"],
+        "persistent_sites": persistent[:TOP_ALLOCATION_SITES],
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect Story-Verse memory diagnostics dumps.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    trend_parser = commands.add_parser("trend", help="Summarize growth across a diagnostics dump.")
+    trend_parser.add_argument("dump", nargs="?", default=DIAGNOSTICS_DUMP_PATH)
+    args = parser.parse_args(argv)
+
+    try:
+        print(json.dumps(summarize_trend(args.dump), indent=2))
+    except OSError as error:
+        print(f"❌ Could not read diagnostics dump '{args.dump}': {error}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
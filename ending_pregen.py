@@ -0,0 +1,69 @@
+### ENDING PRE-GENERATION ###
+# Decides when a story is close enough to its end that an ending set is worth
+# generating before the writer asks for it, and runs that generation on a
+# background event loop that outlives Streamlit script reruns. Results are keyed
+# by the story version they were generated for; any new segment bumps the version,
+# so a stale set is dropped by a single integer comparison.
+
+import os
+import re
+import asyncio
+import threading
+from concurrent.futures import Future
+
+PREGEN_AFTER_ROUNDS = int(os.getenv("STORY_PREGEN_AFTER_ROUNDS", "8")) # Always pre-generate from this round
+CLIMAX_MIN_ROUNDS = 4   # The climax heuristic is ignored before this round
+CLIMAX_WINDOW = 2       # Recent segments inspected for a climax signal
+CLIMAX_THRESHOLD = 2.0  # Score from which a segment window counts as a climax
+
+# Words that tend to appear when a story turns toward its resolution
+CLIMAX_MARKERS = re.compile(
+    r"\b(finally|at last|confront\w*|showdown|final\w*|reveal\w*|truth|betray\w*|"
+    r"sacrifice\w*|last chance|no turning back|everything (?:changed|ended)|face to face|"
+    r"destin\w*|doom\w*|end of|climax)\b",
+    re.IGNORECASE
+)
+
+
+def climax_score(story_log: list[dict], window: int = CLIMAX_WINDOW) -> float:
+    """
+    Scores how "climactic" the latest segments read: one point per marker phrase
+    plus half a point per exclamation.
+
+    Args:
+        story_log (list[dict]): Segments with a "text" field.
+        window (int): How many recent segments to inspect.
+
+    Returns:
+        float: The score of the window (0.0 for an empty log).
+    """
+    score = 0.0
+    for segment in story_log[-window:]:
+        text = segment.get("text", "")
+        score += len(CLIMAX_MARKERS.findall(text)) + 0.5 * text.count("!")
+    return score
+
+
+def should_pregenerate(story_log: list[dict], after_rounds: int = PREGEN_AFTER_ROUNDS) -> bool:
+    """True once the story is long enough, or reads like its climax."""
+    rounds = len(story_log)
+    if rounds >= after_rounds:
+        return True
+    return rounds >= CLIMAX_MIN_ROUNDS and climax_score(story_log) >= CLIMAX_THRESHOLD
+
+
+class BackgroundLoop:
+    """An event loop on a daemon thread; coroutines submitted to it survive the caller's loop."""
+
+    def __init__(self, name: str = "story-background"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine) -> Future:
+        """Schedules a coroutine; returns a concurrent.futures.Future (await it with asyncio.wrap_future)."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
@@ -0,0 +1,286 @@
+### IMAGE PIPELINE ###
+# Post-processes generated images before they are shown or stored. Imagen returns
+# full-size PNGs; each one is decoded once and re-encoded as
+#   - a "display" rendition (WebP, or JPEG where Pillow lacks WebP) sized for the page,
+#   - a "cover" rendition (JPEG, which the PDF/EPUB exporters can embed).
+# Renditions are cached on disk under a key made from the normalised visual
+# concept plus the story's format and era, so near-identical concepts within a
+# story ("A lone lighthouse at dusk." / "lone lighthouse at dusk") reuse one image
+# instead of triggering another Imagen call.
+#
+# Pillow is optional: without it images pass through unchanged (still cached and
+# deduplicated, just not resized).
+#
+# Usage: python image_pipeline.py render cover.png [--out-dir renditions/]
+
+import os
+import io
+import re
+import sys
+import base64
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image, features
+except ImportError: # Optional: renditions are skipped without Pillow
+    Image = None
+
+IMAGE_CACHE_DIRECTORY = os.getenv("STORY_IMAGE_CACHE", ".story_images")
+DISPLAY_WIDTH = 768     # Pixels; Streamlit's main column is narrower than Imagen's output
+COVER_WIDTH = 1600      # Enough for a printed 6x9 cover at ~180 dpi
+DISPLAY_QUALITY = 80
+COVER_QUALITY = 88
+MAX_CACHED_IMAGES = 512 # Oldest renditions are evicted beyond this
+MEMORY_CACHE_ENTRIES = 64
+
+# Words that do not change what an image shows
+CONCEPT_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "at", "with", "and", "or", "to", "for", "by", "from",
+    "is", "are", "its", "their", "his", "her", "this", "that", "image", "picture", "scene",
+    "shot", "showing", "shows", "depicting", "depicts", "visual", "concept", "cover",
+}
+
+
+def normalize_concept(concept: str) -> str:
+    """
+    Reduces a visual concept to a canonical form: lowercase words without
+    punctuation, stopwords or plural endings, sorted and de-duplicated.
+
+    Args:
+        concept (str): The concept text (a "Visual Concept:" prefix is ignored).
+
+    Returns:
+        str: The normalised concept, e.g. "dusk lighthouse lone".
+    """
+    words = re.findall(r"[^\W_]+", concept.lower())
+    normalized = set()
+    for word in words:
+        if word in CONCEPT_STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        normalized.add(word)
+    return " ".join(sorted(normalized))
+
+
+def cover_cache_key(concept: str, story_format: str = "", era_style: str = "") -> str:
+    """The cache key of a concept within a story's format and era."""
+    material = f"{normalize_concept(concept)}|{story_format.strip().lower()}|{era_style.strip().lower()}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:32]
+
+
+def _data_url(mime: str, data: bytes) -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def _decode_data_url(url: str) -> tuple[str, bytes] | None:
+    if not isinstance(url, str) or not url.startswith("data:") or ";base64," not in url:
+        return None
+    header, encoded = url.split(";base64,", 1)
+    return header[len("data:"):], base64.b64decode(encoded)
+
+
+def make_renditions(data: bytes, mime: str = "image/png") -> dict[str, tuple[str, bytes]]:
+    """
+    Decodes an image once and encodes its display and cover renditions.
+
+    Args:
+        data (bytes): The original image (any format Pillow reads).
+        mime (str): The original's MIME type, kept when it passes through unchanged.
+
+    Returns:
+        dict[str, tuple[str, bytes]]: {"display": (mime, bytes), "cover": (mime, bytes)}.
+                                      Without Pillow (or for unreadable data) both are the original,
+                                      as is any rendition that would be larger than it.
+    """
+    if Image is None:
+        return {"display": (mime, data), "cover": (mime, data)}
+    try:
+        with Image.open(io.BytesIO(data)) as original:
+            original.load()
+            image = original.convert("RGB") # Imagen output is opaque; JPEG needs RGB
+    except (OSError, ValueError) as error:
+        print(f"Warning: could not decode generated image, keeping it as-is: {error}")
+        return {"display": (mime, data), "cover": (mime, data)}
+
+    def resized(width: int):
+        if image.width <= width:
+            return image
+        return image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+    renditions = {}
+    display = io.BytesIO()
+    if features.check("webp"):
+        resized(DISPLAY_WIDTH).save(display, "WEBP", quality=DISPLAY_QUALITY, method=4)
+        renditions["display"] = ("image/webp", display.getvalue())
+    else:
+        resized(DISPLAY_WIDTH).save(display, "JPEG", quality=DISPLAY_QUALITY, optimize=True)
+        renditions["display"] = ("image/jpeg", display.getvalue())
+    cover = io.BytesIO()
+    resized(COVER_WIDTH).save(cover, "JPEG", quality=COVER_QUALITY, optimize=True)
+    renditions["cover"] = ("image/jpeg", cover.getvalue())
+    if mime in ("image/png", "image/jpeg"): # Never worse than the original (which exporters can embed too)
+        for name, (_, rendition) in renditions.items():
+            if len(rendition) >= len(data):
+                renditions[name] = (mime, data)
+    return renditions
+
+
+class ImagePipeline:
+    """Rendition cache for generated images, shared by every session of a server process."""
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIRECTORY, max_images: int = MAX_CACHED_IMAGES):
+        self.directory = directory
+        self.max_images = max_images
+        os.makedirs(directory, exist_ok=True)
+        self._memory: OrderedDict[str, dict[str, str]] = OrderedDict() # key -> {rendition: data URL}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_in = 0  # Original image bytes processed
+        self.bytes_out = 0 # Display rendition bytes produced for them
+
+    def _paths(self, key: str) -> dict[str, str]:
+        return {name: os.path.join(self.directory, f"{key}.{name}") for name in ("display", "cover")}
+
+    def lookup(self, concept: str, story_format: str = "", era_style: str = "") -> dict[str, str] | None:
+        """
+        Returns cached renditions for a concept, counting a hit or a miss.
+
+        Returns:
+            dict[str, str] | None: {"display": data URL, "cover": data URL}, or None on a miss.
+        """
+        key = cover_cache_key(concept, story_format, era_style)
+        with self._lock:
+            urls = self._memory.get(key)
+            if urls is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return urls
+        urls = {}
+        for name, path in self._paths(key).items():
+            try:
+                with open(path, "rb") as f:
+                    mime, _, data = f.read().partition(b"\n")
+                urls[name] = _data_url(mime.decode("ascii"), data)
+            except (OSError, UnicodeDecodeError):
+                with self._lock:
+                    self.misses += 1
+                return None
+        with self._lock:
+            self.hits += 1
+            self._remember(key, urls)
+        return urls
+
+    def store(self, concept: str, image_url: str, story_format: str = "", era_style: str = "") -> dict[str, str]:
+        """
+        Makes renditions of a freshly generated image and caches them.
+
+        Args:
+            concept (str): The visual concept the image was generated for.
+            image_url (str): Imagen's base64 data: URL. Placeholder URLs are not cached.
+
+        Returns:
+            dict[str, str]: {"display": url, "cover": url}; both are image_url unchanged for non-data URLs.
+        """
+        urls = self.render(image_url)
+        if urls["display"].startswith("data:"):
+            self.keep(concept, urls, story_format, era_style)
+        return urls
+
+    def render(self, image_url: str) -> dict[str, str]:
+        """
+        Makes renditions of a generated image without caching them (e.g. a cover
+        variant the writer may not pick).
+
+        Returns:
+            dict[str, str]: {"display": url, "cover": url}; both are image_url unchanged for non-data URLs.
+        """
+        decoded = _decode_data_url(image_url)
+        if decoded is None:
+            return {"display": image_url, "cover": image_url}
+        renditions = make_renditions(decoded[1], decoded[0])
+        with self._lock:
+            self.bytes_in += len(decoded[1])
+            self.bytes_out += len(renditions["display"][1])
+        return {name: _data_url(mime, data) for name, (mime, data) in renditions.items()}
+
+    def keep(self, concept: str, urls: dict[str, str], story_format: str = "", era_style: str = ""):
+        """Caches renditions (from render) as the image of a concept, replacing any earlier one."""
+        key = cover_cache_key(concept, story_format, era_style)
+        for name, path in self._paths(key).items():
+            mime, data = _decode_data_url(urls[name])
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(mime.encode("ascii") + b"\n" + data)
+            os.replace(temp_path, path)
+        with self._lock:
+            self._remember(key, urls)
+        self._evict()
+
+    def _remember(self, key: str, urls: dict[str, str]):
+        self._memory[key] = urls
+        self._memory.move_to_end(key)
+        while len(self._memory) > MEMORY_CACHE_ENTRIES:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        """Deletes the least recently written renditions beyond max_images."""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".display")]
+            if len(names) <= self.max_images:
+                return
+            names.sort(key=lambda name: os.path.getmtime(os.path.join(self.directory, name)))
+            for name in names[:len(names) - self.max_images]:
+                for path in self._paths(name[:-len(".display")]).values():
+                    if os.path.exists(path):
+                        os.remove(path)
+        except OSError as error:
+            print(f"Warning: image cache eviction failed: {error}")
+
+    def stats(self) -> dict:
+        """Cache hit statistics and how much smaller the display renditions are."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "display_ratio": self.bytes_out / self.bytes_in if self.bytes_in else 1.0,
+        }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Make display and cover renditions of an image.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    render_parser = commands.add_parser("render", help="Write the renditions of an image file.")
+    render_parser.add_argument("image")
+    render_parser.add_argument("--out-dir", default=".")
+    args = parser.parse_args(argv)
+
+    if Image is None:
+        print("❌ Pillow is not installed; renditions need it (pip install pillow).")
+        return 1
+    try:
+        with open(args.image, "rb") as f:
+            data = f.read()
+    except OSError as error:
+        print(f"❌ Could not read '{args.image}': {error}")
+        return 1
+    stem = os.path.splitext(os.path.basename(args.image))[0]
+    os.makedirs(args.out_dir, exist_ok=True)
+    print(f"original: {len(data):,} bytes")
+    for name, (mime, rendition) in make_renditions(data).items():
+        path = os.path.join(args.out_dir, f"{stem}.{name}.{mime.split('/')[1]}")
+        with open(path, "wb") as f:
+            f.write(rendition)
+        print(f"{name}: {len(rendition):,} bytes ({len(rendition) / max(len(data), 1):.0%}) -> {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
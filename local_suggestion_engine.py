@@ -0,0 +1,517 @@
+### LOCAL SUGGESTION ENGINE ###
+# An offline trigram (second-order Markov) model trained on saved story logs. It is
+# the degraded-mode fallback when the Gemini API is unavailable: it produces
+# continuations, bonus ideas and endings in a few milliseconds on CPU.
+#
+# Models are indexed by kind (continuation / bonus / ending), genre and format; a
+# lookup falls back from the exact genre+format bucket to genre-only, then to all
+# stories. The on-disk model is a flat binary file that is memory-mapped at load
+# time, so loading is O(1) and only the pages touched by a lookup are read.
+#
+# Usage:
+#   python local_suggestion_engine.py train story_local_model.svlm my_story_log.json stories/
+#   python local_suggestion_engine.py suggest story_local_model.svlm --genre Fantasy --format Novel --story "..."
+
+import os
+import re
+import sys
+import mmap
+import json
+import struct
+import random
+import hashlib
+import argparse
+from array import array
+from bisect import bisect_right
+
+from story_records import read_story_record
+
+MODEL_MAGIC = b"SVLM"
+MODEL_VERSION = 1
+MANIFEST_VERSION = 2
+
+# Reserved vocabulary ids
+START_ID = 0
+END_ID = 1
+
+ANY = "*"
+MAX_GENERATED_TOKENS = 40
+SAMPLES_PER_SLOT = 3 # Candidates drawn per output; the one closest to the story wins
+
+# story_log "type" values (non-AI CLI and GUI) mapped to model kinds
+SEGMENT_KINDS = {
+    "Story Ending": "ending",
+    "ending": "ending",
+    "Bonus Idea": "bonus",
+    "plot_twist": "bonus",
+    "character_idea": "bonus",
+}
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:['’][^\W_]+)*|[.!?,;:\"]")
+NO_SPACE_BEFORE = {".", "!", "?", ",", ";", ":"}
+
+# Header: magic, version, vocab size, bucket count, vocab offsets/blob/bucket directory offsets
+_HEADER = struct.Struct("<4sIII QQQ")
+# Bucket directory entry after its name: contexts, context offset, starts offset,
+# successors, successor-word offset, cumulative-count offset
+_BUCKET = struct.Struct("<I QQ I QQ")
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into word and punctuation tokens."""
+    return TOKEN_PATTERN.findall(text)
+
+
+def detokenize(tokens: list[str]) -> str:
+    """Joins tokens back into readable text."""
+    text = ""
+    for token in tokens:
+        if text and token not in NO_SPACE_BEFORE:
+            text += " "
+        text += token
+    return text
+
+
+def segment_kind(segment: dict) -> str:
+    """Returns the model kind (continuation, bonus, ending) for a story_log segment."""
+    return SEGMENT_KINDS.get(segment.get("type", ""), "continuation")
+
+
+def bucket_names(kind: str, genre: str, story_format: str) -> list[str]:
+    """Returns bucket names from most to least specific for a kind/genre/format."""
+    genre = genre or ANY
+    story_format = story_format or ANY
+    names = [f"{kind}|{genre}|{story_format}", f"{kind}|{genre}|{ANY}", f"{kind}|{ANY}|{ANY}"]
+    return list(dict.fromkeys(names)) # Drop duplicates, keep order
+
+
+def _context_key(w1: int, w2: int) -> int:
+    return (w1 << 32) | w2
+
+
+# --- Training ---
+
+class ModelBuilder:
+    """Mutable trigram counts used while training; written out with save()."""
+
+    def __init__(self):
+        self.words = ["<s>", "</s>"]
+        self.word_ids = {"<s>": START_ID, "</s>": END_ID}
+        self.buckets: dict[str, dict[int, dict[int, int]]] = {}
+
+    def _word_id(self, word: str) -> int:
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = len(self.words)
+            self.words.append(word)
+            self.word_ids[word] = word_id
+        return word_id
+
+    def add_text(self, text: str, kind: str, genre: str = "", story_format: str = ""):
+        """Counts the trigrams of one segment into every bucket it belongs to."""
+        ids = [self._word_id(token) for token in tokenize(text)]
+        if not ids:
+            return
+        sequence = [START_ID, START_ID] + ids + [END_ID]
+        for name in bucket_names(kind, genre, story_format):
+            contexts = self.buckets.setdefault(name, {})
+            for i in range(2, len(sequence)):
+                successors = contexts.setdefault(_context_key(sequence[i - 2], sequence[i - 1]), {})
+                successors[sequence[i]] = successors.get(sequence[i], 0) + 1
+
+    def add_story(self, story_log: list[dict], genre: str = "", story_format: str = "", skip: int = 0):
+        """Counts every segment of a story log (after the first `skip` segments)."""
+        for segment in story_log[skip:]:
+            text = segment.get("text", "")
+            if isinstance(text, str) and text.strip():
+                self.add_text(text, segment_kind(segment), genre, story_format)
+
+    @classmethod
+    def from_model(cls, model: "LocalSuggestionModel") -> "ModelBuilder":
+        """Decodes an existing model back into counts so it can be extended."""
+        builder = cls()
+        builder.words = [model.word(i) for i in range(model.vocab_size)]
+        builder.word_ids = {word: i for i, word in enumerate(builder.words)}
+        for name, bucket in model.buckets.items():
+            contexts, starts, succ_words, succ_cum = bucket
+            decoded = {}
+            for c in range(len(contexts)):
+                successors = {}
+                previous = 0
+                for j in range(starts[c], starts[c + 1]):
+                    successors[succ_words[j]] = succ_cum[j] - previous
+                    previous = succ_cum[j]
+                decoded[contexts[c]] = successors
+            builder.buckets[name] = decoded
+        return builder
+
+    def save(self, path: str):
+        """Writes the model atomically in the memory-mappable format."""
+        body = bytearray()
+
+        def align():
+            body.extend(b"\0" * (-(_HEADER.size + len(body)) % 8))
+
+        def offset() -> int:
+            return _HEADER.size + len(body)
+
+        blob = bytearray()
+        vocab_offsets = array("I", [0])
+        for word in self.words:
+            blob.extend(word.encode("utf-8"))
+            vocab_offsets.append(len(blob))
+        vocab_offsets_at = offset()
+        body.extend(vocab_offsets.tobytes())
+        vocab_blob_at = offset()
+        body.extend(blob)
+
+        arrays = {}
+        for name in sorted(self.buckets):
+            contexts = self.buckets[name]
+            keys = array("Q", sorted(contexts))
+            starts = array("I", [0])
+            succ_words = array("I")
+            succ_cum = array("I")
+            for key in keys:
+                total = 0
+                for word_id, count in sorted(contexts[key].items(), key=lambda item: -item[1]):
+                    total += count
+                    succ_words.append(word_id)
+                    succ_cum.append(total)
+                starts.append(len(succ_words))
+            placed = []
+            for data in (keys, starts, succ_words, succ_cum):
+                align()
+                placed.append(offset())
+                body.extend(data.tobytes())
+            arrays[name] = (len(keys), placed[0], placed[1], len(succ_words), placed[2], placed[3])
+
+        bucket_dir_at = offset()
+        for name, (n_contexts, contexts_at, starts_at, n_succ, words_at, cum_at) in arrays.items():
+            encoded = name.encode("utf-8")
+            body.extend(struct.pack("<H", len(encoded)) + encoded)
+            body.extend(_BUCKET.pack(n_contexts, contexts_at, starts_at, n_succ, words_at, cum_at))
+
+        header = _HEADER.pack(MODEL_MAGIC, MODEL_VERSION, len(self.words), len(arrays), vocab_offsets_at, vocab_blob_at, bucket_dir_at)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(header)
+            f.write(body)
+        os.replace(temp_path, path)
+
+
+# --- Loading and Generation ---
+
+class LocalSuggestionModel:
+    """A trained model, memory-mapped read-only from disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, version, self.vocab_size, bucket_count, vocab_offsets_at, vocab_blob_at, bucket_dir_at = _HEADER.unpack_from(view, 0)
+        if magic != MODEL_MAGIC or version != MODEL_VERSION:
+            raise ValueError(f"'{path}' is not a local suggestion model (version {MODEL_VERSION})")
+
+        self._vocab_offsets = view[vocab_offsets_at:vocab_offsets_at + 4 * (self.vocab_size + 1)].cast("I")
+        self._vocab_blob_at = vocab_blob_at
+        self.buckets = {}
+        position = bucket_dir_at
+        for _ in range(bucket_count):
+            (name_length,) = struct.unpack_from("<H", view, position)
+            name = bytes(view[position + 2:position + 2 + name_length]).decode("utf-8")
+            position += 2 + name_length
+            n_contexts, contexts_at, starts_at, n_succ, words_at, cum_at = _BUCKET.unpack_from(view, position)
+            position += _BUCKET.size
+            self.buckets[name] = (
+                view[contexts_at:contexts_at + 8 * n_contexts].cast("Q"),
+                view[starts_at:starts_at + 4 * (n_contexts + 1)].cast("I"),
+                view[words_at:words_at + 4 * n_succ].cast("I"),
+                view[cum_at:cum_at + 4 * n_succ].cast("I"),
+            )
+
+    def word(self, word_id: int) -> str:
+        start = self._vocab_blob_at + self._vocab_offsets[word_id]
+        end = self._vocab_blob_at + self._vocab_offsets[word_id + 1]
+        return self._mmap[start:end].decode("utf-8")
+
+    def _pick_bucket(self, kind: str, genre: str, story_format: str):
+        for name in bucket_names(kind, genre, story_format):
+            bucket = self.buckets.get(name)
+            if bucket is not None and len(bucket[0]) > 0:
+                return bucket
+        return None
+
+    @staticmethod
+    def _next_word(bucket, w1: int, w2: int, rng: random.Random) -> int:
+        contexts, starts, succ_words, succ_cum = bucket
+        key = _context_key(w1, w2)
+        index = bisect_right(contexts, key) - 1
+        if index < 0 or contexts[index] != key:
+            return END_ID
+        first, last = starts[index], starts[index + 1]
+        total = succ_cum[last - 1]
+        target = rng.randrange(total)
+        return succ_words[bisect_right(succ_cum, target, first, last)]
+
+    def _sample(self, bucket, rng: random.Random) -> list[str]:
+        w1, w2 = START_ID, START_ID
+        tokens = []
+        for _ in range(MAX_GENERATED_TOKENS):
+            next_id = self._next_word(bucket, w1, w2, rng)
+            if next_id == END_ID:
+                break
+            tokens.append(self.word(next_id))
+            w1, w2 = w2, next_id
+        return tokens
+
+    def generate(self, kind: str, story_context: str = "", genre: str = "", story_format: str = "", count: int = 1, seed: int | None = None) -> list[str]:
+        """
+        Generates `count` distinct texts of a kind, preferring samples that share
+        vocabulary with the end of the story.
+
+        Args:
+            kind (str): "continuation", "bonus" or "ending".
+            story_context (str): The story so far (only its tail is used for ranking).
+            genre (str): The story genre, for bucket selection.
+            story_format (str): The story format, for bucket selection.
+            count (int): How many texts to return.
+            seed (int): Optional RNG seed; defaults to one derived from the story.
+
+        Returns:
+            list[str]: Up to `count` generated texts (empty if the model has no data).
+        """
+        bucket = self._pick_bucket(kind, genre, story_format)
+        if bucket is None:
+            return []
+        if seed is None:
+            seed = int.from_bytes(hashlib.blake2b(f"{kind}|{story_context[-500:]}".encode("utf-8"), digest_size=8).digest(), "little")
+        rng = random.Random(seed)
+        story_words = {token.lower() for token in tokenize(story_context[-500:])}
+
+        results = []
+        for _ in range(count * 2): # A few spare attempts to find distinct texts
+            samples = [self._sample(bucket, rng) for _ in range(SAMPLES_PER_SLOT)]
+            samples = [s for s in samples if s]
+            if not samples:
+                break
+            best = max(samples, key=lambda s: sum(1 for token in s if token.lower() in story_words) / len(s) ** 0.5)
+            text = detokenize(best)
+            if text not in results:
+                results.append(text)
+            if len(results) == count:
+                break
+        return results
+
+    def generate_suggestions(self, story_context: str, genre: str = "", story_format: str = "") -> list[tuple[str, str]]:
+        """
+        Produces a suggestion set shaped like generate_gemini_suggestions' output:
+        3 continuations, 1 "Bonus Idea: ..." and 1 "Visual Concept: ..." tuple.
+
+        Returns:
+            list[tuple[str, str]]: The 5 (suggestion_text, commentary) tuples, or [] if untrained.
+        """
+        continuations = self.generate("continuation", story_context, genre, story_format, count=3)
+        if not continuations:
+            return []
+        bonus = self.generate("bonus", story_context, genre, story_format, count=1) or continuations[-1:]
+        commentary = "Offline suggestion from the local story model."
+        suggestions = [(text, commentary) for text in continuations]
+        while len(suggestions) < 3:
+            suggestions.append((continuations[0], commentary))
+        suggestions.append(("Bonus Idea: " + bonus[0], commentary))
+        subject = f"{genre} {story_format}".strip() or "story"
+        suggestions.append((f"Visual Concept: A vintage {subject.lower()} cover inspired by: {continuations[0]}", commentary))
+        return suggestions
+
+    def generate_endings(self, story_context: str, genre: str = "", story_format: str = "", count: int = 3) -> list[str]:
+        """Produces up to `count` ending texts (falls back to continuation buckets if no endings were trained)."""
+        return self.generate("ending", story_context, genre, story_format, count) or \
+            self.generate("continuation", story_context, genre, story_format, count)
+
+    def close(self):
+        self._vocab_offsets.release()
+        for bucket in self.buckets.values():
+            for view in bucket:
+                view.release()
+        self.buckets = {}
+        self._mmap.close()
+
+
+_loaded_models: dict[str, LocalSuggestionModel] = {}
+
+def get_local_model(path: str) -> LocalSuggestionModel | None:
+    """Returns the (cached) model at path, or None if it does not exist or is invalid."""
+    model = _loaded_models.get(path)
+    if model is None and os.path.exists(path):
+        try:
+            model = LocalSuggestionModel(path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Warning: could not load local suggestion model '{path}': {e}")
+            return None
+        _loaded_models[path] = model
+    return model
+
+
+# --- Incremental Training ---
+
+def _manifest_path(model_path: str) -> str:
+    return model_path + ".manifest.json"
+
+
+def _iter_story_files(paths: list[str]):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith(".json") and not name.endswith(".manifest.json"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def _prefix_hash(story_log: list[dict], count: int, genre: str, story_format: str) -> str:
+    """Hash of what training counted from the first `count` segments of a story log."""
+    digest = hashlib.sha256(f"{genre}|{story_format}".encode("utf-8"))
+    for segment in story_log[:count]:
+        digest.update(json.dumps([segment.get("text", ""), segment_kind(segment)], ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _load_manifest(model_path: str) -> dict:
+    try:
+        with open(_manifest_path(model_path), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {"version": MANIFEST_VERSION, "files": {}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        # The first manifests held only a segment count per file: nothing to check a prefix against
+        return {"version": MANIFEST_VERSION, "files": {key: {"segments": count} for key, count in manifest.items() if isinstance(count, int)}}
+    return manifest
+
+
+def _train(model_path: str, sources: dict, manifest: dict, builder: ModelBuilder, fresh: bool = False) -> dict | None:
+    """Adds `sources` ({path: (genre, format)}) to `builder`; None when a known file no longer extends what was counted."""
+    stats = {"files": 0, "segments": 0, "skipped": 0, "rebuilt": False}
+    changed = False
+    for key, (genre, story_format) in sources.items():
+        entry = manifest["files"].get(key)
+        try:
+            info = os.stat(key)
+            if entry and entry.get("mtime") == info.st_mtime_ns and entry.get("size") == info.st_size:
+                stats["skipped"] += 1
+                continue
+            story_log, metadata = read_story_record(key)
+        except (OSError, ValueError) as e: # json.JSONDecodeError is a ValueError
+            print(f"Skipping '{key}': {e}")
+            stats["skipped"] += 1
+            continue
+        file_genre = metadata.get("story_genre") or genre
+        file_format = metadata.get("story_format") or story_format
+        already = entry["segments"] if entry else 0
+        if entry and (already > len(story_log) or entry.get("prefix") != _prefix_hash(story_log, already, file_genre, file_format)):
+            return None
+        builder.add_story(story_log, file_genre, file_format, skip=already)
+        manifest["files"][key] = {
+            "mtime": info.st_mtime_ns, "size": info.st_size, "segments": len(story_log),
+            "prefix": _prefix_hash(story_log, len(story_log), file_genre, file_format),
+            "genre": genre, "format": story_format,
+        }
+        changed = True
+        if len(story_log) > already:
+            stats["files"] += 1
+            stats["segments"] += len(story_log) - already
+        else: # Touched, not extended
+            stats["skipped"] += 1
+
+    if stats["files"] or fresh or not os.path.exists(model_path):
+        builder.save(model_path)
+    if changed or fresh:
+        with open(_manifest_path(model_path), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4)
+    return stats
+
+
+def train(model_path: str, paths: list[str], genre: str = "", story_format: str = "", rebuild: bool = False) -> dict:
+    """
+    Trains or extends a model from story files. The manifest next to the model
+    remembers, per file, its mtime and size, how many segments were ingested and
+    a hash of them. An untouched file is not read again; a file that only grew
+    contributes its new segments. Trigram counts cannot be told apart once merged,
+    so a file rewritten in place (its counted segments changed) rebuilds the model
+    from every file the manifest knows.
+
+    Args:
+        model_path (str): The model file to create or extend.
+        paths (list[str]): Story files and/or directories containing them.
+        genre (str): Genre for files that do not carry their own metadata.
+        story_format (str): Format for files that do not carry their own metadata.
+        rebuild (bool): Ignore the existing model and manifest.
+
+    Returns:
+        dict: {"files": ingested files, "segments": new segments, "skipped": unchanged or unreadable files,
+               "rebuilt": whether a rewritten file forced a rebuild}.
+    """
+    sources = {}
+    for path in _iter_story_files(paths):
+        sources.setdefault(os.path.abspath(path), (genre, story_format))
+    if not rebuild and os.path.exists(model_path):
+        existing = LocalSuggestionModel(model_path)
+        builder = ModelBuilder.from_model(existing)
+        existing.close()
+        _loaded_models.pop(model_path, None)
+        manifest = _load_manifest(model_path)
+        stats = _train(model_path, sources, manifest, builder)
+        if stats is not None:
+            return stats
+        print(f"Warning: a story file was rewritten since '{model_path}' was trained; rebuilding it.")
+        known = {}
+        for key, entry in manifest["files"].items():
+            if os.path.exists(key):
+                known[key] = (entry.get("genre", ""), entry.get("format", ""))
+            else:
+                print(f"Warning: '{key}' no longer exists; dropped from the rebuilt model.")
+        sources = {**known, **sources}
+        stats = _train(model_path, sources, {"version": MANIFEST_VERSION, "files": {}}, ModelBuilder(), fresh=True)
+        stats["rebuilt"] = True
+        return stats
+    return _train(model_path, sources, {"version": MANIFEST_VERSION, "files": {}}, ModelBuilder(), fresh=True)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Train or query the offline story suggestion model.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = commands.add_parser("train", help="Ingest story logs into a model (incremental by default).")
+    train_parser.add_argument("model")
+    train_parser.add_argument("paths", nargs="+", help="Story log files or directories.")
+    train_parser.add_argument("--genre", default="", help="Genre for logs without metadata.")
+    train_parser.add_argument("--format", dest="story_format", default="", help="Format for logs without metadata.")
+    train_parser.add_argument("--rebuild", action="store_true", help="Start from an empty model.")
+
+    suggest_parser = commands.add_parser("suggest", help="Print a suggestion set and endings.")
+    suggest_parser.add_argument("model")
+    suggest_parser.add_argument("--genre", default="")
+    suggest_parser.add_argument("--format", dest="story_format", default="")
+    suggest_parser.add_argument("--story", default="")
+
+    args = parser.parse_args(argv)
+    if args.command == "train":
+        stats = train(args.model, args.paths, args.genre, args.story_format, args.rebuild)
+        rebuilt = ", rebuilt after a rewritten file" if stats["rebuilt"] else ""
+        print(f"✅ Ingested {stats['segments']} new segments from {stats['files']} files ({stats['skipped']} skipped{rebuilt}) into '{args.model}'.")
+    else:
+        model = get_local_model(args.model)
+        if model is None:
+            print(f"❌ No model at '{args.model}'.")
+            return 1
+        for text, commentary in model.generate_suggestions(args.story, args.genre, args.story_format):
+            print(f"- {text}")
+        for ending in model.generate_endings(args.story, args.genre, args.story_format):
+            print(f"- Ending: {ending}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
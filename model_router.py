@@ -0,0 +1,254 @@
+### MODEL ROUTER ###
+# Chooses the Gemini/Imagen model for each request instead of always using
+# GEMINI_MODEL/IMAGEN_MODEL. A routing policy (JSON, see DEFAULT_POLICY) maps
+# requests to tiers (fast / standard / strong) by purpose, round and prompt size;
+# the router then checks the tier's model against its observed latency SLO and
+# error rate and steps down a tier when it is unhealthy. The session budget
+# (token_accounting.plan_generation) caps the tier: economy -> fast, offline -> local.
+#
+# Every decision is logged as one JSON line together with its outcome (latency,
+# success, tokens, cost), so the policy can be tuned offline:
+#   python model_router.py report routing_decisions.jsonl
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+
+from token_accounting import OFFLINE_MODEL, model_breakdown, model_cost
+
+ROUTING_POLICY_PATH = os.getenv("STORY_ROUTING_POLICY", "")
+ROUTING_LOG_PATH = os.getenv("STORY_ROUTING_LOG", "routing_decisions.jsonl")
+
+TIER_ORDER = ["strong", "standard", "fast"] # Stepping down = later in this list
+HEALTH_ALPHA = 0.2                          # EWMA weight of each new outcome
+
+# Purposes: "round" (batched suggestions + endings), "suggestions", "endings" (first
+# roll: the candidates that become canon), "endings_reroll", "image".
+DEFAULT_POLICY = {
+    "tiers": {"fast": "gemini-2.0-flash-lite", "standard": "gemini-2.0-flash", "strong": "gemini-2.5-pro"},
+    "image_tiers": {"fast": "imagen-3.0-fast-generate-001", "standard": "imagen-3.0-generate-002", "strong": "imagen-3.0-generate-002"},
+    # First matching rule wins. Conditions: purpose (list), min_round, max_round,
+    # min_prompt_tokens, max_prompt_tokens.
+    "rules": [
+        {"purpose": ["endings_reroll"], "tier": "fast"},
+        {"purpose": ["endings"], "tier": "strong"},
+        {"purpose": ["image"], "max_round": 1, "tier": "fast"},
+        {"purpose": ["image"], "tier": "standard"},
+        {"min_prompt_tokens": 6000, "tier": "strong"},
+        {"purpose": ["round", "suggestions"], "max_round": 2, "tier": "fast"},
+        {"tier": "standard"},
+    ],
+    "latency_slo_seconds": {"round": 12.0, "suggestions": 10.0, "endings": 20.0, "endings_reroll": 10.0, "image": 25.0},
+    "max_error_rate": 0.25,
+    "min_samples": 5, # Outcomes needed before a model can be judged unhealthy
+}
+
+
+def load_policy(path: str = ROUTING_POLICY_PATH) -> dict:
+    """Returns DEFAULT_POLICY overlaid with the JSON file at path (top-level keys replace defaults)."""
+    policy = json.loads(json.dumps(DEFAULT_POLICY))
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                policy.update(json.load(f))
+        except (OSError, ValueError) as error:
+            print(f"Warning: could not load routing policy '{path}', using defaults: {error}")
+    return policy
+
+
+def _rule_matches(rule: dict, purpose: str, round_number: int, prompt_tokens: int) -> bool:
+    return (
+        ("purpose" not in rule or purpose in rule["purpose"])
+        and round_number >= rule.get("min_round", 0)
+        and round_number <= rule.get("max_round", float("inf"))
+        and prompt_tokens >= rule.get("min_prompt_tokens", 0)
+        and prompt_tokens <= rule.get("max_prompt_tokens", float("inf"))
+    )
+
+
+class ModelRouter:
+    """Process-wide router: picks models, tracks per-model health and logs outcomes."""
+
+    def __init__(self, policy: dict | None = None, log_path: str = ROUTING_LOG_PATH):
+        self.policy = policy or load_policy()
+        self.log_path = log_path
+        self.health: dict[str, dict] = {} # model -> {"latency", "error_rate", "samples"}
+        self._lock = threading.Lock()
+
+    def _models(self, purpose: str) -> dict:
+        return self.policy["image_tiers"] if purpose == "image" else self.policy["tiers"]
+
+    def is_healthy(self, model: str, purpose: str) -> bool:
+        """False once a model has enough samples and misses its SLO or error budget."""
+        health = self.health.get(model)
+        if not health or health["samples"] < self.policy["min_samples"]:
+            return True
+        slo = self.policy["latency_slo_seconds"].get(purpose, float("inf"))
+        return health["latency"] <= slo and health["error_rate"] <= self.policy["max_error_rate"]
+
+    def route(self, purpose: str, round_number: int = 0, prompt_tokens: int = 0, budget_status: str = "ok", session: str = "") -> dict:
+        """
+        Chooses the model for one request.
+
+        Args:
+            purpose (str): "round", "suggestions", "endings", "endings_reroll" or "image".
+            round_number (int): The story's round (early rounds are cheap to serve fast).
+            prompt_tokens (int): Estimated prompt size (see token_accounting.estimate_tokens).
+            budget_status (str): "ok", "economy" or "offline" from token_accounting.plan_generation.
+            session (str): Session token, for the decision log.
+
+        Returns:
+            dict: The decision: {"id", "ts", "session", "purpose", "round", "prompt_tokens",
+                  "budget_status", "tier", "model", "reason"}. model is OFFLINE_MODEL when
+                  the budget is spent (text) or "" when no image should be generated.
+        """
+        decision = {
+            "id": uuid.uuid4().hex[:12], "ts": round(time.time(), 3), "session": session, "purpose": purpose,
+            "round": round_number, "prompt_tokens": prompt_tokens, "budget_status": budget_status,
+        }
+        if budget_status == "offline":
+            return {**decision, "tier": "offline", "model": "" if purpose == "image" else OFFLINE_MODEL, "reason": "budget spent"}
+
+        rule_index, tier = next(
+            ((i, rule["tier"]) for i, rule in enumerate(self.policy["rules"]) if _rule_matches(rule, purpose, round_number, prompt_tokens)),
+            (-1, "standard")
+        )
+        reason = f"rule {rule_index}"
+        if budget_status == "economy" and tier != "fast":
+            tier, reason = "fast", "budget economy"
+
+        # Step down while the chosen model misses its SLO/error budget
+        models = self._models(purpose)
+        candidates = TIER_ORDER[TIER_ORDER.index(tier):]
+        for candidate in candidates:
+            if self.is_healthy(models[candidate], purpose):
+                if candidate != tier:
+                    reason += f"; {models[tier]} unhealthy"
+                tier = candidate
+                break
+        else:
+            # Nothing healthy: the least failing of the allowed tiers
+            tier = min(candidates, key=lambda t: self.health.get(models[t], {}).get("error_rate", 0.0))
+            reason += "; all unhealthy"
+        return {**decision, "tier": tier, "model": models[tier], "reason": reason}
+
+    def record_outcome(self, decision: dict, latency_seconds: float, usage_before: dict, usage_after: dict) -> dict:
+        """
+        Records how a routed request went: updates the model's health and appends
+        the decision plus outcome to the routing log.
+
+        Args:
+            decision (dict): From route().
+            latency_seconds (float): Wall time of the request.
+            usage_before (dict), usage_after (dict): The session usage record around the request.
+
+        Returns:
+            dict: The logged entry (decision + "latency_ms", "outcome", "input_tokens", "output_tokens", "cost_usd").
+        """
+        call_key = "imagen_calls" if decision["purpose"] == "image" else "gemini_calls"
+        calls = usage_after.get(call_key, 0) - usage_before.get(call_key, 0)
+        previous = model_breakdown(usage_before)
+        delta = {}
+        for model, counters in model_breakdown(usage_after).items():
+            delta[model] = {key: value - previous.get(model, {}).get(key, 0) for key, value in counters.items()}
+        succeeded = sum(counters["calls"] for counters in delta.values())
+        if decision["model"] in ("", OFFLINE_MODEL):
+            outcome = "offline"
+        elif calls == 0:
+            outcome = "cached" # Served from a shared result cache: says nothing about the model
+        else:
+            outcome = "ok" if succeeded else "error"
+
+        if outcome in ("ok", "error"):
+            with self._lock:
+                health = self.health.setdefault(decision["model"], {"latency": latency_seconds, "error_rate": 0.0, "samples": 0})
+                health["latency"] += HEALTH_ALPHA * (latency_seconds - health["latency"])
+                health["error_rate"] += HEALTH_ALPHA * ((outcome == "error") - health["error_rate"])
+                health["samples"] += 1
+
+        entry = {
+            **decision,
+            "latency_ms": round(latency_seconds * 1000, 1),
+            "outcome": outcome,
+            "input_tokens": sum(counters["input_tokens"] for counters in delta.values()),
+            "output_tokens": sum(counters["output_tokens"] for counters in delta.values()),
+            "cost_usd": round(sum(model_cost(model, counters) for model, counters in delta.items()), 8),
+        }
+        if self.log_path:
+            with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        return entry
+
+
+_router: ModelRouter | None = None
+
+def get_router() -> ModelRouter:
+    """Returns the process-wide router (policy from STORY_ROUTING_POLICY)."""
+    global _router
+    if _router is None:
+        _router = ModelRouter()
+    return _router
+
+
+# --- Offline Report ---
+
+def summarize_decisions(path: str) -> list[dict]:
+    """
+    Aggregates a routing log by (purpose, tier, model).
+
+    Returns:
+        list[dict]: {"purpose", "tier", "model", "requests", "errors", "error_rate",
+                     "p50_ms", "p95_ms", "mean_cost_usd"} rows.
+    """
+    groups: dict[tuple, list[dict]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            groups.setdefault((entry["purpose"], entry["tier"], entry["model"]), []).append(entry)
+    rows = []
+    for (purpose, tier, model), entries in sorted(groups.items()):
+        latencies = sorted(entry["latency_ms"] for entry in entries)
+        errors = sum(entry["outcome"] == "error" for entry in entries)
+        rows.append({
+            "purpose": purpose, "tier": tier, "model": model, "requests": len(entries), "errors": errors,
+            "error_rate": round(errors / len(entries), 3),
+            "p50_ms": latencies[len(latencies) // 2],
+            "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "mean_cost_usd": round(sum(entry["cost_usd"] for entry in entries) / len(entries), 8),
+        })
+    return rows
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect Story-Verse model routing.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report_parser = commands.add_parser("report", help="Summarize a routing decision log.")
+    report_parser.add_argument("log", nargs="?", default=ROUTING_LOG_PATH)
+    policy_parser = commands.add_parser("policy", help="Print the effective routing policy.")
+    policy_parser.add_argument("--policy", default=ROUTING_POLICY_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "policy":
+        print(json.dumps(load_policy(args.policy), indent=2))
+        return 0
+    try:
+        rows = summarize_decisions(args.log)
+    except OSError as error:
+        print(f"❌ Could not read routing log '{args.log}': {error}")
+        return 1
+    print(f"{'purpose':<15} {'tier':<9} {'model':<30} {'reqs':>6} {'err%':>6} {'p50 ms':>9} {'p95 ms':>9} {'cost/req':>10}")
+    for row in rows:
+        print(f"{row['purpose']:<15} {row['tier']:<9} {row['model']:<30} {row['requests']:>6} {row['error_rate']:>6.1%} "
+              f"{row['p50_ms']:>9.0f} {row['p95_ms']:>9.0f} {row['mean_cost_usd']:>10.6f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
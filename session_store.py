@@ -0,0 +1,289 @@
+### SESSION STORE ###
+# Durable snapshots of the GUI's st.session_state so an in-progress story survives
+# a deploy or crash. Each browser session gets a resume token (kept in the URL as
+# ?resume=...). Its state is stored as an append-only file of compressed frames:
+#   - a FULL frame holding every persisted key,
+#   - DELTA frames holding only the keys that changed since the previous frame
+#     (story_log grows by appending, so only new segments are written).
+# Restoring replays the frames. The file is compacted back to a single FULL frame
+# once deltas pile up. Generated images are stored once as separate blob files and
+# referenced from the state; they are only read when displayed (resolve_image).
+
+import os
+import json
+import time
+import zlib
+import base64
+import struct
+import hashlib
+import secrets
+
+SESSION_DIR = os.getenv("STORY_SESSION_DIR", ".story_sessions")
+SESSION_MAX_AGE_SECONDS = 7 * 24 * 3600
+SESSION_CLEANUP_EVERY_SECONDS = 6 * 3600
+COMPACT_AFTER_DELTAS = 50
+
+# Session state keys that make up a resumable story (see initialize_session_state)
+PERSISTED_KEYS = [
+    "current_story",
+    "story_log",
+    "suggestions_with_commentary",
+    "generated_image_url",
+    "cover_image_url",
+    "main_character_name",
+    "main_character_role",
+    "story_language",
+    "story_genre",
+    "story_format",
+    "aesthetic_style",
+    "era_style",
+    "round_number",
+    "story_version",
+    "story_creation_complete",
+    "alternate_endings",
+    "story_concluded",
+    "ending_pool",
+    "ending_pool_version",
+    "api_usage",
+]
+
+FRAME_FULL = 0
+FRAME_DELTA = 1
+_FRAME_HEADER = struct.Struct("<IB") # payload length, frame kind
+
+IMAGE_KEYS = ("generated_image_url", "cover_image_url") # Stored as blobs, not inline
+BLOB_PREFIX = "blob:"
+_APPEND = "__append__"
+
+
+def new_resume_token() -> str:
+    """Returns a fresh, URL-safe resume token."""
+    return secrets.token_urlsafe(16)
+
+
+def _valid_token(token: str) -> bool:
+    return bool(token) and len(token) <= 64 and all(c.isalnum() or c in "-_" for c in token)
+
+
+def _digest(value) -> str:
+    return hashlib.blake2b(json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SessionStore:
+    """Reads and writes session snapshot files under one directory."""
+
+    def __init__(self, directory: str = SESSION_DIR):
+        self.directory = directory
+        self.blob_directory = os.path.join(directory, "blobs")
+        os.makedirs(self.blob_directory, exist_ok=True)
+        # token -> {"digests": {key: digest}, "lists": {key: (length, last item)}, "deltas": int}
+        self._writers: dict[str, dict] = {}
+        self._image_refs: dict[str, str] = {} # data: URL -> blob reference, so reruns skip re-decoding
+
+    def _path(self, token: str) -> str:
+        return os.path.join(self.directory, f"{token}.svs")
+
+    # --- Images ---
+
+    def _store_image(self, url: str) -> str:
+        """Moves a base64 data: URL into a blob file and returns its blob: reference."""
+        if not isinstance(url, str) or not url.startswith("data:") or ";base64," not in url:
+            return url
+        cached = self._image_refs.get(url)
+        if cached is not None:
+            return cached
+        header, encoded = url.split(";base64,", 1)
+        data = base64.b64decode(encoded)
+        sha = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.blob_directory, sha)
+        if not os.path.exists(path):
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        if len(self._image_refs) > 64:
+            self._image_refs.clear()
+        reference = self._image_refs[url] = f"{BLOB_PREFIX}{header[len('data:'):]}:{sha}"
+        return reference
+
+    def resolve_image(self, value: str):
+        """
+        Returns something st.image can display: blob references are loaded from
+        disk (bytes) on demand, anything else is returned unchanged.
+        """
+        if not isinstance(value, str) or not value.startswith(BLOB_PREFIX):
+            return value
+        sha = value.rsplit(":", 1)[1]
+        try:
+            with open(os.path.join(self.blob_directory, sha), "rb") as f:
+                return f.read()
+        except OSError:
+            return "https://placehold.co/400x200/505050/FFFFFF?text=Image+Unavailable"
+
+    # --- Writing ---
+
+    def _encode_value(self, key: str, value):
+        if key in IMAGE_KEYS:
+            return self._store_image(value)
+        if isinstance(value, tuple):
+            return list(value)
+        return value
+
+    def _write_frame(self, path: str, kind: int, payload: dict, mode: str = "ab"):
+        data = zlib.compress(json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 6)
+        with open(path, mode) as f:
+            f.write(_FRAME_HEADER.pack(len(data), kind) + data)
+
+    def save(self, token: str, state) -> bool:
+        """
+        Writes whatever changed in `state` since the last save for this token.
+
+        Args:
+            token (str): The session's resume token.
+            state: st.session_state or any mapping holding PERSISTED_KEYS.
+
+        Returns:
+            bool: True if a frame was written.
+        """
+        if not _valid_token(token):
+            return False
+        values = {key: self._encode_value(key, state[key]) for key in PERSISTED_KEYS if key in state}
+        writer = self._writers.get(token)
+        path = self._path(token)
+
+        if writer is None or writer["deltas"] >= COMPACT_AFTER_DELTAS:
+            # First save in this process (or compaction due): write a FULL frame
+            temp_path = path + ".tmp"
+            self._write_frame(temp_path, FRAME_FULL, values, mode="wb")
+            os.replace(temp_path, path)
+            self._writers[token] = {
+                "digests": {key: _digest(value) for key, value in values.items()},
+                "lengths": {key: len(value) for key, value in values.items() if isinstance(value, list)},
+                "deltas": 0,
+            }
+            return True
+
+        delta = {}
+        for key, value in values.items():
+            digest = _digest(value)
+            previous_digest = writer["digests"].get(key)
+            if previous_digest == digest:
+                continue
+            writer["digests"][key] = digest
+            if isinstance(value, list):
+                previous_length = writer["lengths"].get(key, 0)
+                writer["lengths"][key] = len(value)
+                # Append-only growth (story_log): write just the new items, if the saved list is still their prefix
+                if 0 < previous_length < len(value) and _digest(value[:previous_length]) == previous_digest:
+                    delta[key] = {_APPEND: value[previous_length:]}
+                    continue
+            delta[key] = value
+        if not delta:
+            return False
+        self._write_frame(path, FRAME_DELTA, delta)
+        writer["deltas"] += 1
+        return True
+
+    # --- Reading ---
+
+    def load(self, token: str) -> dict | None:
+        """Replays a session file and returns the persisted values, or None if there is none."""
+        if not _valid_token(token):
+            return None
+        try:
+            with open(self._path(token), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        values: dict = {}
+        position = 0
+        while position + _FRAME_HEADER.size <= len(data):
+            length, kind = _FRAME_HEADER.unpack_from(data, position)
+            position += _FRAME_HEADER.size
+            if position + length > len(data):
+                break # Torn final frame (crash mid-write): keep what we have
+            try:
+                payload = json.loads(zlib.decompress(data[position:position + length]).decode("utf-8"))
+            except (zlib.error, ValueError):
+                break
+            position += length
+            if kind == FRAME_FULL:
+                values = payload
+                continue
+            for key, value in payload.items():
+                if isinstance(value, dict) and set(value) == {_APPEND}:
+                    values[key] = values.get(key, []) + value[_APPEND]
+                else:
+                    values[key] = value
+        return values
+
+    def restore(self, token: str, state) -> bool:
+        """
+        Copies a saved session into `state` (e.g. st.session_state).
+
+        Returns:
+            bool: True if the session existed and was restored.
+        """
+        values = self.load(token)
+        if values is None:
+            return False
+        for key, value in values.items():
+            if key == "suggestions_with_commentary":
+                value = [tuple(item) for item in value]
+            state[key] = value
+        # Continue appending deltas to this file
+        self._writers[token] = {
+            "digests": {key: _digest(self._encode_value(key, value)) for key, value in values.items()},
+            "lengths": {key: len(value) for key, value in values.items() if isinstance(value, list)},
+            "deltas": COMPACT_AFTER_DELTAS // 2,
+        }
+        return True
+
+    def exists(self, token: str) -> bool:
+        """Whether the session has a snapshot file (False once cleanup or delete removed it)."""
+        return _valid_token(token) and os.path.exists(self._path(token))
+
+    def forget(self, token: str):
+        """Drops what this process remembers about a session's file (its next save writes a FULL frame)."""
+        self._writers.pop(token, None)
+
+    def delete(self, token: str):
+        """Removes a session file (blobs are reclaimed by cleanup)."""
+        self._writers.pop(token, None)
+        if _valid_token(token):
+            try:
+                os.remove(self._path(token))
+            except OSError:
+                pass
+
+    def cleanup(self, max_age_seconds: int = SESSION_MAX_AGE_SECONDS) -> int:
+        """Deletes expired session files and image blobs no live session references."""
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        referenced = set()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".svs"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    self._writers.pop(name[:-len(".svs")], None) # A later save starts a fresh file
+                    removed += 1
+                    continue
+            except OSError: # Another app process cleaned it up first
+                continue
+            values = self.load(name[:-len(".svs")]) or {}
+            for key in IMAGE_KEYS:
+                image = values.get(key, "")
+                if isinstance(image, str) and image.startswith(BLOB_PREFIX):
+                    referenced.add(image.rsplit(":", 1)[1])
+        for sha in os.listdir(self.blob_directory):
+            path = os.path.join(self.blob_directory, sha)
+            try:
+                if sha not in referenced and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+        return removed
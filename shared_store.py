@@ -0,0 +1,244 @@
+### SHARED STORE ###
+# A SQLite (WAL mode) file shared by every app and worker process on one host:
+#   - a key/value cache with per-entry expiry, namespaced by feature;
+#   - a job store that app processes submit generation jobs to and worker
+#     processes claim with a lease (see worker_pool.py).
+# No external service is needed; point every process at the same file with the
+# STORY_SHARED_STORE environment variable. Leave it unset for single-process mode.
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import weakref
+import threading
+
+SHARED_STORE_PATH = os.getenv("STORY_SHARED_STORE", "")
+# Finished jobs are kept this long (for wait_for_job pollers and debugging), then purged
+JOB_RETENTION_SECONDS = float(os.getenv("STORY_JOB_RETENTION_SECONDS", "3600"))
+
+JOB_LEASE_SECONDS = 120   # A claimed job returns to the queue if its worker vanishes
+JOB_MAX_ATTEMPTS = 3
+JOB_POLL_SECONDS = 0.05
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'queued',
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    lease_until REAL NOT NULL DEFAULT 0,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status);
+"""
+
+
+class SharedStore:
+    """Cache and job store backed by one SQLite file; safe across threads and processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self.counters = {"cache_hits": 0, "cache_misses": 0}
+        self._waiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary() # loop -> {job id: [futures]}
+        self._pollers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = weakref.WeakKeyDictionary()
+        connection = self._connection()
+        connection.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    # --- Cache ---
+
+    def cache_get(self, namespace: str, key: str) -> bytes | None:
+        """Returns a cached value, or None if missing or expired."""
+        row = self._connection().execute(
+            "SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, key, time.time())
+        ).fetchone()
+        self.counters["cache_hits" if row else "cache_misses"] += 1
+        return row[0] if row else None
+
+    def cache_put(self, namespace: str, key: str, value: bytes, ttl_seconds: float = 3600):
+        """Stores a value for ttl_seconds (replacing any previous value)."""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, time.time() + ttl_seconds)
+        )
+
+    def cache_delete(self, namespace: str, key: str):
+        self._connection().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    # --- Jobs ---
+
+    def submit_job(self, kind: str, payload: dict, dedupe_key: str = "") -> str:
+        """
+        Queues a job and returns its id. With a dedupe_key, an identical job that
+        is still queued or running is reused instead of queueing a second one.
+        """
+        connection = self._connection()
+        if dedupe_key:
+            row = connection.execute(
+                "SELECT id FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+                (dedupe_key,)
+            ).fetchone()
+            if row:
+                return row[0]
+        job_id = uuid.uuid4().hex
+        connection.execute(
+            "INSERT INTO jobs (id, kind, payload, dedupe_key, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), dedupe_key, time.time())
+        )
+        return job_id
+
+    def claim_job(self, worker_id: str, kinds: list[str], lease_seconds: float = JOB_LEASE_SECONDS) -> dict | None:
+        """
+        Atomically claims the oldest runnable job of the given kinds (queued, or
+        running with an expired lease).
+
+        Returns:
+            dict: {"id", "kind", "payload", "attempts"} or None if there is nothing to do.
+        """
+        now = time.time()
+        placeholders = ",".join("?" for _ in kinds)
+        row = self._connection().execute(
+            f"""
+            UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE kind IN ({placeholders})
+                  AND (status = 'queued' OR (status = 'running' AND lease_until < ?))
+                ORDER BY created_at LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts
+            """,
+            (worker_id, now + lease_seconds, *kinds, now)
+        ).fetchone()
+        if row is None:
+            return None
+        job = {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3]}
+        if job["attempts"] > JOB_MAX_ATTEMPTS:
+            self.fail_job(job["id"], "too many attempts (worker crashed repeatedly)")
+            return None
+        return job
+
+    def complete_job(self, job_id: str, result: dict):
+        self._connection().execute(
+            "UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id)
+        )
+
+    def fail_job(self, job_id: str, error: str):
+        self._connection().execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            (error, time.time(), job_id)
+        )
+
+    def get_job(self, job_id: str) -> dict | None:
+        """Returns {"id", "kind", "status", "result", "error"} for a job."""
+        row = self._connection().execute(
+            "SELECT id, kind, status, result, error FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "kind": row[1], "status": row[2], "result": json.loads(row[3]) if row[3] else None, "error": row[4]}
+
+    async def wait_for_job(self, job_id: str, timeout: float = 180.0) -> dict:
+        """
+        Waits until a job finishes. All jobs awaited on one event loop share a
+        single poller, which checks them with one query per tick.
+
+        Returns:
+            dict: The job (see get_job); status is 'done', 'failed' or 'timeout'.
+        """
+        loop = asyncio.get_running_loop()
+        waiters = self._waiters.setdefault(loop, {})
+        future = loop.create_future()
+        waiters.setdefault(job_id, []).append(future)
+        poller = self._pollers.get(loop)
+        if poller is None or poller.done():
+            self._pollers[loop] = loop.create_task(self._poll_jobs(waiters))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            futures = waiters.get(job_id, [])
+            if future in futures:
+                futures.remove(future)
+            if not futures:
+                waiters.pop(job_id, None)
+            job = self.get_job(job_id)
+            return {**job, "status": "timeout"} if job else {"id": job_id, "status": "failed", "result": None, "error": "job vanished"}
+
+    async def _poll_jobs(self, waiters: dict):
+        while waiters:
+            await asyncio.sleep(JOB_POLL_SECONDS)
+            ids = list(waiters)
+            jobs = {}
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._connection().execute(
+                    f"SELECT id, kind, status, result, error FROM jobs WHERE id IN ({','.join('?' for _ in chunk)})", chunk
+                ).fetchall()
+                for row in rows:
+                    if row[2] in ("done", "failed"):
+                        jobs[row[0]] = {"id": row[0], "kind": row[1], "status": row[2], "result": json.loads(row[3]) if row[3] else None, "error": row[4]}
+                    else:
+                        jobs[row[0]] = None
+            for job_id in ids:
+                if job_id not in jobs:
+                    job = {"id": job_id, "status": "failed", "result": None, "error": "job vanished"}
+                elif jobs[job_id] is None:
+                    continue
+                else:
+                    job = jobs[job_id]
+                for future in waiters.pop(job_id, []):
+                    if not future.done():
+                        future.set_result(job)
+
+    def queue_depth(self) -> dict:
+        """Returns job counts per status."""
+        return dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def purge(self, finished_older_than: float = JOB_RETENTION_SECONDS) -> int:
+        """Deletes expired cache entries and old finished jobs; returns how many rows went."""
+        now = time.time()
+        connection = self._connection()
+        removed = connection.execute("DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+        removed += connection.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (now - finished_older_than,)).rowcount
+        return removed
+
+
+_shared_stores: dict[str, SharedStore] = {}
+
+def get_shared_store(path: str | None = None) -> SharedStore | None:
+    """Returns the process-wide SharedStore for path (default STORY_SHARED_STORE), or None if unset."""
+    path = path if path is not None else SHARED_STORE_PATH
+    if not path:
+        return None
+    store = _shared_stores.get(path)
+    if store is None:
+        store = _shared_stores[path] = SharedStore(path)
+    return store
@@ -0,0 +1,530 @@
+### STORY ANALYTICS ###
+# Aggregate statistics over saved story logs: how often writers pick AI
+# continuations versus typing their own text ("User Input"), how
+# often the bonus idea is the one accepted, how segment length grows with the
+# round, and how all of that varies by genre, format and language.
+#
+# Story files are read once into a columnar table: one row per segment with
+# integer columns (story, round, position, words, chars) and dictionary-coded
+# categorical columns (contributor, type; under the GUI's names, see
+# story_ingest.segment_labels), plus one row per story for its setup
+# (genre, format, language, era, role). Aggregations are grouped counts and sums
+# over those columns (numpy.bincount), so a report over a million segments takes
+# well under a second once the table is cached.
+#
+# The table is cached as raw little-endian column buffers behind a JSON header
+# (.storycol); a manifest of (mtime, size) per file means later builds only read
+# new or changed story files.
+#
+# NumPy is optional: without it the same columns are stdlib arrays and a report
+# is one plain-Python pass over the rows into per-group dicts (the same results,
+# at the speed of looping over the story_log dicts themselves).
+#
+# Usage:
+#   python story_analytics.py build analytics.storycol stories/ my_story_log.json
+#   python story_analytics.py report analytics.storycol --by genre format
+#   python story_analytics.py report analytics.storycol --by rounds --genre Fantasy --json
+
+import os
+import sys
+import json
+import struct
+import argparse
+from array import array
+from itertools import repeat
+
+try:
+    import numpy as np
+except ImportError: # Optional: plain-Python aggregation over stdlib arrays without it
+    np = None
+
+from story_records import read_story_record
+from story_search import _iter_json_files
+from story_ingest import segment_labels
+
+ANALYTICS_EXTENSION = ".storycol"
+ANALYTICS_MAGIC = b"STORYCOL"
+ANALYTICS_VERSION = 2 # 2: contributor and type stored under the GUI's names
+_HEADER = struct.Struct("<8sHHQ") # magic, version, flags, JSON header length
+_ALIGNMENT = 8                    # Column buffers start on 8-byte boundaries
+
+# Column name -> array typecode (int32 / uint16); numpy dtypes are the little-endian equivalents
+SEGMENT_COLUMNS = {"story": "i", "round": "i", "position": "i", "contributor": "H", "type": "H", "words": "i", "chars": "i"}
+STORY_COLUMNS = {"genre": "H", "format": "H", "language": "H", "era": "H", "role": "H", "segments": "i"}
+_DTYPES = {"i": "<i4", "H": "<u2", "B": "u1"}
+
+# Grouping dimensions: story setup fields, segment fields, and the round bucket
+STORY_DIMENSIONS = {
+    "genre": "story_genre",
+    "format": "story_format",
+    "language": "story_language",
+    "era": "era_style",
+    "role": "main_character_role",
+}
+SEGMENT_DIMENSIONS = ("contributor", "type")
+ROUND_BUCKETS = (1, 2, 6, 11, 21, 51, 101) # Lower edges: rounds 1, 2-5, 6-10, 11-20, 21-50, 51-100, 101+
+DIMENSIONS = [*STORY_DIMENSIONS, *SEGMENT_DIMENSIONS, "rounds"]
+
+# Summary counts: name -> (segment dimension, value under the GUI's names)
+SUMMARY_COUNTS = {
+    "ai": ("contributor", "AI"),
+    "user": ("contributor", "User"),
+    "continuation": ("type", "Continuation"),
+    "bonus": ("type", "Bonus Idea"),
+    "ending": ("type", "Story Ending"),
+    "user_input": ("type", "User Input"),
+}
+
+
+def _round_bucket_labels() -> list[str]:
+    labels = []
+    for low, high in zip(ROUND_BUCKETS, ROUND_BUCKETS[1:] + (None,)):
+        labels.append(f"{low}+" if high is None else str(low) if high == low + 1 else f"{low}-{high - 1}")
+    return ["<1"] + labels # Round 0 (the opening of logs that count from zero)
+
+
+# --- Column operations (numpy when available, stdlib arrays otherwise) ---
+
+def _column(values: array):
+    return np.frombuffer(values, dtype=_DTYPES[values.typecode]) if np is not None else values
+
+
+def _concat(column, values: array):
+    if np is not None:
+        return np.concatenate([column, _column(values)]) if len(values) else column
+    column = array(column.typecode, column)
+    column.extend(values)
+    return column
+
+
+def _to_bytes(column) -> bytes:
+    if np is not None:
+        return np.ascontiguousarray(column).tobytes()
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _from_bytes(typecode: str, buffer: memoryview):
+    if np is not None:
+        return np.frombuffer(buffer, dtype=_DTYPES[typecode])
+    column = array(typecode)
+    column.frombytes(buffer)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def _take(column, indices):
+    """column[indices] for an integer index column."""
+    if np is not None:
+        return column[indices]
+    return array(column.typecode, [column[i] for i in indices])
+
+
+def _select(column, mask):
+    """The rows of `column` where `mask` is true."""
+    if np is not None:
+        return column[np.asarray(mask, dtype=bool)]
+    return array(column.typecode, [value for value, keep in zip(column, mask) if keep])
+
+
+def _round_buckets(rounds):
+    """The round bucket (index into _round_bucket_labels) of every row."""
+    if np is not None:
+        return np.searchsorted(np.asarray(ROUND_BUCKETS), rounds, side="right")
+    from bisect import bisect_right
+    return array("H", [bisect_right(ROUND_BUCKETS, value) for value in rounds])
+
+
+class StoryTable:
+    """Story logs as columns: one row per segment, one story row per file."""
+
+    def __init__(self):
+        self.segments = {name: _column(array(code)) for name, code in SEGMENT_COLUMNS.items()}
+        self.stories = {name: _column(array(code)) for name, code in STORY_COLUMNS.items()}
+        self.values: dict[str, list[str]] = {name: [] for name in (*STORY_DIMENSIONS, *SEGMENT_DIMENSIONS)}
+        self._value_ids: dict[str, dict[str, int]] = {name: {} for name in self.values}
+        self.paths: list[str] = []            # story id -> path
+        self.manifest: dict[str, dict] = {}   # path -> {"mtime", "size"}
+
+    def __len__(self) -> int:
+        return len(self.segments["story"])
+
+    @property
+    def story_count(self) -> int:
+        return len(self.paths)
+
+    # --- Building ---
+
+    def _value_id(self, name: str, value) -> int:
+        value = str(value) if value not in (None, "") else ""
+        ids = self._value_ids[name]
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = len(self.values[name])
+            self.values[name].append(value)
+            ids[value] = value_id
+        return value_id
+
+    def _append(self, stories: list[tuple[str, list[dict], dict]]):
+        """Adds (path, story_log, metadata) stories as new rows."""
+        segment_rows = {name: array(code) for name, code in SEGMENT_COLUMNS.items()}
+        story_rows = {name: array(code) for name, code in STORY_COLUMNS.items()}
+        for path, story_log, metadata in stories:
+            story_id = len(self.paths)
+            self.paths.append(path)
+            for name, key in STORY_DIMENSIONS.items():
+                story_rows[name].append(self._value_id(name, metadata.get(key, "")))
+            count = 0
+            for position, segment in enumerate(story_log):
+                if not isinstance(segment, dict) or not isinstance(segment.get("text", ""), str):
+                    continue
+                text = segment.get("text", "")
+                round_number = segment.get("round", position)
+                contributor, segment_type = segment_labels(segment, position)
+                segment_rows["story"].append(story_id)
+                segment_rows["round"].append(round_number if isinstance(round_number, int) and -2**31 <= round_number < 2**31 else -1)
+                segment_rows["position"].append(position)
+                segment_rows["contributor"].append(self._value_id("contributor", contributor))
+                segment_rows["type"].append(self._value_id("type", segment_type))
+                segment_rows["words"].append(len(text.split()))
+                segment_rows["chars"].append(len(text))
+                count += 1
+            story_rows["segments"].append(count)
+        for name, rows in segment_rows.items():
+            self.segments[name] = _concat(self.segments[name], rows)
+        for name, rows in story_rows.items():
+            self.stories[name] = _concat(self.stories[name], rows)
+
+    def _drop(self, paths: set[str]):
+        """Removes the rows of these files, renumbering the remaining stories."""
+        keep_story = array("B", [path not in paths for path in self.paths])
+        remap = array("i", [-1] * len(self.paths))
+        kept = 0
+        for story_id, keep in enumerate(keep_story):
+            if keep:
+                remap[story_id] = kept
+                kept += 1
+        row_mask = _take(_column(keep_story), self.segments["story"])
+        for name in SEGMENT_COLUMNS:
+            self.segments[name] = _select(self.segments[name], row_mask)
+        self.segments["story"] = _take(_column(remap), self.segments["story"])
+        for name in STORY_COLUMNS:
+            self.stories[name] = _select(self.stories[name], _column(keep_story))
+        self.paths = [path for path, keep in zip(self.paths, keep_story) if keep]
+
+    def update(self, paths: list[str], genre: str = "", story_format: str = "") -> dict:
+        """
+        Brings the table up to date with story files (and directories of them).
+        Files whose mtime and size are unchanged are not read again.
+
+        Args:
+            paths (list[str]): Files and/or directories to scan.
+            genre (str): Genre for story logs without metadata.
+            story_format (str): Format for story logs without metadata.
+
+        Returns:
+            dict: {"read", "unchanged", "removed", "failed", "segments"} counts.
+        """
+        stats = {"read": 0, "unchanged": 0, "removed": 0, "failed": 0, "segments": 0}
+        seen, changed, stories = set(), set(), []
+        for path in _iter_json_files(paths):
+            path = os.path.abspath(path)
+            seen.add(path)
+            try:
+                info = os.stat(path)
+            except OSError:
+                stats["failed"] += 1
+                continue
+            entry = self.manifest.get(path)
+            if entry and entry["mtime"] == info.st_mtime_ns and entry["size"] == info.st_size:
+                stats["unchanged"] += 1
+                continue
+            if entry:
+                changed.add(path)
+            try:
+                story_log, metadata = read_story_record(path)
+            except (OSError, ValueError) as e: # json.JSONDecodeError is a ValueError
+                print(f"Skipping '{path}': {e}")
+                stats["failed"] += 1
+                self.manifest.pop(path, None)
+                continue
+            metadata = dict(metadata)
+            metadata["story_genre"] = metadata.get("story_genre") or genre
+            metadata["story_format"] = metadata.get("story_format") or story_format
+            stories.append((path, story_log, metadata))
+            self.manifest[path] = {"mtime": info.st_mtime_ns, "size": info.st_size}
+            stats["read"] += 1
+
+        # Files that disappeared from a scanned directory
+        scanned_dirs = [os.path.abspath(p) + os.sep for p in paths if os.path.isdir(p)]
+        for path in list(self.manifest):
+            if path not in seen and any(path.startswith(d) for d in scanned_dirs):
+                del self.manifest[path]
+                changed.add(path)
+                stats["removed"] += 1
+
+        if changed:
+            self._drop(changed)
+        rows_before = len(self)
+        self._append(stories)
+        stats["segments"] = len(self) - rows_before
+        return stats
+
+    # --- Grouping ---
+
+    def dimension(self, name: str):
+        """A per-segment code column for a dimension, and the labels of its codes."""
+        if name in STORY_DIMENSIONS:
+            return _take(self.stories[name], self.segments["story"]), self.values[name]
+        if name in SEGMENT_DIMENSIONS:
+            return self.segments[name], self.values[name]
+        if name == "rounds":
+            return _round_buckets(self.segments["round"]), _round_bucket_labels()
+        raise ValueError(f"unknown dimension '{name}' (use one of: {', '.join(DIMENSIONS)})")
+
+    def _codes_of(self, name: str, wanted) -> set[int]:
+        labels = self.dimension(name)[1] if name == "rounds" else self.values.get(name, [])
+        wanted = {wanted} if isinstance(wanted, str) else set(wanted)
+        return {code for code, label in enumerate(labels) if label in wanted}
+
+    def _group_ids(self, by: list[str]):
+        """
+        Combines (with numpy) the codes of several dimensions into one dense group id per segment.
+
+        Returns:
+            tuple: (group id column, [label tuple per group id]).
+        """
+        combined, dimensions = None, []
+        for name in by:
+            codes, values = self.dimension(name)
+            dimensions.append(values)
+            combined = codes.astype(np.int64) if combined is None else combined * len(values) + codes
+        if combined is None: # No grouping: everything is one group
+            return np.zeros(len(self), dtype=np.int64), [()]
+        # Only the combinations that occur get an id (the full product can be huge)
+        present, ids = np.unique(combined, return_inverse=True)
+        present = present.tolist()
+        labels = []
+        for value in present:
+            key = []
+            for values in reversed(dimensions):
+                value, code = divmod(value, len(values))
+                key.append(values[code])
+            labels.append(tuple(reversed(key)))
+        return ids, labels
+
+    def summarize(self, by: list[str] | tuple = (), filters: dict | None = None) -> list[dict]:
+        """
+        Counts who wrote the segments and how long they are, per group.
+
+        Args:
+            by (list[str]): Dimensions to group by (see DIMENSIONS); none = one overall row.
+            filters (dict): Optional {dimension: value or list of values} to keep.
+
+        Returns:
+            list[dict]: One row per non-empty group: the dimension values plus "segments",
+                        "stories", "ai", "user", "continuation", "bonus", "ending", "user_input",
+                        "words_mean", "ai_share" (of all segments) and
+                        "bonus_rate" (of the picks among the round's suggestions).
+        """
+        by = list(by)
+        filters = {name: wanted for name, wanted in (filters or {}).items() if wanted not in (None, "", [])}
+        groups = self._count_columns(by, filters) if np is not None else self._count_rows(by, filters)
+        rows = []
+        for key, counts in groups:
+            segments = counts["segments"]
+            if not segments:
+                continue
+            row = dict(zip(by, key))
+            row.update({name: int(counts[name]) for name in ("segments", *SUMMARY_COUNTS, "stories")})
+            row["words_mean"] = round(counts["words"] / segments, 2)
+            row["ai_share"] = round(row["ai"] / segments, 4)
+            picks = row["continuation"] + row["bonus"]
+            row["bonus_rate"] = round(row["bonus"] / picks, 4) if picks else 0.0
+            rows.append(row)
+        return rows
+
+    def _count_columns(self, by: list[str], filters: dict) -> list[tuple[tuple, dict]]:
+        """Per-group counts with numpy: grouped bincounts over whole columns."""
+        ids, labels = self._group_ids(by)
+        size = len(labels)
+        mask = None
+        for name, wanted in filters.items():
+            keep = np.isin(self.dimension(name)[0], list(self._codes_of(name, wanted)))
+            mask = keep if mask is None else mask & keep
+        columns = {name: self.segments[name] for name in ("contributor", "type", "words", "story")}
+        if mask is not None:
+            ids = ids[mask]
+            columns = {name: column[mask] for name, column in columns.items()}
+
+        totals = {"segments": np.bincount(ids, minlength=size), "words": np.bincount(ids, weights=columns["words"], minlength=size)}
+        for name, (dimension, value) in SUMMARY_COUNTS.items():
+            codes = list(self._codes_of(dimension, value))
+            totals[name] = np.bincount(ids[np.isin(columns[dimension], codes)], minlength=size) if codes else np.zeros(size, dtype=np.int64)
+        # Stories per group: distinct (group, story) pairs
+        pairs = np.unique(ids * max(1, self.story_count) + columns["story"])
+        totals["stories"] = np.bincount(pairs // max(1, self.story_count), minlength=size)
+        totals = {name: values.tolist() for name, values in totals.items()}
+        return [(key, {name: values[group] for name, values in totals.items()}) for group, key in enumerate(labels)]
+
+    def _count_rows(self, by: list[str], filters: dict) -> list[tuple[tuple, dict]]:
+        """Per-group counts without numpy: one pass over the rows into a dict per group."""
+        keys = zip(*(self.dimension(name)[0] for name in by)) if by else repeat(())
+        tests = [(self.dimension(name)[0], self._codes_of(name, wanted)) for name, wanted in filters.items()]
+        counted = {} # (dimension, code) -> the SUMMARY_COUNTS it adds to
+        for name, (dimension, value) in SUMMARY_COUNTS.items():
+            for code in self._codes_of(dimension, value):
+                counted.setdefault((dimension, code), []).append(name)
+        by_contributor = [counted.get(("contributor", code), []) for code in range(len(self.values["contributor"]))]
+        by_type = [counted.get(("type", code), []) for code in range(len(self.values["type"]))]
+
+        groups, stories = {}, {}
+        columns = (self.segments[name] for name in ("contributor", "type", "words", "story"))
+        for row, (key, contributor, segment_type, words, story) in enumerate(zip(keys, *columns)):
+            if tests and not all(column[row] in codes for column, codes in tests):
+                continue
+            counts = groups.get(key)
+            if counts is None:
+                counts = groups[key] = dict.fromkeys(("segments", "words", *SUMMARY_COUNTS), 0)
+                stories[key] = set()
+            counts["segments"] += 1
+            counts["words"] += words
+            for name in by_contributor[contributor]:
+                counts[name] += 1
+            for name in by_type[segment_type]:
+                counts[name] += 1
+            stories[key].add(story)
+        labels = [self.dimension(name)[1] for name in by]
+        result = []
+        for key in sorted(groups):
+            groups[key]["stories"] = len(stories[key])
+            result.append((tuple(values[code] for values, code in zip(labels, key)), groups[key]))
+        return result
+
+    # --- Persistence ---
+
+    def save(self, path: str):
+        """Writes the table to a column file (atomically)."""
+        buffers, layout, offset = [], {"segments": {}, "stories": {}}, 0
+        for section, columns, codes in (("segments", self.segments, SEGMENT_COLUMNS), ("stories", self.stories, STORY_COLUMNS)):
+            for name, code in codes.items():
+                data = _to_bytes(columns[name])
+                layout[section][name] = [code, offset, len(data)]
+                buffers.append(data)
+                padding = -len(data) % _ALIGNMENT
+                buffers.append(b"\0" * padding)
+                offset += len(data) + padding
+        header = json.dumps({
+            "rows": len(self),
+            "columns": layout,
+            "values": self.values,
+            "paths": self.paths,
+            "manifest": self.manifest,
+        }, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        header += b" " * (-(len(header) + _HEADER.size) % _ALIGNMENT)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(_HEADER.pack(ANALYTICS_MAGIC, ANALYTICS_VERSION, 0, len(header)))
+            f.write(header)
+            for data in buffers:
+                f.write(data)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "StoryTable":
+        """Loads a table written by save(); returns an empty table if the file does not exist."""
+        table = cls()
+        if not os.path.exists(path):
+            return table
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, _, header_length = _HEADER.unpack_from(data)
+        if magic != ANALYTICS_MAGIC or version != ANALYTICS_VERSION:
+            print(f"Warning: analytics cache '{path}' has an old format; rebuilding from scratch.")
+            return table
+        header = json.loads(data[_HEADER.size:_HEADER.size + header_length])
+        start = _HEADER.size + header_length
+        view = memoryview(data)
+        for section, columns in (("segments", table.segments), ("stories", table.stories)):
+            for name, (code, offset, length) in header["columns"][section].items():
+                columns[name] = _from_bytes(code, view[start + offset:start + offset + length])
+        table.values = header["values"]
+        table._value_ids = {name: {v: i for i, v in enumerate(values)} for name, values in table.values.items()}
+        table.paths = header["paths"]
+        table.manifest = header["manifest"]
+        return table
+
+
+# --- Reports ---
+
+def _format_rows(rows: list[dict], by: list[str]) -> list[str]:
+    lines = []
+    for row in sorted(rows, key=lambda r: -r["segments"]):
+        label = " / ".join(row[name] or "?" for name in by) or "all stories"
+        lines.append(f"{label}: {row['segments']} segments in {row['stories']} stories, AI {row['ai_share']:.0%}, "
+                     f"user input {row['user_input']}, bonus accepted {row['bonus_rate']:.0%}, "
+                     f"{row['words_mean']} words per segment")
+    return lines
+
+
+def build_report(table: StoryTable, by: list[str] | tuple = (), filters: dict | None = None) -> dict:
+    """{"overall", "groups", "rounds"}: the overall summary, the groups of `by`, and segment length by round bucket."""
+    rounds = table.summarize(["rounds"], filters)
+    order = {label: i for i, label in enumerate(_round_bucket_labels())}
+    return {
+        "overall": table.summarize((), filters),
+        "groups": table.summarize(by, filters) if by else [],
+        "rounds": sorted(rounds, key=lambda row: order[row["rounds"]]),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Aggregate statistics over saved story logs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Add new or changed story logs to an analytics cache.")
+    build_parser.add_argument("cache")
+    build_parser.add_argument("paths", nargs="+", help="Story log files or directories.")
+    build_parser.add_argument("--genre", default="", help="Genre for logs without metadata.")
+    build_parser.add_argument("--format", dest="story_format", default="", help="Format for logs without metadata.")
+
+    report_parser = commands.add_parser("report", help="Summarise an analytics cache.")
+    report_parser.add_argument("cache")
+    report_parser.add_argument("--by", nargs="+", default=[], choices=DIMENSIONS, help="Dimensions to group by.")
+    for name in (*STORY_DIMENSIONS, *SEGMENT_DIMENSIONS):
+        report_parser.add_argument(f"--{name}", action="append", help=f"Only segments with this {name} (repeatable).")
+    report_parser.add_argument("--json", action="store_true", help="Print the raw report as JSON.")
+
+    args = parser.parse_args(argv)
+    table = StoryTable.load(args.cache)
+    if args.command == "build":
+        stats = table.update(args.paths, args.genre, args.story_format)
+        table.save(args.cache)
+        print(f"✅ Added {stats['segments']} segments from {stats['read']} files "
+              f"({stats['unchanged']} unchanged, {stats['removed']} removed, {stats['failed']} failed); "
+              f"{len(table)} segments in {table.story_count} stories.")
+        return 0
+
+    filters = {name: getattr(args, name) for name in (*STORY_DIMENSIONS, *SEGMENT_DIMENSIONS) if getattr(args, name)}
+    report = build_report(table, args.by, filters)
+    if args.json:
+        print(json.dumps(report, indent=4, ensure_ascii=False))
+        return 0
+    print(f"--- {len(table)} segments in {table.story_count} stories ---")
+    for line in _format_rows(report["overall"], []):
+        print(line)
+    if report["groups"]:
+        print(f"--- By {', '.join(args.by)} ---")
+        for line in _format_rows(report["groups"], args.by):
+            print(line)
+    print("--- Words per segment by round ---")
+    for row in report["rounds"]:
+        print(f"rounds {row['rounds']}: {row['words_mean']} words ({row['segments']} segments)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
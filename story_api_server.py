@@ -0,0 +1,621 @@
+### STORY API SERVER ###
+# A headless HTTP/JSON front end to the co-writer engine, for services that cannot
+# drive the Streamlit script. One asyncio process serves every story:
+#   POST   /stories                           create a story (setup fields, optional "opening")
+#   GET    /stories/{id}[?since=N]            the story (segments from position N on)
+#   DELETE /stories/{id}
+#   POST   /stories/{id}/segments             append {"text", "contributor", "type", "expected_version"}
+#   POST   /stories/{id}/suggestions          this version's suggestions (generated once, then reused)
+#   GET    /stories/{id}/suggestions/stream   the same as server-sent events, text chunks first
+#   POST   /stories/{id}/endings              roll alternate endings
+#   GET    /stories/{id}/export?format=pdf    a manuscript (see story_export.py); &language=French
+#                                             for another-language edition (see story_translation.py)
+#   GET    /health
+# Stories are kept as the GUI's session state keys and saved with SessionStore
+# after every change, so a story idle for a while is dropped from memory and
+# reloaded on its next request; thousands of idle stories cost disk, not RAM.
+# The story id is also a resume token: ?resume=<story id> opens it in the GUI.
+#
+# Usage: python story_api_server.py [--host 127.0.0.1] [--port 8080]
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+import story_co_writer_ai
+from story_co_writer_ai import new_usage_counters
+from context_cache import StoryContextCache
+from story_records import STORY_METADATA_KEYS, build_story_context, build_story_record, append_story_segment
+from suggestion_diversity import SketchIndex
+from session_store import SessionStore, new_resume_token
+from worker_pool import run_job
+from token_accounting import OFFLINE_MODEL, INSTRUCTION_TOKENS_ESTIMATE, plan_generation, record_usage_delta, estimate_tokens
+from model_router import get_router
+from story_export import ExportPipeline, EXPORT_EXTENSIONS, EXPORT_MIME_TYPES, export_file_name
+from story_translation import SUPPORTED_LANGUAGES
+from deadlines import Deadline
+from story_retrieval import StoryRetrievalIndex
+
+API_HOST = os.getenv("STORY_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("STORY_API_PORT", "8080"))
+API_TOKEN = os.getenv("STORY_API_TOKEN", "")  # When set, requests need "Authorization: Bearer <token>"
+EVICT_AFTER_SECONDS = float(os.getenv("STORY_API_EVICT_SECONDS", "300")) # Idle stories leave memory (they are on disk)
+MAX_LIVE_STORIES = int(os.getenv("STORY_API_MAX_LIVE", "10000"))
+KEEPALIVE_SECONDS = 75.0
+MAX_BODY_BYTES = 1 << 20
+MAX_FIELD_CHARS = 200
+MAX_SEGMENT_CHARS = 5000
+ENDINGS_PER_ROLL = 3
+REQUIRED_SETUP_KEYS = ["main_character_name", "main_character_role", "story_language", "story_genre", "story_format"]
+
+_STATUS_TEXT = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+                405: "Method Not Allowed", 409: "Conflict", 411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class ApiError(Exception):
+    """An error answered with its status code and {"error": message}."""
+
+    def __init__(self, status: int, message: str, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+class Response:
+    """A complete body, or a stream of server-sent events (an async iterator of bytes)."""
+
+    __slots__ = ("status", "body", "content_type", "headers", "events")
+
+    def __init__(self, status: int = 200, body: bytes = b"", content_type: str = "application/json", headers: dict | None = None, events=None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.events = events
+
+
+def json_response(payload, status: int = 200) -> Response:
+    return Response(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+
+def sse_event(event: str, payload) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def suggestions_json(suggestions: list[tuple[str, str]]) -> dict:
+    """The engine's (text, commentary) tuples as {"suggestions": [...], "visual_concept": ...}."""
+    result = {"suggestions": [], "visual_concept": None}
+    for text, commentary in suggestions:
+        if text.startswith("Visual Concept:"):
+            result["visual_concept"] = {"text": text[len("Visual Concept:"):].strip(), "commentary": commentary}
+        elif text.startswith("Bonus Idea:"):
+            result["suggestions"].append({"text": text[len("Bonus Idea:"):].strip(), "commentary": commentary, "type": "Bonus Idea"})
+        else:
+            result["suggestions"].append({"text": text, "commentary": commentary, "type": "Continuation"})
+    return result
+
+
+class _LiveStory:
+    """A story held in memory: its state plus the helpers rebuilt when it is loaded."""
+
+    __slots__ = ("state", "touched", "generation", "busy")
+
+    def __init__(self, state: dict):
+        self.state = state
+        self.touched = time.monotonic()
+        self.generation: tuple[int, asyncio.Task] | None = None # In-flight suggestions for a version
+        self.busy = 0 # Requests (and event streams) in flight; a busy story is never evicted
+
+
+class StoryApiServer:
+    """Serves the story API over asyncio streams (HTTP/1.1 with keep-alive)."""
+
+    def __init__(self, store: SessionStore | None = None, max_live: int = MAX_LIVE_STORIES, evict_after: float = EVICT_AFTER_SECONDS):
+        self.store = store or SessionStore()
+        self.max_live = max_live
+        self.evict_after = evict_after
+        self.stories: OrderedDict[str, _LiveStory] = OrderedDict() # Least recently used first
+        self.connections = 0
+        self.requests = 0
+        self.started = time.time()
+        self._export_pipeline: ExportPipeline | None = None
+        self._closing: set[asyncio.Task] = set() # Context caches of evicted stories being closed
+        self.routes = [
+            ("GET", re.compile(r"^/health$"), self.health),
+            ("POST", re.compile(r"^/stories$"), self.create_story),
+            ("GET", re.compile(r"^/stories/([\w-]+)$"), self.get_story),
+            ("DELETE", re.compile(r"^/stories/([\w-]+)$"), self.delete_story),
+            ("POST", re.compile(r"^/stories/([\w-]+)/segments$"), self.append_segment),
+            ("POST", re.compile(r"^/stories/([\w-]+)/suggestions$"), self.suggestions),
+            ("GET", re.compile(r"^/stories/([\w-]+)/suggestions/stream$"), self.stream_suggestions),
+            ("POST", re.compile(r"^/stories/([\w-]+)/endings$"), self.endings),
+            ("GET", re.compile(r"^/stories/([\w-]+)/export$"), self.export),
+        ]
+
+    # --- Story state ---
+
+    def _new_state(self, metadata: dict) -> dict:
+        state = {key: metadata.get(key, "") for key in STORY_METADATA_KEYS}
+        state.update({
+            "current_story": "",
+            "story_log": [],
+            "suggestions_with_commentary": [],
+            "round_number": 0,
+            "story_version": 0,
+            "story_creation_complete": True,
+            "alternate_endings": [],
+            "story_concluded": False,
+            "ending_pool": [],
+            "ending_pool_version": -1,
+            "api_usage": new_usage_counters(),
+        })
+        self._attach_helpers(state)
+        return state
+
+    def _attach_helpers(self, state: dict):
+        """Per-story helpers derived from the story rather than persisted (as the GUI's rebuild_session_indexes)."""
+        state["sketch_index"] = SketchIndex()
+        for segment in state["story_log"]:
+            state["sketch_index"].add(segment.get("text", ""))
+        state["retrieval_index"] = StoryRetrievalIndex()
+        state["retrieval_index"].sync(state["story_log"])
+        state["context_cache"] = StoryContextCache()
+
+    def _story(self, story_id: str) -> _LiveStory:
+        """The live story, loading it from the session store if it was evicted."""
+        live = self.stories.get(story_id)
+        if live is None:
+            state = {}
+            if not self.store.restore(story_id, state) or "story_log" not in state:
+                raise ApiError(404, "no such story")
+            self._attach_helpers(state)
+            live = self.stories[story_id] = _LiveStory(state)
+            self._evict(keep=story_id)
+        self.stories.move_to_end(story_id)
+        live.touched = time.monotonic()
+        return live
+
+    def _save(self, story_id: str, live: _LiveStory):
+        self.store.save(story_id, live.state)
+
+    def _evict(self, keep: str = ""):
+        """Drops stories idle past evict_after, and the least recently used beyond max_live, from memory."""
+        cutoff = time.monotonic() - self.evict_after
+        for story_id, live in list(self.stories.items()):
+            over_capacity = len(self.stories) > self.max_live
+            if story_id == keep or live.busy or live.generation is not None or not (over_capacity or live.touched < cutoff):
+                if not over_capacity:
+                    break # The rest were used more recently
+                continue
+            del self.stories[story_id]
+            self.store.forget(story_id)
+            task = asyncio.create_task(live.state["context_cache"].close()) # Its upstream cache is billed until deleted
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def _hold(self, live: _LiveStory):
+        live.busy += 1
+
+    def _release(self, live: _LiveStory):
+        live.busy -= 1
+        live.touched = time.monotonic()
+
+    async def _held_events(self, live: _LiveStory, events):
+        """The events of a stream, holding its story until the stream ends."""
+        try:
+            async for event in events:
+                yield event
+        finally:
+            self._release(live)
+            await events.aclose()
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.evict_after / 5))
+            self._evict()
+
+    def _story_json(self, story_id: str, state: dict, since: int = 0) -> dict:
+        return {
+            "story_id": story_id,
+            "version": state["story_version"],
+            "round": state["round_number"],
+            "concluded": state["story_concluded"],
+            "metadata": {key: state.get(key, "") for key in STORY_METADATA_KEYS},
+            "segments_from": since,
+            "segments": state["story_log"][since:],
+        }
+
+    # --- Generation (as in the GUI: budget plan, routing, billed jobs) ---
+
+    def _plan(self, story_id: str, state: dict, purpose: str, candidate_count: int) -> tuple[dict, dict]:
+        plan = plan_generation(state["api_usage"], build_story_context(state), state["story_language"], candidate_count)
+        prompt_tokens = estimate_tokens(plan["story_context"], state["story_language"]) + INSTRUCTION_TOKENS_ESTIMATE
+        decision = get_router().route(purpose, state["round_number"], prompt_tokens, plan["status"], story_id)
+        return plan, decision
+
+    def _payload(self, story_id: str, state: dict, plan: dict, decision: dict, **fields) -> dict:
+        model = decision["model"]
+        return {
+            "session": story_id,
+            "story_context": plan["story_context"],
+            "language": state["story_language"],
+            "genre": state["story_genre"],
+            "story_format": state["story_format"],
+            "aesthetic_style": state["aesthetic_style"],
+            "era_style": state["era_style"],
+            "recent_segments": [segment.get("text", "") for segment in state["story_log"][-50:]],
+            # Empty for the default model so text rounds keep using the context cache
+            "model": "" if model == story_co_writer_ai.GEMINI_MODEL else model,
+            **fields,
+        }
+
+    async def _billed_job(self, story_id: str, state: dict, kind: str, payload: dict, decision: dict | None = None, deadline: Deadline | None = None, on_chunk=None):
+        before = dict(state["api_usage"])
+        started = time.perf_counter()
+        try:
+            if on_chunk is not None: # Streamed in-process: chunks do not cross the worker pool
+                return await story_co_writer_ai.stream_gemini_suggestions(
+                    payload["story_context"], payload["language"], payload["genre"], payload["story_format"], on_chunk,
+                    aesthetic_style=payload["aesthetic_style"], era_style=payload["era_style"], usage=state["api_usage"],
+                    sketch_index=state["sketch_index"], model=payload["model"], deadline=deadline
+                )
+            # A retrieved context changes from round to round, so it has no stable prefix to cache upstream
+            context_cache = None if state["retrieval_index"].exceeds() else state["context_cache"]
+            return await run_job(kind, payload, usage=state["api_usage"], context_cache=context_cache,
+                                 sketch_index=state["sketch_index"], deadline=deadline)
+        finally:
+            record_usage_delta(story_id, before, state["api_usage"])
+            if decision is not None:
+                get_router().record_outcome(decision, time.perf_counter() - started, before, state["api_usage"])
+
+    async def _generate_suggestions(self, story_id: str, live: _LiveStory, version: int, chunks: asyncio.Queue | None = None) -> list[tuple[str, str]]:
+        """
+        The round's suggestions (and ending pool) from one batched job; with `chunks`,
+        the suggestions alone from one streamed call, whose text is put on the queue
+        as it arrives and None at the end.
+        """
+        state = live.state
+        purpose = "round" if chunks is None else "suggestions"
+        deadline = Deadline(purpose)
+        plan, decision = self._plan(story_id, state, purpose, story_co_writer_ai.BATCH_CANDIDATE_COUNT if chunks is None else 1)
+        payload = self._payload(story_id, state, plan, decision, deadline=deadline.to_payload())
+        endings = None
+        try:
+            if chunks is not None and plan["status"] != "offline" and decision["model"] != OFFLINE_MODEL:
+                suggestions = await self._billed_job(story_id, state, "suggestions", payload, decision, deadline, on_chunk=chunks.put_nowait)
+            else: # Nothing to stream offline; the batch also fills the ending pool
+                round_batch = await self._billed_job(story_id, state, "round", payload, decision, deadline)
+                suggestions, endings = round_batch["suggestions"], round_batch["endings"]
+        finally:
+            deadline.finish(story_id)
+            if chunks is not None:
+                chunks.put_nowait(None)
+        if state["story_version"] == version: # The story may have moved on while we waited
+            state["suggestions_with_commentary"] = suggestions
+            if endings is not None:
+                state["ending_pool"] = endings
+                state["ending_pool_version"] = version
+            self._save(story_id, live)
+        return suggestions
+
+    def _suggestions_task(self, story_id: str, live: _LiveStory, chunks: asyncio.Queue | None = None) -> asyncio.Task:
+        """One generation per story version, however many requests ask for it (streamed into `chunks` if it starts one)."""
+        version = live.state["story_version"]
+        if live.generation is None or live.generation[0] != version:
+            task = asyncio.create_task(self._generate_suggestions(story_id, live, version, chunks))
+            live.generation = (version, task)
+            task.add_done_callback(lambda _: setattr(live, "generation", None) if live.generation and live.generation[1] is task else None)
+        return live.generation[1]
+
+    # --- Handlers ---
+
+    async def health(self, request: dict) -> Response:
+        return json_response({
+            "status": "ok",
+            "live_stories": len(self.stories),
+            "connections": self.connections,
+            "requests": self.requests,
+            "uptime_seconds": round(time.time() - self.started, 1),
+        })
+
+    async def create_story(self, request: dict) -> Response:
+        body = request["json"]
+        metadata = {}
+        for key in STORY_METADATA_KEYS:
+            value = body.get(key, "")
+            if not isinstance(value, str) or len(value) > MAX_FIELD_CHARS:
+                raise ApiError(400, f"'{key}' must be a string of at most {MAX_FIELD_CHARS} characters")
+            metadata[key] = value.strip()
+        missing = [key for key in REQUIRED_SETUP_KEYS if not metadata[key]]
+        if missing:
+            raise ApiError(400, f"missing setup fields: {', '.join(missing)}")
+        story_id = new_resume_token()
+        live = self.stories[story_id] = _LiveStory(self._new_state(metadata))
+        opening = body.get("opening", "")
+        if opening:
+            append_story_segment(live.state, self._segment_text(opening), "User")
+        self._save(story_id, live)
+        self._evict(keep=story_id)
+        return json_response(self._story_json(story_id, live.state), 201)
+
+    async def get_story(self, request: dict, story_id: str) -> Response:
+        live = self._story(story_id)
+        try:
+            since = max(0, int(request["query"].get("since", ["0"])[0]))
+        except ValueError:
+            raise ApiError(400, "'since' must be an integer")
+        return json_response(self._story_json(story_id, live.state, since))
+
+    async def delete_story(self, request: dict, story_id: str) -> Response:
+        live = self._story(story_id)
+        self.stories.pop(story_id, None)
+        await live.state["context_cache"].close()
+        self.store.delete(story_id)
+        return Response(204)
+
+    def _segment_text(self, text) -> str:
+        if not isinstance(text, str) or not text.strip():
+            raise ApiError(400, "'text' must be a non-empty string")
+        if len(text) > MAX_SEGMENT_CHARS:
+            raise ApiError(413, f"segments are limited to {MAX_SEGMENT_CHARS} characters")
+        return text
+
+    async def append_segment(self, request: dict, story_id: str) -> Response:
+        body = request["json"]
+        live = self._story(story_id)
+        state = live.state
+        text = self._segment_text(body.get("text"))
+        contributor = body.get("contributor", "User")
+        if contributor not in ("User", "AI"):
+            raise ApiError(400, "'contributor' must be \"User\" or \"AI\"")
+        expected = body.get("expected_version")
+        if expected is not None and expected != state["story_version"]:
+            raise ApiError(409, "the story has changed", version=state["story_version"])
+        if state["story_concluded"]:
+            raise ApiError(409, "the story has concluded", version=state["story_version"])
+        append_story_segment(state, text, contributor, str(body.get("type", "")))
+        state["suggestions_with_commentary"] = [] # They were for the previous version
+        state["alternate_endings"] = []
+        if state["story_log"][-1]["type"] == "Story Ending":
+            state["story_concluded"] = True
+        self._save(story_id, live)
+        return json_response({"version": state["story_version"], "round": state["round_number"], "segment": state["story_log"][-1]})
+
+    async def suggestions(self, request: dict, story_id: str) -> Response:
+        live = self._story(story_id)
+        version = live.state["story_version"]
+        suggestions = live.state["suggestions_with_commentary"] or await self._suggestions_task(story_id, live)
+        return json_response({"version": version, **suggestions_json(suggestions)})
+
+    async def stream_suggestions(self, request: dict, story_id: str) -> Response:
+        live = self._story(story_id)
+        return Response(content_type="text/event-stream", headers={"Cache-Control": "no-cache"}, events=self._suggestion_events(story_id, live))
+
+    async def _suggestion_events(self, story_id: str, live: _LiveStory):
+        state = live.state
+        version = state["story_version"]
+        suggestions = state["suggestions_with_commentary"]
+        if not suggestions:
+            # A request that joins a generation already running gets its result without the chunks
+            chunks = None if live.generation is not None and live.generation[0] == version else asyncio.Queue()
+            task = self._suggestions_task(story_id, live, chunks)
+            while chunks is not None and (chunk := await chunks.get()) is not None:
+                yield sse_event("chunk", {"text": chunk})
+            suggestions = await task
+        yield sse_event("suggestions", {"version": version, **suggestions_json(suggestions)})
+        yield sse_event("done", {"version": version})
+
+    async def endings(self, request: dict, story_id: str) -> Response:
+        live = self._story(story_id)
+        state = live.state
+        version = state["story_version"]
+        if state["ending_pool_version"] == version and len(state["ending_pool"]) >= 2: # Surplus of an earlier call
+            endings = state["ending_pool"][:ENDINGS_PER_ROLL]
+            state["ending_pool"] = state["ending_pool"][ENDINGS_PER_ROLL:]
+        else:
+            candidate_count = story_co_writer_ai.BATCH_CANDIDATE_COUNT
+            deadline = Deadline("endings")
+            plan, decision = self._plan(story_id, state, "endings_reroll" if state["alternate_endings"] else "endings", candidate_count)
+            payload = self._payload(story_id, state, plan, decision, candidate_count=candidate_count, deadline=deadline.to_payload())
+            try:
+                candidates = await self._billed_job(story_id, state, "endings", payload, decision, deadline)
+            finally:
+                deadline.finish(story_id)
+            endings = candidates[:ENDINGS_PER_ROLL]
+            if state["story_version"] == version:
+                state["ending_pool"] = candidates[ENDINGS_PER_ROLL:]
+                state["ending_pool_version"] = version
+        if state["story_version"] == version:
+            state["alternate_endings"] = endings
+            self._save(story_id, live)
+        return json_response({"version": version, "endings": endings})
+
+    async def export(self, request: dict, story_id: str) -> Response:
+        state = self._story(story_id).state
+        export_format = request["query"].get("format", ["pdf"])[0]
+        if export_format not in EXPORT_EXTENSIONS:
+            raise ApiError(400, f"'format' must be one of: {', '.join(sorted(EXPORT_EXTENSIONS))}")
+        language = request["query"].get("language", [""])[0] or state["story_language"]
+        record = build_story_record(state["story_log"], state)
+        if language != state["story_language"]: # Only segments never translated before cost a call
+            if language not in SUPPORTED_LANGUAGES:
+                raise ApiError(400, f"'language' must be one of: {', '.join(SUPPORTED_LANGUAGES)}")
+            plan = plan_generation(state["api_usage"], state["current_story"], state["story_language"])
+            if plan["status"] == "offline":
+                raise ApiError(409, "the story has used its budget; export it in its own language")
+            deadline = Deadline("translate")
+            payload = {"session": story_id, "record": record, "target_language": language, "model": plan["model"], "deadline": deadline.to_payload()}
+            try:
+                record = (await self._billed_job(story_id, state, "translate", payload, deadline=deadline))["record"]
+            finally:
+                deadline.finish(story_id)
+        if self._export_pipeline is None:
+            self._export_pipeline = ExportPipeline()
+        path = await asyncio.wrap_future(self._export_pipeline.submit(record, export_format))
+        with open(path, "rb") as f:
+            data = f.read()
+        file_name = export_file_name(state, export_format, language if language != state["story_language"] else "")
+        return Response(200, data, EXPORT_MIME_TYPES[export_format], {"Content-Disposition": f'attachment; filename="{file_name}"'})
+
+    # --- HTTP ---
+
+    async def dispatch(self, method: str, target: str, headers: dict, body: bytes) -> Response:
+        """Routes one request to its handler and turns errors into JSON responses."""
+        self.requests += 1
+        url = urlsplit(target)
+        try:
+            if API_TOKEN and url.path != "/health" and headers.get("authorization") != f"Bearer {API_TOKEN}":
+                raise ApiError(401, "missing or wrong bearer token")
+            allowed = []
+            for route_method, pattern, handler in self.routes:
+                match = pattern.match(url.path)
+                if match is None:
+                    continue
+                if route_method != method:
+                    allowed.append(route_method)
+                    continue
+                try:
+                    payload = json.loads(body) if body else {}
+                except ValueError:
+                    raise ApiError(400, "the body must be JSON")
+                if not isinstance(payload, dict):
+                    raise ApiError(400, "the body must be a JSON object")
+                request = {"method": method, "path": url.path, "query": parse_qs(url.query), "headers": headers, "json": payload}
+                live = self._story(match.group(1)) if pattern.groups else None
+                if live is None:
+                    return await handler(request)
+                self._hold(live) # Until the response (or its event stream) is done, so it is not evicted meanwhile
+                response = None
+                try:
+                    response = await handler(request, *match.groups())
+                finally:
+                    if response is not None and response.events is not None:
+                        response.events = self._held_events(live, response.events)
+                    else:
+                        self._release(live)
+                return response
+            if allowed:
+                raise ApiError(405, f"use {' or '.join(allowed)}")
+            raise ApiError(404, "no such endpoint")
+        except ApiError as error:
+            return json_response({"error": str(error), **error.details}, error.status)
+        except Exception as error: # Keep serving; the engine reports upstream errors itself
+            print(f"❌ {method} {url.path} failed: {error!r}")
+            return json_response({"error": "internal error"}, 500)
+
+    async def _write_response(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> bool:
+        """Writes the response; returns whether the connection can serve another request."""
+        head = [f"HTTP/1.1 {response.status} {_STATUS_TEXT.get(response.status, 'OK')}", f"Content-Type: {response.content_type}"]
+        head += [f"{name}: {value}" for name, value in response.headers.items()]
+        head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        if response.events is None:
+            head.append(f"Content-Length: {len(response.body)}")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + response.body)
+            await writer.drain()
+            return keep_alive
+        head.append("Transfer-Encoding: chunked")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        try:
+            async for event in response.events:
+                writer.write(f"{len(event):x}\r\n".encode("latin-1") + event + b"\r\n")
+                await writer.drain()
+        except ConnectionError:
+            raise
+        except Exception as error: # The headers are sent: end the stream with an error event and the connection
+            if not isinstance(error, ApiError):
+                print(f"❌ Event stream failed: {error!r}")
+            event = sse_event("error", {"error": str(error) if isinstance(error, ApiError) else "internal error"})
+            writer.write(f"{len(event):x}\r\n".encode("latin-1") + event + b"\r\n")
+            keep_alive = False
+        finally:
+            await response.events.aclose()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return keep_alive
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    break # Idle keep-alive connection
+                if not request_line:
+                    break
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    await self._write_response(writer, json_response({"error": "malformed request line"}, 400), False)
+                    break
+                method, target, version = parts
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if "chunked" in headers.get("transfer-encoding", "").lower():
+                    await self._write_response(writer, json_response({"error": "send a Content-Length"}, 411), False)
+                    break
+                length = int(headers.get("content-length", "0") or 0)
+                if length > MAX_BODY_BYTES:
+                    await self._write_response(writer, json_response({"error": "body too large"}, 413), False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                response = await self.dispatch(method, target, headers, body)
+                if not await self._write_response(writer, response, keep_alive):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except Exception as error: # One connection's failure must not reach the event loop
+            print(f"❌ Connection failed: {error!r}")
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def start(self, host: str = API_HOST, port: int = API_PORT) -> asyncio.AbstractServer:
+        """Starts serving (port 0 picks a free port) and the idle-story sweeper."""
+        self._sweeper = asyncio.create_task(self._sweep())
+        return await asyncio.start_server(self._serve_connection, host, port, backlog=1024)
+
+    def shutdown(self):
+        self._sweeper.cancel()
+        if self._export_pipeline is not None:
+            self._export_pipeline.shutdown()
+
+
+async def _serve(host: str, port: int, session_dir: str):
+    server_state = StoryApiServer(SessionStore(session_dir) if session_dir else None)
+    server = await server_state.start(host, port)
+    print(f"✅ Story API listening on http://{host}:{server.sockets[0].getsockname()[1]}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        server_state.shutdown()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the co-writer engine over HTTP/JSON.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--session-dir", default="", help="Where stories are saved (default: the GUI's session directory).")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve(args.host, args.port, args.session_dir))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,394 @@
+### STORY ARCHIVE ###
+# A compact binary format for story logs (".storyarc"). A story log saved by
+# save_story_to_file spends most of its bytes on indentation and on keys
+# repeated for every segment, and reading one segment means parsing the whole
+# file. An archive instead holds:
+#   - a header with the section offsets,
+#   - a compressed metadata section: interned contributor/type strings, segment
+#     key orders ("shapes"), the story record's other fields, and verbatim copies
+#     of any segment that does not fit the compact layout,
+#   - a block table and a fixed-width segment index (round, interned codes, and
+#     where the segment's text sits),
+#   - the segment texts, concatenated and zlib-compressed in ~64 KiB blocks.
+# Archives are read through mmap: fetching segment 9,000 or rounds 120-140
+# decompresses only the blocks holding them. Conversion to and from the JSON
+# shapes (bare story log or story record) is lossless, down to key order.
+#
+# Usage:
+#   python story_archive.py pack my_story_log.json            # -> my_story_log.storyarc
+#   python story_archive.py unpack my_story_log.storyarc      # -> my_story_log.json
+#   python story_archive.py show my_story_log.storyarc --segment 9000
+#   python story_archive.py show my_story_log.storyarc --rounds 120 140
+#   python story_archive.py info my_story_log.storyarc
+
+import os
+import sys
+import json
+import mmap
+import zlib
+import bisect
+import struct
+import argparse
+from collections import OrderedDict
+
+ARCHIVE_EXTENSION = ".storyarc"
+ARCHIVE_MAGIC = b"STORYARC"
+ARCHIVE_VERSION = 1
+BLOCK_SIZE = 64 * 1024    # Uncompressed text per block; a segment never spans blocks
+COMPRESSION_LEVEL = 6
+BLOCK_CACHE_BLOCKS = 16   # Decompressed blocks kept per open archive
+
+FLAG_RECORD = 1           # The archive holds a story record, not a bare story log
+FLAG_ROUNDS_SORTED = 2    # Rounds never decrease, so round ranges are found by bisection
+SEGMENT_VERBATIM = 1      # The segment is stored as-is in the metadata section
+
+# magic, version, flags, segments, blocks, metadata offset, metadata length, block table offset, index offset
+_HEADER = struct.Struct("<8sHHIIQIQQ")
+_BLOCK = struct.Struct("<QII")         # offset, compressed length, uncompressed length
+_SEGMENT = struct.Struct("<iHHHHIII")  # round, shape, contributor, type, flags, block, offset, length
+
+_STRING_KEYS = ("text", "contributor", "type")
+
+
+def _compact(segment) -> bool:
+    """Whether a segment fits the fixed-width index (anything else is stored verbatim)."""
+    if not isinstance(segment, dict) or "text" not in segment:
+        return False
+    for key, value in segment.items():
+        if key == "round":
+            if type(value) is not int or not -2**31 <= value < 2**31: # bool is not a round
+                return False
+        elif key not in _STRING_KEYS or not isinstance(value, str):
+            return False
+    return True
+
+
+def _intern(table: dict, value) -> int:
+    code = table.get(value)
+    if code is None:
+        code = table[value] = len(table)
+        if code > 0xFFFF:
+            raise ValueError("too many distinct contributors, types or segment shapes")
+    return code
+
+
+def write_archive(data, path: str):
+    """
+    Writes a story log or story record as an archive.
+
+    Args:
+        data: Decoded story JSON, either a list of segments or a dict with "story_log".
+        path (str): The archive file to write (replaced atomically).
+
+    Raises:
+        ValueError: If the data is neither shape.
+        OSError: If the file cannot be written.
+    """
+    if isinstance(data, list):
+        story_log, document, flags = data, None, 0
+    elif isinstance(data, dict) and isinstance(data.get("story_log"), list):
+        story_log, flags = data["story_log"], FLAG_RECORD
+        document = {"keys": list(data), "fields": {key: value for key, value in data.items() if key != "story_log"}}
+    else:
+        raise ValueError("not a story log or story record")
+
+    strings, shapes, verbatim = {}, {}, {}
+    index, blocks, block_table = [], [], []
+    pending, pending_size = [], 0
+    rounds_sorted, last_round = True, None
+
+    def flush():
+        nonlocal pending, pending_size
+        if pending:
+            raw = b"".join(pending)
+            blocks.append(zlib.compress(raw, COMPRESSION_LEVEL))
+            block_table.append(len(raw))
+            pending, pending_size = [], 0
+
+    for position, segment in enumerate(story_log):
+        if not _compact(segment):
+            verbatim[str(position)] = segment
+            index.append((0, 0, 0, 0, SEGMENT_VERBATIM, 0, 0, 0))
+            continue
+        text = segment["text"].encode("utf-8", "surrogatepass")
+        if pending and pending_size + len(text) > BLOCK_SIZE:
+            flush()
+        round_num = segment.get("round", 0)
+        if "round" not in segment or (last_round is not None and round_num < last_round):
+            rounds_sorted = False
+        last_round = round_num
+        index.append((
+            round_num,
+            _intern(shapes, tuple(segment)),
+            _intern(strings, segment.get("contributor", "")),
+            _intern(strings, segment.get("type", "")),
+            0, len(blocks), pending_size, len(text),
+        ))
+        pending.append(text)
+        pending_size += len(text)
+    flush()
+    if rounds_sorted:
+        flags |= FLAG_ROUNDS_SORTED
+
+    metadata = zlib.compress(json.dumps({
+        "strings": list(strings),
+        "shapes": [list(shape) for shape in shapes],
+        "document": document,
+        "verbatim": verbatim,
+    }, separators=(",", ":"), ensure_ascii=False).encode("utf-8", "surrogatepass"), COMPRESSION_LEVEL)
+
+    metadata_offset = _HEADER.size
+    block_table_offset = metadata_offset + len(metadata)
+    index_offset = block_table_offset + _BLOCK.size * len(blocks)
+    data_offset = index_offset + _SEGMENT.size * len(index)
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, flags, len(index), len(blocks),
+                             metadata_offset, len(metadata), block_table_offset, index_offset))
+        f.write(metadata)
+        offset = data_offset
+        for block, raw_length in zip(blocks, block_table):
+            f.write(_BLOCK.pack(offset, len(block), raw_length))
+            offset += len(block)
+        f.write(b"".join(_SEGMENT.pack(*entry) for entry in index))
+        for block in blocks:
+            f.write(block)
+    os.replace(temp_path, path)
+
+
+class StoryArchive:
+    """
+    A read-only, memory-mapped story archive. Segments are decoded on demand;
+    only the blocks holding them are decompressed.
+
+    Usage:
+        with StoryArchive("story.storyarc") as archive:
+            archive.segment(9000)
+            archive.rounds(120, 140)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty file
+            self._file.close()
+            raise ValueError(f"'{path}' is not a readable story archive: empty file")
+        try:
+            self._read_header()
+        except (struct.error, zlib.error, ValueError, KeyError) as error:
+            self.close()
+            raise ValueError(f"'{path}' is not a readable story archive: {error}") from error
+        self._blocks: OrderedDict[int, bytes] = OrderedDict()
+
+    def _read_header(self):
+        (magic, version, self.flags, self.segment_count, self.block_count,
+         metadata_offset, metadata_length, self._block_table_offset, self._index_offset) = _HEADER.unpack_from(self._map, 0)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("bad magic")
+        if version > ARCHIVE_VERSION:
+            raise ValueError(f"archive version {version}, this reader supports up to {ARCHIVE_VERSION}")
+        if self._index_offset + _SEGMENT.size * self.segment_count > len(self._map):
+            raise ValueError("truncated index")
+        metadata = json.loads(zlib.decompress(self._map[metadata_offset:metadata_offset + metadata_length]).decode("utf-8", "surrogatepass"))
+        self._strings = metadata["strings"]
+        self._shapes = [tuple(shape) for shape in metadata["shapes"]]
+        self._document = metadata["document"]
+        self._verbatim = {int(position): segment for position, segment in metadata["verbatim"].items()}
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.segment_count
+
+    @property
+    def metadata(self) -> dict:
+        """The story record's fields other than story_log (empty for a bare story log)."""
+        return dict(self._document["fields"]) if self._document else {}
+
+    # --- Reading segments ---
+
+    def _entry(self, position: int) -> tuple:
+        return _SEGMENT.unpack_from(self._map, self._index_offset + position * _SEGMENT.size)
+
+    def _block(self, number: int) -> bytes:
+        block = self._blocks.get(number)
+        if block is not None:
+            self._blocks.move_to_end(number)
+            return block
+        offset, length, _ = _BLOCK.unpack_from(self._map, self._block_table_offset + number * _BLOCK.size)
+        try:
+            block = self._blocks[number] = zlib.decompress(self._map[offset:offset + length])
+        except zlib.error as error:
+            raise ValueError(f"'{self.path}' has a corrupt block {number}: {error}") from error
+        if len(self._blocks) > BLOCK_CACHE_BLOCKS:
+            self._blocks.popitem(last=False)
+        return block
+
+    def _segment(self, position: int, entry: tuple) -> dict:
+        round_num, shape, contributor, segment_type, flags, block, offset, length = entry
+        if flags & SEGMENT_VERBATIM:
+            return self._verbatim[position]
+        values = {
+            "round": round_num,
+            "text": self._block(block)[offset:offset + length].decode("utf-8", "surrogatepass"),
+            "contributor": self._strings[contributor],
+            "type": self._strings[segment_type],
+        }
+        return {key: values[key] for key in self._shapes[shape]}
+
+    def segment(self, position: int) -> dict:
+        """
+        Returns one segment, decompressing only the block that holds it.
+
+        Args:
+            position (int): The segment's position in the story log (negative counts from the end).
+
+        Raises:
+            IndexError: If there is no such segment.
+        """
+        if position < 0:
+            position += self.segment_count
+        if not 0 <= position < self.segment_count:
+            raise IndexError("segment index out of range")
+        return self._segment(position, self._entry(position))
+
+    def segments(self, start: int = 0, stop: int | None = None) -> list[dict]:
+        """Returns segments [start, stop) in story order."""
+        start, stop, _ = slice(start, stop).indices(self.segment_count)
+        return [self._segment(position, self._entry(position)) for position in range(start, stop)]
+
+    def _round_of(self, position: int) -> int | None:
+        entry = self._entry(position)
+        if entry[4] & SEGMENT_VERBATIM:
+            segment = self._verbatim[position]
+            value = segment.get("round") if isinstance(segment, dict) else None
+            return value if isinstance(value, int) and not isinstance(value, bool) else None
+        return entry[0] if "round" in self._shapes[entry[1]] else None
+
+    def rounds(self, first: int, last: int) -> list[dict]:
+        """
+        Returns the segments whose round is within [first, last], reading only the
+        index (and, when rounds never decrease, only a bisected slice of it).
+        """
+        if self.flags & FLAG_ROUNDS_SORTED and not self._verbatim:
+            start = bisect.bisect_left(range(self.segment_count), first, key=self._round_of)
+            stop = bisect.bisect_right(range(self.segment_count), last, key=self._round_of)
+            return self.segments(start, stop)
+        matches = []
+        for position in range(self.segment_count):
+            round_num = self._round_of(position)
+            if round_num is not None and first <= round_num <= last:
+                matches.append(self._segment(position, self._entry(position)))
+        return matches
+
+    def story_log(self) -> list[dict]:
+        """Decodes every segment."""
+        return self.segments()
+
+    def to_data(self):
+        """Decodes the archive back into the JSON shape it was written from."""
+        story_log = self.story_log()
+        if not self.flags & FLAG_RECORD:
+            return story_log
+        fields = self._document["fields"]
+        return {key: story_log if key == "story_log" else fields[key] for key in self._document["keys"]}
+
+    def info(self) -> dict:
+        """Sizes of the archive's sections."""
+        text_bytes = sum(_BLOCK.unpack_from(self._map, self._block_table_offset + i * _BLOCK.size)[2] for i in range(self.block_count))
+        return {
+            "segments": self.segment_count,
+            "blocks": self.block_count,
+            "verbatim_segments": len(self._verbatim),
+            "text_bytes": text_bytes,
+            "archive_bytes": len(self._map),
+            "rounds_sorted": bool(self.flags & FLAG_ROUNDS_SORTED),
+        }
+
+
+def read_archive(path: str):
+    """Reads a whole archive back into its JSON shape (list or story record)."""
+    with StoryArchive(path) as archive:
+        return archive.to_data()
+
+
+def is_archive(path: str) -> bool:
+    """Whether a file starts with the archive magic."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+    except OSError:
+        return False
+
+
+def pack_json(json_path: str, archive_path: str = "") -> str:
+    """Converts a JSON story file into an archive next to it (or at archive_path)."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    archive_path = archive_path or os.path.splitext(json_path)[0] + ARCHIVE_EXTENSION
+    write_archive(data, archive_path)
+    return archive_path
+
+
+def unpack_archive(archive_path: str, json_path: str = "") -> str:
+    """Converts an archive back into a JSON story file, formatted like save_story_to_file."""
+    data = read_archive(archive_path)
+    json_path = json_path or os.path.splitext(archive_path)[0] + ".json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4)
+    return json_path
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Convert and inspect compact story archives.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_parser = commands.add_parser("pack", help="Convert a JSON story log or record into an archive.")
+    pack_parser.add_argument("story")
+    pack_parser.add_argument("--output", default="")
+    unpack_parser = commands.add_parser("unpack", help="Convert an archive back into JSON.")
+    unpack_parser.add_argument("archive")
+    unpack_parser.add_argument("--output", default="")
+    show_parser = commands.add_parser("show", help="Print segments without decoding the whole archive.")
+    show_parser.add_argument("archive")
+    show_group = show_parser.add_mutually_exclusive_group(required=True)
+    show_group.add_argument("--segment", type=int)
+    show_group.add_argument("--rounds", type=int, nargs=2, metavar=("FIRST", "LAST"))
+    info_parser = commands.add_parser("info", help="Print the archive's section sizes.")
+    info_parser.add_argument("archive")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "pack":
+            output = pack_json(args.story, args.output)
+            before, after = os.path.getsize(args.story), os.path.getsize(output)
+            print(f"✅ Packed '{args.story}' ({before:,} bytes) -> '{output}' ({after:,} bytes, {after / max(before, 1):.0%})")
+        elif args.command == "unpack":
+            output = unpack_archive(args.archive, args.output)
+            print(f"✅ Unpacked '{args.archive}' -> '{output}'")
+        elif args.command == "show":
+            with StoryArchive(args.archive) as archive:
+                segments = [archive.segment(args.segment)] if args.segment is not None else archive.rounds(*args.rounds)
+            print(json.dumps(segments, indent=4, ensure_ascii=False))
+        else:
+            with StoryArchive(args.archive) as archive:
+                for key, value in archive.info().items():
+                    print(f"{key}: {value:,}" if isinstance(value, int) and not isinstance(value, bool) else f"{key}: {value}")
+    except (OSError, ValueError, IndexError) as error:
+        print(f"❌ {error}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
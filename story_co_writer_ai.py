@@ -0,0 +1,912 @@
+### STORY CO-WRITER AI ENGINE ###
+# The Gemini/Imagen calls, prompt templates and response parsers used by the
+# Streamlit GUI (story_verse_gui.py). This module never imports Streamlit so the
+# same engine can be driven from the CLI, background workers and tools.
+
+import os
+import re
+import json
+import asyncio
+import weakref
+import httpx # For making asynchronous HTTP requests from Python
+
+from local_suggestion_engine import get_local_model
+from suggestion_diversity import diversify_suggestions, diversify_endings
+from token_accounting import ESTIMATOR, OFFLINE_MODEL, ECONOMY_CONTEXT_TOKENS, record_model_tokens, record_model_images, trim_story_context
+from deadlines import MIN_CALL_SECONDS, SHORT_CONTEXT_SECONDS, deadline_phase
+
+# --- API Configuration ---
+# IMPORTANT: The API key should NOT be hardcoded in production.
+# Front ends (e.g. the Streamlit GUI) set story_co_writer_ai.API_KEY at start-up;
+# otherwise the GEMINI_API_KEY environment variable is used.
+API_KEY = os.getenv("GEMINI_API_KEY", "")
+API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = "gemini-2.0-flash"
+# Context caching needs an explicitly versioned model; see context_cache.py.
+CACHED_GEMINI_MODEL = "gemini-2.0-flash-001"
+IMAGEN_MODEL = "imagen-3.0-generate-002"
+
+# Offline model used in degraded mode when Gemini is unreachable or returns
+# something unparseable. Train it with local_suggestion_engine.py.
+LOCAL_MODEL_PATH = os.getenv("STORY_LOCAL_MODEL", "story_local_model.svlm")
+
+# How many candidates a batched round asks for. Candidate 1 supplies the
+# suggestions shown to the user; every candidate contributes to the ending pool.
+BATCH_CANDIDATE_COUNT = 2
+
+# Candidates requested by generate_gemini_suggestions when near-duplicate
+# filtering is on, so dropped continuations can be topped up without a re-roll.
+DIVERSITY_CANDIDATE_COUNT = 2
+
+
+# --- UI Hooks ---
+# The engine reports problems through these callables. The GUI swaps them for
+# st.error / st.info; scripts and workers keep the default print.
+_error_reporter = print
+_info_reporter = print
+
+def set_reporters(error=None, info=None):
+    """
+    Registers the callables used to surface engine errors and progress messages.
+
+    Args:
+        error (callable): Receives a message string for errors (e.g. st.error).
+        info (callable): Receives a message string for progress notes (e.g. st.info).
+    """
+    global _error_reporter, _info_reporter
+    if error is not None:
+        _error_reporter = error
+    if info is not None:
+        _info_reporter = info
+
+
+def new_usage_counters() -> dict:
+    """
+    Returns an empty usage record for counting upstream calls, bytes sent and
+    the token counts Gemini reports back (prompt, cached part of the prompt, output).
+    """
+    return {
+        "gemini_calls": 0,
+        "imagen_calls": 0,
+        "context_bytes": 0,
+        "prompt_tokens": 0,
+        "cached_tokens": 0,
+        "output_tokens": 0,
+    }
+
+
+def _record_usage(usage: dict | None, key: str, prompt_text: str = ""):
+    """Adds one call (and the bytes of its prompt) to a usage record, if given."""
+    if usage is None:
+        return
+    usage[key] = usage.get(key, 0) + 1
+    usage["context_bytes"] = usage.get("context_bytes", 0) + len(prompt_text.encode("utf-8"))
+
+
+def _record_token_usage(usage: dict | None, usage_metadata: dict, model: str = ""):
+    """Adds the usageMetadata of a generateContent response to a usage record (totals and per model), if given."""
+    if usage is None or not usage_metadata:
+        return
+    usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + usage_metadata.get("promptTokenCount", 0)
+    usage["cached_tokens"] = usage.get("cached_tokens", 0) + usage_metadata.get("cachedContentTokenCount", 0)
+    usage["output_tokens"] = usage.get("output_tokens", 0) + usage_metadata.get("candidatesTokenCount", 0)
+    record_model_tokens(
+        usage, model or GEMINI_MODEL,
+        usage_metadata.get("promptTokenCount", 0),
+        usage_metadata.get("cachedContentTokenCount", 0),
+        usage_metadata.get("candidatesTokenCount", 0)
+    )
+
+
+def _resolve_api_key() -> str:
+    """Returns the configured API key (module setting first, then environment)."""
+    return API_KEY or os.getenv("GEMINI_API_KEY", "")
+
+
+# One pooled HTTP client per event loop. Building an httpx.AsyncClient loads the
+# TLS context, which costs more CPU than the request itself; reusing it also keeps
+# upstream connections alive between calls.
+_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared httpx.AsyncClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = _http_clients[loop] = httpx.AsyncClient(
+            timeout=60.0, limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+        )
+    return client
+
+
+# --- API Call Functions ---
+
+async def call_gemini_api_candidates(prompt_text: str, candidate_count: int = 1, usage: dict | None = None, model: str = "", cached_content: str = "", language: str = "", deadline=None) -> list[str]:
+    """
+    Makes an asynchronous call to the Gemini API and returns the text of every
+    candidate. Asking for several candidates in one call costs one round trip and
+    one copy of the prompt, instead of one per candidate.
+
+    Args:
+        prompt_text (str): The prompt string to send to the AI.
+        candidate_count (int): How many candidates to request (generationConfig.candidateCount).
+        usage (dict): Optional usage record (see new_usage_counters) to update.
+        model (str): Model to call (defaults to GEMINI_MODEL).
+        cached_content (str): Optional cachedContents/... name holding the prompt prefix;
+                              prompt_text is then only the uncached tail.
+        language (str): Story language; uncached prompts calibrate the token estimator for it.
+        deadline (Deadline): Optional latency budget (see deadlines.py); the call times out at it.
+
+    Returns:
+        list[str]: One text per returned candidate. On failure a single error message.
+    """
+    api_key_to_use = _resolve_api_key()
+
+    if not api_key_to_use:
+        _error_reporter("Error: API key is not configured. Please set the API_KEY variable or ensure Canvas provides it.")
+        return ["API Key Error"]
+
+    chat_history = [{'role': 'user', 'parts': [{'text': prompt_text}]}]
+    payload = {'contents': chat_history}
+    if candidate_count > 1:
+        payload['generationConfig'] = {'candidateCount': candidate_count}
+    if cached_content:
+        payload['cachedContent'] = cached_content
+    api_url = f"{API_BASE_URL}/models/{model or GEMINI_MODEL}:generateContent?key={api_key_to_use}"
+    _record_usage(usage, "gemini_calls", prompt_text)
+    request_options = {"timeout": deadline.timeout()} if deadline is not None else {} # Otherwise the client's 60 s
+
+    try:
+        client = get_http_client()
+        response = await client.post(
+            api_url,
+            headers={'Content-Type': 'application/json'},
+            json=payload, # httpx handles JSON payload directly
+            **request_options
+        )
+        response.raise_for_status()
+
+        result = response.json()
+        usage_metadata = result.get('usageMetadata', {})
+        _record_token_usage(usage, usage_metadata, model)
+        if not cached_content and usage_metadata.get('promptTokenCount'):
+            ESTIMATOR.observe(prompt_text, language, usage_metadata['promptTokenCount'])
+        texts = []
+        for candidate in result.get('candidates', []):
+            parts = candidate.get('content', {}).get('parts', [])
+            if parts and 'text' in parts[0]:
+                texts.append(parts[0]['text'])
+        if texts:
+            return texts
+
+        _error_reporter(f'Unexpected API response structure: {result}')
+        return ["Sorry, I couldn't get a clear response from the AI. Please try again!"]
+
+    except httpx.TimeoutException as error:
+        if deadline is not None:
+            deadline.degrade("gemini_timeout")
+        _error_reporter(f'Gemini API call timed out: {type(error).__name__}')
+        return ["ERROR: The AI did not answer within the time budget."]
+    except httpx.RequestError as error:
+        _error_reporter(f'Error calling Gemini API: {error}')
+        return [f"ERROR: Failed to connect to AI. Details: {error}. Make sure your API key is correctly entered and you have an internet connection."]
+    except Exception as error:
+        _error_reporter(f'An unexpected error occurred: {error}')
+        return [f"An unexpected error occurred: {error}"]
+
+
+async def call_gemini_api(prompt_text: str, usage: dict | None = None, model: str = "") -> str:
+    """
+    Makes an asynchronous call to the Gemini API (text generation model) to generate content.
+    Uses httpx for HTTP requests.
+
+    Args:
+        prompt_text (str): The prompt string to send to the AI.
+        usage (dict): Optional usage record (see new_usage_counters) to update.
+        model (str): Gemini model to use (e.g. chosen by model_router); defaults to GEMINI_MODEL.
+
+    Returns:
+        str: The AI's generated response text.
+    """
+    texts = await call_gemini_api_candidates(prompt_text, 1, usage, model=model)
+    return texts[0]
+
+
+async def stream_gemini_api(prompt_text: str, usage: dict | None = None, model: str = "", deadline=None):
+    """
+    Streams a Gemini response (streamGenerateContent with server-sent events),
+    yielding text chunks as they arrive.
+
+    Args:
+        prompt_text (str): The prompt string to send to the AI.
+        usage (dict): Optional usage record (see new_usage_counters) to update.
+        model (str): Model to call (defaults to GEMINI_MODEL).
+        deadline (Deadline): Optional latency budget (see deadlines.py); each read times out at it.
+
+    Yields:
+        str: Text chunks. On failure a single error message.
+    """
+    api_key_to_use = _resolve_api_key()
+
+    if not api_key_to_use:
+        _error_reporter("Error: API key is not configured. Please set the API_KEY variable or ensure Canvas provides it.")
+        yield "API Key Error"
+        return
+
+    payload = {'contents': [{'role': 'user', 'parts': [{'text': prompt_text}]}]}
+    api_url = f"{API_BASE_URL}/models/{model or GEMINI_MODEL}:streamGenerateContent?alt=sse&key={api_key_to_use}"
+    _record_usage(usage, "gemini_calls", prompt_text)
+    request_options = {"timeout": deadline.timeout()} if deadline is not None else {}
+
+    try:
+        usage_metadata = {}
+        async with get_http_client().stream("POST", api_url, headers={'Content-Type': 'application/json'}, json=payload, **request_options) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[len("data:"):])
+                usage_metadata = event.get('usageMetadata') or usage_metadata # Totals arrive with the last event
+                for candidate in event.get('candidates', [])[:1]:
+                    for part in candidate.get('content', {}).get('parts', []):
+                        if part.get('text'):
+                            yield part['text']
+        _record_token_usage(usage, usage_metadata, model)
+    except httpx.TimeoutException as error:
+        if deadline is not None:
+            deadline.degrade("gemini_timeout")
+        _error_reporter(f'Gemini API stream timed out: {type(error).__name__}')
+        yield "ERROR: The AI did not answer within the time budget."
+    except httpx.RequestError as error:
+        _error_reporter(f'Error calling Gemini API: {error}')
+        yield f"ERROR: Failed to connect to AI. Details: {error}. Make sure your API key is correctly entered and you have an internet connection."
+    except Exception as error:
+        _error_reporter(f'An unexpected error occurred: {error}')
+        yield f"An unexpected error occurred: {error}"
+
+
+async def call_imagen_api_samples(prompt_text: str, sample_count: int = 1, usage: dict | None = None, model: str = "", deadline=None) -> list[str]:
+    """
+    Calls the Imagen API (image generation model) and returns every sample.
+    Asking for several samples in one request (parameters.sampleCount) costs one
+    round trip instead of one per image.
+
+    Args:
+        prompt_text (str): The prompt string for the image generation.
+        sample_count (int): How many images to request.
+        usage (dict): Optional usage record (see new_usage_counters) to update.
+        model (str): Imagen model to use (e.g. chosen by model_router); defaults to IMAGEN_MODEL.
+        deadline (Deadline): Optional latency budget (see deadlines.py); the call times out at it.
+
+    Returns:
+        list[str]: One base64 image URL per returned sample. On failure a single placeholder URL.
+    """
+    api_key_to_use = _resolve_api_key()
+
+    if not api_key_to_use:
+        _error_reporter("Error: API key is not configured for Imagen. Please set the API_KEY variable.")
+        return [f"https://placehold.co/400x200/505050/FFFFFF?text=API+Key+Missing"] # Fallback for display
+
+
+    model = model or IMAGEN_MODEL
+    payload = {"instances": {"prompt": prompt_text}, "parameters": {"sampleCount": sample_count}}
+    apiUrl = f"{API_BASE_URL}/models/{model}:predict?key={api_key_to_use}";
+    _record_usage(usage, "imagen_calls", prompt_text)
+
+    _info_reporter(f"Generating visual concept for: '{prompt_text}'...") # Informative message for user
+    request_options = {"timeout": deadline.timeout()} if deadline is not None else {}
+
+    try:
+        client = get_http_client()
+        response = await client.post(
+            apiUrl,
+            headers={'Content-Type': 'application/json'},
+            json=payload, # httpx handles JSON payload directly
+            **request_options
+        )
+        response.raise_for_status()
+
+        result = response.json()
+        images = [f"data:image/png;base64,{prediction['bytesBase64Encoded']}"
+                  for prediction in result.get('predictions') or [] if prediction.get('bytesBase64Encoded')]
+        if images:
+            record_model_images(usage, model, len(images))
+            return images
+        else:
+            _error_reporter(f'Unexpected Imagen API response structure: {result}');
+            return [f"https://placehold.co/400x200/FF0000/FFFFFF?text=Image+Gen+Failed"]; # Generic failure placeholder
+    except httpx.TimeoutException as error:
+        if deadline is not None:
+            deadline.degrade("image_timeout")
+        _error_reporter(f'Imagen API call timed out: {type(error).__name__}')
+        return [f"https://placehold.co/400x200/505050/FFFFFF?text=Image+Timed+Out"]
+    except httpx.RequestError as error:
+        _error_reporter(f'Error calling Imagen API: {error}');
+        return [f"https://placehold.co/400x200/FF0000/FFFFFF?text=API+Error"]; # Connection error placeholder
+    except Exception as error:
+        _error_reporter(f'An unexpected error occurred: {error}');
+        return [f"An unexpected error occurred: {error}"]
+
+
+async def call_imagen_api(prompt_text: str, usage: dict | None = None, model: str = "", deadline=None) -> str:
+    """
+    Calls the Imagen API (image generation model) to generate an image.
+    Uses httpx for HTTP requests.
+
+    Args:
+        prompt_text (str): The prompt string for the image generation.
+        usage (dict): Optional usage record (see new_usage_counters) to update.
+        model (str): Imagen model to use (e.g. chosen by model_router); defaults to IMAGEN_MODEL.
+        deadline (Deadline): Optional latency budget (see deadlines.py); the call times out at it.
+
+    Returns:
+        str: A base64 image URL or a placeholder URL if generation fails.
+    """
+    images = await call_imagen_api_samples(prompt_text, 1, usage, model=model, deadline=deadline)
+    return images[0]
+
+
+# --- Prompt Construction ---
+
+def _style_instructions(story_format: str, aesthetic_style: str = "", era_style: str = "") -> tuple[str, str, str]:
+    """Returns (writer_persona, aesthetic_instruction, era_style_instruction) for a prompt."""
+    writer_persona = f"award-winning {story_format.lower()} writer";
+    aesthetic_instruction = "";
+    if aesthetic_style == "20th-century aesthetic":
+        aesthetic_instruction = f"Write in the style of a classic 20th-century {story_format.lower()} from the 1930s-1980s, emulating the language, structure, and tone of that era.";
+
+    era_style_instruction = "";
+    if era_style:
+        era_style_instruction = f"Emulate the stylistic elements of a {era_style}.";
+    return writer_persona, aesthetic_instruction, era_style_instruction
+
+
+def _visual_concept_instruction(story_format: str) -> str:
+    """Returns the instruction asking for a format-appropriate cover/poster concept."""
+    # Determine the type of visual concept to ask for
+    visual_concept_type_prompt = "";
+    if story_format == "Novel":
+        visual_concept_type_prompt = "book cover concept";
+    elif story_format == "Short Story":
+        visual_concept_type_prompt = "magazine cover concept";
+    elif story_format == "Screenplay":
+        visual_concept_type_prompt = "movie poster concept";
+    elif story_format == "Television Script":
+        visual_concept_type_prompt = "TV show title card concept";
+    elif story_format == "Play":
+        visual_concept_type_prompt = "playbill poster concept";
+
+    visual_concept_instruction = "";
+    if visual_concept_type_prompt:
+        visual_concept_instruction = f"Also describe what a 20th-century-style {visual_concept_type_prompt} would look like for this story. Use vivid visual language.";
+    return visual_concept_instruction
+
+
+def format_story_block(story_context: str) -> str:
+    """Returns the 'Story so far' block that closes every prompt."""
+    return f"""
+Story so far:
+---
+{story_context}
+---
+"""
+
+
+def build_suggestions_instructions(language: str, genre: str, story_format: str, tone_command: str = "", aesthetic_style: str = "", era_style: str = "", include_endings: bool = False) -> str:
+    """
+    Builds the instruction part of the suggestions prompt (persona, style, format
+    template) - everything that precedes the story itself. It only changes when the
+    story settings change, which makes it the stable prefix for context caching.
+
+    Args:
+        language (str): The language the AI should generate the response in.
+        genre (str): The chosen genre of the story.
+        story_format (str): The chosen format of the story (Novel, Screenplay, etc.).
+        tone_command (str): An optional command to influence the tone of the next generation.
+        aesthetic_style (str): Optional aesthetic style (e.g., "20th-century aesthetic").
+        era_style (str): Optional era/style reference (e.g., "1940s Noir").
+        include_endings (bool): If True, also ask for an 'Endings:' section (batched mode).
+
+    Returns:
+        str: The instruction text.
+    """
+    tone_instruction = f"Also, {tone_command} the next part of the story." if tone_command else "";
+    writer_persona, aesthetic_instruction, era_style_instruction = _style_instructions(story_format, aesthetic_style, era_style)
+    visual_concept_instruction = _visual_concept_instruction(story_format)
+
+    endings_instruction = ""
+    endings_format = ""
+    if include_endings:
+        # Combined schema: the same call also returns ending candidates so that
+        # "Roll Alternate Endings" can be served without another round trip.
+        visual_concept_instruction += " Start that description with 'Visual Concept:'." if visual_concept_instruction else ""
+        endings_instruction = f"Finally, provide 3 distinct and concise {story_format.lower()} ending options (1-3 sentences max each), each with a different resolution or emotional tone, in case the user decides to conclude the story now."
+        endings_format = "Visual Concept: [Cover description]\nEndings:\nEnding 1: [Ending 1]\nEnding 2: [Ending 2]\nEnding 3: [Ending 3]"
+
+    return f"""
+You are an {writer_persona} helping a user co-write a suspenseful, engaging, and fun story. The user will pick from your suggestions.
+
+The story genre is {genre}. Write in {language}.
+Provide 3 vivid {story_format.lower()} continuation options (1-2 sentences max), each followed by a 'Commentary:' line explaining the creative choice.
+Also suggest 1 'Bonus Idea' that introduces a surprise twist or new character, followed by its own 'Commentary:' line.
+{tone_instruction}
+{aesthetic_instruction}
+{era_style_instruction}
+{endings_instruction}
+
+Use a tone appropriate to the current mood and {genre} conventions. Be playful, mysterious, or dramatic when fitting.
+
+Format exactly like this:
+1. [Continuation 1]
+Commentary: [Explanation]
+2. [Continuation 2]
+Commentary: [Explanation]
+3. [Continuation 3]
+Commentary: [Explanation]
+Bonus Idea: [Plot twist or new character]
+Commentary: [Explanation]
+{endings_format}
+{visual_concept_instruction}
+""";
+
+
+def build_suggestions_prompt(story_context: str, language: str, genre: str, story_format: str, tone_command: str = "", aesthetic_style: str = "", era_style: str = "", include_endings: bool = False) -> str:
+    """
+    Builds the suggestions prompt sent by generate_gemini_suggestions.
+
+    Args:
+        story_context (str): The current story content to base suggestions on.
+        language (str): The language the AI should generate the response in.
+        genre (str): The chosen genre of the story.
+        story_format (str): The chosen format of the story (Novel, Screenplay, etc.).
+        tone_command (str): An optional command to influence the tone of the next generation.
+        aesthetic_style (str): Optional aesthetic style (e.g., "20th-century aesthetic").
+        era_style (str): Optional era/style reference (e.g., "1940s Noir").
+        include_endings (bool): If True, also ask for an 'Endings:' section (batched mode).
+
+    Returns:
+        str: The full prompt text.
+    """
+    instructions = build_suggestions_instructions(language, genre, story_format, tone_command, aesthetic_style, era_style, include_endings)
+    return instructions + format_story_block(story_context)
+
+
+def build_endings_prompt(story_context: str, language: str, genre: str, story_format: str, aesthetic_style: str = "", era_style: str = "") -> str:
+    """
+    Builds the endings prompt sent by generate_gemini_endings.
+
+    Args:
+        story_context (str): The current story content to base endings on.
+        language (str): The language the AI should generate the response in.
+        genre (str): The chosen genre of the story.
+        story_format (str): The chosen format of the story (Novel, Screenplay, etc.).
+        aesthetic_style (str): Optional aesthetic style (e.g., "20th-century aesthetic").
+        era_style (str): Optional era/style reference (e.g., "1940s Noir").
+
+    Returns:
+        str: The full prompt text.
+    """
+    writer_persona, aesthetic_instruction, era_style_instruction = _style_instructions(story_format, aesthetic_style, era_style)
+
+    return f"""
+You are an {writer_persona} helping a user conclude their suspenseful, engaging, and fun story. The user will pick from your suggested endings.
+
+The story genre is {genre}. Write in {language}.
+Provide 2-3 distinct and concise {story_format.lower()} ending options (1-3 sentences max each). Each ending should offer a different resolution or emotional tone (e.g., triumphant, bittersweet, mysterious, conclusive).
+{aesthetic_instruction}
+{era_style_instruction}
+
+Format exactly as a numbered list:
+1. [Ending 1]
+2. [Ending 2]
+3. [Ending 3] (Optional, if you have a third distinct idea)
+
+Story so far:
+---
+{story_context}
+---
+""";
+
+
+# --- Response Parsing ---
+
+def _split_endings_section(ai_raw_response: str) -> tuple[str, str]:
+    """Splits a combined response into (suggestions part, endings part) at the 'Endings:' heading."""
+    match = re.search(r'^\s*Endings:\s*$', ai_raw_response, re.IGNORECASE | re.MULTILINE)
+    if not match:
+        return ai_raw_response, ""
+    return ai_raw_response[:match.start()], ai_raw_response[match.end():]
+
+
+def parse_suggestions(ai_raw_response: str, pad: bool = True) -> list[tuple[str, str]]:
+    """
+    Parses a suggestions response into (suggestion_text, commentary) tuples.
+    Any 'Endings:' section of a combined response is ignored here (see parse_endings).
+
+    Args:
+        ai_raw_response (str): The raw AI response text.
+        pad (bool): If True, pad to exactly 5 tuples with fallback entries.
+
+    Returns:
+        list[tuple[str, str]]: 3 continuations, 1 bonus idea and 1 visual concept when padded.
+    """
+    suggestions_part, _ = _split_endings_section(ai_raw_response)
+
+    # --- Parsing AI Response for Suggestions and Commentary ---
+    parsed_suggestions = [];
+    lines = [line.strip() for line in suggestions_part.strip().split('\n') if line.strip()]; # Clean and split
+
+    i = 0;
+    while i < len(lines):
+        # Match numbered suggestions
+        match_suggestion = re.match(r'^\d+\.\s*(.*)$', lines[i]);
+        # Match Bonus Idea
+        match_bonus = re.match(r'^Bonus Idea:\s*(.*)$', lines[i], re.IGNORECASE);
+        # Match Visual Concept - now explicitly looking for the new prompt wording
+        match_visual_concept_output = re.match(r'^(Visual Concept:.*?)$', lines[i], re.IGNORECASE);
+
+
+        current_line_is_suggestion_or_bonus = False;
+        suggestion_text = "";
+
+        if match_suggestion:
+            suggestion_text = match_suggestion.group(1).strip();
+            current_line_is_suggestion_or_bonus = True;
+        elif match_bonus:
+            suggestion_text = "Bonus Idea: " + match_bonus.group(1).strip();
+            current_line_is_suggestion_or_bonus = True;
+        elif match_visual_concept_output: # This means it's the actual output of the visual concept
+            suggestion_text = match_visual_concept_output.group(1).strip();
+        else:
+            i += 1;
+            continue; # Skip line if it's not a recognizable suggestion or visual concept
+
+        # Move to the next line to check for commentary
+        i += 1;
+        commentary_text = "No commentary provided."; # Default if not found
+
+        if i < len(lines) and lines[i].lower().startswith("commentary:"):
+            commentary_text = re.sub(r'^commentary:\s*', '', lines[i], flags=re.IGNORECASE).strip();
+            i += 1; # Move to the next line after commentary
+        else:
+            # If no commentary found, stay on the current line or move past the suggestion
+            pass;
+
+        parsed_suggestions.append((suggestion_text, commentary_text));
+
+    if not pad:
+        return parsed_suggestions
+    return pad_suggestions(parsed_suggestions, ai_raw_response)
+
+
+def pad_suggestions(parsed_suggestions: list[tuple[str, str]], ai_raw_response: str = "") -> list[tuple[str, str]]:
+    """
+    Pads parsed suggestions to exactly 5 tuples (3 main + 1 bonus + 1 visual concept).
+
+    Args:
+        parsed_suggestions (list[tuple[str, str]]): Suggestions parsed so far.
+        ai_raw_response (str): The raw response, for the warning message.
+
+    Returns:
+        list[tuple[str, str]]: Exactly 5 (suggestion_text, commentary) tuples.
+    """
+    parsed_suggestions = list(parsed_suggestions)
+    # Ensure we return exactly 5 tuples (3 main + 1 bonus + 1 visual concept), even if parsing fails partially.
+    # This robust padding ensures display functions don't error out.
+    if len(parsed_suggestions) < 5:
+        print(f"Warning: Expected 5 suggestions with commentary (3 main, 1 bonus, 1 visual), got {len(parsed_suggestions)}. Raw response:\n{ai_raw_response}");
+        while len(parsed_suggestions) < 3: # Pad main suggestions
+            parsed_suggestions.append((f"AI continuation {len(parsed_suggestions)+1} (fallback)", "No commentary."));
+        if len(parsed_suggestions) < 4: # Pad bonus idea
+            parsed_suggestions.append(("Bonus Idea (fallback)", "No commentary."));
+        if len(parsed_suggestions) < 5: # Pad visual concept
+            parsed_suggestions.append(("Visual Concept: Placeholder image idea.", "No commentary."));
+
+    return parsed_suggestions[:5]; # Return exactly the first 5 if more were somehow parsed
+
+
+def parse_endings(ai_raw_response: str, combined: bool = False) -> list[str]:
+    """
+    Parses ending options from a response. Accepts both the numbered list used by
+    the endings prompt and the 'Ending N:' lines of a combined batched response.
+
+    Args:
+        ai_raw_response (str): The raw AI response text.
+        combined (bool): True for a batched response, whose numbered lines are
+                         continuations and must never be taken as endings.
+
+    Returns:
+        list[str]: The parsed ending texts (may be empty).
+    """
+    _, endings_part = _split_endings_section(ai_raw_response)
+    # [ \t]* rather than \s*: an empty item must not swallow the line after it
+    endings = re.findall(r'^[ \t]*Ending[ \t]*\d+[.:][ \t]*(.*)$', endings_part or ai_raw_response, re.IGNORECASE | re.MULTILINE)
+    if not endings and endings_part:
+        endings = re.findall(r'^[ \t]*\d+\.[ \t]*(.*)$', endings_part, re.MULTILINE)
+    elif not endings and not combined:
+        endings = re.findall(r'^\d+\.[ \t]*(.*)$', ai_raw_response, re.MULTILINE)
+    return [ending.strip() for ending in endings if ending.strip()]
+
+
+# --- Degraded Mode ---
+
+def complete_suggestions(parsed_suggestions: list[tuple[str, str]], ai_raw_response: str, story_context: str, genre: str, story_format: str) -> list[tuple[str, str]]:
+    """
+    Turns unpadded parsed suggestions into the final 5 tuples. When the response
+    was incomplete (API down, unparseable output) the gaps are filled from the
+    offline local model, if one is trained, before falling back to placeholders.
+    """
+    if len(parsed_suggestions) < 5:
+        local_model = get_local_model(LOCAL_MODEL_PATH)
+        local_suggestions = local_model.generate_suggestions(story_context, genre, story_format) if local_model else []
+        if local_suggestions:
+            if len(parsed_suggestions) < 3:
+                # Nothing usable came back: serve the whole set locally
+                print(f"Warning: Gemini response unusable, serving offline suggestions. Raw response:\n{ai_raw_response}")
+                return local_suggestions
+            parsed_suggestions = parsed_suggestions + local_suggestions[len(parsed_suggestions):]
+    return pad_suggestions(parsed_suggestions, ai_raw_response)
+
+
+def local_fallback_endings(story_context: str, genre: str, story_format: str) -> list[str]:
+    """Returns endings from the offline local model, or [] if none is trained."""
+    local_model = get_local_model(LOCAL_MODEL_PATH)
+    return local_model.generate_endings(story_context, genre, story_format) if local_model else []
+
+
+# --- Core Project Functions ---
+
+def _fit_to_deadline(story_context: str, language: str, context_cache, deadline) -> tuple[str, object, bool]:
+    """
+    Adapts a generation to the time its deadline has left: a shorter context
+    without the context cache (whose refresh can cost an upstream call of its own)
+    when time is short, and no upstream call at all when there is too little.
+
+    Returns:
+        tuple[str, StoryContextCache | None, bool]: The story context, the context cache
+                                                    and whether to call Gemini.
+    """
+    if deadline is None:
+        return story_context, context_cache, True
+    if not deadline.allows(MIN_CALL_SECONDS):
+        deadline.degrade("offline")
+        return story_context, None, False
+    if not deadline.allows(SHORT_CONTEXT_SECONDS):
+        deadline.degrade("short_context")
+        return trim_story_context(story_context, ECONOMY_CONTEXT_TOKENS, language), None, True
+    return story_context, context_cache, True
+
+
+async def _call_with_story_prefix(instructions: str, story_context: str, candidate_count: int = 1, usage: dict | None = None, context_cache=None, model: str = "", language: str = "", deadline=None) -> list[str]:
+    """
+    Sends instructions + story to Gemini. With a context cache (see
+    context_cache.StoryContextCache) the stable prefix is served from the upstream
+    cached context and only the new tail of the story is sent. An explicit model
+    (e.g. the economy model) bypasses the cache, which is tied to CACHED_GEMINI_MODEL.
+    """
+    if context_cache is None or model:
+        with deadline_phase(deadline, "gemini"):
+            return await call_gemini_api_candidates(instructions + format_story_block(story_context), candidate_count, usage, model=model, language=language, deadline=deadline)
+
+    with deadline_phase(deadline, "prompt"):
+        request = await context_cache.prepare(instructions, story_context, usage)
+    with deadline_phase(deadline, "gemini"):
+        return await call_gemini_api_candidates(
+            request["prompt"],
+            candidate_count,
+            usage,
+            model=request["model"],
+            cached_content=request["cached_content"],
+            language=language,
+            deadline=deadline
+        )
+
+
+async def generate_gemini_suggestions(story_context: str, language: str, genre: str, story_format: str, tone_command: str = "", aesthetic_style: str = "", era_style: str = "", usage: dict | None = None, context_cache=None, sketch_index=None, model: str = "", deadline=None) -> list[tuple[str, str]]:
+    """
+    Generates dynamic story suggestions (continuations, character ideas, plot twists)
+    by prompting the Gemini API, respecting the chosen language, genre, character details,
+    story format, optional tone command, aesthetic style, and era/style.
+    Each suggestion includes a commentary, and a visual concept is also generated.
+
+    Args:
+        story_context (str): The current story content to base suggestions on.
+        language (str): The language the AI should generate the response in.
+        genre (str): The chosen genre of the story.
+        story_format (str): The chosen format of the story (Novel, Screenplay, etc.).
+        tone_command (str): An optional command to influence the tone of the next generation.
+        aesthetic_style (str): Optional aesthetic style (e.g., "20th-century aesthetic").
+        era_style (str): Optional era/style reference (e.g., "1940s Noir").
+        usage (dict): Optional usage record (see new_usage_counters) to update.
+        context_cache (StoryContextCache): Optional per-session upstream cache for the prompt prefix.
+        sketch_index (SketchIndex): Optional per-session index of story segments; when given,
+                                    near-duplicate continuations are replaced from an extra candidate.
+        model (str): Model override (see token_accounting.plan_generation); OFFLINE_MODEL
+                     serves the local model without calling Gemini.
+        deadline (Deadline): Optional latency budget (see deadlines.py) passed down to every phase;
+                             as it runs short the context is cut, then the local model answers.
+
+    Returns:
+        list[tuple[str, str]]: A list of tuples, where each tuple contains (suggestion_text, commentary).
+                                Expected to return 5 tuples (3 continuations + 1 bonus idea + 1 visual concept).
+    """
+    story_context, context_cache, call_upstream = _fit_to_deadline(story_context, language, context_cache, deadline)
+    if model == OFFLINE_MODEL or not call_upstream:
+        return complete_suggestions([], "", story_context, genre, story_format)
+    with deadline_phase(deadline, "prompt"):
+        instructions = build_suggestions_instructions(language, genre, story_format, tone_command, aesthetic_style, era_style)
+    candidate_count = DIVERSITY_CANDIDATE_COUNT if sketch_index is not None else 1
+    raw_responses = await _call_with_story_prefix(instructions, story_context, candidate_count, usage, context_cache, model, language, deadline);
+    with deadline_phase(deadline, "parse"):
+        ai_raw_response = raw_responses[0]
+        parsed_suggestions = parse_suggestions(ai_raw_response, pad=False)
+        if sketch_index is not None:
+            alternates = [parse_suggestions(raw, pad=False) for raw in raw_responses[1:]]
+            parsed_suggestions = diversify_suggestions(parsed_suggestions, alternates, sketch_index)
+        return complete_suggestions(parsed_suggestions, ai_raw_response, story_context, genre, story_format)
+
+
+async def stream_gemini_suggestions(story_context: str, language: str, genre: str, story_format: str, on_chunk, tone_command: str = "", aesthetic_style: str = "", era_style: str = "", usage: dict | None = None, sketch_index=None, model: str = "", deadline=None) -> list[tuple[str, str]]:
+    """
+    generate_gemini_suggestions with one streamed candidate: each text chunk is passed
+    to on_chunk as it arrives. The context cache is not used (a streamed call sends
+    the whole prompt), and with a single candidate the sketch index can only
+    filter near-duplicates, which the local model then replaces.
+
+    Args:
+        story_context (str): The current story content to base suggestions on.
+        language (str): The language the AI should generate the response in.
+        genre (str): The chosen genre of the story.
+        story_format (str): The chosen format of the story (Novel, Screenplay, etc.).
+        on_chunk (Callable[[str], None]): Called with every streamed text chunk.
+        tone_command (str): An optional command to influence the tone of the next generation.
+        aesthetic_style (str): Optional aesthetic style (e.g., "20th-century aesthetic").
+        era_style (str): Optional era/style reference (e.g., "1940s Noir").
+        usage (dict): Optional usage record (see new_usage_counters) to update.
+        sketch_index (SketchIndex): Optional per-session index of story segments.
+        model (str): Model override; OFFLINE_MODEL serves the local model without calling Gemini.
+        deadline (Deadline): Optional latency budget (see deadlines.py) passed down to every phase.
+
+    Returns:
+        list[tuple[str, str]]: The parsed and completed suggestions, as generate_gemini_suggestions.
+    """
+    story_context, _, call_upstream = _fit_to_deadline(story_context, language, None, deadline)
+    if model == OFFLINE_MODEL or not call_upstream:
+        return complete_suggestions([], "", story_context, genre, story_format)
+    with deadline_phase(deadline, "prompt"):
+        prompt = build_suggestions_prompt(story_context, language, genre, story_format, tone_command, aesthetic_style, era_style)
+    chunks = []
+    with deadline_phase(deadline, "gemini"):
+        async for chunk in stream_gemini_api(prompt, usage, model, deadline=deadline):
+            chunks.append(chunk)
+            on_chunk(chunk)
+    with deadline_phase(deadline, "parse"):
+        ai_raw_response = "".join(chunks)
+        parsed_suggestions = parse_suggestions(ai_raw_response, pad=False)
+        if sketch_index is not None:
+            parsed_suggestions = diversify_suggestions(parsed_suggestions, [], sketch_index)
+        return complete_suggestions(parsed_suggestions, ai_raw_response, story_context, genre, story_format)
+
+
+async def generate_gemini_endings(story_context: str, language: str, genre: str, story_format: str, aesthetic_style: str = "", era_style: str = "", candidate_count: int = 1, usage: dict | None = None, sketch_index=None, model: str = "", deadline=None) -> list[str]:
+    """
+    Generates distinct story endings by prompting the Gemini API, respecting
+    the chosen language, genre, story format, aesthetic style, and era/style.
+
+    Args:
+        story_context (str): The current story content to base endings on.
+        language (str): The language the AI should generate the response in.
+        genre (str): The chosen genre of the story.
+        story_format (str): The chosen format of the story (Novel, Screenplay, etc.).
+        aesthetic_style (str): Optional aesthetic style (e.g., "20th-century aesthetic").
+        era_style (str): Optional era/style reference (e.g., "1940s Noir").
+        candidate_count (int): Candidates to request; endings from all of them are returned
+                               in order so callers can keep the surplus for later rolls.
+        usage (dict): Optional usage record (see new_usage_counters) to update.
+        sketch_index (SketchIndex): Optional per-session index of story segments; when given,
+                                    near-duplicate endings are moved behind distinct ones.
+        model (str): Model override (see token_accounting.plan_generation); OFFLINE_MODEL
+                     serves the local model without calling Gemini.
+        deadline (Deadline): Optional latency budget (see deadlines.py) passed down to every phase;
+                             as it runs short the context is cut, then the local model answers.
+
+    Returns:
+        list[str]: A list of distinct AI-generated ending texts (2-3 per candidate).
+    """
+    story_context, _, call_upstream = _fit_to_deadline(story_context, language, None, deadline)
+    with deadline_phase(deadline, "prompt"):
+        prompt = build_endings_prompt(story_context, language, genre, story_format, aesthetic_style, era_style)
+    if model == OFFLINE_MODEL or not call_upstream:
+        raw_responses = [""]
+    else:
+        with deadline_phase(deadline, "gemini"):
+            raw_responses = await call_gemini_api_candidates(prompt, candidate_count, usage, model=model, language=language, deadline=deadline);
+
+    # Parsing AI Response for Endings
+    endings = []
+    with deadline_phase(deadline, "parse"):
+        for ai_raw_response in raw_responses:
+            for ending in parse_endings(ai_raw_response):
+                if ending not in endings:
+                    endings.append(ending)
+
+    if not endings:
+        print(f"Warning: No endings parsed from AI response. Raw response:\n{raw_responses[0]}");
+        endings = local_fallback_endings(story_context, genre, story_format)
+        if endings:
+            return endings
+        return ["A mysterious silence fell, leaving the story unfinished.", "The end, for now."]; # Fallback endings
+
+    if sketch_index is not None:
+        endings = diversify_endings(endings, sketch_index)
+    return endings;
+
+
+async def generate_gemini_round(story_context: str, language: str, genre: str, story_format: str, tone_command: str = "", aesthetic_style: str = "", era_style: str = "", candidate_count: int = BATCH_CANDIDATE_COUNT, usage: dict | None = None, context_cache=None, sketch_index=None, model: str = "", deadline=None) -> dict:
+    """
+    Batched generation: one multi-candidate call returns the round's suggestions,
+    the visual concept and a pool of ending candidates. The story context is sent
+    once instead of once per feature.
+
+    Args:
+        story_context (str): The current story content to base suggestions on.
+        language (str): The language the AI should generate the response in.
+        genre (str): The chosen genre of the story.
+        story_format (str): The chosen format of the story (Novel, Screenplay, etc.).
+        tone_command (str): An optional command to influence the tone of the next generation.
+        aesthetic_style (str): Optional aesthetic style (e.g., "20th-century aesthetic").
+        era_style (str): Optional era/style reference (e.g., "1940s Noir").
+        candidate_count (int): Candidates to request in the single call.
+        usage (dict): Optional usage record (see new_usage_counters) to update.
+        context_cache (StoryContextCache): Optional per-session upstream cache for the prompt prefix.
+        sketch_index (SketchIndex): Optional per-session index of story segments used to
+                                    replace near-duplicate continuations/endings from other candidates.
+        model (str): Model override (see token_accounting.plan_generation); OFFLINE_MODEL
+                     serves the local model without calling Gemini.
+        deadline (Deadline): Optional latency budget (see deadlines.py) passed down to every phase;
+                             as it runs short the context is cut, then the local model answers.
+
+    Returns:
+        dict: {
+            "suggestions": list[tuple[str, str]] - 5 padded tuples, as generate_gemini_suggestions,
+            "alternates": list[list[tuple[str, str]]] - unpadded suggestions of the other candidates,
+            "endings": list[str] - de-duplicated endings from every candidate (may be empty),
+        }
+    """
+    story_context, context_cache, call_upstream = _fit_to_deadline(story_context, language, context_cache, deadline)
+    if model == OFFLINE_MODEL or not call_upstream:
+        return {
+            "suggestions": complete_suggestions([], "", story_context, genre, story_format),
+            "alternates": [],
+            "endings": local_fallback_endings(story_context, genre, story_format),
+        }
+    with deadline_phase(deadline, "prompt"):
+        instructions = build_suggestions_instructions(language, genre, story_format, tone_command, aesthetic_style, era_style, include_endings=True)
+    raw_responses = await _call_with_story_prefix(instructions, story_context, candidate_count, usage, context_cache, model, language, deadline)
+    with deadline_phase(deadline, "parse"):
+        return _assemble_round(raw_responses, story_context, genre, story_format, sketch_index)
+
+
+def _assemble_round(raw_responses: list[str], story_context: str, genre: str, story_format: str, sketch_index=None) -> dict:
+    """Parses the candidates of a batched round into generate_gemini_round's result."""
+    # Prefer the first candidate that parsed completely for display.
+    parsed = [parse_suggestions(raw, pad=False) for raw in raw_responses]
+    best_index = next((i for i, p in enumerate(parsed) if len(p) >= 5), 0)
+
+    endings = []
+    for raw in raw_responses:
+        for ending in parse_endings(raw, combined=True):
+            if ending not in endings:
+                endings.append(ending)
+
+    alternates = [p for i, p in enumerate(parsed) if i != best_index]
+    primary = parsed[best_index]
+    if sketch_index is not None:
+        primary = diversify_suggestions(primary, alternates, sketch_index)
+        endings = diversify_endings(endings, sketch_index)
+
+    return {
+        "suggestions": complete_suggestions(primary, raw_responses[best_index], story_context, genre, story_format),
+        "alternates": alternates,
+        "endings": endings,
+    }
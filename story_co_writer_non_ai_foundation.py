@@ -1,5 +1,52 @@
+### STORY CO-WRITER (TERMINAL) ###
+# The terminal co-writer. Suggestions come from a pluggable backend: static
+# placeholders (the original non-AI demo), the offline local model, or Gemini with
+# streaming. Input is read without blocking the event loop, so while the writer
+# types, the next round's suggestions are already being generated for the
+# choices they are most likely to pick. Each round reports how long the writer
+# waited for suggestions.
+#
+# Usage: python story_co_writer_non_ai_foundation.py [--backend static|local|gemini] [--rounds 3]
+
 import re
+import abc
+import sys
 import json # Import json for saving/loading structured data
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Asynchronous Terminal Input ---
+
+class AsyncStdin:
+    """
+    Reads lines from stdin without blocking the event loop. A single reader
+    thread keeps lines in order and works for terminals, pipes and files alike;
+    background tasks (suggestion prefetches) keep running while it waits.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stdin")
+
+    async def readline(self, prompt: str = "") -> str:
+        """
+        Shows a prompt and waits for one line of input.
+
+        Raises:
+            EOFError: When stdin is closed.
+        """
+        if prompt:
+            sys.stdout.write(prompt)
+            sys.stdout.flush()
+        line = await asyncio.get_running_loop().run_in_executor(self._executor, sys.stdin.readline)
+        if not line:
+            raise EOFError
+        return line.rstrip("\r\n")
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
 
 # --- Core Project Functions (Non-AI Version) ---
 
@@ -10,16 +57,17 @@ def start_new_story():
     print("\n--- Welcome to the Story Co-Writer (Non-AI Mode)! ---")
     print("Let's craft a tale together. You'll start, and I'll give you options.\n")
 
-def get_initial_prompt(story_log: list[dict]) -> None:
+async def get_initial_prompt(story_log: list[dict], stdin: AsyncStdin) -> None:
     """
     Asks the user for the initial sentence or prompt for their story
     and appends it as the first segment to the story_log.
 
     Args:
         story_log (list[dict]): The list of story segments (each a dictionary).
+        stdin (AsyncStdin): Where the answer is read from.
     """
     while True:
-        prompt_text = input("Start your story with an opening sentence: ").strip()
+        prompt_text = (await stdin.readline("Start your story with an opening sentence: ")).strip()
         if prompt_text:
             # Store the initial prompt as a dictionary with 'text' and 'contributor'
             story_log.append({
@@ -94,47 +142,64 @@ def display_suggestions(suggestions: list[dict]):
         print(f"{i+1}. [{suggestion_dict['type'].replace('_', ' ').title()}]: {suggestion_dict['text']}")
     print("---------------------------------------------")
 
-def get_user_choice(num_suggestions: int, suggestions_list: list[dict]) -> dict:
+async def get_user_choice(num_suggestions: int, suggestions_list: list[dict], stdin: AsyncStdin) -> dict:
     """
     Prompts the user to make a choice: select a numbered suggestion
     or type their own continuation. Returns the chosen segment as a dictionary.
 
     Args:
-        num_suggestions (int): The number of static suggestions provided.
+        num_suggestions (int): The number of suggestions provided.
         suggestions_list (list[dict]): The actual list of suggestion dictionaries.
+        stdin (AsyncStdin): Where the answer is read from.
 
     Returns:
         dict: A dictionary representing the chosen segment (either from suggestions or user input).
     """
     while True:
-        user_input = input(f"Enter a number (1-{num_suggestions}) or type your own continuation: ").strip()
+        user_input = (await stdin.readline(f"Enter a number (1-{num_suggestions}) or type your own continuation: ")).strip()
         if not user_input:
             print("Please make a choice or type your continuation.")
             continue
+        return parse_user_choice(user_input, suggestions_list)
 
-        try:
-            choice_index = int(user_input) - 1 # Convert to 0-based index
-            if 0 <= choice_index < num_suggestions:
-                # User chose a valid numbered suggestion, return its dictionary
-                return {
-                    "text": suggestions_list[choice_index]["text"],
-                    "contributor": "AI", # This segment came from an AI suggestion
-                    "type": suggestions_list[choice_index]["type"] # Include the type of suggestion
-                }
-            else:
-                # Number is out of valid range, treat as free-form text
-                return {
-                    "text": user_input,
-                    "contributor": "User", # This segment was user-typed
-                    "type": "free_form"
-                }
-        except ValueError:
-            # Not a number, treat as free-form text
+
+def parse_user_choice(user_input: str, suggestions_list: list[dict]) -> dict:
+    """
+    Turns the user's answer into a segment: a valid number picks that suggestion,
+    anything else is the user's own continuation.
+
+    Args:
+        user_input (str): The non-empty answer.
+        suggestions_list (list[dict]): The suggestions that were offered.
+
+    Returns:
+        dict: The chosen segment ("text", "contributor", "type").
+    """
+    num_suggestions = len(suggestions_list)
+    try:
+        choice_index = int(user_input) - 1 # Convert to 0-based index
+        if 0 <= choice_index < num_suggestions:
+            # User chose a valid numbered suggestion, return its dictionary
+            return {
+                "text": suggestions_list[choice_index]["text"],
+                "contributor": "AI", # This segment came from an AI suggestion
+                "type": suggestions_list[choice_index]["type"] # Include the type of suggestion
+            }
+        else:
+            # Number is out of valid range, treat as free-form text
             return {
                 "text": user_input,
-                "contributor": "User",
+                "contributor": "User", # This segment was user-typed
                 "type": "free_form"
             }
+    except ValueError:
+        # Not a number, treat as free-form text
+        return {
+            "text": user_input,
+            "contributor": "User",
+            "type": "free_form"
+        }
+
 
 def update_story(story_log: list[dict], chosen_segment_dict: dict, round_num: int) -> None:
     """
@@ -189,12 +254,171 @@ def load_story_from_file(filename: str = "my_story_log.json") -> list[dict]:
         print(f"\n❌ Error loading story from file: {e}. Starting a new story.")
         return []
 
-# --- Main Logic for Non-AI Version ---
+# --- Suggestion Backends ---
 
-async def run_non_ai_story_co_writer(): # Made async to match potential AI version
+def suggestions_from_tuples(suggestion_tuples: list[tuple[str, str]]) -> list[dict]:
     """
-    Orchestrates the flow of the non-AI story co-writer, simulating the
-    collaborative loop with static suggestions using list of dictionaries.
+    Converts the engine's (suggestion_text, commentary) tuples into the terminal's
+    suggestion dictionaries. Visual concepts are dropped (there is nothing to show them on).
+    """
+    suggestions = []
+    for text, _commentary in suggestion_tuples:
+        if text.startswith("Visual Concept:"):
+            continue
+        if text.startswith("Bonus Idea:"):
+            suggestions.append({"type": "bonus_idea", "text": text[len("Bonus Idea:"):].strip()})
+        else:
+            suggestions.append({"type": "continuation", "text": text})
+    return suggestions
+
+
+class SuggestionBackend(abc.ABC):
+    """Where a round's suggestions come from. Subclasses implement suggest()."""
+
+    name = "base"
+    prefetch_width = 0 # How many offered choices to generate the next round for in advance
+
+    @abc.abstractmethod
+    async def suggest(self, story_log: list[dict], round_num: int, on_text=None) -> list[dict]:
+        """
+        Generates the suggestions for a round.
+
+        Args:
+            story_log (list[dict]): The story so far.
+            round_num (int): The round the suggestions are for.
+            on_text (callable): Optional; receives streamed text chunks while the user waits.
+
+        Returns:
+            list[dict]: Suggestion dictionaries with "type" and "text".
+        """
+
+
+class StaticBackend(SuggestionBackend):
+    """The original hardcoded suggestions (no model, no network)."""
+
+    name = "static"
+    prefetch_width = 4
+
+    async def suggest(self, story_log: list[dict], round_num: int, on_text=None) -> list[dict]:
+        return generate_static_suggestions(round_num)
+
+
+class LocalModelBackend(SuggestionBackend):
+    """Suggestions from the offline local model (see local_suggestion_engine.py)."""
+
+    name = "local"
+    prefetch_width = 4 # Cheap: speculate on every continuation
+
+    def __init__(self, genre: str = "", story_format: str = "", model_path: str = ""):
+        from local_suggestion_engine import get_local_model
+        from story_co_writer_ai import LOCAL_MODEL_PATH
+        self.genre = genre
+        self.story_format = story_format
+        self.model = get_local_model(model_path or LOCAL_MODEL_PATH)
+        if self.model is None:
+            raise ValueError(f"No local model at '{model_path or LOCAL_MODEL_PATH}'. Train one with local_suggestion_engine.py.")
+
+    async def suggest(self, story_log: list[dict], round_num: int, on_text=None) -> list[dict]:
+        # Sampling is CPU-bound; keep the event loop (and typing) responsive
+        suggestion_tuples = await asyncio.to_thread(
+            self.model.generate_suggestions, get_full_story_text(story_log), self.genre, self.story_format
+        )
+        return suggestions_from_tuples(suggestion_tuples)
+
+
+class GeminiBackend(SuggestionBackend):
+    """Suggestions from Gemini, streamed so the writer sees progress on a cold round."""
+
+    name = "gemini"
+    prefetch_width = 1 # Each speculation is a paid call: only the first continuation by default
+
+    def __init__(self, language: str = "English", genre: str = "", story_format: str = "", model: str = ""):
+        import story_co_writer_ai
+        self.engine = story_co_writer_ai
+        self.language = language
+        self.genre = genre
+        self.story_format = story_format
+        self.model = model
+        self.usage = story_co_writer_ai.new_usage_counters()
+
+    async def suggest(self, story_log: list[dict], round_num: int, on_text=None) -> list[dict]:
+        prompt = self.engine.build_suggestions_prompt(get_full_story_text(story_log), self.language, self.genre, self.story_format)
+        chunks = []
+        async for chunk in self.engine.stream_gemini_api(prompt, self.usage, self.model):
+            chunks.append(chunk)
+            if on_text is not None:
+                on_text(chunk)
+        return suggestions_from_tuples(self.engine.parse_suggestions("".join(chunks)))
+
+
+def make_backend(name: str, language: str = "English", genre: str = "", story_format: str = "", model: str = "") -> SuggestionBackend:
+    """Builds a backend by name ("static", "local" or "gemini")."""
+    if name == "local":
+        return LocalModelBackend(genre, story_format)
+    if name == "gemini":
+        return GeminiBackend(language, genre, story_format, model)
+    return StaticBackend()
+
+
+class SuggestionPrefetcher:
+    """
+    Speculatively generates the next round while the user is choosing: one task
+    per likely choice (the first prefetch_width suggestions). Picking a prefetched
+    choice serves its round at once; anything else cancels the speculation.
+    """
+
+    def __init__(self, backend: SuggestionBackend, width: int | None = None):
+        self.backend = backend
+        self.width = backend.prefetch_width if width is None else width
+        self.tasks: dict[str, asyncio.Task] = {} # choice text -> next round's suggestions
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, story_log: list[dict], suggestions: list[dict], round_num: int):
+        """Starts generating round round_num + 1 for each likely choice of round round_num."""
+        self.cancel()
+        for suggestion in suggestions[:self.width]:
+            speculative_log = story_log + [{"text": suggestion["text"], "contributor": "AI", "type": suggestion["type"], "round": round_num}]
+            self.tasks[suggestion["text"]] = asyncio.create_task(self.backend.suggest(speculative_log, round_num + 1))
+
+    def take(self, chosen_text: str) -> asyncio.Task | None:
+        """Returns the task matching the user's choice (if any) and cancels the others."""
+        if not self.tasks:
+            return None # Nothing was speculated on (last round, or prefetching off)
+        task = self.tasks.pop(chosen_text, None)
+        if task is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self.cancel()
+        return task
+
+    def cancel(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+
+
+def _show_stream_progress(chunk: str):
+    sys.stdout.write(".")
+    sys.stdout.flush()
+
+
+# --- Main Logic ---
+
+async def run_story_session(backend: SuggestionBackend, stdin: AsyncStdin, num_rounds: int = 3, prefetch_width: int | None = None) -> tuple[list[dict], dict]:
+    """
+    Runs one story: opening, num_rounds rounds of suggestions and choices.
+
+    Args:
+        backend (SuggestionBackend): Where suggestions come from.
+        stdin (AsyncStdin): Where the user's answers are read from.
+        num_rounds (int): How many rounds to play.
+        prefetch_width (int): Overrides the backend's prefetch width (0 disables prefetching).
+
+    Returns:
+        tuple[list[dict], dict]: The story log and round stats ({"first_round", "latencies": [seconds per round],
+                                 "prefetch_hits", "prefetch_misses"}).
     """
     start_new_story()
 
@@ -202,47 +426,131 @@ async def run_non_ai_story_co_writer(): # Made async to match potential AI versi
     story_log: list[dict] = []
 
     # Option to load a previous story
-    if input("Load a previous story? (y/n): ").lower().strip() == 'y':
+    if (await stdin.readline("Load a previous story? (y/n): ")).lower().strip() == 'y':
         story_log = load_story_from_file()
 
     if not story_log: # If no story loaded or user chose not to load
-        get_initial_prompt(story_log)
+        await get_initial_prompt(story_log, stdin)
 
+    prefetcher = SuggestionPrefetcher(backend, prefetch_width)
+    first_round = max((segment.get("round", 0) for segment in story_log), default=0) + 1 # Loaded stories continue
+    latencies = []
+    next_round_task = None
+    try:
+        for round_num in range(first_round, first_round + num_rounds):
+            print(f"\n--- Round {round_num} ---")
+            started = time.perf_counter()
+            suggestions, source = None, "prefetched"
+            if next_round_task is not None:
+                try:
+                    suggestions = await next_round_task
+                except Exception as error:
+                    print(f"Warning: prefetched suggestions failed, generating again: {error}")
+            if suggestions is None:
+                source = "generated"
+                suggestions = await backend.suggest(story_log, round_num, on_text=_show_stream_progress)
+            latency = time.perf_counter() - started
+            latencies.append(latency)
+
+            display_suggestions(suggestions)
+            print(f"(suggestions {source} by the {backend.name} backend in {latency * 1000:.0f} ms)")
+            if round_num < first_round + num_rounds - 1:
+                prefetcher.start(story_log, suggestions, round_num) # Runs while the user types
+
+            user_choice_segment_dict = await get_user_choice(len(suggestions), suggestions, stdin)
+            update_story(story_log, user_choice_segment_dict, round_num) # Pass round_num here
+            next_round_task = prefetcher.take(user_choice_segment_dict["text"])
+
+            print(f"\n--- Current Story After Round {round_num} ---\n{get_full_story_text(story_log)}\n----------------------------------\n")
+    finally:
+        prefetcher.cancel()
+        if next_round_task is not None:
+            next_round_task.cancel()
+
+    stats = {"first_round": first_round, "latencies": latencies, "prefetch_hits": prefetcher.hits, "prefetch_misses": prefetcher.misses}
+    return story_log, stats
+
+
+def print_latency_report(stats: dict):
+    """Prints how long the user waited for suggestions in each round."""
+    latencies = stats["latencies"]
+    if not latencies:
+        return
+    ordered = sorted(latencies)
+    print("\n--- Suggestion Latency ---")
+    for round_num, latency in enumerate(latencies, start=stats.get("first_round", 1)): # A loaded story starts later
+        print(f"Round {round_num}: {latency * 1000:.0f} ms")
+    print(f"Mean {sum(latencies) / len(latencies) * 1000:.0f} ms · median {ordered[len(ordered) // 2] * 1000:.0f} ms · "
+          f"worst {ordered[-1] * 1000:.0f} ms · prefetch hits {stats['prefetch_hits']}/{stats['prefetch_hits'] + stats['prefetch_misses']}")
+
+
+async def ask_yes_no(stdin: AsyncStdin, prompt: str) -> bool:
+    """Asks until the user answers 'y' or 'n'."""
+    while True:
+        answer = (await stdin.readline(prompt)).lower().strip()
+        if answer in ("y", "n"):
+            return answer == "y"
+        print("Invalid input. Please enter 'y' or 'n'.")
 
-    num_rounds = 3 # Run for a few rounds to demonstrate the interaction
-    for i in range(1, num_rounds + 1): # Start rounds from 1
-        print(f"\n--- Round {i} ---")
-        
-        # We don't need story_context in the non-AI version as suggestions are static
-        suggestions = generate_static_suggestions(i) # Pass round number to vary suggestions
-        display_suggestions(suggestions)
 
-        user_choice_segment_dict = get_user_choice(len(suggestions), suggestions)
-        update_story(story_log, user_choice_segment_dict, i) # Pass round_num here
+async def run_non_ai_story_co_writer(backend: SuggestionBackend | None = None, num_rounds: int = 3, prefetch_width: int | None = None):
+    """
+    Orchestrates the terminal co-writer: story sessions one after another
+    (iteratively, so restarting never grows the stack) until the user stops.
 
-        print(f"\n--- Current Story After Round {i} ---\n{get_full_story_text(story_log)}\n----------------------------------\n")
+    Args:
+        backend (SuggestionBackend): Suggestion source (static suggestions by default).
+        num_rounds (int): Rounds per story.
+        prefetch_width (int): Overrides the backend's prefetch width.
+    """
+    backend = backend or StaticBackend()
+    stdin = AsyncStdin()
+    try:
+        while True:
+            story_log, stats = await run_story_session(backend, stdin, num_rounds, prefetch_width)
 
-    print("\n--- Story Session Concluded (Non-AI Demo) ---")
-    print("Here's your complete story:\n")
-    print(get_full_story_text(story_log)) # Display the full compiled story
+            print("\n--- Story Session Concluded ---")
+            print("Here's your complete story:\n")
+            print(get_full_story_text(story_log)) # Display the full compiled story
+            print_latency_report(stats)
 
-    save_story_to_file(story_log) # Save the full structured log
-    
-    print("\nThanks for co-writing!")
+            save_story_to_file(story_log) # Save the full structured log
 
-    # Add Replay or Restart Option
-    while True:
-        restart = input("\nWould you like to start a new story? (y/n): ").lower().strip()
-        if restart == "y":
+            print("\nThanks for co-writing!")
+
+            # Replay or Restart Option
+            if not await ask_yes_no(stdin, "\nWould you like to start a new story? (y/n): "):
+                print("Goodbye, storyteller!")
+                break
             print("\n")
-            await run_non_ai_story_co_writer() # Restart the entire process
-            break # Exit the loop after restarting
-        elif restart == "n":
-            print("Goodbye, storyteller!")
-            break
-        else:
-            print("Invalid input. Please enter 'y' or 'n'.")
+    except (EOFError, KeyboardInterrupt):
+        print("\nGoodbye, storyteller!")
+    finally:
+        stdin.close()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Co-write a story in the terminal.")
+    parser.add_argument("--backend", choices=["static", "local", "gemini"], default="static")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--language", default="English")
+    parser.add_argument("--genre", default="")
+    parser.add_argument("--format", dest="story_format", default="")
+    parser.add_argument("--model", default="", help="Gemini model (gemini backend only).")
+    parser.add_argument("--prefetch", type=int, default=None, help="Choices to prefetch the next round for (0 = off).")
+    args = parser.parse_args(argv)
+
+    try:
+        backend = make_backend(args.backend, args.language, args.genre, args.story_format, args.model)
+    except ValueError as error:
+        print(f"❌ {error}")
+        return 1
+    try:
+        asyncio.run(run_non_ai_story_co_writer(backend, args.rounds, args.prefetch))
+    except KeyboardInterrupt: # asyncio.run cancels the session and raises it here
+        print("\nGoodbye, storyteller!")
+    return 0
+
 
-# To run this non-AI version, use asyncio.run():
 if __name__ == "__main__":
-    asyncio.run(run_non_ai_story_co_writer())
+    sys.exit(main())
@@ -0,0 +1,851 @@
+### STORY EXPORT ###
+# Renders a story log as a manuscript that matches its format (STORY_FORMATS):
+#   - screenplay, teleplay and stage-play layouts (plain text, 10 characters per inch),
+#   - EPUB 3 for novels and short stories,
+#   - PDF in any layout, opening with the generated cover image.
+# Renderers consume the story one segment at a time and write their output as
+# they go. Rendering long stories is CPU-heavy, so ExportPipeline runs it in a
+# process pool and caches finished artifacts by story hash; the GUI only holds a
+# Future. No third-party packages are needed (EPUB is a zip, PDF is hand-written).
+#
+# Usage:
+#   python story_export.py export my_story_log.json --format pdf --cover cover.png
+#   python story_export.py bulk stories/ --formats pdf epub --out exports/
+
+import os
+import re
+import sys
+import html
+import json
+import time
+import zlib
+import struct
+import hashlib
+import zipfile
+import argparse
+import textwrap
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+
+from story_archive import ARCHIVE_EXTENSION
+from story_records import build_story_record, read_story_record, split_story_record
+
+EXPORT_DIR = os.getenv("STORY_EXPORT_DIR", ".story_exports")
+EXPORT_VERSION = 1 # Bump when a layout changes so cached artifacts are re-rendered
+
+EXPORT_EXTENSIONS = {
+    "screenplay": ".screenplay.txt",
+    "teleplay": ".teleplay.txt",
+    "stageplay": ".play.txt",
+    "epub": ".epub",
+    "pdf": ".pdf",
+}
+EXPORT_MIME_TYPES = {
+    "screenplay": "text/plain",
+    "teleplay": "text/plain",
+    "stageplay": "text/plain",
+    "epub": "application/epub+zip",
+    "pdf": "application/pdf",
+}
+
+# Page layout used by each story format (PDF pages and EPUB chapters follow it too)
+FORMAT_LAYOUTS = {
+    "Novel": "prose",
+    "Short Story": "prose",
+    "Screenplay": "screenplay",
+    "Television Script": "teleplay",
+    "Play": "stageplay",
+}
+# What the GUI offers first for each story format
+DEFAULT_EXPORTS = {
+    "Novel": ["epub", "pdf"],
+    "Short Story": ["epub", "pdf"],
+    "Screenplay": ["screenplay", "pdf"],
+    "Television Script": ["teleplay", "pdf"],
+    "Play": ["stageplay", "pdf"],
+}
+
+LANGUAGE_CODES = {"English": "en", "Spanish": "es", "French": "fr", "German": "de", "Hindi": "hi", "Chinese": "zh"}
+
+PAGE_LINES = 55           # Courier 12pt, 6 lines per inch, 1" top and bottom margins
+LINE_WIDTH = 60           # Characters between the 1.5" left and 1" right margins
+CHAPTER_SEGMENTS = 10     # Story segments per prose chapter
+TELEPLAY_ACT_SEGMENTS = 8 # Story segments per teleplay act
+SCRIPT_PART_ELEMENTS = 150 # Script lines per EPUB part (split at the next scene heading)
+
+_ACT_WORDS = ["ONE", "TWO", "THREE", "FOUR", "FIVE", "SIX", "SEVEN", "EIGHT", "NINE", "TEN"]
+
+
+# --- Script Elements ---
+# Segments are free text: the AI writes screenplay-like text for script formats
+# and prose otherwise, and users type whatever they like. Each line is
+# classified into a script element so the layouts can place it.
+
+_SCENE_RE = re.compile(r"^(INT\.?/EXT|EXT\.?/INT|I/E|INT|EXT)[\.\s]", re.IGNORECASE)
+_TRANSITION_RE = re.compile(r"^([A-Z ]+TO:|FADE (IN|OUT)[:.]?|FADE TO BLACK\.?|THE END\.?)$")
+_CUE_RE = re.compile(r"^[A-Z][A-Z0-9 .'\-]{0,34}(\s*\([A-Z.' ]+\))?$")
+_SPEAKER_RE = re.compile(r"^([A-Za-z][A-Za-z0-9 .'\-]{0,30}?)\s*(\([^)]*\))?:\s+(.+)$")
+_MARKDOWN_RE = re.compile(r"(\*\*|__|^#+\s*|^\s*[-*]\s+)")
+
+
+def story_title(metadata: dict) -> str:
+    """A title for the manuscript, from the story's setup."""
+    if metadata.get("title"):
+        return metadata["title"]
+    name = metadata.get("main_character_name", "")
+    role = metadata.get("main_character_role", "")
+    if name:
+        return f"{name} the {role}" if role else name
+    return "Untitled Story"
+
+
+def segment_elements(text: str, speakers: set[str] = frozenset()):
+    """
+    Classifies the lines of one segment into script elements.
+
+    Args:
+        text (str): The segment text.
+        speakers (set[str]): Lower-case names that count as speakers even when not in capitals.
+
+    Yields:
+        tuple[str, str]: (kind, text) with kind one of scene, transition, character,
+                         parenthetical, dialogue, action.
+    """
+    in_dialogue = False
+    for raw_line in text.splitlines():
+        line = _MARKDOWN_RE.sub("", raw_line).strip()
+        if not line:
+            in_dialogue = False
+            continue
+        if _SCENE_RE.match(line):
+            in_dialogue = False
+            yield "scene", line.upper()
+        elif _TRANSITION_RE.match(line):
+            in_dialogue = False
+            yield "transition", line
+        elif in_dialogue:
+            yield ("parenthetical" if line.startswith("(") and line.endswith(")") else "dialogue"), line
+        elif _CUE_RE.match(line) and any(c.isalpha() for c in line) and not line.endswith((".", "!", "?")):
+            in_dialogue = True
+            yield "character", line
+        else:
+            match = _SPEAKER_RE.match(line)
+            if match and (match.group(1).isupper() or match.group(1).lower() in speakers):
+                yield "character", match.group(1).upper()
+                if match.group(2):
+                    yield "parenthetical", match.group(2)
+                yield "dialogue", match.group(3)
+            else:
+                yield "action", line
+
+
+def story_elements(story_log, layout: str, speakers: set[str] = frozenset()):
+    """
+    Turns a story log into layout elements, adding the layout's fixed furniture
+    (FADE IN/OUT, act breaks, chapter headings).
+
+    Yields:
+        tuple[str, str]: (kind, text); besides segment_elements kinds: act, act_end,
+                         chapter, paragraph, page_break.
+    """
+    if layout == "prose":
+        chapter = 0
+        for index, segment in enumerate(story_log):
+            if index % CHAPTER_SEGMENTS == 0:
+                chapter += 1
+                if chapter > 1:
+                    yield "page_break", ""
+                yield "chapter", f"Chapter {chapter}"
+            for paragraph in segment.get("text", "").splitlines():
+                paragraph = _MARKDOWN_RE.sub("", paragraph).strip()
+                if paragraph:
+                    yield "paragraph", paragraph
+        return
+
+    acts = 0
+    for index, segment in enumerate(story_log):
+        if layout == "teleplay" and index % TELEPLAY_ACT_SEGMENTS == 0:
+            if acts:
+                yield "act_end", f"END OF ACT {_ACT_WORDS[min(acts, len(_ACT_WORDS)) - 1]}"
+                yield "page_break", ""
+            acts += 1
+            yield "act", f"ACT {_ACT_WORDS[min(acts, len(_ACT_WORDS)) - 1]}"
+        if index == 0 and layout in ("screenplay", "teleplay"):
+            yield "transition_left", "FADE IN:"
+        yield from segment_elements(segment.get("text", ""), speakers)
+    if acts:
+        yield "act_end", f"END OF ACT {_ACT_WORDS[min(acts, len(_ACT_WORDS)) - 1]}"
+    if layout in ("screenplay", "teleplay"):
+        yield "transition", "FADE OUT."
+    elif layout == "stageplay":
+        yield "act_end", "END OF PLAY"
+
+
+# --- Line Layout ---
+# (indent, width, blank lines before, keep with next) per element kind, in
+# characters from the left margin. Standard screenplay and stage-play measures.
+
+_SCRIPT_STYLE = {
+    "scene": (0, 60, 1, True),
+    "action": (0, 60, 1, False),
+    "character": (22, 38, 1, True),
+    "parenthetical": (16, 25, 0, True),
+    "dialogue": (10, 35, 0, False),
+    "transition": ("right", 60, 1, False),
+    "transition_left": (0, 60, 0, False),
+    "act": ("center", 60, 2, True),
+    "act_end": ("center", 60, 2, False),
+}
+_STAGE_STYLE = {
+    **_SCRIPT_STYLE,
+    "scene": ("center", 60, 1, True),
+    "action": (25, 35, 1, False),
+    "character": ("center", 60, 1, True),
+    "parenthetical": (10, 45, 0, True),
+    "dialogue": (0, 60, 0, False),
+}
+_PROSE_STYLE = {
+    "chapter": ("center", 60, 2, True),
+    "paragraph": (0, 60, 1, False),
+}
+_LAYOUT_STYLES = {"screenplay": _SCRIPT_STYLE, "teleplay": _SCRIPT_STYLE, "stageplay": _STAGE_STYLE, "prose": _PROSE_STYLE}
+
+
+def layout_blocks(elements, layout: str):
+    """
+    Wraps elements into blocks of (indent, text) lines.
+
+    Yields:
+        tuple[list[tuple[int, str]], int, bool]: (lines, blank lines before, keep with next),
+        or None for a forced page break.
+    """
+    styles = _LAYOUT_STYLES[layout]
+    for kind, text in elements:
+        if kind == "page_break":
+            yield None
+            continue
+        if layout == "stageplay" and kind == "action" and not text.startswith("("):
+            text = f"({text})"
+        if kind in ("act", "chapter", "act_end") and layout != "prose":
+            text = text.upper()
+        indent, width, before, keep = styles.get(kind, styles.get("action", styles.get("paragraph")))
+        wrapped = textwrap.wrap(text, width, initial_indent="    " if kind == "paragraph" else "") or [""]
+        lines = []
+        for line in wrapped:
+            if indent == "right":
+                lines.append((max(0, LINE_WIDTH - len(line)), line))
+            elif indent == "center":
+                lines.append((max(0, (LINE_WIDTH - len(line)) // 2), line))
+            else:
+                lines.append((indent, line))
+        yield lines, before, keep
+
+
+def paginate(blocks):
+    """
+    Fills pages of PAGE_LINES lines, moving a block to the next page when it
+    does not fit and keeping headings and character cues with what follows.
+
+    Yields:
+        list[tuple[int, str]]: The lines of each page ((0, "") is a blank line).
+    """
+    page: list[tuple[int, str]] = []
+    pending_keep: list[tuple[int, str]] = []
+
+    def room() -> int:
+        return PAGE_LINES - len(page)
+
+    for block in blocks:
+        if block is None:
+            page.extend(pending_keep)
+            pending_keep = []
+            if page:
+                yield page
+            page = []
+            continue
+        lines, before, keep = block
+        spacing = [(0, "")] * (before if page or pending_keep else 0)
+        chunk = pending_keep + spacing + lines
+        if keep:
+            # Hold until the next block so they land on the same page
+            pending_keep = chunk
+            continue
+        pending_keep = []
+        if len(chunk) > room() and page:
+            if len(chunk) <= PAGE_LINES or room() < 4:
+                yield page
+                page = []
+                while chunk and chunk[0] == (0, ""):
+                    chunk = chunk[1:]
+        while len(chunk) > room():
+            split = room()
+            page.extend(chunk[:split])
+            yield page
+            page, chunk = [], chunk[split:]
+        page.extend(chunk)
+    page.extend(pending_keep)
+    if page:
+        yield page
+
+
+def _speakers(metadata: dict) -> set[str]:
+    name = metadata.get("main_character_name", "").strip().lower()
+    return {name, name.split(" ")[0]} if name else set()
+
+
+def _pages(story_log, metadata: dict, layout: str):
+    return paginate(layout_blocks(story_elements(story_log, layout, _speakers(metadata)), layout))
+
+
+# --- Plain-Text Script Renderer ---
+
+def write_script_text(f, story_log, metadata: dict, layout: str):
+    """Writes a paginated script (screenplay, teleplay or stage play) as text; pages end with a form feed."""
+    title = story_title(metadata)
+    f.write("\n" * 20 + title.upper().center(LINE_WIDTH).rstrip() + "\n\n")
+    f.write("written with Story-Verse".center(LINE_WIDTH).rstrip() + "\n\f")
+    for number, page in enumerate(_pages(story_log, metadata, layout), start=1):
+        if number > 1:
+            f.write(f"{number}.".rjust(LINE_WIDTH + 10) + "\n\n")
+        for indent, text in page:
+            f.write((" " * indent + text).rstrip() + "\n")
+        f.write("\f")
+
+
+# --- PDF Renderer ---
+# A minimal PDF 1.4 writer: Courier (a standard font, nothing embedded),
+# Flate-compressed page streams, and the cover as an image XObject. Text uses
+# WinAnsi encoding; characters outside it (e.g. Hindi, Chinese) become "?", so
+# those stories are better exported as EPUB.
+
+_PAGE_WIDTH, _PAGE_HEIGHT = 612, 792 # US Letter, points
+_LEFT_MARGIN = 108                   # 1.5"
+_TOP_BASELINE = 708                  # 1" top margin, first baseline
+_LINE_HEIGHT = 12
+_CHAR_WIDTH = 7.2                    # Courier 12pt
+
+
+class _PdfWriter:
+    """Writes objects straight to the file, remembering offsets for the xref table."""
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets: dict[int, int] = {}
+        self.next_id = 1
+        self._start = f.tell()
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def reserve(self) -> int:
+        object_id = self.next_id
+        self.next_id += 1
+        return object_id
+
+    def write(self, object_id: int, dictionary: str, stream: bytes | None = None):
+        self.offsets[object_id] = self.f.tell() - self._start
+        if stream is None:
+            self.f.write(f"{object_id} 0 obj\n{dictionary}\nendobj\n".encode("latin-1"))
+            return
+        self.f.write(f"{object_id} 0 obj\n<< {dictionary} /Length {len(stream)} >>\nstream\n".encode("latin-1"))
+        self.f.write(stream)
+        self.f.write(b"\nendstream\nendobj\n")
+
+    def finish(self, root_id: int, info_id: int):
+        xref_offset = self.f.tell() - self._start
+        count = self.next_id
+        rows = ["xref", f"0 {count}", "0000000000 65535 f "]
+        rows += [f"{self.offsets.get(i, 0):010d} 00000 n " for i in range(1, count)]
+        rows += ["trailer", f"<< /Size {count} /Root {root_id} 0 R /Info {info_id} 0 R >>", "startxref", str(xref_offset), "%%EOF"]
+        self.f.write(("\n".join(rows) + "\n").encode("latin-1"))
+
+
+def _pdf_text(text: str) -> bytes:
+    data = text.encode("cp1252", errors="replace")
+    return data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def _pdf_string(text: str) -> str:
+    return "(" + _pdf_text(text).decode("latin-1") + ")"
+
+
+def _text_ops(x: float, y: float, text: str, font: str = "F1", size: int = 12) -> bytes:
+    return b"BT /%s %d Tf 1 0 0 1 %.2f %.2f Tm (" % (font.encode(), size, x, y) + _pdf_text(text) + b") Tj ET\n"
+
+
+def _png_unfilter(raw: bytes, width: int, height: int, bpp: int) -> bytearray:
+    """Reverses PNG row filters (needed to strip an alpha channel)."""
+    stride = width * bpp
+    out = bytearray(stride * height)
+    previous = bytearray(stride)
+    position = 0
+    for row in range(height):
+        filter_type = raw[position]
+        line = bytearray(raw[position + 1:position + 1 + stride])
+        position += 1 + stride
+        if filter_type == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 0xFF
+        elif filter_type == 2:
+            for i in range(stride):
+                line[i] = (line[i] + previous[i]) & 0xFF
+        elif filter_type == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + previous[i]) >> 1)) & 0xFF
+        elif filter_type == 4:
+            for i in range(stride):
+                a = line[i - bpp] if i >= bpp else 0
+                b = previous[i]
+                c = previous[i - bpp] if i >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                line[i] = (line[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xFF
+        out[row * stride:(row + 1) * stride] = line
+        previous = line
+    return out
+
+
+def image_xobject(data: bytes) -> tuple[str, bytes, int, int] | None:
+    """
+    Converts JPEG or PNG bytes into a PDF image XObject.
+
+    Returns:
+        tuple[str, bytes, int, int]: (dictionary entries, stream, width, height), or None
+                                     for formats this writer cannot embed.
+    """
+    if data[:3] == b"\xff\xd8\xff": # JPEG: embedded as-is
+        position = 2
+        while position + 9 < len(data):
+            if data[position] != 0xFF:
+                return None
+            marker = data[position + 1]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", data[position + 5:position + 9])
+                colour_space = {1: "/DeviceGray", 3: "/DeviceRGB", 4: "/DeviceCMYK"}.get(data[position + 9], "/DeviceRGB")
+                return f"/Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace {colour_space} /BitsPerComponent 8 /Filter /DCTDecode", data, width, height
+            position += 2 + struct.unpack(">H", data[position + 2:position + 4])[0]
+        return None
+
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        return None
+    position, idat = 8, []
+    width = height = bit_depth = colour_type = interlace = 0
+    while position + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        body = data[position + 8:position + 8 + length]
+        if chunk_type == b"IHDR":
+            width, height, bit_depth, colour_type, _, _, interlace = struct.unpack(">IIBBBBB", body)
+        elif chunk_type == b"IDAT":
+            idat.append(body)
+        elif chunk_type == b"IEND":
+            break
+        position += 12 + length
+    if bit_depth != 8 or interlace or colour_type not in (0, 2, 4, 6):
+        return None
+    colours = 1 if colour_type in (0, 4) else 3
+    colour_space = "/DeviceGray" if colours == 1 else "/DeviceRGB"
+    compressed = b"".join(idat)
+    if colour_type in (0, 2):
+        # PDF understands PNG row filters directly
+        parms = f"/DecodeParms << /Predictor 15 /Colors {colours} /BitsPerComponent 8 /Columns {width} >>"
+        return f"/Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace {colour_space} /BitsPerComponent 8 /Filter /FlateDecode {parms}", compressed, width, height
+    # Alpha: unfilter and drop it (the cover sits on a white page)
+    bpp = colours + 1
+    pixels = _png_unfilter(zlib.decompress(compressed), width, height, bpp)
+    opaque = bytearray(width * height * colours)
+    for channel in range(colours):
+        opaque[channel::colours] = pixels[channel::bpp]
+    return f"/Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace {colour_space} /BitsPerComponent 8 /Filter /FlateDecode", zlib.compress(bytes(opaque), 6), width, height
+
+
+def write_pdf(f, story_log, metadata: dict, layout: str, cover: bytes | None = None):
+    """Writes the story as a paginated PDF in the given layout, with a cover page."""
+    pdf = _PdfWriter(f)
+    catalog_id, pages_id, font_id, bold_id, info_id = (pdf.reserve() for _ in range(5))
+    pdf.write(font_id, "<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>")
+    pdf.write(bold_id, "<< /Type /Font /Subtype /Type1 /BaseFont /Courier-Bold /Encoding /WinAnsiEncoding >>")
+    resources = f"/Font << /F1 {font_id} 0 R /F2 {bold_id} 0 R >>"
+    page_ids = []
+
+    def add_page(content: bytes, extra_resources: str = ""):
+        content_id, page_id = pdf.reserve(), pdf.reserve()
+        pdf.write(content_id, "/Filter /FlateDecode", zlib.compress(content, 6))
+        pdf.write(page_id, f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {_PAGE_WIDTH} {_PAGE_HEIGHT}] "
+                           f"/Resources << {resources} {extra_resources} >> /Contents {content_id} 0 R >>")
+        page_ids.append(page_id)
+
+    # Cover page: image (if any) above the title
+    title = story_title(metadata)
+    content = b""
+    extra = ""
+    title_y = _PAGE_HEIGHT / 2
+    image = image_xobject(cover) if cover else None
+    if image:
+        entries, stream, width, height = image
+        image_id = pdf.reserve()
+        pdf.write(image_id, entries, stream)
+        box_width, box_height = _PAGE_WIDTH - 144, _PAGE_HEIGHT - 288
+        scale = min(box_width / width, box_height / height)
+        draw_width, draw_height = width * scale, height * scale
+        x, y = (_PAGE_WIDTH - draw_width) / 2, _PAGE_HEIGHT - 72 - draw_height
+        content += b"q %.2f 0 0 %.2f %.2f %.2f cm /Im1 Do Q\n" % (draw_width, draw_height, x, y)
+        extra = f"/XObject << /Im1 {image_id} 0 R >>"
+        title_y = y - 60
+    content += _text_ops(max(36, (_PAGE_WIDTH - len(title) * 9.6) / 2), title_y, title, "F2", 16)
+    byline = "written with Story-Verse"
+    content += _text_ops((_PAGE_WIDTH - len(byline) * _CHAR_WIDTH) / 2, title_y - 28, byline)
+    add_page(content, extra)
+
+    for number, page in enumerate(_pages(story_log, metadata, layout), start=1):
+        content = b""
+        if number > 1:
+            label = f"{number}."
+            content += _text_ops(_PAGE_WIDTH - 72 - len(label) * _CHAR_WIDTH, _PAGE_HEIGHT - 36, label)
+        for row, (indent, text) in enumerate(page):
+            if text:
+                content += _text_ops(_LEFT_MARGIN + indent * _CHAR_WIDTH, _TOP_BASELINE - row * _LINE_HEIGHT, text)
+        add_page(content)
+
+    pdf.write(pages_id, f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>")
+    pdf.write(catalog_id, f"<< /Type /Catalog /Pages {pages_id} 0 R >>")
+    pdf.write(info_id, f"<< /Title {_pdf_string(title)} /Producer (Story-Verse) >>")
+    pdf.finish(catalog_id, info_id)
+
+
+# --- EPUB Renderer ---
+
+_EPUB_CSS = """body { font-family: serif; line-height: 1.5; }
+h1 { text-align: center; margin: 2em 0 1em; }
+p.prose { text-indent: 1.5em; margin: 0; }
+.script p { font-family: "Courier New", Courier, monospace; margin: 0; }
+p.scene { font-weight: bold; margin-top: 1em; }
+p.action { margin-top: 1em; }
+p.character { margin: 1em 0 0 40%; }
+p.parenthetical { margin-left: 30%; }
+p.dialogue { margin: 0 20% 0 20%; }
+p.transition { text-align: right; margin-top: 1em; }
+p.act, p.act_end { text-align: center; font-weight: bold; margin: 2em 0; }
+.cover { text-align: center; }
+.cover img { max-width: 100%; max-height: 90vh; }
+"""
+
+
+def _zip_write(book: zipfile.ZipFile, name: str, data: str | bytes, stored: bool = False):
+    # A fixed timestamp keeps the output identical for identical stories
+    info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+    book.writestr(info, data.encode("utf-8") if isinstance(data, str) else data)
+
+
+def _xhtml(title: str, body: str, language: str) -> str:
+    return (f'<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+            f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{language}" xml:lang="{language}">\n'
+            f'<head><title>{html.escape(title)}</title><link rel="stylesheet" type="text/css" href="style.css"/></head>\n'
+            f'<body>\n{body}\n</body>\n</html>\n')
+
+
+def _epub_chapters(story_log, layout: str, speakers: set[str]):
+    """Yields (heading, xhtml body) per chapter (prose) or act/block of segments (scripts)."""
+    if layout == "prose":
+        heading, paragraphs = "", []
+        for kind, text in story_elements(story_log, layout, speakers):
+            if kind == "chapter":
+                if heading:
+                    yield heading, "\n".join(paragraphs)
+                heading, paragraphs = text, [f"<h1>{html.escape(text)}</h1>"]
+            elif kind == "paragraph":
+                paragraphs.append(f'<p class="prose">{html.escape(text)}</p>')
+        if heading:
+            yield heading, "\n".join(paragraphs)
+        return
+    # Scripts: a new part per teleplay act, otherwise at a scene heading once the part is long
+    parts, heading, lines = 0, "", []
+    for kind, text in story_elements(story_log, layout, speakers):
+        if kind == "page_break":
+            continue
+        if not lines or kind == "act" or (kind == "scene" and len(lines) >= SCRIPT_PART_ELEMENTS):
+            if lines:
+                yield heading, "\n".join(lines + ["</div>"])
+            parts += 1
+            heading = text.title() if kind == "act" else f"Part {parts}"
+            lines = [f"<h1>{html.escape(heading)}</h1>", '<div class="script">']
+            if kind == "act":
+                continue
+        lines.append(f'<p class="{kind.replace("transition_left", "transition")}">{html.escape(text)}</p>')
+    if lines:
+        yield heading, "\n".join(lines + ["</div>"])
+
+
+def write_epub(f, story_log, metadata: dict, layout: str, cover: bytes | None = None, identifier: str = ""):
+    """Writes the story as an EPUB 3 book (one chapter per CHAPTER_SEGMENTS segments)."""
+    title = story_title(metadata)
+    language = LANGUAGE_CODES.get(metadata.get("story_language", ""), "en")
+    manifest, spine, toc = [], [], []
+    with zipfile.ZipFile(f, "w") as book:
+        _zip_write(book, "mimetype", "application/epub+zip", stored=True) # Must be first and uncompressed
+        _zip_write(book, "META-INF/container.xml",
+                   '<?xml version="1.0"?>\n<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+                   '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>\n</container>\n')
+        _zip_write(book, "OEBPS/style.css", _EPUB_CSS)
+        manifest.append('<item id="css" href="style.css" media-type="text/css"/>')
+
+        is_jpeg = bool(cover) and cover[:3] == b"\xff\xd8\xff"
+        if is_jpeg or (cover and cover[:8] == b"\x89PNG\r\n\x1a\n"):
+            image_name, media_type = ("cover.jpg", "image/jpeg") if is_jpeg else ("cover.png", "image/png")
+            _zip_write(book, f"OEBPS/{image_name}", cover)
+            _zip_write(book, "OEBPS/cover.xhtml", _xhtml(title, f'<div class="cover"><img src="{image_name}" alt="{html.escape(title)}"/></div>', language))
+            manifest.append(f'<item id="cover-image" href="{image_name}" media-type="{media_type}" properties="cover-image"/>')
+            manifest.append('<item id="cover" href="cover.xhtml" media-type="application/xhtml+xml"/>')
+            spine.append('<itemref idref="cover"/>')
+
+        for number, (heading, body) in enumerate(_epub_chapters(story_log, layout, _speakers(metadata)), start=1):
+            name = f"chapter_{number:03d}.xhtml"
+            _zip_write(book, f"OEBPS/{name}", _xhtml(heading, body, language))
+            manifest.append(f'<item id="ch{number}" href="{name}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="ch{number}"/>')
+            toc.append(f'<li><a href="{name}">{html.escape(heading)}</a></li>')
+
+        _zip_write(book, "OEBPS/nav.xhtml", _xhtml(title, f'<nav epub:type="toc" id="toc"><h1>Contents</h1><ol>\n{chr(10).join(toc)}\n</ol></nav>', language))
+        manifest.append('<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>')
+        _zip_write(book, "OEBPS/content.opf",
+                   '<?xml version="1.0" encoding="utf-8"?>\n'
+                   '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">\n'
+                   '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+                   f'<dc:identifier id="book-id">urn:story-verse:{identifier or "story"}</dc:identifier>\n'
+                   f'<dc:title>{html.escape(title)}</dc:title>\n<dc:language>{language}</dc:language>\n'
+                   f'<dc:creator>Story-Verse</dc:creator>\n'
+                   f'<dc:subject>{html.escape(metadata.get("story_genre", ""))}</dc:subject>\n'
+                   '<meta property="dcterms:modified">2000-01-01T00:00:00Z</meta>\n</metadata>\n'
+                   f'<manifest>\n{chr(10).join(manifest)}\n</manifest>\n<spine>\n{chr(10).join(spine)}\n</spine>\n</package>\n')
+
+
+# --- Rendering Entry Points (run inside pool processes) ---
+
+def story_digest(record: dict, cover: bytes | None = None) -> str:
+    """Hash of a story record (and its cover) used to name cached artifacts."""
+    digest = hashlib.blake2b(json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8"), digest_size=16)
+    if cover:
+        digest.update(hashlib.sha256(cover).digest())
+    return digest.hexdigest()
+
+
+def artifact_path(directory: str, digest: str, export_format: str) -> str:
+    key = hashlib.blake2b(f"{EXPORT_VERSION}|{export_format}|{digest}".encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(directory, key + EXPORT_EXTENSIONS[export_format])
+
+
+def layout_for(metadata: dict, export_format: str) -> str:
+    """The layout an export uses: the script formats name theirs, EPUB/PDF follow the story format."""
+    if export_format in ("screenplay", "teleplay", "stageplay"):
+        return export_format
+    return FORMAT_LAYOUTS.get(metadata.get("story_format", ""), "prose")
+
+
+def render_export(record: dict, export_format: str, output_path: str, cover: bytes | None = None) -> str:
+    """
+    Renders one story record to output_path (written atomically).
+
+    Args:
+        record (dict): A story record (see story_records.build_story_record).
+        export_format (str): One of EXPORT_EXTENSIONS.
+        output_path (str): Where to write the artifact.
+        cover (bytes): Optional PNG/JPEG cover image.
+
+    Returns:
+        str: output_path.
+    """
+    story_log, metadata = split_story_record(record)
+    layout = layout_for(metadata, export_format)
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    if export_format == "epub":
+        with open(temp_path, "wb") as f:
+            write_epub(f, story_log, metadata, layout, cover, identifier=story_digest(record))
+    elif export_format == "pdf":
+        with open(temp_path, "wb") as f:
+            write_pdf(f, story_log, metadata, layout, cover)
+    else:
+        with open(temp_path, "w", encoding="utf-8", newline="\n") as f:
+            write_script_text(f, story_log, metadata, layout)
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+def render_story_file(path: str, export_formats: list[str], directory: str) -> dict:
+    """
+    Reads a story file and renders it in each format, skipping cached artifacts.
+
+    Returns:
+        dict: {"path", "artifacts": {format: artifact path}, "rendered": int, "cached": int}
+              or {"path", "error"} if the file is not a story.
+    """
+    try:
+        story_log, metadata = read_story_record(path)
+    except (OSError, ValueError) as error:
+        return {"path": path, "error": str(error)}
+    record = build_story_record(story_log, metadata)
+    digest = story_digest(record)
+    summary = {"path": path, "artifacts": {}, "rendered": 0, "cached": 0}
+    for export_format in export_formats or DEFAULT_EXPORTS.get(metadata.get("story_format", ""), ["pdf"]):
+        target = artifact_path(directory, digest, export_format)
+        if os.path.exists(target):
+            summary["cached"] += 1
+        else:
+            render_export(record, export_format, target)
+            summary["rendered"] += 1
+        summary["artifacts"][export_format] = target
+    return summary
+
+
+# --- Export Pipeline ---
+
+class ExportPipeline:
+    """
+    Renders exports in a process pool, caching artifacts by story hash.
+    One pipeline per server process; submit() never blocks on rendering.
+    """
+
+    def __init__(self, directory: str = EXPORT_DIR, max_workers: int | None = None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.max_workers = max_workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self._executor: ProcessPoolExecutor | None = None
+        self._pending: dict[str, Future] = {} # artifact path -> render in progress
+        self.counters = {"rendered": 0, "cache_hits": 0, "failed": 0}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: safe to start from a threaded server such as Streamlit
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def submit(self, record: dict, export_format: str, cover: bytes | None = None) -> Future:
+        """
+        Starts (or reuses) the rendering of one export.
+
+        Args:
+            record (dict): A story record (see story_records.build_story_record).
+            export_format (str): One of EXPORT_EXTENSIONS.
+            cover (bytes): Optional PNG/JPEG cover image.
+
+        Returns:
+            Future: Resolves to the artifact path.
+        """
+        path = artifact_path(self.directory, story_digest(record, cover), export_format)
+        if os.path.exists(path):
+            self.counters["cache_hits"] += 1
+            done = Future()
+            done.set_result(path)
+            return done
+        future = self._pending.get(path)
+        if future is not None:
+            return future
+        future = self._pool().submit(render_export, record, export_format, path, cover)
+        self._pending[path] = future
+        future.add_done_callback(lambda finished: self._finished(path, finished))
+        return future
+
+    def _finished(self, path: str, future: Future):
+        self._pending.pop(path, None)
+        self.counters["failed" if future.exception() else "rendered"] += 1
+
+    def export_library(self, paths: list[str], export_formats: list[str] | None = None, progress=None) -> dict:
+        """
+        Bulk-exports story files (directories are walked for *.json). Each file
+        is read and rendered inside a pool process.
+
+        Args:
+            paths (list[str]): Story files or directories.
+            export_formats (list[str]): Formats to render; default per story format (DEFAULT_EXPORTS).
+            progress (callable): Optional callback(summary) per finished file.
+
+        Returns:
+            dict: {"files", "rendered", "cached", "errors", "seconds"}.
+        """
+        started = time.perf_counter()
+        files = list(_story_files(paths))
+        totals = {"files": len(files), "rendered": 0, "cached": 0, "errors": 0}
+        futures = [self._pool().submit(render_story_file, path, export_formats, self.directory) for path in files]
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as error:
+                summary = {"path": "?", "error": str(error)}
+            if "error" in summary:
+                totals["errors"] += 1
+            else:
+                totals["rendered"] += summary["rendered"]
+                totals["cached"] += summary["cached"]
+            if progress:
+                progress(summary)
+        self.counters["rendered"] += totals["rendered"]
+        self.counters["cache_hits"] += totals["cached"]
+        totals["seconds"] = round(time.perf_counter() - started, 2)
+        return totals
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def _story_files(paths: list[str]):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.endswith((".json", ARCHIVE_EXTENSION)) and not name.endswith(".manifest.json"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def export_file_name(metadata: dict, export_format: str, language: str = "") -> str:
+    """A friendly download name, e.g. 'ada_the_hero.screenplay.txt' ('ada_the_hero.fr.pdf' for a French edition)."""
+    stem = re.sub(r"[^a-z0-9]+", "_", story_title(metadata).lower()).strip("_") or "story"
+    if language in LANGUAGE_CODES:
+        stem += "." + LANGUAGE_CODES[language]
+    return stem + EXPORT_EXTENSIONS[export_format]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Export Story-Verse stories as screenplay, teleplay, stage play, EPUB or PDF.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Export one story file.")
+    export_parser.add_argument("story", help="Story log or story record (JSON).")
+    export_parser.add_argument("--format", choices=sorted(EXPORT_EXTENSIONS), default="pdf")
+    export_parser.add_argument("--cover", help="PNG or JPEG cover image (PDF/EPUB).")
+    export_parser.add_argument("--output", help="Output file (default: next to the story).")
+
+    bulk_parser = commands.add_parser("bulk", help="Export every story under files/directories.")
+    bulk_parser.add_argument("paths", nargs="+")
+    bulk_parser.add_argument("--formats", nargs="+", choices=sorted(EXPORT_EXTENSIONS))
+    bulk_parser.add_argument("--out", default=EXPORT_DIR)
+    bulk_parser.add_argument("--workers", type=int)
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        try:
+            story_log, metadata = read_story_record(args.story)
+        except (OSError, ValueError) as error:
+            print(f"❌ Could not read '{args.story}': {error}")
+            return 1
+        cover = None
+        if args.cover:
+            with open(args.cover, "rb") as f:
+                cover = f.read()
+        output = args.output or os.path.splitext(args.story)[0] + EXPORT_EXTENSIONS[args.format]
+        render_export(build_story_record(story_log, metadata), args.format, output, cover)
+        print(f"✅ Exported to '{output}'")
+        return 0
+
+    pipeline = ExportPipeline(args.out, args.workers)
+    totals = pipeline.export_library(args.paths, args.formats, progress=lambda s: print(f"❌ {s['path']}: {s['error']}") if "error" in s else None)
+    pipeline.shutdown()
+    rate = totals["files"] / totals["seconds"] if totals["seconds"] else 0.0
+    print(f"✅ {totals['files']} stories: {totals['rendered']} rendered, {totals['cached']} cached, "
+          f"{totals['errors']} unreadable in {totals['seconds']} s ({rate:.1f} stories/s) -> '{args.out}'")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
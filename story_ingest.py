@@ -0,0 +1,567 @@
+### STORY INGEST ###
+# Bulk import of legacy story logs into one schema. Years of files come in mixed
+# shapes: bare story logs from save_story_to_file (types "free_form",
+# "continuation", "plot_twist"; the opening segment has no type), GUI records and
+# debug dumps (types "User Input", "Continuation", "Bonus Idea"), some without
+# "round", some with setup fields under older names ("genre", "format").
+# Every segment is normalised to
+#   {"story", "position", "round", "text", "contributor": "AI"|"User", "type"}
+# with the GUI's type names, and every story to one line of its setup fields.
+#
+# Files are read in a process pool and streamed: segments are decoded one at a
+# time from the file, so a story of any length costs one segment of memory.
+# Output goes to a directory of JSON Lines shards, a story's segments and its
+# story line always in the same shard (chosen from the story id):
+#   segments-00003.jsonl, stories-00003.jsonl, rejected.jsonl (records that
+#   failed validation, with their source and reason)
+# Workers stage each file's output; the parent appends it to the shards and
+# commits a manifest (files done, byte length of every output) every few files.
+# An interrupted run is resumed by running it again: outputs are cut back to
+# the manifest's lengths and files already ingested are skipped. A file
+# rewritten since (save_story_to_file overwrites my_story_log.json with each
+# new story) is ingested again as a new story; the old one stays in its shard.
+#
+# Usage:
+#   python story_ingest.py run ingested/ old_stories/ gui_dumps/ my_story_log.json [--workers 4] [--shards 16]
+#   python story_ingest.py status ingested/
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from story_archive import StoryArchive, is_archive
+from story_records import STORY_METADATA_KEYS
+from story_search import _iter_json_files
+
+DEFAULT_SHARDS = 16
+MANIFEST_NAME = "ingest.manifest.json" # Skipped when a directory is scanned for stories
+MANIFEST_VERSION = 1
+STAGING_DIRECTORY = ".staging"
+READ_CHUNK_CHARS = 1 << 20      # Characters read from a story file at a time
+MAX_VALUE_CHARS = 64 << 20      # A single JSON value (a segment) larger than this is treated as corrupt
+COMMIT_EVERY_FILES = 200        # Files appended between manifest commits
+COMMIT_EVERY_SECONDS = 5.0
+ARCHIVE_SEGMENTS_PER_READ = 1024
+
+# Legacy and GUI type names -> the GUI's names (keys lower-cased, "_" read as " ")
+SEGMENT_TYPES = {
+    "user input": "User Input",
+    "free form": "User Input",
+    "freeform": "User Input",
+    "continuation": "Continuation",
+    "bonus idea": "Bonus Idea",
+    "bonus": "Bonus Idea",
+    "plot twist": "Plot Twist",
+    "character idea": "Character Idea",
+    "ending": "Story Ending",
+    "story ending": "Story Ending",
+}
+CONTRIBUTORS = {"ai": "AI", "model": "AI", "gemini": "AI", "assistant": "AI", "user": "User", "human": "User", "writer": "User"}
+# Older names of story record fields
+METADATA_ALIASES = {
+    "genre": "story_genre",
+    "format": "story_format",
+    "language": "story_language",
+    "era": "era_style",
+    "aesthetic": "aesthetic_style",
+    "main_character": "main_character_name",
+    "character_name": "main_character_name",
+    "role": "main_character_role",
+}
+
+_WHITESPACE = re.compile(r"\s*")
+_DECODER = json.JSONDecoder()
+
+
+# --- Streaming JSON ---
+
+class _JsonStream:
+    """Decodes JSON values one at a time from a text file, reading it in chunks."""
+
+    def __init__(self, f, chunk_chars: int = READ_CHUNK_CHARS):
+        self.f = f
+        self.chunk_chars = chunk_chars
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Reads the next chunk, dropping what was consumed; False at the end of the file."""
+        chunk = self.f.read(self.chunk_chars)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next non-whitespace character ("" at the end of the file)."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"expected '{char}' at character {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next complete value, reading more of the file while it is cut off."""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as error:
+                if len(self.buffer) - self.pos > MAX_VALUE_CHARS or not self._fill():
+                    raise ValueError(f"invalid JSON: {error.msg}") from None
+                continue
+            if end == len(self.buffer) and isinstance(value, (int, float)) and not self.eof and self._fill():
+                continue # A number at the end of the chunk may go on in the next one
+            self.pos = end
+            return value
+
+    def items(self):
+        """Yields the values of the array whose "[" was just consumed."""
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError("expected ',' or ']' in the story log")
+
+
+def iter_story_file(path: str, metadata: dict):
+    """
+    Streams the segments of a story file of either shape, JSON or archive,
+    filling `metadata` with the record's other fields as they are read (a story
+    record may list them after its story_log, so read them once the segments are done).
+
+    Yields:
+        The raw segments, in story order.
+
+    Raises:
+        OSError, ValueError: If the file cannot be read or is not a story.
+    """
+    if is_archive(path):
+        with StoryArchive(path) as archive:
+            metadata.update(archive.metadata)
+            for start in range(0, len(archive), ARCHIVE_SEGMENTS_PER_READ):
+                yield from archive.segments(start, start + ARCHIVE_SEGMENTS_PER_READ)
+        return
+    with open(path, "r", encoding="utf-8-sig") as f:
+        stream = _JsonStream(f)
+        first = stream.peek()
+        if first == "[":
+            stream.pos += 1
+            yield from stream.items()
+        elif first == "{":
+            stream.pos += 1
+            found = False
+            while stream.peek() != "}":
+                key = stream.value()
+                if not isinstance(key, str):
+                    raise ValueError("not a story log or story record")
+                stream.expect(":")
+                if key == "story_log" and stream.peek() == "[":
+                    stream.pos += 1
+                    found = True
+                    yield from stream.items()
+                else:
+                    metadata[key] = stream.value()
+                if stream.peek() == ",":
+                    stream.pos += 1
+            stream.pos += 1
+            if not found:
+                raise ValueError("not a story log or story record")
+        else:
+            raise ValueError("not a story log or story record")
+        if stream.peek():
+            raise ValueError("unexpected data after the story")
+
+
+# --- Normalisation ---
+
+def normalize_type(value, contributor: str) -> tuple[str, bool]:
+    """
+    A segment type under its GUI name. User segments are always "User Input"
+    (as story_records.append_story_segment writes them).
+
+    Returns:
+        tuple[str, bool]: The type and whether it was a known name.
+    """
+    if contributor == "User":
+        return "User Input", True
+    raw = str(value or "").strip()
+    if not raw:
+        return "Continuation", True
+    known = SEGMENT_TYPES.get(raw.lower().replace("_", " ").replace("-", " "))
+    if known:
+        return known, True
+    return raw.replace("_", " ").title(), False
+
+
+def normalize_segment(segment, position: int, previous_round: int | None) -> tuple[dict | None, str]:
+    """
+    Validates and normalises one segment.
+
+    Args:
+        segment: The decoded segment.
+        position (int): Its position in the story.
+        previous_round (int | None): The round of the story's previous kept segment.
+
+    Returns:
+        tuple[dict | None, str]: ({"position", "round", "text", "contributor", "type"}, "")
+                                 or (None, the reason it was rejected).
+    """
+    if not isinstance(segment, dict):
+        return None, "not_an_object"
+    text = segment.get("text")
+    if not isinstance(text, str):
+        return None, "missing_text" if text is None else "text_not_a_string"
+    text = text.strip()
+    if not text:
+        return None, "empty_text"
+
+    round_number = segment.get("round")
+    if isinstance(round_number, str) and round_number.strip().lstrip("-").isdigit():
+        round_number = int(round_number)
+    if type(round_number) is not int or not -2**31 <= round_number < 2**31:
+        round_number = 0 if previous_round is None else previous_round + 1
+
+    contributor, segment_type = segment_labels(segment, position)
+    return {"position": position, "round": round_number, "text": text, "contributor": contributor, "type": segment_type}, ""
+
+
+def segment_labels(segment: dict, position: int) -> tuple[str, str]:
+    """A segment's (contributor, type) under the GUI's names, whichever logger wrote it."""
+    raw_type = segment.get("type", "")
+    contributor = CONTRIBUTORS.get(str(segment.get("contributor", "")).strip().lower())
+    if contributor is None: # Missing: typed input is the user's, anything else a suggestion taken
+        contributor = "User" if normalize_type(raw_type, "AI")[0] == "User Input" or (not raw_type and position == 0) else "AI"
+    return contributor, normalize_type(raw_type, contributor)[0]
+
+
+def normalize_metadata(metadata: dict, defaults: dict) -> dict:
+    """The story's setup under STORY_METADATA_KEYS (older field names accepted, defaults for the missing)."""
+    fields = dict(defaults)
+    for key, value in metadata.items():
+        key = METADATA_ALIASES.get(key, key)
+        if key in STORY_METADATA_KEYS and isinstance(value, str) and value.strip():
+            fields[key] = value.strip()
+    return {key: fields.get(key, "") for key in STORY_METADATA_KEYS}
+
+
+def story_id(path: str, info: os.stat_result) -> str:
+    """
+    Identifies the story a file holds now. save_story_to_file overwrites
+    my_story_log.json with each new story, so the id covers the file's
+    modification time and size as well as its path.
+    """
+    key = f"{os.path.abspath(path)}|{info.st_mtime_ns}|{info.st_size}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def shard_of(story: str, shards: int) -> int:
+    return int(story[:8], 16) % shards
+
+
+# --- Workers ---
+
+def ingest_file(path: str, story: str, staging_directory: str, defaults: dict) -> dict:
+    """
+    Reads, validates and normalises one story file into staged output (in a pool process).
+
+    Returns:
+        dict: {"path", "story", "segments", "rejected": {reason: count}, "unknown_types": {type: count},
+               "segments_file", "rejected_file", "story_line"} or {"path", "error"} if the file is not a story.
+    """
+    segments_file = os.path.join(staging_directory, f"{story}.segments")
+    rejected_file = os.path.join(staging_directory, f"{story}.rejected")
+    summary = {"path": path, "story": story, "segments": 0, "rejected": {}, "unknown_types": {},
+               "segments_file": segments_file, "rejected_file": rejected_file}
+    metadata, previous_round = {}, None
+    try:
+        with open(segments_file, "w", encoding="utf-8") as segments_out, open(rejected_file, "w", encoding="utf-8") as rejected_out:
+            for position, raw in enumerate(iter_story_file(path, metadata)):
+                segment, reason = normalize_segment(raw, position, previous_round)
+                if segment is None:
+                    summary["rejected"][reason] = summary["rejected"].get(reason, 0) + 1
+                    rejected_out.write(json.dumps({"source": path, "position": position, "reason": reason, "record": raw}, ensure_ascii=False) + "\n")
+                    continue
+                if not normalize_type(raw.get("type", ""), segment["contributor"])[1]:
+                    unknown = str(raw.get("type"))
+                    summary["unknown_types"][unknown] = summary["unknown_types"].get(unknown, 0) + 1
+                previous_round = segment["round"]
+                segments_out.write(json.dumps({"story": story, **segment}, ensure_ascii=False) + "\n")
+                summary["segments"] += 1
+    except (OSError, ValueError, UnicodeDecodeError) as error:
+        for staged in (segments_file, rejected_file):
+            if os.path.exists(staged):
+                os.remove(staged)
+        return {"path": path, "error": str(error)}
+    summary["story_line"] = json.dumps({
+        "story": story, "source": path, **normalize_metadata(metadata, defaults),
+        "segments": summary["segments"], "rejected": sum(summary["rejected"].values()),
+    }, ensure_ascii=False) + "\n"
+    return summary
+
+
+# --- Manifest ---
+
+def load_manifest(output_directory: str) -> dict:
+    """The ingest manifest of an output directory (a fresh one if there is none)."""
+    try:
+        with open(os.path.join(output_directory, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+        print(f"Warning: ingest manifest in '{output_directory}' has an old format; starting over.")
+    except (OSError, ValueError):
+        pass
+    return {"version": MANIFEST_VERSION, "shards": 0, "outputs": {}, "files": {}, "totals": {}}
+
+
+def save_manifest(output_directory: str, manifest: dict):
+    path = os.path.join(output_directory, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+def _restore_outputs(output_directory: str, manifest: dict):
+    """Cuts every output back to its committed length (drops what an interrupted run appended after its last commit)."""
+    for name in os.listdir(output_directory):
+        if not name.endswith(".jsonl"):
+            continue
+        path = os.path.join(output_directory, name)
+        committed = manifest["outputs"].get(name, 0)
+        if os.path.getsize(path) != committed:
+            with open(path, "r+b") as f:
+                f.truncate(committed)
+
+
+class _Outputs:
+    """Append handles of the output files, tracking their lengths for the manifest."""
+
+    def __init__(self, output_directory: str, lengths: dict):
+        self.directory = output_directory
+        self.lengths = dict(lengths)
+        self._files = {}
+
+    def append(self, name: str, source=None, text: str = ""):
+        f = self._files.get(name)
+        if f is None:
+            f = self._files[name] = open(os.path.join(self.directory, name), "ab")
+        if source is not None:
+            with open(source, "rb") as staged:
+                shutil.copyfileobj(staged, f, 1 << 20)
+        if text:
+            f.write(text.encode("utf-8"))
+        self.lengths[name] = f.tell()
+
+    def flush(self):
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+# --- Bulk Ingest ---
+
+def ingest_library(paths: list[str], output_directory: str, shards: int = DEFAULT_SHARDS, max_workers: int | None = None,
+                   genre: str = "", story_format: str = "", progress=None) -> dict:
+    """
+    Ingests story files (directories are walked for *.json and archives) into
+    sharded JSON Lines, resuming from the output directory's manifest.
+
+    Args:
+        paths (list[str]): Story files or directories.
+        output_directory (str): Where the shards and the manifest live.
+        shards (int): Shard count of a new output directory (an existing one keeps its own).
+        max_workers (int | None): Pool processes (default: CPUs - 1, at least 1).
+        genre (str), story_format (str): Setup for story logs without metadata.
+        progress (callable): Optional callback(summary) per finished file.
+
+    Returns:
+        dict: {"files", "ingested", "skipped" (ingested before, unchanged), "changed" (ingested before and
+               rewritten since, ingested again as a new story), "failed" (tried again next run), "segments",
+               "rejected": {reason: count}, "unknown_types": {type: count}, "seconds", "files_per_second",
+               "segments_per_second"}.
+
+    Raises:
+        BrokenProcessPool: If a pool process died. Files finished so far are committed; run again to resume.
+    """
+    started = time.perf_counter()
+    os.makedirs(output_directory, exist_ok=True)
+    manifest = load_manifest(output_directory)
+    if manifest["shards"] and manifest["shards"] != shards:
+        print(f"Warning: '{output_directory}' has {manifest['shards']} shards; keeping them.")
+    shards = manifest["shards"] = manifest["shards"] or shards
+    _restore_outputs(output_directory, manifest)
+    staging_directory = os.path.join(output_directory, STAGING_DIRECTORY)
+    shutil.rmtree(staging_directory, ignore_errors=True)
+    os.makedirs(staging_directory)
+    defaults = {"story_genre": genre, "story_format": story_format}
+
+    totals = {"files": 0, "ingested": 0, "skipped": 0, "changed": 0, "failed": 0, "segments": 0, "rejected": {}, "unknown_types": {}}
+    outputs = _Outputs(output_directory, manifest["outputs"])
+    uncommitted, committed_at = 0, time.perf_counter()
+
+    def commit():
+        outputs.flush()
+        save_manifest(output_directory, manifest)
+
+    def finish(future):
+        nonlocal uncommitted, committed_at
+        path, info = pending.pop(future)
+        try:
+            summary = future.result()
+        except BrokenProcessPool:
+            raise # The pool died, not this file: stop (outputs are committed below); a rerun resumes
+        except Exception as error: # An error raised in the worker fails its file, not the run
+            summary = {"path": path, "error": str(error)}
+        entry = {"mtime": info.st_mtime_ns, "size": info.st_size}
+        seen = manifest["files"].get(path, {})
+        earlier = seen.get("earlier", []) + ([seen["story"]] if "story" in seen else [])
+        if earlier: # The stories this file held before it was overwritten (they stay in the shards)
+            entry["earlier"] = earlier
+        if "error" in summary:
+            totals["failed"] += 1
+            entry["error"] = summary["error"]
+        else:
+            shard = f"{shard_of(summary['story'], shards):05d}"
+            outputs.append(f"segments-{shard}.jsonl", source=summary["segments_file"])
+            outputs.append(f"stories-{shard}.jsonl", text=summary["story_line"])
+            if summary["rejected"]:
+                outputs.append("rejected.jsonl", source=summary["rejected_file"])
+            os.remove(summary["segments_file"])
+            os.remove(summary["rejected_file"])
+            totals["ingested"] += 1
+            totals["changed"] += "story" in seen
+            totals["segments"] += summary["segments"]
+            for name in ("rejected", "unknown_types"):
+                for key, count in summary[name].items():
+                    totals[name][key] = totals[name].get(key, 0) + count
+            entry.update(story=summary["story"], segments=summary["segments"], rejected=sum(summary["rejected"].values()))
+        manifest["files"][path] = entry
+        manifest["outputs"].update(outputs.lengths) # Only whole files count as committed output
+        uncommitted += 1
+        if uncommitted >= COMMIT_EVERY_FILES or time.perf_counter() - committed_at >= COMMIT_EVERY_SECONDS:
+            commit()
+            uncommitted, committed_at = 0, time.perf_counter()
+        if progress:
+            progress(summary)
+
+    max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+    pending = {}
+    # spawn: the same start method the export pool uses, safe from threaded callers
+    with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        try:
+            for path in _iter_json_files(paths):
+                path = os.path.abspath(path)
+                totals["files"] += 1
+                try:
+                    info = os.stat(path)
+                except OSError as error:
+                    totals["failed"] += 1
+                    if progress:
+                        progress({"path": path, "error": str(error)})
+                    continue
+                seen = manifest["files"].get(path)
+                if seen is not None and "error" not in seen and seen["mtime"] == info.st_mtime_ns and seen["size"] == info.st_size:
+                    totals["skipped"] += 1
+                    continue
+                # New, failed before, or rewritten since (a new story under the same name)
+                pending[executor.submit(ingest_file, path, story_id(path, info), staging_directory, defaults)] = (path, info)
+                while len(pending) >= max_workers * 4: # Bounded: the file list may be huge
+                    for future in wait(pending, return_when=FIRST_COMPLETED).done:
+                        finish(future)
+            while pending:
+                for future in wait(pending, return_when=FIRST_COMPLETED).done:
+                    finish(future)
+        finally:
+            commit()
+            outputs.close()
+            shutil.rmtree(staging_directory, ignore_errors=True)
+
+    seconds = time.perf_counter() - started
+    totals["seconds"] = round(seconds, 3)
+    totals["files_per_second"] = round(totals["ingested"] / seconds, 1) if seconds else 0.0
+    totals["segments_per_second"] = round(totals["segments"] / seconds, 1) if seconds else 0.0
+    manifest["totals"] = totals
+    save_manifest(output_directory, manifest)
+    return totals
+
+
+def manifest_status(output_directory: str) -> dict:
+    """Totals over every file an output directory's manifest has seen."""
+    manifest = load_manifest(output_directory)
+    files = manifest["files"].values()
+    return {
+        "shards": manifest["shards"],
+        "files": len(manifest["files"]),
+        "ingested": sum(1 for entry in files if "story" in entry),
+        "failed": sum(1 for entry in files if "error" in entry),
+        "segments": sum(entry.get("segments", 0) for entry in files),
+        "rejected": sum(entry.get("rejected", 0) for entry in files),
+        "output_bytes": sum(manifest["outputs"].values()),
+        "last_run": manifest["totals"],
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Ingest legacy story logs into sharded, normalised JSON Lines.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Ingest story files (resumes an interrupted run).")
+    run_parser.add_argument("output", help="Output directory (shards and manifest).")
+    run_parser.add_argument("paths", nargs="+", help="Story log files or directories.")
+    run_parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+    run_parser.add_argument("--workers", type=int, default=None)
+    run_parser.add_argument("--genre", default="", help="Genre for logs without metadata.")
+    run_parser.add_argument("--format", dest="story_format", default="", help="Format for logs without metadata.")
+    status_parser = commands.add_parser("status", help="Summarise an output directory's manifest.")
+    status_parser.add_argument("output")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        print(json.dumps(manifest_status(args.output), indent=2))
+        return 0
+    try:
+        totals = ingest_library(args.paths, args.output, args.shards, args.workers, args.genre, args.story_format,
+                                progress=lambda s: print(f"❌ {s['path']}: {s['error']}") if "error" in s else None)
+    except BrokenProcessPool as error:
+        print(f"❌ The worker pool crashed ({error}); run the same command again to resume.")
+        return 1
+    rejected = ", ".join(f"{reason} {count}" for reason, count in sorted(totals["rejected"].items(), key=lambda item: -item[1]))
+    print(f"✅ {totals['ingested']} stories ingested ({totals['segments']} segments) in {totals['seconds']:.1f}s: "
+          f"{totals['files_per_second']:.1f} files/s, {totals['segments_per_second']:.0f} segments/s.")
+    print(f"Skipped {totals['skipped']} seen before; {totals['changed']} rewritten since ingested, ingested as new stories; {totals['failed']} failed.")
+    print(f"Rejected records: {sum(totals['rejected'].values())}{f' ({rejected})' if rejected else ''}.")
+    if totals["unknown_types"]:
+        print(f"Warning: unknown segment types kept as written: {', '.join(sorted(totals['unknown_types']))}.")
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
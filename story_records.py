@@ -0,0 +1,143 @@
+### STORY RECORDS ###
+# Story logs on disk come in two shapes:
+#   - a bare list of segments, as written by save_story_to_file in the non-AI foundation;
+#   - a story record: {"story_log": [...], "story_genre": ..., "story_format": ..., ...},
+#     as exported by the Streamlit GUI, which also carries the story's setup.
+# Either shape may also be stored as a compact story archive (story_archive.py).
+# These helpers read every variant so tools (training, indexing, analytics) can
+# tell genre/format/era/language apart.
+
+import json
+
+from story_archive import is_archive, read_archive
+
+# Setup fields copied from st.session_state into an exported story record.
+STORY_METADATA_KEYS = [
+    "main_character_name",
+    "main_character_role",
+    "story_language",
+    "story_genre",
+    "story_format",
+    "aesthetic_style",
+    "era_style",
+]
+
+
+def build_story_record(story_log: list[dict], metadata: dict) -> dict:
+    """
+    Builds an exportable story record from a story log and the story's setup.
+
+    Args:
+        story_log (list[dict]): The list of story segments.
+        metadata (dict): Any mapping holding STORY_METADATA_KEYS (e.g. st.session_state).
+
+    Returns:
+        dict: {"story_log": [...], <metadata keys>...}.
+    """
+    record = {key: metadata.get(key, "") for key in STORY_METADATA_KEYS}
+    record["story_log"] = list(story_log)
+    return record
+
+
+def build_story_context(state) -> str:
+    """
+    The story as the AI sees it: the setup (character, genre, format, aesthetic, era)
+    followed by the story so far.
+
+    Args:
+        state: st.session_state or any mapping holding STORY_METADATA_KEYS and current_story.
+               With a "retrieval_index" (story_retrieval.StoryRetrievalIndex) and story_log,
+               a story over the context budget is sent as its recent tail plus the
+               earlier segments most relevant to it.
+
+    Returns:
+        str: The story context sent with every generation request.
+    """
+    story = state.get('current_story', '')
+    retrieval_index = state.get("retrieval_index")
+    if retrieval_index is not None:
+        story = retrieval_index.story_context(state.get("story_log", []), state.get("main_character_name", "")) or story
+    aesthetic_line = f"Aesthetic Style: {state.get('aesthetic_style', '')}.\n" if state.get("aesthetic_style") else ""
+    era_style_line = f"Era/Stylistic Reference: {state.get('era_style', '')}.\n" if state.get("era_style") else ""
+
+    return (f"Main character: {state.get('main_character_name', '')} the {state.get('main_character_role', '')}.\n"
+            f"Story Genre: {state.get('story_genre', '')}.\n"
+            f"Story Format: {state.get('story_format', '')}.\n"
+            f"{aesthetic_line}"
+            f"{era_style_line}"
+            f"Current story progress:\n{story}")
+
+
+def append_story_segment(state, chosen_text: str, contributor: str = "User", suggestion_type: str = ""):
+    """
+    Appends a segment to a live story: its log, its display text, its
+    near-duplicate index and (if it has one) its retrieval index, bumping the
+    round and the story version.
+
+    Args:
+        state: st.session_state or any mapping with round_number, story_version,
+               story_log, current_story and sketch_index (and optionally retrieval_index).
+        chosen_text (str): The segment's text.
+        contributor (str): "AI" or "User".
+        suggestion_type (str): The suggestion type for AI segments.
+    """
+    state["round_number"] += 1
+    state["story_version"] += 1 # Invalidates ending sets generated for the previous version
+    state["story_log"].append({
+        "round": state["round_number"],
+        "text": chosen_text,
+        "contributor": contributor,
+        "type": suggestion_type if contributor == "AI" else "User Input"
+    })
+    # Update current_story string for display (rstrip returns the same string when
+    # there is no trailing whitespace, so this stays cheap on long stories)
+    current_story = state["current_story"]
+    if current_story and not current_story.rstrip().endswith(('.', '!', '?')):
+        separator = ". "
+    else:
+        separator = ""
+    state["current_story"] = current_story + separator + chosen_text.strip()
+    state["sketch_index"].add(chosen_text) # Future suggestions must not repeat it
+    if state.get("retrieval_index") is not None:
+        state["retrieval_index"].add(chosen_text)
+
+
+def split_story_record(data) -> tuple[list[dict], dict]:
+    """
+    Splits decoded JSON (bare list or story record) into (story_log, metadata).
+
+    Args:
+        data: The decoded JSON content of a story file.
+
+    Returns:
+        tuple[list[dict], dict]: The segments and the metadata (empty for bare lists).
+
+    Raises:
+        ValueError: If the data is neither shape.
+    """
+    if isinstance(data, list):
+        return data, {}
+    if isinstance(data, dict) and isinstance(data.get("story_log"), list):
+        metadata = {key: data.get(key, "") for key in STORY_METADATA_KEYS}
+        return data["story_log"], metadata
+    raise ValueError("not a story log or story record")
+
+
+def read_story_record(path: str) -> tuple[list[dict], dict]:
+    """
+    Reads a story file of either shape, as JSON or as a story archive (.storyarc).
+
+    Args:
+        path (str): Path to a JSON story log or story record, or an archive of one.
+
+    Returns:
+        tuple[list[dict], dict]: The segments and the metadata (empty for bare lists).
+
+    Raises:
+        OSError, json.JSONDecodeError, ValueError: If the file cannot be read or is not a story.
+    """
+    if is_archive(path):
+        return split_story_record(read_archive(path))
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return split_story_record(data)
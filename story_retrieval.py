@@ -0,0 +1,252 @@
+### STORY RETRIEVAL ###
+# Prompt context for long stories. Sending all of current_story either blows the
+# prompt size or, once trimmed to its tail, loses early details such as the main
+# character's backstory. Each live story keeps a local index over its story_log:
+#   - an inverted index of segment terms, ranked with BM25 (story_search.py),
+#   - an entity table of character names, places and objects: where each was
+#     first mentioned, in how many segments, and how often.
+# Both are updated on every append in time proportional to the segment's length.
+#
+# Once the story is larger than the context budget, the context is the recent
+# tail plus the earlier segments most relevant to it: the segments that
+# introduced the entities the tail mentions, then the best BM25 matches for the
+# tail's terms, in story order, within a fixed byte budget.
+#
+# Usage:
+#   python story_retrieval.py context my_story_log.json [--budget-bytes 32000]
+#   python story_retrieval.py entities my_story_log.json [--top 30]
+
+import os
+import re
+import sys
+import argparse
+
+from story_search import tokenize, bm25_term_score, bm25_idf
+from story_records import read_story_record
+
+RETRIEVAL_CONTEXT_BYTES = int(os.getenv("STORY_CONTEXT_BYTES", "32000")) # About 8k tokens of story
+TAIL_SHARE = 0.5            # Of the budget, kept for the latest segments
+ENTITY_INTRO_BOOST = 2.0    # Weight (times the entity's idf) of the segment that introduced an entity
+GAP_MARKER = "\n[...]\n"    # Between passages that are not consecutive in the story
+MAX_TERM_SHARE = 0.5        # Query terms in more than this share of segments are skipped (they rank nothing)
+
+# Capitalized words that start sentences rather than name things
+_NOT_NAMES = set("""a an the he she they it i we you his her hers their its our my your me him them us
+but and or nor so yet then when while as if once now after before since until because though although
+in at on of to for with from by into onto near over under this that these those there here what who whom
+where why how which suddenly meanwhile later still just even only no not yes all some every each int ext""".split())
+_PLACE_PREPOSITIONS = {"in", "at", "to", "from", "into", "near", "towards", "toward", "through", "across", "inside", "beyond"}
+_NAME_PATTERN = re.compile(r"(?<![\w'])([A-Z][\w'-]*(?:\s+[A-Z][\w'-]*)*)")
+_OBJECT_PATTERN = re.compile(r"\b(?:the|a|an|his|her|their|my)\s+([a-z][a-z'-]{3,})\b")
+_PRECEDING_WORD = re.compile(r"([A-Za-z]+)\s+(?:the\s+)?$")
+_SENTENCE_START = re.compile(r"(?:^|[.!?:;\"\u201c\u201d])\s*$")
+
+
+def extract_entities(text: str) -> list[tuple[str, str]]:
+    """
+    The entities a segment mentions, as (name, kind) pairs in order of appearance:
+    capitalized names (a "place" after a preposition such as "in" or "to",
+    otherwise a "character") and the nouns after articles and possessives ("object").
+    A single capitalized word opening a sentence is not taken for a name: it is
+    as likely to be any word, and names recur mid-sentence soon enough.
+    Scripts without capitals only yield objects in Latin script; BM25 still covers them.
+    """
+    entities = []
+    for match in _NAME_PATTERN.finditer(text):
+        words = match.group(1).split()
+        while words and words[0].lower() in _NOT_NAMES: # "The Keeper" -> "Keeper", "She" -> nothing
+            words.pop(0)
+        if not words:
+            continue
+        if len(words) == 1 and words[0] == match.group(1) and _SENTENCE_START.search(text, max(0, match.start() - 8), match.start()):
+            continue
+        preceding = _PRECEDING_WORD.search(text, max(0, match.start() - 24), match.start())
+        kind = "place" if preceding and preceding.group(1).lower() in _PLACE_PREPOSITIONS else "character"
+        entities.append((" ".join(words), kind))
+    entities.extend((match.group(1), "object") for match in _OBJECT_PATTERN.finditer(text))
+    return entities
+
+
+class StoryRetrievalIndex:
+    """The BM25 index and entity table of one live story's segments, in story_log order."""
+
+    def __init__(self):
+        self.postings: dict[str, dict[int, int]] = {} # term -> {segment position: term frequency}
+        self.lengths: list[int] = []                  # Terms per segment
+        self.sizes: list[int] = []                    # UTF-8 bytes per segment (as it appears in the context)
+        self.segment_terms: list[tuple[str, ...]] = [] # Distinct terms per segment
+        self.segment_entities: list[tuple[str, ...]] = [] # Entity keys per segment
+        self.entities: dict[str, dict] = {}           # lower-cased name -> {"name", "kind", "first", "last", "segments", "mentions"}
+        self.total_terms = 0
+        self.total_bytes = 0
+        self._last_text = ""
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, text: str):
+        """Indexes the next segment (cost proportional to its length)."""
+        position = len(self.lengths)
+        counts: dict[str, int] = {}
+        for term in tokenize(text):
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[position] = tf
+        length = sum(counts.values())
+        self.lengths.append(length)
+        self.total_terms += length
+        size = len(text.strip().encode("utf-8")) + 1
+        self.sizes.append(size)
+        self.total_bytes += size
+        self.segment_terms.append(tuple(counts))
+
+        keys = []
+        for name, kind in extract_entities(text):
+            key = name.lower()
+            entity = self.entities.get(key)
+            if entity is None:
+                entity = self.entities[key] = {"name": name, "kind": kind, "first": position, "last": -1, "segments": 0, "mentions": 0}
+            elif entity["kind"] == "object" and kind != "object":
+                entity["kind"] = kind # A capitalized mention names it
+            entity["mentions"] += 1
+            if entity["last"] != position:
+                entity["last"] = position
+                entity["segments"] += 1
+                keys.append(key)
+        self.segment_entities.append(tuple(keys))
+        self._last_text = text
+
+    def sync(self, story_log: list[dict]):
+        """Indexes the segments of story_log not indexed yet; rebuilds if the log was replaced (e.g. by a room snapshot)."""
+        indexed = len(self.lengths)
+        if indexed > len(story_log) or (indexed and story_log[indexed - 1].get("text", "") != self._last_text):
+            self.__init__()
+            indexed = 0
+        for segment in story_log[indexed:]:
+            self.add(segment.get("text", ""))
+
+    def exceeds(self, budget_bytes: int = RETRIEVAL_CONTEXT_BYTES) -> bool:
+        """Whether the whole story no longer fits the context budget."""
+        return self.total_bytes > budget_bytes
+
+    def top_entities(self, count: int = 20, kind: str = "") -> list[dict]:
+        """The entities mentioned in the most segments (optionally only one kind)."""
+        entities = [entity for entity in self.entities.values() if not kind or entity["kind"] == kind]
+        return sorted(entities, key=lambda entity: (-entity["segments"], entity["first"]))[:count]
+
+    # --- Selection ---
+
+    def score(self, terms, limit: int) -> dict[int, float]:
+        """BM25 scores of the segments before position `limit` for the query terms."""
+        count = len(self.lengths)
+        average_length = self.total_terms / count if count else 0.0
+        scores: dict[int, float] = {}
+        for term in set(terms):
+            postings = self.postings.get(term)
+            if not postings or len(postings) > count * MAX_TERM_SHARE:
+                continue
+            idf = bm25_idf(len(postings), count)
+            for position, tf in postings.items():
+                if position < limit:
+                    scores[position] = scores.get(position, 0.0) + bm25_term_score(tf, self.lengths[position], average_length, idf)
+        return scores
+
+    def select(self, budget_bytes: int = RETRIEVAL_CONTEXT_BYTES, extra_terms=()) -> list[int]:
+        """
+        Chooses the segments to send: the recent tail (TAIL_SHARE of the budget, at
+        least the latest segment), then the introductions of the entities the tail
+        mentions and the best BM25 matches for its terms, while they fit, then
+        the segments before the tail with whatever room is left.
+
+        Args:
+            budget_bytes (int): Bytes of story text to send.
+            extra_terms: Query terms to add (e.g. the main character's name).
+
+        Returns:
+            list[int]: Segment positions, in story order.
+        """
+        count = len(self.lengths)
+        tail_start, used = count, 0
+        while tail_start > 0 and (tail_start == count or used + self.sizes[tail_start - 1] <= budget_bytes * TAIL_SHARE):
+            tail_start -= 1
+            used += self.sizes[tail_start]
+
+        terms = list(extra_terms)
+        for position in range(tail_start, count):
+            terms.extend(self.segment_terms[position])
+        scores = self.score(terms, tail_start)
+        for position in range(tail_start, count):
+            for key in self.segment_entities[position]:
+                entity = self.entities[key]
+                if entity["first"] < tail_start:
+                    boost = ENTITY_INTRO_BOOST * bm25_idf(entity["segments"], count)
+                    scores[entity["first"]] = scores.get(entity["first"], 0.0) + boost
+
+        chosen = set(range(tail_start, count))
+        for position in sorted(scores, key=lambda p: (-scores[p], p)):
+            if used + self.sizes[position] <= budget_bytes:
+                chosen.add(position)
+                used += self.sizes[position]
+        # Room to spare: extend the tail backwards
+        position = tail_start - 1
+        while position >= 0 and (position in chosen or used + self.sizes[position] <= budget_bytes):
+            if position not in chosen:
+                chosen.add(position)
+                used += self.sizes[position]
+            position -= 1
+        return sorted(chosen)
+
+    def story_context(self, story_log: list[dict], focus: str = "", budget_bytes: int = RETRIEVAL_CONTEXT_BYTES) -> str | None:
+        """
+        The story text to send when the whole story exceeds budget_bytes, or None when it fits
+        (the caller then sends current_story as it is). `focus` (e.g. the main character's
+        name) is added to the query.
+        """
+        self.sync(story_log)
+        if not self.exceeds(budget_bytes):
+            return None
+        parts, previous = [], None
+        for position in self.select(budget_bytes, tokenize(focus)):
+            if previous is not None:
+                parts.append(" " if position == previous + 1 else GAP_MARKER)
+            elif position > 0:
+                parts.append("[...]\n")
+            parts.append(story_log[position].get("text", "").strip())
+            previous = position
+        return "".join(parts)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect the retrieval context of a saved story.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    context_parser = commands.add_parser("context", help="Print the story context a generation request would send.")
+    context_parser.add_argument("story", help="Story log or story record (JSON or archive).")
+    context_parser.add_argument("--budget-bytes", type=int, default=RETRIEVAL_CONTEXT_BYTES)
+    entities_parser = commands.add_parser("entities", help="Print the story's entity table.")
+    entities_parser.add_argument("story", help="Story log or story record (JSON or archive).")
+    entities_parser.add_argument("--top", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    try:
+        story_log, metadata = read_story_record(args.story)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read '{args.story}': {e}")
+        return 1
+    index = StoryRetrievalIndex()
+    index.sync(story_log)
+    if args.command == "entities":
+        print(f"{'name':<30} {'kind':<10} {'first':>6} {'last':>6} {'segments':>9}")
+        for entity in index.top_entities(args.top):
+            print(f"{entity['name']:<30} {entity['kind']:<10} {entity['first']:>6} {entity['last']:>6} {entity['segments']:>9}")
+        return 0
+    context = index.story_context(story_log, metadata.get("main_character_name", ""), args.budget_bytes)
+    if context is None:
+        print(f"The whole story fits in {args.budget_bytes} bytes ({index.total_bytes} bytes); it is sent as it is.")
+        return 0
+    print(context)
+    print(f"\n✅ {len(context.encode('utf-8'))} of {index.total_bytes} story bytes, {len(index)} segments indexed.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
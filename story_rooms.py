@@ -0,0 +1,414 @@
+### STORY ROOMS ###
+# Shared writing rooms: several browser sessions co-writing one story. A room
+# holds the single authoritative story log; every member's session mirrors it.
+#   - Changes are published as small events (an appended segment with the exact
+#     text added to current_story and its near-duplicate sketch, or a suggestion
+#     set), never the full story.
+#   - Events are stored once, in the room's history; a subscription is just a
+#     cursor into it, so publishing costs the same for 1 or 100 members. Members
+#     waiting on an event loop are woken with one callback per loop.
+#   - A member that falls behind the history gets a snapshot event instead.
+#   - Suggestion generation is deduplicated per story version: the first member
+#     to ask starts the call, everyone else awaits the same future.
+# Rooms live in this server process (see RoomRegistry); members on other
+# processes would need a shared bus.
+
+import re
+import time
+import asyncio
+import secrets
+import threading
+import weakref
+from itertools import islice
+from collections import deque
+from concurrent.futures import Future
+
+from story_records import STORY_METADATA_KEYS, append_story_segment
+from suggestion_diversity import SketchIndex, minhash
+
+ROOM_HISTORY_EVENTS = 1000  # Events kept for members catching up; older cursors get a snapshot
+ROOM_IDLE_SECONDS = 3600    # Rooms without members are dropped after this
+ROOM_ENDING_TYPE = "Story Ending"
+
+_ROOM_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{4,64}$")
+
+
+def new_room_id() -> str:
+    """A fresh, URL-safe room id for ?room=..."""
+    return secrets.token_urlsafe(8)
+
+
+def valid_room_id(room_id: str) -> bool:
+    return bool(room_id) and bool(_ROOM_ID_PATTERN.match(room_id))
+
+
+def _wake(futures: list[asyncio.Future]):
+    for future in futures:
+        if not future.done():
+            future.set_result(None)
+
+
+class StoryRoom:
+    """One shared story and its event history. Thread-safe: members run on different script threads."""
+
+    def __init__(self, room_id: str, history: int = ROOM_HISTORY_EVENTS):
+        self.room_id = room_id
+        self.metadata: dict = {}
+        self._state = {
+            "round_number": 0,
+            "story_version": 0,
+            "story_log": [],
+            "current_story": "",
+            "sketch_index": SketchIndex(),
+        }
+        self.suggestions: list[tuple[str, str]] = []
+        self.endings: list[str] = []
+        self.suggestions_version = -1
+        self.concluded = False
+        self._seq = 0
+        self._history: deque[dict] = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._waiters: dict[asyncio.AbstractEventLoop, list[asyncio.Future]] = {}
+        self._subscriptions: weakref.WeakSet = weakref.WeakSet()
+        self._generation: tuple[int, Future] | None = None
+        self.last_active = time.monotonic()
+        self.counters = {"events": 0, "conflicts": 0, "generations_started": 0, "generations_shared": 0}
+
+    @property
+    def story_version(self) -> int:
+        return self._state["story_version"]
+
+    @property
+    def members(self) -> int:
+        return len(self._subscriptions)
+
+    # --- Publishing ---
+
+    def _publish(self, event: dict) -> dict:
+        """Appends an event to the history and wakes waiting members. Call with the lock held."""
+        self._seq += 1
+        event["seq"] = self._seq
+        self._history.append(event)
+        self.counters["events"] += 1
+        self.last_active = time.monotonic()
+        waiters, self._waiters = self._waiters, {}
+        for loop, futures in waiters.items():
+            try:
+                loop.call_soon_threadsafe(_wake, futures) # One callback per loop, however many members wait on it
+            except RuntimeError: # The member's loop has closed
+                pass
+        return event
+
+    def configure(self, metadata) -> dict:
+        """
+        Sets the story's setup (character, genre, format...) unless the room already has one.
+
+        Args:
+            metadata: Any mapping holding STORY_METADATA_KEYS (e.g. st.session_state).
+
+        Returns:
+            dict: The room's setup, which members should adopt.
+        """
+        with self._lock:
+            if not self.metadata:
+                self.metadata = {key: metadata.get(key, "") for key in STORY_METADATA_KEYS}
+                self._publish({"kind": "setup", "metadata": dict(self.metadata)})
+            return dict(self.metadata)
+
+    def seed(self, state) -> bool:
+        """
+        Starts an empty room from a member's story in progress.
+
+        Args:
+            state: st.session_state or any mapping with the setup keys, story_log,
+                   current_story, round_number and story_version.
+
+        Returns:
+            bool: False if the room already has a story (members then adopt the room's).
+        """
+        with self._lock:
+            if self.metadata or self._state["story_log"]:
+                return False
+            self.metadata = {key: state.get(key, "") for key in STORY_METADATA_KEYS}
+            self._state.update({
+                "story_log": list(state["story_log"]),
+                "current_story": state["current_story"],
+                "round_number": state["round_number"],
+                "story_version": state["story_version"],
+            })
+            for segment in self._state["story_log"]:
+                self._state["sketch_index"].add(segment.get("text", ""))
+            self.concluded = bool(state.get("story_concluded"))
+            self._publish(self._snapshot())
+            return True
+
+    def append(self, text: str, contributor: str = "User", suggestion_type: str = "", expected_version: int | None = None) -> dict | None:
+        """
+        Appends a segment to the shared story.
+
+        Args:
+            text (str): The segment's text.
+            contributor (str): "AI" or "User".
+            suggestion_type (str): The suggestion type for AI segments.
+            expected_version (int | None): The story version the writer was looking at;
+                                           if someone else changed the story since, nothing is appended.
+
+        Returns:
+            dict | None: The published event, or None on a version conflict or a concluded story.
+        """
+        with self._lock:
+            if self.concluded or (expected_version is not None and expected_version != self._state["story_version"]):
+                self.counters["conflicts"] += 1
+                return None
+            previous_length = len(self._state["current_story"])
+            append_story_segment(self._state, text, contributor, suggestion_type)
+            segment = self._state["story_log"][-1]
+            self.concluded = segment["type"] == ROOM_ENDING_TYPE
+            self.suggestions, self.endings = [], []
+            return self._publish({
+                "kind": "segment",
+                "version": self._state["story_version"],
+                "round": self._state["round_number"],
+                "segment": segment,
+                # What append_story_segment added to current_story (separator included)
+                "text_delta": self._state["current_story"][previous_length:],
+                "sketch": minhash(text), # Computed once here rather than by every member
+            })
+
+    def publish_suggestions(self, version: int, suggestions: list, endings: list[str] | None = None) -> dict | None:
+        """Shares a suggestion set (and ending candidates) generated for a story version; stale sets are dropped."""
+        with self._lock:
+            if version != self._state["story_version"]:
+                return None
+            self.suggestions = [tuple(suggestion) for suggestion in suggestions]
+            self.endings = list(endings or [])
+            self.suggestions_version = version
+            return self._publish({"kind": "suggestions", "version": version, "suggestions": self.suggestions, "endings": self.endings})
+
+    # --- Deduplicated generation ---
+
+    def generation_for(self, version: int, start) -> tuple[Future | None, bool]:
+        """
+        Returns the suggestion generation for a story version, starting it only if no
+        member has yet. The result ({"suggestions": [...], "endings": [...]}) is
+        published to every member when it arrives.
+
+        Args:
+            version (int): The story version the suggestions are for.
+            start: Called (at most once per version) to start the generation; returns a
+                   concurrent.futures.Future of {"suggestions", "endings"}.
+
+        Returns:
+            tuple[Future | None, bool]: The generation (None if the version is stale) and
+                                        whether this call started it (and so pays for it).
+        """
+        with self._lock:
+            if version != self._state["story_version"]:
+                return None, False
+            if self.suggestions_version == version:
+                done = Future()
+                done.set_result({"suggestions": list(self.suggestions), "endings": list(self.endings)})
+                self.counters["generations_shared"] += 1
+                return done, False
+            if self._generation and self._generation[0] == version and not self._generation[1].cancelled():
+                self.counters["generations_shared"] += 1
+                return self._generation[1], False
+            future = start()
+            self._generation = (version, future)
+            self.counters["generations_started"] += 1
+        future.add_done_callback(lambda finished: self._generation_done(version, finished))
+        return future, True
+
+    def _generation_done(self, version: int, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                if self._generation and self._generation[1] is future:
+                    self._generation = None # The next member to ask retries
+            return
+        result = future.result()
+        self.publish_suggestions(version, result.get("suggestions", []), result.get("endings", []))
+
+    # --- Subscribing ---
+
+    def snapshot(self) -> dict:
+        """The whole room as one event, for members joining or too far behind."""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> dict:
+        return {
+            "kind": "snapshot",
+            "seq": self._seq,
+            "version": self._state["story_version"],
+            "round": self._state["round_number"],
+            "metadata": dict(self.metadata),
+            "story_log": list(self._state["story_log"]),
+            "current_story": self._state["current_story"],
+            "suggestions": list(self.suggestions) if self.suggestions_version == self._state["story_version"] else [],
+            "endings": list(self.endings),
+            "concluded": self.concluded,
+        }
+
+    def events_since(self, seq: int) -> list[dict]:
+        """Events after `seq`, or a single snapshot event if they are no longer in the history."""
+        with self._lock:
+            if seq >= self._seq:
+                return []
+            missed = self._seq - seq
+            if missed > len(self._history):
+                return [self._snapshot()]
+            # seqs are consecutive, so the missed events are the newest ones
+            return list(islice(reversed(self._history), missed))[::-1]
+
+    def _add_waiter(self, loop: asyncio.AbstractEventLoop, future: asyncio.Future, seq: int) -> bool:
+        with self._lock:
+            if seq < self._seq:
+                return False # Something was published in the meantime
+            self._waiters.setdefault(loop, []).append(future)
+            return True
+
+    def _remove_waiter(self, loop: asyncio.AbstractEventLoop, future: asyncio.Future):
+        with self._lock:
+            futures = self._waiters.get(loop)
+            if futures and future in futures:
+                futures.remove(future)
+                if not futures:
+                    del self._waiters[loop] # Don't keep closed loops alive
+
+    def subscribe(self) -> "RoomSubscription":
+        """A new member's subscription; its first poll() returns a snapshot."""
+        subscription = RoomSubscription(self)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            self.last_active = time.monotonic()
+        return subscription
+
+
+class RoomSubscription:
+    """A member's cursor into a room's events."""
+
+    def __init__(self, room: StoryRoom):
+        self.room = room
+        self.cursor = -1 # Before anything: the first poll returns a snapshot
+
+    def pending(self) -> bool:
+        """Whether events were published since the last poll (cheap; for polling UIs)."""
+        return self.cursor < self.room._seq
+
+    def poll(self) -> list[dict]:
+        """Returns the events since the last poll (or a snapshot), advancing the cursor."""
+        if self.cursor < 0:
+            events = [self.room.snapshot()]
+        else:
+            events = self.room.events_since(self.cursor)
+        if events:
+            self.cursor = events[-1]["seq"]
+        return events
+
+    async def wait(self, timeout: float | None = None) -> list[dict]:
+        """Returns new events, waiting up to `timeout` seconds for some (an empty list on timeout)."""
+        events = self.poll()
+        if events:
+            return events
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.room._add_waiter(loop, future, self.cursor):
+            # A timer rather than asyncio.wait_for, which would add a task per waiting member
+            timer = loop.call_later(timeout, _wake, [future]) if timeout is not None else None
+            try:
+                await future
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                self.room._remove_waiter(loop, future)
+        return self.poll()
+
+
+def apply_room_events(state, events: list[dict]):
+    """
+    Applies room events to a member's session state.
+
+    Args:
+        state: st.session_state or any mapping holding the GUI's story keys (story_log,
+               current_story, round_number, story_version, suggestions_with_commentary,
+               ending_pool, sketch_index...) and the setup keys.
+        events (list[dict]): Events from RoomSubscription.poll() or wait().
+    """
+    for event in events:
+        kind = event["kind"]
+        if kind == "snapshot":
+            state.update({key: value for key, value in event["metadata"].items()})
+            state["story_log"] = list(event["story_log"])
+            state["current_story"] = event["current_story"]
+            state["round_number"] = event["round"]
+            state["story_version"] = event["version"]
+            state["suggestions_with_commentary"] = list(event["suggestions"])
+            state["ending_pool"] = list(event["endings"])
+            state["ending_pool_version"] = event["version"] if event["endings"] else -1
+            state["story_concluded"] = event["concluded"]
+            state["story_creation_complete"] = bool(event["metadata"]) or bool(event["story_log"])
+            state["sketch_index"] = SketchIndex()
+            for segment in state["story_log"]:
+                state["sketch_index"].add(segment.get("text", ""))
+        elif kind == "setup":
+            state.update(event["metadata"])
+            state["story_creation_complete"] = True
+        elif kind == "segment":
+            state["story_log"].append(event["segment"])
+            state["current_story"] += event["text_delta"]
+            state["round_number"] = event["round"]
+            state["story_version"] = event["version"]
+            state["sketch_index"].add_sketch(event["sketch"])
+            state["suggestions_with_commentary"] = [] # They were for the previous version
+            state["alternate_endings"] = []
+            if event["segment"]["type"] == ROOM_ENDING_TYPE:
+                state["story_concluded"] = True
+        elif kind == "suggestions" and event["version"] == state["story_version"]:
+            state["suggestions_with_commentary"] = list(event["suggestions"])
+            state["ending_pool"] = list(event["endings"])
+            state["ending_pool_version"] = event["version"]
+
+
+class RoomRegistry:
+    """The rooms of one server process."""
+
+    def __init__(self, idle_seconds: float = ROOM_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._rooms: dict[str, StoryRoom] = {}
+        self._lock = threading.Lock()
+
+    def open(self, room_id: str) -> StoryRoom:
+        """
+        Returns the room with this id, creating it if needed.
+
+        Raises:
+            ValueError: If the id is not a valid room id.
+        """
+        if not valid_room_id(room_id):
+            raise ValueError(f"invalid room id: {room_id!r}")
+        with self._lock:
+            self._sweep()
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = StoryRoom(room_id)
+            return room
+
+    def get(self, room_id: str) -> StoryRoom | None:
+        with self._lock:
+            return self._rooms.get(room_id)
+
+    def _sweep(self):
+        """Drops rooms nobody has been in for idle_seconds."""
+        now = time.monotonic()
+        for room_id, room in list(self._rooms.items()):
+            if room.members == 0 and now - room.last_active > self.idle_seconds:
+                del self._rooms[room_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rooms": len(self._rooms),
+                "members": sum(room.members for room in self._rooms.values()),
+                "generations_started": sum(room.counters["generations_started"] for room in self._rooms.values()),
+                "generations_shared": sum(room.counters["generations_shared"] for room in self._rooms.values()),
+            }
@@ -0,0 +1,418 @@
+### STORY SEARCH ###
+# Full-text and faceted search over saved story logs. Every story_log segment is a
+# document: its text goes into an inverted index ranked with BM25, and the story's
+# setup (genre, format, era, language, character role) plus the segment's
+# contributor and type are facets that can filter and summarise results.
+#
+# Indexing is incremental: a manifest of (mtime, size, hash) per file means only
+# new or changed story files are re-read.
+#
+# Usage:
+#   python story_search.py index stories.idx stories/ my_story_log.json
+#   python story_search.py query stories.idx "villain librarian" --format Screenplay --era noir
+
+import os
+import re
+import sys
+import json
+import zlib
+import math
+import hashlib
+import argparse
+from array import array
+
+from story_archive import ARCHIVE_EXTENSION
+from story_records import read_story_record
+
+INDEX_VERSION = 1
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Facet name -> where its value comes from ("meta:" = story metadata, "seg:" = segment field)
+FACETS = {
+    "genre": "meta:story_genre",
+    "format": "meta:story_format",
+    "era": "meta:era_style",
+    "language": "meta:story_language",
+    "role": "meta:main_character_role",
+    "contributor": "seg:contributor",
+    "type": "seg:type",
+}
+FACET_NAMES = list(FACETS)
+
+# Compact away deleted documents once they exceed this share of the index
+COMPACT_DELETED_RATIO = 0.2
+
+_WORD_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into lower-cased word terms."""
+    return _WORD_PATTERN.findall(text.lower())
+
+
+def bm25_term_score(tf: int, doc_length: int, average_length: float, idf: float) -> float:
+    """BM25 contribution of one term occurring tf times in a document."""
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_length / average_length) if average_length else BM25_K1
+    return idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+
+def bm25_idf(document_frequency: int, document_count: int) -> float:
+    """BM25 inverse document frequency (always positive)."""
+    return math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StorySearchIndex:
+    """An in-memory inverted index with facets, persisted to a single compressed file."""
+
+    def __init__(self):
+        self.paths: list[str] = []                       # path id -> path
+        self._path_ids: dict[str, int] = {}              # path -> path id
+        self.manifest: dict[str, dict] = {}              # path -> {"mtime", "size", "hash", "docs"}
+        self.docs: list[list] = []                       # doc id -> [path id, segment index, round, text]
+        self.doc_lengths = array("I")
+        self.doc_facets: list[list[int]] = []            # doc id -> value id per facet
+        self.facet_values: dict[str, list[str]] = {name: [] for name in FACET_NAMES}
+        self._facet_value_ids: dict[str, dict[str, int]] = {name: {} for name in FACET_NAMES}
+        self.postings: dict[str, array] = {}             # term -> flat [doc id, tf, doc id, tf, ...]
+        self.deleted: set[int] = set()
+        self.total_length = 0
+
+    # --- Building ---
+
+    def _facet_id(self, name: str, value) -> int:
+        value = str(value) if value not in (None, "") else ""
+        ids = self._facet_value_ids[name]
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = len(self.facet_values[name])
+            self.facet_values[name].append(value)
+            ids[value] = value_id
+        return value_id
+
+    def add_story(self, path: str, story_log: list[dict], metadata: dict) -> list[int]:
+        """Indexes every segment of one story and returns the new document ids."""
+        path_id = self._path_ids.get(path)
+        if path_id is None:
+            path_id = self._path_ids[path] = len(self.paths)
+            self.paths.append(path)
+        doc_ids = []
+        for segment_index, segment in enumerate(story_log):
+            if not isinstance(segment, dict):
+                continue
+            text = segment.get("text", "")
+            if not isinstance(text, str):
+                continue
+            terms = tokenize(text)
+            doc_id = len(self.docs)
+            self.docs.append([path_id, segment_index, segment.get("round", segment_index), text])
+            self.doc_lengths.append(len(terms))
+            self.total_length += len(terms)
+            facets = []
+            for name, source in FACETS.items():
+                kind, key = source.split(":", 1)
+                facets.append(self._facet_id(name, (metadata if kind == "meta" else segment).get(key, "")))
+            self.doc_facets.append(facets)
+            counts: dict[str, int] = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = array("I")
+                postings.append(doc_id)
+                postings.append(tf)
+            doc_ids.append(doc_id)
+        return doc_ids
+
+    def remove_path(self, path: str):
+        """Marks the documents of one file as deleted (compacted later)."""
+        entry = self.manifest.pop(path, None)
+        if entry is None:
+            return
+        for doc_id in entry["docs"]:
+            if doc_id not in self.deleted:
+                self.deleted.add(doc_id)
+                self.total_length -= self.doc_lengths[doc_id]
+
+    def update(self, paths: list[str], genre: str = "", story_format: str = "") -> dict:
+        """
+        Brings the index up to date with story files (and directories of them).
+        Files whose mtime and size are unchanged are skipped without reading;
+        touched files are re-read only if their content hash changed.
+
+        Args:
+            paths (list[str]): Files and/or directories to scan.
+            genre (str): Genre for story logs without metadata.
+            story_format (str): Format for story logs without metadata.
+
+        Returns:
+            dict: {"indexed", "unchanged", "removed", "failed", "segments"} counts.
+        """
+        stats = {"indexed": 0, "unchanged": 0, "removed": 0, "failed": 0, "segments": 0}
+        seen = set()
+        for path in _iter_json_files(paths):
+            path = os.path.abspath(path)
+            seen.add(path)
+            try:
+                info = os.stat(path)
+            except OSError:
+                stats["failed"] += 1
+                continue
+            entry = self.manifest.get(path)
+            if entry and entry["mtime"] == info.st_mtime_ns and entry["size"] == info.st_size:
+                stats["unchanged"] += 1
+                continue
+            digest = _file_digest(path)
+            if entry and entry["hash"] == digest:
+                entry["mtime"], entry["size"] = info.st_mtime_ns, info.st_size
+                stats["unchanged"] += 1
+                continue
+            try:
+                story_log, metadata = read_story_record(path)
+            except (OSError, ValueError) as e: # json.JSONDecodeError is a ValueError
+                print(f"Skipping '{path}': {e}")
+                stats["failed"] += 1
+                continue
+            metadata = dict(metadata)
+            metadata["story_genre"] = metadata.get("story_genre") or genre
+            metadata["story_format"] = metadata.get("story_format") or story_format
+            self.remove_path(path)
+            doc_ids = self.add_story(path, story_log, metadata)
+            self.manifest[path] = {"mtime": info.st_mtime_ns, "size": info.st_size, "hash": digest, "docs": doc_ids}
+            stats["indexed"] += 1
+            stats["segments"] += len(doc_ids)
+
+        # Files that disappeared from a scanned directory
+        scanned_dirs = [os.path.abspath(p) + os.sep for p in paths if os.path.isdir(p)]
+        for path in list(self.manifest):
+            if path not in seen and any(path.startswith(d) for d in scanned_dirs):
+                self.remove_path(path)
+                stats["removed"] += 1
+
+        if self.deleted and len(self.deleted) > COMPACT_DELETED_RATIO * len(self.docs):
+            self.compact()
+        return stats
+
+    def compact(self):
+        """Rebuilds postings, document ids and path ids without the deleted documents."""
+        old_docs, old_facets, old_manifest, old_paths = self.docs, self.doc_facets, self.manifest, self.paths
+        remap = {}
+        self.docs, self.doc_facets, self.doc_lengths = [], [], array("I")
+        self.paths, self._path_ids = [], {}
+        self.postings, self.total_length = {}, 0
+        deleted = self.deleted
+        self.deleted = set()
+        for old_id, doc in enumerate(old_docs):
+            if old_id in deleted:
+                continue
+            new_id = len(self.docs)
+            remap[old_id] = new_id
+            path = old_paths[doc[0]]
+            path_id = self._path_ids.get(path)
+            if path_id is None: # Paths of removed files are dropped with their documents
+                path_id = self._path_ids[path] = len(self.paths)
+                self.paths.append(path)
+            doc[0] = path_id
+            terms = tokenize(doc[3])
+            self.docs.append(doc)
+            self.doc_facets.append(old_facets[old_id])
+            self.doc_lengths.append(len(terms))
+            self.total_length += len(terms)
+            counts: dict[str, int] = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings = self.postings.setdefault(term, array("I"))
+                postings.append(new_id)
+                postings.append(tf)
+        for entry in old_manifest.values():
+            entry["docs"] = [remap[d] for d in entry["docs"] if d in remap]
+
+    # --- Querying ---
+
+    def _allowed_docs(self, filters: dict) -> set[int] | None:
+        """Returns the doc ids matching every facet filter (None = no filters)."""
+        allowed = None
+        for name, wanted in (filters or {}).items():
+            if name not in self.facet_values or wanted in (None, "", []):
+                continue
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+            value_ids = set()
+            for value in wanted:
+                lowered = value.lower()
+                exact = {i for i, v in enumerate(self.facet_values[name]) if v.lower() == lowered}
+                # Fall back to substring matching so era:noir finds "1940s Noir"
+                value_ids |= exact or {i for i, v in enumerate(self.facet_values[name]) if lowered in v.lower()}
+            column = FACET_NAMES.index(name)
+            matching = {doc_id for doc_id, facets in enumerate(self.doc_facets) if facets[column] in value_ids}
+            allowed = matching if allowed is None else allowed & matching
+        return allowed
+
+    def search(self, query: str, filters: dict | None = None, limit: int = 10) -> dict:
+        """
+        Runs a BM25 query, optionally restricted by facet filters.
+
+        Args:
+            query (str): Free text; an empty query lists every document matching the filters.
+            filters (dict): Facet name -> value or list of values (case-insensitive;
+                            substring match if no value matches exactly).
+            limit (int): Maximum hits to return.
+
+        Returns:
+            dict: {"total": int, "hits": [{"path", "segment", "round", "text", "score", <facets>}],
+                   "facets": {facet name: {value: count}}} where facet counts cover all matches.
+        """
+        allowed = self._allowed_docs(filters)
+        live_count = len(self.docs) - len(self.deleted)
+        average_length = self.total_length / live_count if live_count else 0.0
+        scores: dict[int, float] = {}
+        terms = list(dict.fromkeys(tokenize(query)))
+
+        if terms:
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                document_frequency = len(postings) // 2
+                if self.deleted: # Postings of deleted documents stay until compaction; they must not lower the idf
+                    document_frequency -= sum(1 for i in range(0, len(postings), 2) if postings[i] in self.deleted)
+                if not document_frequency:
+                    continue
+                idf = bm25_idf(document_frequency, live_count)
+                for i in range(0, len(postings), 2):
+                    doc_id = postings[i]
+                    if doc_id in self.deleted or (allowed is not None and doc_id not in allowed):
+                        continue
+                    scores[doc_id] = scores.get(doc_id, 0.0) + bm25_term_score(postings[i + 1], self.doc_lengths[doc_id], average_length, idf)
+        else:
+            candidates = allowed if allowed is not None else range(len(self.docs))
+            scores = {doc_id: 0.0 for doc_id in candidates if doc_id not in self.deleted}
+
+        facet_counts = {name: {} for name in FACET_NAMES}
+        for doc_id in scores:
+            for column, name in enumerate(FACET_NAMES):
+                value = self.facet_values[name][self.doc_facets[doc_id][column]]
+                if value:
+                    facet_counts[name][value] = facet_counts[name].get(value, 0) + 1
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        hits = []
+        for doc_id, score in ranked:
+            path_id, segment_index, round_num, text = self.docs[doc_id]
+            hit = {"path": self.paths[path_id], "segment": segment_index, "round": round_num, "text": text, "score": round(score, 4)}
+            for column, name in enumerate(FACET_NAMES):
+                hit[name] = self.facet_values[name][self.doc_facets[doc_id][column]]
+            hits.append(hit)
+        return {"total": len(scores), "hits": hits, "facets": facet_counts}
+
+    # --- Persistence ---
+
+    def save(self, path: str):
+        """Writes the index to a zlib-compressed JSON file (atomically)."""
+        data = {
+            "version": INDEX_VERSION,
+            "paths": self.paths,
+            "manifest": self.manifest,
+            "docs": self.docs,
+            "doc_facets": self.doc_facets,
+            "facet_values": self.facet_values,
+            "postings": {term: postings.tolist() for term, postings in self.postings.items()},
+            "deleted": sorted(self.deleted),
+        }
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), 6))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "StorySearchIndex":
+        """Loads an index written by save(); returns an empty index if the file does not exist."""
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        with open(path, "rb") as f:
+            data = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+        if data.get("version") != INDEX_VERSION:
+            print(f"Warning: index '{path}' has an old format; rebuilding from scratch.")
+            return index
+        index.paths = data["paths"]
+        index._path_ids = {path: path_id for path_id, path in enumerate(index.paths)}
+        index.manifest = data["manifest"]
+        index.docs = data["docs"]
+        index.doc_facets = data["doc_facets"]
+        index.facet_values = data["facet_values"]
+        index._facet_value_ids = {name: {v: i for i, v in enumerate(values)} for name, values in index.facet_values.items()}
+        index.postings = {term: array("I", postings) for term, postings in data["postings"].items()}
+        index.deleted = set(data["deleted"])
+        index.doc_lengths = array("I", (len(tokenize(doc[3])) for doc in index.docs))
+        index.total_length = sum(length for doc_id, length in enumerate(index.doc_lengths) if doc_id not in index.deleted)
+        return index
+
+
+def _iter_json_files(paths: list[str]):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith((".json", ARCHIVE_EXTENSION)) and not name.endswith(".manifest.json"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Index and search saved story logs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = commands.add_parser("index", help="Add new or changed story logs to an index.")
+    index_parser.add_argument("index")
+    index_parser.add_argument("paths", nargs="+", help="Story log files or directories.")
+    index_parser.add_argument("--genre", default="", help="Genre for logs without metadata.")
+    index_parser.add_argument("--format", dest="story_format", default="", help="Format for logs without metadata.")
+
+    query_parser = commands.add_parser("query", help="Search an index.")
+    query_parser.add_argument("index")
+    query_parser.add_argument("text", nargs="?", default="")
+    for name in FACET_NAMES:
+        query_parser.add_argument(f"--{name}", action="append", help=f"Filter on {name} (repeatable).")
+    query_parser.add_argument("--limit", type=int, default=10)
+    query_parser.add_argument("--json", action="store_true", help="Print the raw result as JSON.")
+
+    args = parser.parse_args(argv)
+    index = StorySearchIndex.load(args.index)
+    if args.command == "index":
+        stats = index.update(args.paths, args.genre, args.story_format)
+        index.save(args.index)
+        print(f"✅ Indexed {stats['segments']} segments from {stats['indexed']} files "
+              f"({stats['unchanged']} unchanged, {stats['removed']} removed, {stats['failed']} failed).")
+        return 0
+
+    filters = {name: getattr(args, name) for name in FACET_NAMES if getattr(args, name)}
+    result = index.search(args.text, filters, args.limit)
+    if args.json:
+        print(json.dumps(result, indent=4, ensure_ascii=False))
+        return 0
+    print(f"--- {result['total']} matching segments ---")
+    for hit in result["hits"]:
+        print(f"[{hit['score']:.2f}] {hit['path']} #{hit['segment']} (round {hit['round']}, {hit['genre'] or '?'} {hit['format'] or '?'})")
+        print(f"    {hit['text'][:160]}")
+    for name, counts in result["facets"].items():
+        if counts:
+            top = ", ".join(f"{value} ({count})" for value, count in sorted(counts.items(), key=lambda item: -item[1])[:5])
+            print(f"{name}: {top}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+### STORY TRANSLATION ###
+# Other-language editions of a story, translated segment by segment instead of
+# resending the whole current_story:
+#   - every story_log segment is cached by the hash of its text (and source
+#     language) per target language, so once a story has been translated, the
+#     next edition only pays for the rounds appended since,
+#   - segments still missing are packed into as few Gemini calls as fit a token
+#     budget, each segment tagged <seg id=N> so the reply maps back to segments
+#     (& and < in the text are sent as &amp; and &lt;, so a text cannot close a tag),
+#   - segments a reply drops are retried alone; a segment that still has no
+#     translation (or whose call failed or ran out of the deadline) stays in the
+#     source language, uncached.
+#
+# The cache is one append-only JSON Lines file per target language.
+#
+# Usage:
+#   python story_translation.py translate my_story_log.json --to French [--output my_story.fr.json]
+#   python story_translation.py stats
+
+import os
+import re
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+import threading
+
+import story_co_writer_ai
+from story_records import read_story_record, split_story_record, STORY_METADATA_KEYS
+from story_export import LANGUAGE_CODES
+from token_accounting import estimate_tokens
+from deadlines import MIN_CALL_SECONDS
+
+TRANSLATION_CACHE_DIR = os.getenv("STORY_TRANSLATION_CACHE", ".story_translations")
+SUPPORTED_LANGUAGES = list(LANGUAGE_CODES) # The languages offered at story setup
+TRANSLATION_BATCH_TOKENS = 2500  # Source tokens per call; the reply is about as long again
+TRANSLATION_BATCH_SEGMENTS = 40
+TRANSLATION_CONCURRENCY = 4      # Batches of one story in flight at once
+
+_SEGMENT_PATTERN = re.compile(r'<seg id="?(\d+)"?>(.*?)</seg>', re.DOTALL)
+_ESCAPED_PATTERN = re.compile(r"&(amp|lt);")
+
+
+def segment_key(text: str, source_language: str) -> str:
+    """The cache key of one segment's text in its source language."""
+    return hashlib.sha256(f"{source_language}|{text}".encode("utf-8")).hexdigest()[:32]
+
+
+class TranslationCache:
+    """Segment translations by (segment key, target language), persisted per language."""
+
+    def __init__(self, directory: str = TRANSLATION_CACHE_DIR):
+        self.directory = directory
+        self._entries: dict[str, dict[str, str]] = {} # target language -> key -> translation
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stored": 0}
+
+    def _path(self, language: str) -> str:
+        return os.path.join(self.directory, f"{LANGUAGE_CODES.get(language, re.sub(r'[^a-z0-9]+', '_', language.lower()))}.jsonl")
+
+    def _language(self, language: str) -> dict[str, str]:
+        entries = self._entries.get(language)
+        if entries is None:
+            entries = {}
+            try:
+                with open(self._path(language), "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                            entries[entry["key"]] = entry["text"]
+                        except (ValueError, KeyError, TypeError):
+                            continue # A line cut short by a crash
+            except OSError:
+                pass
+            self._entries[language] = entries
+        return entries
+
+    def get(self, key: str, target_language: str) -> str | None:
+        with self._lock:
+            translation = self._language(target_language).get(key)
+        self.counters["hits" if translation is not None else "misses"] += 1
+        return translation
+
+    def put_many(self, target_language: str, translations: dict[str, str]):
+        """Stores {segment key: translation} and appends them to the language's file."""
+        if not translations:
+            return
+        with self._lock:
+            entries = self._language(target_language)
+            entries.update(translations)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(target_language), "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps({"key": key, "text": text}, ensure_ascii=False) + "\n" for key, text in translations.items()))
+        self.counters["stored"] += len(translations)
+
+    def stats(self) -> dict:
+        """{language: cached segments} for every language file in the directory."""
+        counts = {}
+        for language in SUPPORTED_LANGUAGES:
+            if os.path.exists(self._path(language)):
+                with self._lock:
+                    counts[language] = len(self._language(language))
+        return counts
+
+
+_cache: TranslationCache | None = None
+
+
+def get_translation_cache() -> TranslationCache:
+    """The process-wide translation cache."""
+    global _cache
+    if _cache is None:
+        _cache = TranslationCache()
+    return _cache
+
+
+# --- Batching and Prompts ---
+
+def plan_batches(texts: list[str], language: str = "", max_tokens: int = TRANSLATION_BATCH_TOKENS, max_segments: int = TRANSLATION_BATCH_SEGMENTS) -> list[list[int]]:
+    """
+    Packs texts, in order, into batches of at most max_tokens (estimated) and
+    max_segments each. A text larger than the budget gets a batch of its own.
+
+    Returns:
+        list[list[int]]: The indexes of `texts` in each batch.
+    """
+    batches, current, current_tokens = [], [], 0
+    for index, text in enumerate(texts):
+        tokens = estimate_tokens(text, language)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_segments):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;")
+
+
+def _unescape(text: str) -> str:
+    return _ESCAPED_PATTERN.sub(lambda match: "&" if match.group(1) == "amp" else "<", text)
+
+
+def build_translation_prompt(segments: list[tuple[int, str]], source_language: str, target_language: str, genre: str = "", story_format: str = "") -> str:
+    """
+    Builds the prompt translating tagged story segments.
+
+    Args:
+        segments (list[tuple[int, str]]): (id, text) pairs, in story order.
+        source_language (str): The story's language.
+        target_language (str): The edition's language.
+        genre (str): Story genre, for tone.
+        story_format (str): Story format, for conventions (e.g. screenplay dialogue).
+
+    Returns:
+        str: The prompt.
+    """
+    setting = ", ".join(part for part in (genre, story_format) if part)
+    tagged = "\n".join(f'<seg id="{segment_id}">{_escape(text)}</seg>' for segment_id, text in segments)
+    return (f"Translate these consecutive passages of a {setting + ' ' if setting else ''}story from {source_language} into {target_language}.\n"
+            f"Keep names, tone, formatting and line breaks. Translate every passage completely and add nothing.\n"
+            f'Answer with each translation inside the same <seg id="N"></seg> tags, one per passage, and nothing else.\n'
+            f"Inside the tags, & and < are written &amp; and &lt;; write them the same way.\n\n"
+            f"{tagged}")
+
+
+def parse_translation(ai_raw_response: str, segment_ids) -> dict[int, str]:
+    """The translations found in a reply, by segment id (ids not asked for are ignored)."""
+    wanted = set(segment_ids)
+    translations = {}
+    for match in _SEGMENT_PATTERN.finditer(ai_raw_response):
+        segment_id, text = int(match.group(1)), _unescape(match.group(2).strip())
+        if segment_id in wanted and text:
+            translations[segment_id] = text
+    return translations
+
+
+# --- Translation ---
+
+async def translate_texts(texts: list[str], source_language: str, target_language: str, usage: dict | None = None,
+                          cache: TranslationCache | None = None, model: str = "", genre: str = "", story_format: str = "",
+                          deadline=None) -> tuple[list[str], dict]:
+    """
+    Translates texts, using and filling the translation cache.
+
+    Args:
+        texts (list[str]): Segment texts, in story order.
+        source_language (str): Their language.
+        target_language (str): The language wanted.
+        usage (dict): Optional usage record (see new_usage_counters) to update.
+        cache (TranslationCache): Defaults to the process-wide cache.
+        model (str): Gemini model override (e.g. the economy model).
+        genre (str): Story genre, for tone.
+        story_format (str): Story format.
+        deadline (Deadline): Optional latency budget (see deadlines.py); calls time out at it,
+                             and batches left when it runs out are not sent.
+
+    Returns:
+        tuple[list[str], dict]: The translations (a text that could not be translated is returned
+                                unchanged) and {"segments", "cached", "translated", "failed", "calls"}.
+    """
+    stats = {"segments": len(texts), "cached": 0, "translated": 0, "failed": 0, "calls": 0}
+    if not texts or source_language == target_language:
+        stats["cached"] = len(texts)
+        return list(texts), stats
+    cache = cache or get_translation_cache()
+    keys = [segment_key(text, source_language) for text in texts]
+    results: list[str | None] = [None] * len(texts)
+    missing: dict[str, int] = {} # key -> first index with that text (repeated texts are translated once)
+    for index, key in enumerate(keys):
+        if not texts[index].strip():
+            results[index] = texts[index]
+            continue
+        translation = cache.get(key, target_language) if key not in missing else None
+        if translation is not None:
+            results[index] = translation
+            stats["cached"] += 1
+        else:
+            missing.setdefault(key, index)
+
+    semaphore = asyncio.Semaphore(TRANSLATION_CONCURRENCY)
+
+    async def run_batch(indexes: list[int]) -> dict[int, str]:
+        prompt = build_translation_prompt([(i, texts[i]) for i in indexes], source_language, target_language, genre, story_format)
+        async with semaphore:
+            if deadline is not None and not deadline.allows(MIN_CALL_SECONDS):
+                deadline.degrade("translation_skipped")
+                return {}
+            stats["calls"] += 1
+            raw = (await story_co_writer_ai.call_gemini_api_candidates(prompt, 1, usage, model=model, language=source_language, deadline=deadline))[0]
+        return parse_translation(raw, indexes)
+
+    pending = list(missing.values())
+    batches = [[pending[position] for position in batch] for batch in plan_batches([texts[i] for i in pending], source_language)]
+    translated: dict[int, str] = {}
+    dropped = []
+    for batch, reply in zip(batches, await asyncio.gather(*(run_batch(batch) for batch in batches))):
+        translated.update(reply)
+        if reply: # A reply that skipped some passages; a failed call is not retried
+            dropped += [index for index in batch if index not in reply]
+    for reply in await asyncio.gather(*(run_batch([index]) for index in dropped)):
+        translated.update(reply)
+
+    cache.put_many(target_language, {keys[index]: text for index, text in translated.items()})
+    for index, key in enumerate(keys):
+        if results[index] is None:
+            translation = translated.get(missing[key])
+            if translation is None:
+                stats["failed"] += 1
+                results[index] = texts[index]
+            else:
+                stats["translated"] += 1
+                results[index] = translation
+    return results, stats
+
+
+async def translate_record(record: dict, target_language: str, usage: dict | None = None, cache: TranslationCache | None = None, model: str = "", deadline=None) -> tuple[dict, dict]:
+    """
+    A story record (see story_records.build_story_record) in another language.
+
+    Returns:
+        tuple[dict, dict]: The translated record (story_language set to the target) and the
+                           translate_texts stats.
+    """
+    story_log, metadata = split_story_record(record)
+    positions = [i for i, segment in enumerate(story_log) if isinstance(segment, dict) and isinstance(segment.get("text"), str)]
+    translations, stats = await translate_texts(
+        [story_log[i]["text"] for i in positions], metadata.get("story_language") or "English", target_language,
+        usage, cache, model, metadata.get("story_genre", ""), metadata.get("story_format", ""), deadline
+    )
+    translated_log = list(story_log)
+    for position, text in zip(positions, translations):
+        translated_log[position] = {**story_log[position], "text": text}
+    translated = {**record, **{key: metadata.get(key, "") for key in STORY_METADATA_KEYS}, "story_log": translated_log}
+    translated["story_language"] = target_language
+    return translated, stats
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Translate saved stories segment by segment, with a shared cache.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    translate_parser = commands.add_parser("translate", help="Write another-language edition of a story.")
+    translate_parser.add_argument("story", help="Story log or story record (JSON or archive).")
+    translate_parser.add_argument("--to", dest="target", required=True, choices=SUPPORTED_LANGUAGES)
+    translate_parser.add_argument("--from", dest="source", default="", help="Source language for logs without metadata (default: English).")
+    translate_parser.add_argument("--output", help="Output file (default: next to the story).")
+
+    commands.add_parser("stats", help="Cached segments per language.")
+
+    args = parser.parse_args(argv)
+    if args.command == "stats":
+        for language, count in get_translation_cache().stats().items():
+            print(f"{language}: {count} segments")
+        return 0
+
+    try:
+        story_log, metadata = read_story_record(args.story)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read '{args.story}': {e}")
+        return 1
+    metadata = {**metadata, "story_language": metadata.get("story_language") or args.source or "English"}
+    record = {**metadata, "story_log": story_log}
+    usage = story_co_writer_ai.new_usage_counters()
+    translated, stats = asyncio.run(translate_record(record, args.target, usage))
+    output = args.output or f"{os.path.splitext(args.story)[0]}.{LANGUAGE_CODES[args.target]}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(translated, f, indent=4, ensure_ascii=False)
+    print(f"✅ Wrote '{output}': {stats['translated']} segments translated in {stats['calls']} calls, "
+          f"{stats['cached']} from the cache, {stats['failed']} left untranslated.")
+    return 0 if not stats["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,10 +8,30 @@ time.sleep(1) # Small delay to ensure the print statement appears before other S
 
 import streamlit as st
 import re
+import queue
 import asyncio
+import threading
 import random
 import json
-import httpx # For making asynchronous HTTP requests from Python
+import story_co_writer_ai
+from story_co_writer_ai import new_usage_counters
+from context_cache import StoryContextCache, summarize_token_usage
+from story_records import build_story_record, build_story_context, append_story_segment
+from suggestion_diversity import SketchIndex, rerolls_avoided_rate
+from session_store import SessionStore, new_resume_token, SESSION_CLEANUP_EVERY_SECONDS
+from worker_pool import run_job
+from token_accounting import plan_generation, record_usage_delta, usage_cost, estimate_tokens, INSTRUCTION_TOKENS_ESTIMATE
+from model_router import get_router
+from image_pipeline import ImagePipeline
+from ending_pregen import BackgroundLoop, should_pregenerate
+from diagnostics import get_diagnostics, ADMIN_TOKEN
+from story_rooms import RoomRegistry, apply_room_events, new_room_id, valid_room_id
+from story_export import ExportPipeline, DEFAULT_EXPORTS, EXPORT_EXTENSIONS, EXPORT_MIME_TYPES, export_file_name
+from story_translation import SUPPORTED_LANGUAGES
+from deadlines import Deadline, IMAGE_MIN_SECONDS
+from story_retrieval import StoryRetrievalIndex
+from cover_variants import generate_variants, COVER_VARIANT_COUNT
+from warm_pool import WarmPool, WARM_POOL_SESSION
 
 # --- API Configuration ---
 # IMPORTANT: The API key should NOT be hardcoded in production.
@@ -105,300 +125,20 @@ QUIZ_QUESTIONS = [ # From ai-story-co-writer-python-local-exec
 ]
 
 
-# --- API Call Functions (from ai-story-co-writer-python-local-exec) ---
+# --- AI Engine Wiring ---
+# The Gemini/Imagen calls, prompts and parsers live in story_co_writer_ai so that
+# they can be reused outside Streamlit. Point the engine at this app's settings.
+if '__api_key' in globals(): # Check if running in Canvas environment
+    API_KEY = globals()['__api_key']
+if API_KEY:
+    story_co_writer_ai.API_KEY = API_KEY
+story_co_writer_ai.set_reporters(error=st.error, info=st.info)
 
-async def call_gemini_api(prompt_text: str) -> str:
-    """
-    Makes an asynchronous call to the Gemini API (text generation model) to generate content.
-    Uses httpx for HTTP requests.
-
-    Args:
-        prompt_text (str): The prompt string to send to the AI.
-
-    Returns:
-        str: The AI's generated response text.
-    """
-    api_key_to_use = API_KEY
-    if '__api_key' in globals(): # Check if running in Canvas environment
-        api_key_to_use = globals()['__api_key']
-
-    if not api_key_to_use:
-        st.error("Error: API key is not configured. Please set the API_KEY variable or ensure Canvas provides it.")
-        return "API Key Error"
-
-    chat_history = [{'role': 'user', 'parts': [{'text': prompt_text}]}]
-    payload = {'contents': chat_history}
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key_to_use}";
-
-    try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                api_url,
-                headers={'Content-Type': 'application/json'},
-                json=payload # httpx handles JSON payload directly
-            )
-            response.raise_for_status()
-
-            result = response.json()
-            candidates = result.get('candidates', [])
-            if candidates:
-                content = candidates[0].get('content', {})
-                parts = content.get('parts', [])
-                if parts and 'text' in parts[0]:
-                    return parts[0]['text']
-            
-            st.error(f'Unexpected API response structure: {result}')
-            return "Sorry, I couldn't get a clear response from the AI. Please try again!"
-
-    except httpx.RequestError as error:
-        st.error(f'Error calling Gemini API: {error}')
-        return f"ERROR: Failed to connect to AI. Details: {error}. Make sure your API key is correctly entered and you have an internet connection."
-    except Exception as error:
-        st.error(f'An unexpected error occurred: {error}')
-        return f"An unexpected error occurred: {error}"
-
-async def call_imagen_api(prompt_text: str) -> str:
-    """
-    Calls the Imagen API (image generation model) to generate an image.
-    Uses httpx for HTTP requests.
-
-    Args:
-        prompt_text (str): The prompt string for the image generation.
-
-    Returns:
-        str: A base64 image URL or a placeholder URL if generation fails.
-    """
-    api_key_to_use = API_KEY
-    if '__api_key' in globals(): # Check if running in Canvas environment
-        api_key_to_use = globals()['__api_key']
-
-    if not api_key_to_use:
-        st.error("Error: API key is not configured for Imagen. Please set the API_KEY variable.")
-        return f"https://placehold.co/400x200/505050/FFFFFF?text=API+Key+Missing" # Fallback for display
-
-
-    payload = {"instances": {"prompt": prompt_text}, "parameters": {"sampleCount": 1}}
-    apiUrl = f"https://generativelanguage.googleapis.com/v1beta/models/imagen-3.0-generate-002:predict?key={api_key_to_use}";
-
-    st.info(f"Generating visual concept for: '{prompt_text}'...") # Informative message for user
-    await asyncio.sleep(4) # Simulate longer network delay for image generation
-
-    try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                apiUrl,
-                headers={'Content-Type': 'application/json'},
-                json=payload # httpx handles JSON payload directly
-            )
-            response.raise_for_status()
-
-            result = response.json()
-            if result.get('predictions') and len(result['predictions']) > 0 and result['predictions'][0].get('bytesBase64Encoded'):
-                return f"data:image/png;base64,{result['predictions'][0]['bytesBase64Encoded']}"
-            else:
-                st.error(f'Unexpected Imagen API response structure: {result}');
-                return f"https://placehold.co/400x200/FF0000/FFFFFF?text=Image+Gen+Failed"; # Generic failure placeholder
-    except httpx.RequestError as error:
-        st.error(f'Error calling Imagen API: {error}');
-        return f"https://placehold.co/400x200/FF0000/FFFFFF?text=API+Error"; # Connection error placeholder
-    except Exception as error:
-        st.error(f'An unexpected error occurred: {error}');
-        return f"An unexpected error occurred: {error}"
-
-
-# --- Core Project Functions (Adapted from ai-story-co-writer-python-local-exec) ---
-
-async def generate_gemini_suggestions(story_context: str, language: str, genre: str, story_format: str, tone_command: str = "", aesthetic_style: str = "", era_style: str = "") -> list[tuple[str, str]]:
-    """
-    Generates dynamic story suggestions (continuations, character ideas, plot twists)
-    by prompting the Gemini API, respecting the chosen language, genre, character details,
-    story format, optional tone command, aesthetic style, and era/style.
-    Each suggestion includes a commentary, and a visual concept is also generated.
-
-    Args:
-        story_context (str): The current story content to base suggestions on.
-        language (str): The language the AI should generate the response in.
-        genre (str): The chosen genre of the story.
-        story_format (str): The chosen format of the story (Novel, Screenplay, etc.).
-        tone_command (str): An optional command to influence the tone of the next generation.
-        aesthetic_style (str): Optional aesthetic style (e.g., "20th-century aesthetic").
-        era_style (str): Optional era/style reference (e.g., "1940s Noir").
-
-    Returns:
-        list[tuple[str, str]]: A list of tuples, where each tuple contains (suggestion_text, commentary).
-                                Expected to return 5 tuples (3 continuations + 1 bonus idea + 1 visual concept).
-    """
-    # --- AI Prompt Engineering for Suggestions ---
-    tone_instruction = f"Also, {tone_command} the next part of the story." if tone_command else "";
-
-    writer_persona = f"award-winning {story_format.lower()} writer";
-    aesthetic_instruction = "";
-    if aesthetic_style == "20th-century aesthetic":
-        aesthetic_instruction = f"Write in the style of a classic 20th-century {story_format.lower()} from the 1930s-1980s, emulating the language, structure, and tone of that era.";
-    
-    era_style_instruction = "";
-    if era_style:
-        era_style_instruction = f"Emulate the stylistic elements of a {era_style}.";
-
-    # Determine the type of visual concept to ask for
-    visual_concept_type_prompt = "";
-    if story_format == "Novel":
-        visual_concept_type_prompt = "book cover concept";
-    elif story_format == "Short Story":
-        visual_concept_type_prompt = "magazine cover concept";
-    elif story_format == "Screenplay":
-        visual_concept_type_prompt = "movie poster concept";
-    elif story_format == "Television Script":
-        visual_concept_type_prompt = "TV show title card concept";
-    elif story_format == "Play":
-        visual_concept_type_prompt = "playbill poster concept";
-    
-    visual_concept_instruction = "";
-    if visual_concept_type_prompt:
-        visual_concept_instruction = f"Also describe what a 20th-century-style {visual_concept_type_prompt} would look like for this story. Use vivid visual language.";
-
-
-    prompt = f"""
-You are an {writer_persona} helping a user co-write a suspenseful, engaging, and fun story. The user will pick from your suggestions.
-
-The story genre is {genre}. Write in {language}.
-Provide 3 vivid {story_format.lower()} continuation options (1-2 sentences max), each followed by a 'Commentary:' line explaining the creative choice.
-Also suggest 1 'Bonus Idea' that introduces a surprise twist or new character, followed by its own 'Commentary:' line.
-{tone_instruction}
-{aesthetic_instruction}
-{era_style_instruction}
-
-Use a tone appropriate to the current mood and {genre} conventions. Be playful, mysterious, or dramatic when fitting.
-
-Format exactly like this:
-1. [Continuation 1]
-Commentary: [Explanation]
-2. [Continuation 2]
-Commentary: [Explanation]
-3. [Continuation 3]
-Commentary: [Explanation]
-Bonus Idea: [Plot twist or new character]
-Commentary: [Explanation]
-{visual_concept_instruction}
-
-Story so far:
----
-{story_context}
----
-""";
-    ai_raw_response = await call_gemini_api(prompt);
-
-    # --- Parsing AI Response for Suggestions and Commentary ---
-    parsed_suggestions = [];
-    lines = [line.strip() for line in ai_raw_response.strip().split('\n') if line.strip()]; # Clean and split
-
-    i = 0;
-    while i < len(lines):
-        # Match numbered suggestions
-        match_suggestion = re.match(r'^\d+\.\s*(.*)$', lines[i]);
-        # Match Bonus Idea
-        match_bonus = re.match(r'^Bonus Idea:\s*(.*)$', lines[i], re.IGNORECASE);
-        # Match Visual Concept - now explicitly looking for the new prompt wording
-        match_visual_concept_output = re.match(r'^(Visual Concept:.*?)$', lines[i], re.IGNORECASE);
-
-
-        current_line_is_suggestion_or_bonus = False;
-        suggestion_text = "";
-
-        if match_suggestion:
-            suggestion_text = match_suggestion.group(1).strip();
-            current_line_is_suggestion_or_bonus = True;
-        elif match_bonus:
-            suggestion_text = "Bonus Idea: " + match_bonus.group(1).strip();
-            current_line_is_suggestion_or_bonus = True;
-        elif match_visual_concept_output: # This means it's the actual output of the visual concept
-            suggestion_text = match_visual_concept_output.group(1).strip();
-        else:
-            i += 1;
-            continue; # Skip line if it's not a recognizable suggestion or visual concept
-
-        # Move to the next line to check for commentary
-        i += 1; 
-        commentary_text = "No commentary provided."; # Default if not found
-
-        if i < len(lines) and lines[i].lower().startswith("commentary:"):
-            commentary_text = re.sub(r'^commentary:\s*', '', lines[i], flags=re.IGNORECASE).strip();
-            i += 1; # Move to the next line after commentary
-        else:
-            # If no commentary found, stay on the current line or move past the suggestion
-            pass; 
-        
-        parsed_suggestions.append((suggestion_text, commentary_text));
-
-
-    # Ensure we return exactly 5 tuples (3 main + 1 bonus + 1 visual concept), even if parsing fails partially.
-    # This robust padding ensures display functions don't error out.
-    if len(parsed_suggestions) < 5:
-        print(f"Warning: Expected 5 suggestions with commentary (3 main, 1 bonus, 1 visual), got {len(parsed_suggestions)}. Raw response:\n{ai_raw_response}");
-        while len(parsed_suggestions) < 3: # Pad main suggestions
-            parsed_suggestions.append((f"AI continuation {len(parsed_suggestions)+1} (fallback)", "No commentary."));
-        if len(parsed_suggestions) < 4: # Pad bonus idea
-            parsed_suggestions.append(("Bonus Idea (fallback)", "No commentary."));
-        if len(parsed_suggestions) < 5: # Pad visual concept
-            parsed_suggestions.append(("Visual Concept: Placeholder image idea.", "No commentary."));
-
-
-    return parsed_suggestions[:5]; # Return exactly the first 5 if more were somehow parsed
-
-
-async def generate_gemini_endings(story_context: str, language: str, genre: str, story_format: str, aesthetic_style: str = "", era_style: str = "") -> list[str]:
-    """
-    Generates distinct story endings by prompting the Gemini API, respecting
-    the chosen language, genre, story format, aesthetic style, and era/style.
-
-    Args:
-        story_context (str): The current story content to base endings on.
-        language (str): The language the AI should generate the response in.
-        genre (str): The chosen genre of the story.
-        story_format (str): The chosen format of the story (Novel, Screenplay, etc.).
-        aesthetic_style (str): Optional aesthetic style (e.g., "20th-century aesthetic").
-        era_style (str): Optional era/style reference (e.g., "1940s Noir").
-
-    Returns:
-        list[str]: A list of 2-3 distinct AI-generated ending texts.
-    """
-    writer_persona = f"award-winning {story_format.lower()} writer";
-    aesthetic_instruction = "";
-    if aesthetic_style == "20th-century aesthetic":
-        aesthetic_instruction = f"Write in the style of a classic 20th-century {story_format.lower()} from the 1930s-1980s, emulating the language, structure, and tone of that era.";
-    
-    era_style_instruction = "";
-    if era_style:
-        era_style_instruction = f"Emulate the stylistic elements of a {era_style}.";
-
-    prompt = f"""
-You are an {writer_persona} helping a user conclude their suspenseful, engaging, and fun story. The user will pick from your suggested endings.
-
-The story genre is {genre}. Write in {language}.
-Provide 2-3 distinct and concise {story_format.lower()} ending options (1-3 sentences max each). Each ending should offer a different resolution or emotional tone (e.g., triumphant, bittersweet, mysterious, conclusive).
-{aesthetic_instruction}
-{era_style_instruction}
-
-Format exactly as a numbered list:
-1. [Ending 1]
-2. [Ending 2]
-3. [Ending 3] (Optional, if you have a third distinct idea)
-
-Story so far:
----
-{story_context}
----
-""";
-    ai_raw_response = await call_gemini_api(prompt);
-
-    # Parsing AI Response for Endings
-    endings = re.findall(r'^\d+\.\s*(.*)$', ai_raw_response, re.MULTILINE);
-
-    if not endings:
-        print(f"Warning: No endings parsed from AI response. Raw response:\n{ai_raw_response}");
-        return ["A mysterious silence fell, leaving the story unfinished.", "The end, for now."]; # Fallback endings
-    
-    return endings;
+# Batched mode asks for suggestions, the visual concept and ending candidates in
+# one multi-candidate call; later "Roll Alternate Endings" clicks are served from
+# the stored ending pool until it runs out.
+BATCHED_GENERATION = True
+ENDINGS_PER_ROLL = 3
 
 
 # --- Helper Functions for Streamlit State Management (from ai-story-co-writer-python-local-exec) ---
@@ -413,6 +153,8 @@ def initialize_session_state():
         st.session_state.suggestions_with_commentary = []
     if 'generated_image_url' not in st.session_state:
         st.session_state.generated_image_url = ""
+    if 'cover_image_url' not in st.session_state: # Latest generated image, kept as the export cover
+        st.session_state.cover_image_url = ""
     if 'main_character_name' not in st.session_state:
         st.session_state.main_character_name = ""
     if 'main_character_role' not in st.session_state:
@@ -429,29 +171,178 @@ def initialize_session_state():
         st.session_state.era_style = ""
     if 'round_number' not in st.session_state:
         st.session_state.round_number = 0
+    if 'story_version' not in st.session_state: # Bumped by every story change; keys pre-generated results
+        st.session_state.story_version = 0
     if 'story_creation_complete' not in st.session_state:
         st.session_state.story_creation_complete = False # Flag to control UI stages
     if 'alternate_endings' not in st.session_state: # NEW: for storing alternate endings
         st.session_state.alternate_endings = []
     if 'story_concluded' not in st.session_state: # NEW: flag to indicate story is finished
         st.session_state.story_concluded = False
+    if 'ending_pool' not in st.session_state: # Batched ending candidates not yet shown
+        st.session_state.ending_pool = []
+    if 'ending_pool_version' not in st.session_state: # Story version the ending pool was generated for
+        st.session_state.ending_pool_version = -1
+    if '_pregen_endings' not in st.session_state: # (story version, Future) of background-generated endings
+        st.session_state._pregen_endings = None
+    if '_cover_variants' not in st.session_state: # Cover variants of the current concept, until one is picked
+        st.session_state._cover_variants = None
+    if 'api_usage' not in st.session_state: # Upstream calls and context bytes for this story
+        st.session_state.api_usage = new_usage_counters()
+    if 'context_cache' not in st.session_state: # Upstream cached prompt prefix for this story
+        st.session_state.context_cache = StoryContextCache()
+    if 'sketch_index' not in st.session_state: # MinHash sketches of recent story segments
+        st.session_state.sketch_index = SketchIndex()
+    if 'retrieval_index' not in st.session_state: # BM25 index and entity table of the story's segments
+        st.session_state.retrieval_index = StoryRetrievalIndex()
 
 
 def update_story_log(chosen_text: str, contributor: str = "User", suggestion_type: str = ""):
-    """Appends a new segment to the story log."""
-    st.session_state.round_number += 1
-    st.session_state.story_log.append({
-        "round": st.session_state.round_number,
-        "text": chosen_text,
-        "contributor": contributor,
-        "type": suggestion_type if contributor == "AI" else "User Input"
-    })
-    # Update current_story string for display
-    if st.session_state.current_story and not st.session_state.current_story.strip().endswith(('.', '!', '?', '\n', ' ')):
-        separator = ". "
-    else:
-        separator = ""
-    st.session_state.current_story += separator + chosen_text.strip()
+    """Appends a new segment to the story log (see story_records.append_story_segment), or to the shared room's."""
+    room = current_room()
+    if room is None:
+        append_story_segment(st.session_state, chosen_text, contributor, suggestion_type)
+        return
+    if room.append(chosen_text, contributor, suggestion_type, expected_version=st.session_state.story_version) is None:
+        st.toast("✍️ Another writer added to the story first; here is the latest version.")
+    sync_room() # Our own segment comes back as a room event, like everyone else's
+
+
+# --- Session Persistence (survives deploys and crashes) ---
+
+async def _clean_up_sessions(store: SessionStore, context_caches: dict):
+    """
+    Deletes expired session files and unreferenced image blobs at startup, then every few hours,
+    and closes the context caches of sessions whose file is gone.
+    """
+    while True:
+        try:
+            removed = await asyncio.to_thread(store.cleanup)
+            if removed:
+                print(f"Removed {removed} expired sessions.")
+        except OSError as error:
+            print(f"Warning: session cleanup failed: {error}")
+        for token in list(context_caches):
+            if not store.exists(token):
+                await context_caches.pop(token).close()
+        await asyncio.sleep(SESSION_CLEANUP_EVERY_SECONDS)
+
+
+@st.cache_resource
+def get_session_store() -> SessionStore:
+    """One SessionStore per server process, shared by every browser session."""
+    store = SessionStore()
+    get_background_loop().submit(_clean_up_sessions(store, get_context_caches()))
+    return store
+
+
+@st.cache_resource
+def get_context_caches() -> dict:
+    """Every session's context cache by resume token, for the session cleanup to close."""
+    return {}
+
+
+@st.cache_resource
+def get_export_pipeline() -> ExportPipeline:
+    """One export process pool per server process, shared by every browser session."""
+    return ExportPipeline()
+
+
+@st.cache_resource
+def get_image_pipeline() -> ImagePipeline:
+    """One image rendition cache per server process, shared by every browser session."""
+    return ImagePipeline()
+
+
+@st.cache_resource
+def get_background_loop() -> BackgroundLoop:
+    """One background event loop per server process, for work that outlives a script rerun."""
+    return BackgroundLoop()
+
+
+@st.cache_resource
+def get_warm_pool() -> WarmPool:
+    """One stock of ready-made opening rounds per server process, shared by every browser session."""
+    return WarmPool()
+
+
+@st.cache_resource
+def get_room_registry() -> RoomRegistry:
+    """The shared writing rooms of this server process."""
+    return RoomRegistry()
+
+
+def resume_or_start_session() -> bool:
+    """
+    Gives this browser session a resume token (kept in the URL as ?resume=...).
+    On the first run of a reconnecting session, restores its saved snapshot.
+
+    Returns:
+        bool: True if a saved session was restored on this run.
+    """
+    if 'resume_token' in st.session_state:
+        return False
+    token = st.query_params.get("resume", "")
+    restored = bool(token) and get_session_store().restore(token, st.session_state)
+    if not restored:
+        token = new_resume_token()
+    st.session_state.resume_token = token
+    st.query_params["resume"] = token
+    return restored
+
+
+def rebuild_session_indexes():
+    """Recreates per-session helpers that are derived from the story rather than persisted."""
+    st.session_state.sketch_index = SketchIndex()
+    for segment in st.session_state.story_log:
+        st.session_state.sketch_index.add(segment.get("text", ""))
+    st.session_state.retrieval_index = StoryRetrievalIndex()
+    st.session_state.retrieval_index.sync(st.session_state.story_log)
+
+
+def save_session_snapshot():
+    """Writes the changes since the last snapshot (cheap when nothing changed)."""
+    get_session_store().save(st.session_state.resume_token, st.session_state)
+
+
+# --- Shared Writing Rooms (see story_rooms.py) ---
+
+ROOM_POLL_SECONDS = 2 # How often an idle page checks its room for other writers' changes
+
+def current_room():
+    """The shared room this session writes in, or None for a solo story."""
+    subscription = st.session_state.get("_room_subscription")
+    return subscription.room if subscription is not None else None
+
+
+def join_room():
+    """Joins the room named by ?room=... (seeding it with this session's story if it is empty) and catches up."""
+    room_id = st.query_params.get("room", "")
+    if not valid_room_id(room_id):
+        st.session_state._room_subscription = None
+        return
+    subscription = st.session_state.get("_room_subscription")
+    if subscription is None or subscription.room.room_id != room_id:
+        room = get_room_registry().open(room_id)
+        if st.session_state.story_creation_complete:
+            room.seed(st.session_state) # No-op if the room already has a story: we adopt it below
+        st.session_state._room_subscription = room.subscribe()
+    sync_room()
+
+
+def sync_room():
+    """Applies the room's events since this session last looked."""
+    subscription = st.session_state.get("_room_subscription")
+    if subscription is not None:
+        apply_room_events(st.session_state, subscription.poll())
+
+
+def _watch_room():
+    """Reruns the page when other writers changed the room (runs every ROOM_POLL_SECONDS as a fragment)."""
+    subscription = st.session_state.get("_room_subscription")
+    busy = st.session_state.get('_generating_suggestions', False) or st.session_state.get('_generating_endings', False)
+    if subscription is not None and subscription.pending() and not busy:
+        st.rerun()
 
 
 # --- Story Generation Logic (Adapted for Streamlit) ---
@@ -460,17 +351,352 @@ def get_story_context_streamlit(main_character_name: str, main_character_role: s
     """
     Prepares and returns the current story content as context for the AI,
     including character details, genre, format, aesthetic style, and era/style.
-    Uses st.session_state.current_story.
+    Uses st.session_state.current_story, or for a story over the context budget its
+    tail plus the most relevant earlier segments (see story_records.build_story_context).
     """
-    aesthetic_line = f"Aesthetic Style: {aesthetic_style}.\n" if aesthetic_style else ""
-    era_style_line = f"Era/Stylistic Reference: {era_style}.\n" if era_style else ""
+    return build_story_context({
+        "main_character_name": main_character_name,
+        "main_character_role": main_character_role,
+        "story_genre": story_genre,
+        "story_format": story_format,
+        "aesthetic_style": aesthetic_style,
+        "era_style": era_style,
+        "current_story": st.session_state.current_story,
+        "story_log": st.session_state.story_log,
+        "retrieval_index": st.session_state.retrieval_index,
+    })
+
+RECENT_SEGMENTS_PER_JOB = 50 # Story segments sent along so a worker can filter near-duplicates
+
+def _job_payload(story_context: str, **fields) -> dict:
+    """
+    Builds the JSON payload of a generation job (see worker_pool.run_job). In
+    multi-worker mode the job may run in another process, so it carries the
+    session's resume token and its recent segments instead of live helpers.
+    """
+    return {
+        "session": st.session_state.resume_token,
+        "story_context": story_context,
+        "language": st.session_state.story_language,
+        "genre": st.session_state.story_genre,
+        "story_format": st.session_state.story_format,
+        "aesthetic_style": st.session_state.aesthetic_style,
+        "era_style": st.session_state.era_style,
+        "recent_segments": [segment.get("text", "") for segment in st.session_state.story_log[-RECENT_SEGMENTS_PER_JOB:]],
+        **fields,
+    }
+
+
+def _session_helpers() -> dict:
+    # A retrieved context changes from round to round, so it has no stable prefix to cache upstream
+    retrieving = st.session_state.retrieval_index.exceeds()
+    return {
+        "usage": st.session_state.api_usage,
+        "context_cache": None if retrieving else st.session_state.context_cache,
+        "sketch_index": st.session_state.sketch_index,
+    }
+
+
+def _plan_budget(story_context: str, candidate_count: int = 1) -> dict:
+    """Applies the session budget (see token_accounting.plan_generation), telling the writer when it bites."""
+    plan = plan_generation(st.session_state.api_usage, story_context, st.session_state.story_language, candidate_count)
+    if plan["status"] == "economy":
+        st.toast("💸 This story is close to its budget: using a shorter context and a lighter model.")
+    elif plan["status"] == "offline":
+        st.toast("💸 This story has used its budget: suggestions now come from the offline model.")
+    return plan
+
+
+def _route_request(purpose: str, plan: dict) -> dict:
+    """Picks the model for one request (see model_router) within the budget plan."""
+    prompt_tokens = estimate_tokens(plan["story_context"], st.session_state.story_language) + INSTRUCTION_TOKENS_ESTIMATE
+    return get_router().route(purpose, st.session_state.round_number, prompt_tokens, plan["status"], st.session_state.resume_token)
+
+
+def _routed_model(decision: dict) -> str:
+    """The job's "model" field: empty for the default models so text rounds keep using the context cache."""
+    if decision["model"] in (story_co_writer_ai.GEMINI_MODEL, story_co_writer_ai.IMAGEN_MODEL):
+        return ""
+    return decision["model"]
+
+
+async def _run_billed_job(kind: str, payload: dict, decision: dict | None = None, **helpers):
+    """Runs a generation job, appends the usage it added to the billing ledger and reports the routing outcome."""
+    before = dict(st.session_state.api_usage)
+    started = time.perf_counter()
+    try:
+        return await run_job(kind, payload, **helpers)
+    finally:
+        record_usage_delta(st.session_state.resume_token, before, st.session_state.api_usage)
+        if decision is not None:
+            get_router().record_outcome(decision, time.perf_counter() - started, before, st.session_state.api_usage)
+
+
+def _translate_for_export(record: dict, language: str) -> dict:
+    """A story record in another language for a manuscript; segments translated before come from the cache."""
+    plan = _plan_budget(st.session_state.current_story)
+    if plan["status"] == "offline":
+        st.warning(f"This story has used its budget, so the manuscript stays in {st.session_state.story_language}.")
+        return record
+    deadline = Deadline("translate")
+    payload = {"session": st.session_state.resume_token, "record": record, "target_language": language, "model": plan["model"],
+               "deadline": deadline.to_payload()}
+    usage = new_usage_counters() # The job runs on the background loop, off the session state
+    with st.spinner(f"Translating the story into {language}..."):
+        try:
+            result = get_background_loop().submit(run_job("translate", payload, usage=usage, deadline=deadline)).result()
+        finally:
+            _bill_background_usage(usage)
+            deadline.finish(st.session_state.resume_token)
+    if result["stats"]["failed"]:
+        st.warning(f"{result['stats']['failed']} passages could not be translated and stay in {st.session_state.story_language}.")
+    return result["record"]
+
+
+# --- Ending Pre-generation (see ending_pregen.py) ---
+
+async def _pregenerate_endings(payload: dict, usage: dict, decision: dict, api_usage: dict, session: str) -> list[str]:
+    """
+    Runs on the background loop with its own usage record. It is billed to the session's
+    api_usage when the job stops (done, failed or cancelled), so a dropped set is
+    billed once, with what its call finally used.
+    """
+    started = time.perf_counter()
+    try:
+        return await run_job("endings", payload, usage=usage)
+    finally:
+        get_router().record_outcome(decision, time.perf_counter() - started, new_usage_counters(), usage)
+        _add_usage(api_usage, session, usage)
+
+
+def _maybe_pregenerate_endings():
+    """Starts generating endings for the current story version in the background once the story nears its climax."""
+    pending = st.session_state._pregen_endings
+    if pending and pending["version"] == st.session_state.story_version:
+        return
+    _drop_pregenerated_endings()
+    if not should_pregenerate(st.session_state.story_log):
+        return
+    story_context = get_story_context_streamlit(
+        st.session_state.main_character_name,
+        st.session_state.main_character_role,
+        st.session_state.story_genre,
+        st.session_state.story_format,
+        st.session_state.aesthetic_style,
+        st.session_state.era_style
+    )
+    candidate_count = story_co_writer_ai.BATCH_CANDIDATE_COUNT if BATCHED_GENERATION else 1
+    plan = plan_generation(st.session_state.api_usage, story_context, st.session_state.story_language, candidate_count)
+    if plan["status"] != "ok": # No speculative spend once the budget is tight
+        return
+    decision = _route_request("endings", plan)
+    usage = new_usage_counters()
+    payload = _job_payload(plan["story_context"], candidate_count=candidate_count, model=_routed_model(decision))
+    st.session_state._pregen_endings = {
+        "version": st.session_state.story_version,
+        "future": get_background_loop().submit(_pregenerate_endings(
+            payload, usage, decision, st.session_state.api_usage, st.session_state.resume_token
+        )),
+    }
+
+
+_usage_lock = threading.Lock() # Background jobs bill from the background loop's thread
+
+
+def _add_usage(api_usage: dict, session: str, usage: dict):
+    """Adds a job's usage record to a session's usage record and the billing ledger (from any thread)."""
+    with _usage_lock:
+        before = dict(api_usage)
+        for key, value in usage.items():
+            api_usage[key] = api_usage.get(key, 0) + value
+        record_usage_delta(session, before, api_usage)
+
+
+def _bill_background_usage(usage: dict):
+    """Adds the usage of work done on the background loop to the session and the billing ledger."""
+    _add_usage(st.session_state.api_usage, st.session_state.resume_token, usage)
+
+
+def _drop_pregenerated_endings():
+    """Discards (and cancels, if still running) a pre-generated set; the job bills itself when it stops."""
+    pending = st.session_state._pregen_endings
+    if pending:
+        st.session_state._pregen_endings = None
+        pending["future"].cancel()
+
+
+async def _take_pregenerated_endings() -> list[str] | None:
+    """Returns the pre-generated endings if they match the current story version, waiting for them if needed."""
+    pending = st.session_state._pregen_endings
+    if not pending:
+        return None
+    if pending["version"] != st.session_state.story_version:
+        _drop_pregenerated_endings()
+        return None
+    st.session_state._pregen_endings = None
+    try:
+        return await asyncio.wrap_future(pending["future"])
+    except Exception as error:
+        print(f"Warning: ending pre-generation failed, generating on demand: {error}")
+        return None
+
+# --- Suggestion Sets (shared by a room's members) ---
+
+async def _room_generation(kind: str, payload: dict, usage: dict, decision: dict) -> dict:
+    """Runs on the background loop so the room's generation outlives the rerun of the member who started it."""
+    sketch_index = SketchIndex() # The room's recent segments, as a worker in another process would rebuild them
+    for text in payload["recent_segments"]:
+        sketch_index.add(text)
+    started = time.perf_counter()
+    try:
+        result = await run_job(kind, payload, usage=usage, sketch_index=sketch_index)
+    finally:
+        get_router().record_outcome(decision, time.perf_counter() - started, new_usage_counters(), usage)
+    return result if kind == "round" else {"suggestions": result, "endings": []}
+
+
+async def _generate_suggestion_set(payload: dict, decision: dict, deadline: Deadline | None = None) -> tuple[list, list]:
+    """
+    Generates the suggestions (and, batched, the ending candidates) for the current
+    story version. In a room, one generation serves every member: the member who
+    starts it pays for it, the others wait for the same result (which keeps to the
+    deadline in the starter's payload).
+    """
+    kind = "round" if BATCHED_GENERATION else "suggestions"
+    room = current_room()
+    if room is None:
+        result = await _run_billed_job(kind, payload, decision=decision, deadline=deadline, **_session_helpers())
+        return (result["suggestions"], result["endings"]) if BATCHED_GENERATION else (result, [])
+    usage = new_usage_counters()
+    generation, started = room.generation_for(
+        st.session_state.story_version,
+        lambda: get_background_loop().submit(_room_generation(kind, payload, usage, decision))
+    )
+    if generation is None: # Another writer moved the story on meanwhile
+        sync_room()
+        return [], []
+    try:
+        result = await asyncio.wrap_future(generation)
+    finally:
+        if started:
+            _bill_background_usage(usage)
+    return result["suggestions"], result["endings"]
+
+# --- Cover Variants (see cover_variants.py) ---
+
+async def _cover_variants_job(concept: str, poster_mood: str, era_style: str, count: int, include_described: bool,
+                              base_payload: dict, decision: dict, deadline: Deadline, usage: dict, arrivals: queue.Queue):
+    """
+    Runs on the background loop: puts (label, url) on `arrivals` as each variant
+    arrives, then None. Variants run in parallel, each job from its own usage
+    record, summed into `usage` for the script thread to bill.
+    """
+    async def billed(kind: str, payload: dict):
+        job_usage = new_usage_counters()
+        started = time.perf_counter()
+        try:
+            return await run_job(kind, payload, usage=job_usage, deadline=deadline)
+        finally:
+            for key, value in job_usage.items(): # Jobs finish on this loop's thread, one at a time
+                usage[key] = usage.get(key, 0) + value
+            get_router().record_outcome(decision, time.perf_counter() - started, new_usage_counters(), job_usage)
+
+    async def run_image(prompt: str) -> str:
+        return await billed("image", {**base_payload, "prompt": prompt})
+
+    async def run_samples(prompt: str, sample_count: int) -> list[str]:
+        return await billed("image_samples", {**base_payload, "prompt": prompt, "sample_count": sample_count})
+
+    try:
+        async for _, label, url in generate_variants(run_image, run_samples, concept, poster_mood, era_style, count=count, include_described=include_described):
+            arrivals.put((label, url))
+    finally:
+        arrivals.put(None)
+
+
+def _generate_cover_variants_gui(concept: str, slots: list) -> list[dict]:
+    """
+    Generates cover variants of a visual concept on the background loop, showing
+    each in the next free slot as soon as it arrives.
+
+    Returns:
+        list[dict]: {"label", "display", "cover"} per variant that arrived in time.
+    """
+    deadline = Deadline("covers")
+    plan = _plan_budget(st.session_state.current_story)
+    decision = _route_request("image", plan)
+    if not decision["model"]: # No image model past the budget
+        st.warning("This story has used its budget, so there are no more cover variants.")
+        return []
+    base_payload = {"model": _routed_model(decision), "deadline": deadline.to_payload(), "roll": time.time()}
+    usage, arrivals = new_usage_counters(), queue.Queue()
+    future = get_background_loop().submit(_cover_variants_job(
+        concept, FORMAT_POSTER_MOODS.get(st.session_state.story_format, ""), st.session_state.era_style, len(slots),
+        not st.session_state.generated_image_url, base_payload, decision, deadline, usage, arrivals
+    ))
+
+    variants = []
+    with deadline.phase("image"):
+        while (arrival := arrivals.get()) is not None: # Slots are drawn here, on the script thread
+            label, url = arrival
+            renditions = get_image_pipeline().render(url)
+            if not renditions["display"].startswith("data:"): # Failed or timed out: leave its slot for the next one
+                continue
+            slots[len(variants)].image(renditions["display"], caption=label, use_column_width=True)
+            variants.append({"label": label, **renditions})
+    try:
+        future.result()
+    finally:
+        _bill_background_usage(usage)
+    deadline.finish(st.session_state.resume_token)
+    return variants
+
+
+def _choose_cover_variant(variant: dict):
+    """Makes a variant the concept's image and cover; the variants not picked are dropped."""
+    pending = st.session_state._cover_variants
+    get_image_pipeline().keep(pending["concept"], variant, st.session_state.story_format, st.session_state.era_style)
+    st.session_state.generated_image_url = variant["display"]
+    if variant["cover"].startswith("data:"):
+        st.session_state.cover_image_url = variant["cover"]
+    st.session_state._cover_variants = None
+
+
+# --- Warm Pool of Opening Rounds (see warm_pool.py) ---
+
+async def _refill_warm_pool(pool: WarmPool) -> int:
+    """Runs on the background loop; refills are billed to the pool's own ledger account, not a writer's story."""
+    async def billed(kind: str, payload: dict) -> tuple:
+        usage = new_usage_counters()
+        try:
+            return await run_job(kind, payload, usage=usage), usage
+        finally:
+            record_usage_delta(WARM_POOL_SESSION, new_usage_counters(), usage)
+
+    async def run_round(payload: dict) -> dict | None:
+        result, usage = await billed("round", payload)
+        return result if usage["output_tokens"] else None # A fallback set is not worth stocking
+
+    async def run_image(prompt: str) -> str:
+        return (await billed("image", {"session": WARM_POOL_SESSION, "prompt": prompt}))[0]
+
+    return await pool.refill(run_round, run_image)
+
+
+def _schedule_warm_pool_refill():
+    """Starts a background refill when a popular setup is short of opening sets."""
+    pool = get_warm_pool()
+    if BATCHED_GENERATION and pool.needs_refill():
+        get_background_loop().submit(_refill_warm_pool(pool))
+
+
+def _keep_pooled_image(pooled: dict):
+    """Caches a pooled set's image under its filled-in concept, where the round looks for it."""
+    concept = next((text for text, _ in pooled["suggestions"] if text.startswith("Visual Concept:")), None)
+    if concept and pooled["image_url"]:
+        get_image_pipeline().store(concept.replace("Visual Concept: ", "").strip(), pooled["image_url"],
+                                   st.session_state.story_format, st.session_state.era_style)
 
-    return (f"Main character: {main_character_name} the {main_character_role}.\n"
-            f"Story Genre: {story_genre}.\n"
-            f"Story Format: {story_format}.\n"
-            f"{aesthetic_line}"
-            f"{era_style_line}"
-            f"Current story progress:\n{st.session_state.current_story}")
 
 # This function will be triggered by Streamlit's event loop
 async def _generate_and_update_suggestions_gui():
@@ -489,6 +715,7 @@ async def _generate_and_update_suggestions_gui():
         st.rerun() # Rerun to clear spinner/show warning
         return
 
+    deadline = Deadline("round" if BATCHED_GENERATION else "suggestions") # The round's latency budget, image included
     with st.spinner("Calling the AI Muse..."): # Show spinner while AI is thinking
         # Gather all necessary context from session state
         story_context = get_story_context_streamlit(
@@ -502,28 +729,59 @@ async def _generate_and_update_suggestions_gui():
         
         # Tone command can be made dynamic via a st.text_input in UI later (not implemented in this GUI version yet)
         tone_command = "" 
+        plan = _plan_budget(story_context, story_co_writer_ai.BATCH_CANDIDATE_COUNT if BATCHED_GENERATION else story_co_writer_ai.DIVERSITY_CANDIDATE_COUNT)
+        # An opening round may come ready-made from the warm pool (filled in with this writer's character)
+        opening = BATCHED_GENERATION and not st.session_state.story_log and current_room() is None
+        pooled = get_warm_pool().take(st.session_state) if opening and plan["status"] == "ok" else None
+        if pooled is not None:
+            suggestions_with_commentary, ending_pool = pooled["suggestions"], pooled["endings"]
+            _keep_pooled_image(pooled)
+        else:
+            decision = _route_request("round" if BATCHED_GENERATION else "suggestions", plan)
+            payload = _job_payload(plan["story_context"], tone_command=tone_command, model=_routed_model(decision), deadline=deadline.to_payload())
+            suggestions_with_commentary, ending_pool = await _generate_suggestion_set(payload, decision, deadline)
+        if BATCHED_GENERATION:
+            # Keep the ending candidates for this version of the story
+            st.session_state.ending_pool = ending_pool
+            st.session_state.ending_pool_version = st.session_state.story_version
 
-        suggestions_with_commentary = await generate_gemini_suggestions(
-            story_context,
-            st.session_state.story_language,
-            st.session_state.story_genre,
-            st.session_state.story_format,
-            tone_command,
-            st.session_state.aesthetic_style,
-            st.session_state.era_style
-        )
-        
         st.session_state.suggestions_with_commentary = suggestions_with_commentary
         st.session_state.alternate_endings = [] # Clear endings if new suggestions are generated
+        st.session_state._cover_variants = None # Variants of the previous concept nobody picked
 
-        generated_image_url = ""
+        renditions = {"display": "", "cover": ""}
         visual_concept_tuple = next((s for s in suggestions_with_commentary if s[0].startswith("Visual Concept:")), None)
         if visual_concept_tuple:
             visual_concept_description = visual_concept_tuple[0].replace("Visual Concept: ", "").strip()
-            # Call the image generation API with the description
-            generated_image_url = await call_imagen_api(visual_concept_description)
-        
-        st.session_state.generated_image_url = generated_image_url
+            # A reworded concept already drawn for this format and era reuses its image
+            image_pipeline = get_image_pipeline()
+            cached = image_pipeline.lookup(visual_concept_description, st.session_state.story_format, st.session_state.era_style)
+            image_decision = _route_request("image", plan) if cached is None else None
+            if cached is not None:
+                renditions = cached
+            elif image_decision["model"] and not deadline.allows(IMAGE_MIN_SECONDS):
+                deadline.degrade("image_skipped") # The concept text still shows; its image would miss the round's budget
+            elif image_decision["model"]: # No image model past the budget
+                # Call the image generation API with the description
+                with deadline.phase("image"):
+                    generated_image_url = await _run_billed_job(
+                        "image",
+                        {"prompt": visual_concept_description, "model": _routed_model(image_decision), "deadline": deadline.to_payload()},
+                        decision=image_decision,
+                        usage=st.session_state.api_usage,
+                        deadline=deadline
+                    )
+                renditions = image_pipeline.store(visual_concept_description, generated_image_url, st.session_state.story_format, st.session_state.era_style)
+
+        st.session_state.generated_image_url = renditions["display"] # Sized for the page
+        if renditions["cover"].startswith("data:"):
+            st.session_state.cover_image_url = renditions["cover"] # JPEG, embeddable in exports
+        entry = deadline.finish(st.session_state.resume_token)
+        if opening:
+            get_warm_pool().record_latency(pooled is not None, entry["elapsed_ms"] / 1000)
+            _schedule_warm_pool_refill() # This click counted toward its setup's demand
+        if "image_skipped" in deadline.degraded:
+            st.toast("⏱️ This round ran long, so its visual concept comes without an image.")
         st.session_state._generating_suggestions = False # Reset generating state after completion
         st.session_state.story_creation_complete = True # Move to the next UI stage
         st.rerun() # Rerun to update UI with new suggestions and image
@@ -533,6 +791,30 @@ async def _generate_and_update_endings_gui():
     """
     Orchestrates AI ending generation and updates Streamlit UI state.
     """
+    # Serve the pre-generated set (waiting for it if still running), then the batched pool,
+    # as long as they were generated for this story version
+    pregenerated = await _take_pregenerated_endings()
+    if pregenerated:
+        st.session_state.alternate_endings = pregenerated[:ENDINGS_PER_ROLL]
+        fresh_pool = st.session_state.ending_pool if st.session_state.ending_pool_version == st.session_state.story_version else []
+        st.session_state.ending_pool = pregenerated[ENDINGS_PER_ROLL:] + fresh_pool
+        st.session_state.ending_pool_version = st.session_state.story_version
+        st.session_state.suggestions_with_commentary = [] # Clear regular suggestions
+        st.session_state.generated_image_url = "" # Clear image
+        st.session_state._generating_endings = False # Reset generating state
+        st.rerun()
+        return
+    if st.session_state.ending_pool_version == st.session_state.story_version and len(st.session_state.ending_pool) >= 2:
+        alternate_endings = st.session_state.ending_pool[:ENDINGS_PER_ROLL]
+        st.session_state.ending_pool = st.session_state.ending_pool[ENDINGS_PER_ROLL:]
+        st.session_state.alternate_endings = alternate_endings
+        st.session_state.suggestions_with_commentary = [] # Clear regular suggestions
+        st.session_state.generated_image_url = "" # Clear image
+        st.session_state._generating_endings = False # Reset generating state
+        st.rerun()
+        return
+
+    deadline = Deadline("endings")
     with st.spinner("Crafting alternate realities..."):
         story_context = get_story_context_streamlit(
             st.session_state.main_character_name,
@@ -542,16 +824,23 @@ async def _generate_and_update_endings_gui():
             st.session_state.aesthetic_style,
             st.session_state.era_style
         )
-        
-        alternate_endings = await generate_gemini_endings(
-            story_context,
-            st.session_state.story_language,
-            st.session_state.story_genre,
-            st.session_state.story_format,
-            st.session_state.aesthetic_style,
-            st.session_state.era_style
+
+        candidate_count = story_co_writer_ai.BATCH_CANDIDATE_COUNT if BATCHED_GENERATION else 1
+        plan = _plan_budget(story_context, candidate_count)
+        # A second roll for the same moment is a re-roll: cheap and fast is good enough
+        decision = _route_request("endings_reroll" if st.session_state.alternate_endings else "endings", plan)
+        ending_candidates = await _run_billed_job(
+            "endings",
+            _job_payload(plan["story_context"], candidate_count=candidate_count, model=_routed_model(decision), deadline=deadline.to_payload()),
+            decision=decision,
+            deadline=deadline,
+            **_session_helpers()
         )
-        
+        deadline.finish(st.session_state.resume_token)
+        alternate_endings = ending_candidates[:ENDINGS_PER_ROLL]
+        st.session_state.ending_pool = ending_candidates[ENDINGS_PER_ROLL:] # Surplus serves the next roll
+        st.session_state.ending_pool_version = st.session_state.story_version
+
         st.session_state.alternate_endings = alternate_endings # Store new endings
         st.session_state.suggestions_with_commentary = [] # Clear regular suggestions
         st.session_state.generated_image_url = "" # Clear image
@@ -731,6 +1020,40 @@ def create_choice_buttons(label, options, session_state_key):
     )
 
 
+# --- Diagnostics Admin Page (?admin=diagnostics, STORY_DIAGNOSTICS=1) ---
+
+def render_diagnostics_page(diagnostics):
+    """Shows the server's memory diagnostics instead of the app."""
+    st.title("🩺 Server Diagnostics")
+    if st.button("Reset the baseline", key="diagnostics_baseline_btn"): # Growth since start counts from here
+        diagnostics.reset_baseline()
+        diagnostics.sample()
+    if st.button("Take a sample now", key="diagnostics_sample_btn") or not diagnostics.history:
+        diagnostics.sample()
+    sample = diagnostics.history[-1]
+    columns = st.columns(5)
+    columns[0].metric("RSS", f"{(sample['rss_bytes'] or 0) / 2**20:.0f} MB")
+    columns[1].metric("Traced heap", f"{sample['traced_bytes'] / 2**20:.1f} MB")
+    columns[2].metric("Sessions", sample["sessions"], f"{sample['session_bytes'] / 2**20:.1f} MB state")
+    columns[3].metric("Live tasks", sample["tasks"]["live_tasks"])
+    columns[4].metric("HTTP connections", sample["connections"]["open"], f"{sample['connections']['idle']} idle")
+
+    st.subheader("Memory over time (MB)")
+    st.line_chart({
+        "rss": [(entry["rss_bytes"] or 0) / 2**20 for entry in diagnostics.history],
+        "traced": [entry["traced_bytes"] / 2**20 for entry in diagnostics.history],
+        "session state": [entry["session_bytes"] / 2**20 for entry in diagnostics.history],
+    })
+    st.subheader("Largest sessions (bytes per state key)")
+    st.dataframe(sample["largest_sessions"])
+    st.subheader(f"Top allocation growth since {time.strftime('%Y-%m-%d %H:%M', time.localtime(sample['baseline_ts']))}")
+    st.dataframe(sample["growth_since_start"])
+    st.subheader("Top allocation growth since the previous sample")
+    st.dataframe(sample["growth_since_last"])
+    st.subheader("Pending tasks by coroutine")
+    st.json(sample["tasks"]["by_coroutine"])
+
+
 # --- Streamlit UI Layout ---
 
 st.set_page_config(layout="centered", page_title="Story-Verse Alpha") # Centered layout for mobile-like feel
@@ -740,7 +1063,66 @@ st.sidebar.markdown("---")
 st.sidebar.info("App Version: 2025-06-27-V13") # This line will confirm the correct file is running!
 
 
+session_restored = resume_or_start_session()
 initialize_session_state()
+get_context_caches()[st.session_state.resume_token] = st.session_state.context_cache
+if session_restored:
+    rebuild_session_indexes()
+    st.toast("Welcome back! Your story was restored.")
+join_room() # Co-writing in a shared room (?room=...): catch up with the other writers
+# Persist whatever the previous run changed (runs that end in st.rerun() never reach the bottom)
+save_session_snapshot()
+
+# Leak hunting: per-session state sizes, and a hidden admin page for the whole server
+diagnostics = get_diagnostics()
+if diagnostics is not None:
+    diagnostics.watch_loop(get_background_loop().loop)
+    diagnostics.observe_session(st.session_state.resume_token, st.session_state)
+    # The page shows every session's sizes: only served with an admin token configured and given
+    if ADMIN_TOKEN and st.query_params.get("admin") == "diagnostics" and st.query_params.get("token") == ADMIN_TOKEN:
+        render_diagnostics_page(diagnostics)
+        st.stop()
+
+# Upstream usage for the current story (lets us compare batched vs. separate calls)
+st.sidebar.caption(
+    f"Upstream calls: {st.session_state.api_usage['gemini_calls']} text, "
+    f"{st.session_state.api_usage['imagen_calls']} image · "
+    f"Context sent: {st.session_state.api_usage['context_bytes'] / 1024:.1f} KB"
+)
+token_summary = summarize_token_usage(st.session_state.api_usage)
+st.sidebar.caption(
+    f"Prompt tokens: {token_summary['billed_prompt_tokens']} billed, "
+    f"{token_summary['cached_tokens']} cached ({token_summary['cache_hit_ratio']:.0%})"
+)
+session_cost = usage_cost(st.session_state.api_usage)
+budget_plan = plan_generation(st.session_state.api_usage, "", st.session_state.story_language)
+st.sidebar.caption(
+    f"Estimated cost: ${session_cost:.4f}"
+    + (f" of ${budget_plan['budget_usd']:.2f} budget ({budget_plan['status']})" if budget_plan["budget_usd"] > 0 else "")
+)
+diversity = st.session_state.sketch_index.counters
+st.sidebar.caption(
+    f"Near-duplicates dropped: {diversity['duplicates_dropped']} · "
+    f"Re-rolls avoided: {diversity['rerolls_avoided']} ({rerolls_avoided_rate(diversity):.0%})"
+)
+room = current_room()
+if room is None:
+    if st.sidebar.button("👥 Invite Co-Writers", key="open_room_btn", help="Move this story into a shared room"):
+        st.query_params["room"] = new_room_id()
+        st.rerun()
+else:
+    # Invite with the room id only: the resume token in this page's URL is this session's own
+    st.sidebar.caption(f"Shared room · {room.members} writer(s) · invite co-writers with `?room={room.room_id}`")
+    if hasattr(st, "fragment"): # Streamlit >= 1.37: pick up other writers' changes while idle
+        st.fragment(run_every=ROOM_POLL_SECONDS)(_watch_room)()
+    elif st.sidebar.button("🔄 Check for Changes", key="room_refresh_btn"):
+        st.rerun()
+image_stats = get_image_pipeline().stats()
+st.sidebar.caption(
+    f"Image cache: {image_stats['hits']} hits / {image_stats['misses']} misses ({image_stats['hit_rate']:.0%}) · "
+    f"display size {image_stats['display_ratio']:.0%} of original"
+)
+
 
 # Custom Header (Mimicking the image's top bar)
 st.markdown("""
@@ -796,6 +1178,7 @@ with st.container():
 
     # The "Create Story" button from the image
     if not st.session_state.story_creation_complete and not st.session_state.story_concluded:
+        _schedule_warm_pool_refill() # Restock popular setups while the writer fills in the form
         if st.button("Create Story", key="create_story_btn", type="primary", help="Generate the initial story segment"):
             # Check if all required fields are filled for initial story creation
             if not st.session_state.main_character_name:
@@ -810,6 +1193,8 @@ with st.container():
                 st.error("Please select a Format.")
             else:
                 # All initial setup is complete, proceed to story generation
+                if current_room() is not None: # The first writer's setup becomes the room's
+                    st.session_state.update(current_room().configure(st.session_state))
                 st.session_state.story_creation_complete = True
                 st.session_state._generating_suggestions = True # Set flag to show spinner
                 # Use asyncio.create_task for async generation in Streamlit callback
@@ -899,14 +1284,32 @@ if st.session_state.story_creation_complete:
                     st.markdown(f"**Concept:** {visual_concept_found[0].replace('Visual Concept: ', '').strip()}")
                     st.markdown(f"*(Director's Notes: {visual_concept_found[1]})*")
                     if st.session_state.generated_image_url:
-                        st.image(st.session_state.generated_image_url, caption="AI-Generated Visual Concept", use_column_width=True)
+                        st.image(get_session_store().resolve_image(st.session_state.generated_image_url), caption="AI-Generated Visual Concept", use_column_width=True)
                     else:
                         st.info("No image URL generated or available for this concept.")
+
+                    concept = visual_concept_found[0].replace('Visual Concept: ', '').strip()
+                    pending_variants = st.session_state._cover_variants
+                    if pending_variants and pending_variants["concept"] == concept:
+                        st.markdown("**Cover variants** (pick one to use it as the cover):")
+                        for column, (i, variant) in zip(st.columns(len(pending_variants["variants"])), enumerate(pending_variants["variants"])):
+                            with column:
+                                st.image(variant["display"], caption=variant["label"], use_column_width=True)
+                                if st.button("Use this cover", key=f"cover_variant_{i}"):
+                                    _choose_cover_variant(variant)
+                                    st.rerun()
+                    elif st.button("🎨 More Cover Variants", key="cover_variants_btn"):
+                        slots = [column.empty() for column in st.columns(COVER_VARIANT_COUNT)]
+                        with st.spinner("Painting cover variants..."):
+                            variants = _generate_cover_variants_gui(concept, slots)
+                        st.session_state._cover_variants = {"concept": concept, "variants": variants} if variants else None
+                        st.rerun()
                 else:
                     st.info("AI has not yet generated a visual concept for this story segment.")
                 
                 # --- NEW: Roll Another Ending Button ---
                 if st.session_state.round_number > 0: # Only show after at least one round
+                    _maybe_pregenerate_endings() # Near the climax, have endings ready before the click
                     st.markdown("---")
                     if st.button("🎭 Roll Alternate Endings", key="roll_endings_btn"):
                         st.session_state._generating_endings = True
@@ -921,6 +1324,7 @@ if st.session_state.story_creation_complete:
                     st.write(ending_text)
                     if st.button(f"✅ Make Ending {i+1} Canon", key=f"select_ending_{i}"):
                         update_story_log(ending_text, "AI", "Story Ending")
+                        _drop_pregenerated_endings()
                         st.session_state.story_concluded = True
                         st.session_state.alternate_endings = [] # Clear endings after one is chosen
                         st.rerun()
@@ -947,8 +1351,56 @@ if st.session_state.story_creation_complete:
             file_name="my_co_authored_story.txt",
             mime="text/plain"
         )
+        # Story log plus setup (genre, format, era...) for the offline model and other tools
+        st.download_button(
+            label="⬇️ Download Story Log (JSON)",
+            data=json.dumps(build_story_record(st.session_state.story_log, st.session_state), indent=4).encode('utf-8'),
+            file_name="my_story_log.json",
+            mime="application/json"
+        )
+        # Manuscript exports render in a background process pool; results are cached by story hash
+        export_choices = DEFAULT_EXPORTS.get(st.session_state.story_format, ["pdf"])
+        export_choices = export_choices + [fmt for fmt in EXPORT_EXTENSIONS if fmt not in export_choices]
+        export_format = st.selectbox("Manuscript format", export_choices, key="export_format_choice")
+        story_language = st.session_state.story_language
+        export_language = st.selectbox(
+            "Manuscript language", SUPPORTED_LANGUAGES,
+            index=SUPPORTED_LANGUAGES.index(story_language) if story_language in SUPPORTED_LANGUAGES else 0,
+            key="export_language_choice"
+        )
+        if st.button("📚 Prepare Manuscript", key="prepare_export_btn"):
+            cover = get_session_store().resolve_image(st.session_state.cover_image_url) if st.session_state.cover_image_url else None
+            record = build_story_record(st.session_state.story_log, st.session_state)
+            if export_language != story_language: # Only segments never translated before cost a call
+                record = _translate_for_export(record, export_language)
+            st.session_state._export_job = (export_format, get_export_pipeline().submit(
+                record,
+                export_format,
+                cover if isinstance(cover, bytes) else None
+            ), record["story_language"] if record["story_language"] != story_language else "")
+        if st.session_state.get("_export_job"):
+            job_format, job, job_language = st.session_state._export_job
+            if not job.done():
+                st.info("Rendering your manuscript in the background...")
+                st.button("Check Manuscript", key="check_export_btn")
+            elif job.exception():
+                st.error(f"Export failed: {job.exception()}")
+            else:
+                with open(job.result(), "rb") as f:
+                    st.download_button(
+                        label=f"⬇️ Download {job_format.upper()} Manuscript",
+                        data=f.read(),
+                        file_name=export_file_name(st.session_state, job_format, job_language),
+                        mime=EXPORT_MIME_TYPES[job_format]
+                    )
         st.markdown("---")
         if st.button("Start a New Story", key="new_story_after_end_btn"):
+            # The cached prefix belongs to the old story; closed on the loop that owns the shared HTTP clients
+            get_background_loop().submit(st.session_state.context_cache.close())
+            get_session_store().delete(st.session_state.resume_token) # Don't resume the finished story
+            _drop_pregenerated_endings()
+            if "room" in st.query_params: # The new story starts solo
+                del st.query_params["room"]
             st.session_state.clear()
             initialize_session_state()
             st.experimental_rerun()
@@ -960,3 +1412,5 @@ with st.expander("Show Full Story Log (for Debugging)"):
 
 st.markdown("---")
 st.markdown("Created by Director Dunstan with AI assistance.")
+
+save_session_snapshot()
@@ -0,0 +1,244 @@
+### SUGGESTION DIVERSITY ###
+# Near-duplicate detection for AI suggestions and endings. Each text is reduced to
+# a MinHash sketch of its word shingles; a per-session SketchIndex holds sketches
+# of recent story segments and is banded (LSH) so a check only compares against
+# a handful of candidates. A check takes well under a millisecond.
+#
+# Near-duplicates (of each other or of text already in story_log) are dropped and
+# replaced from the extra candidates of a multi-candidate call, so the user gets a
+# usable set without pressing "Roll" again.
+
+import re
+import zlib
+import random
+from collections import deque
+
+SHINGLE_SIZE = 3           # Words per shingle
+NUM_PERMUTATIONS = 32      # MinHash signature length
+LSH_BANDS = 8              # NUM_PERMUTATIONS must be divisible by this
+ROWS_PER_BAND = NUM_PERMUTATIONS // LSH_BANDS
+DUPLICATE_THRESHOLD = 0.6  # Estimated Jaccard similarity at/above which texts count as duplicates
+MAX_INDEXED_SEGMENTS = 300 # Recent story segments kept per session
+
+_MASK64 = (1 << 64) - 1
+_rng = random.Random(0x5709) # Fixed seed: sketches stay comparable across processes
+_PERMUTATIONS = [(_rng.getrandbits(64) | 1, _rng.getrandbits(64)) for _ in range(NUM_PERMUTATIONS)]
+
+_WORD_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def shingles(text: str) -> set[str]:
+    """Returns the set of lower-cased word shingles of a text (single words for very short texts)."""
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return set(words)
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text: str) -> tuple[int, ...]:
+    """
+    Computes the MinHash signature of a text.
+
+    Args:
+        text (str): Any suggestion or story segment.
+
+    Returns:
+        tuple[int, ...]: NUM_PERMUTATIONS minimum hash values (empty tuple for text without words).
+    """
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)]
+    if not hashes:
+        return ()
+    return tuple(min(((a * h + b) & _MASK64) >> 32 for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(sketch_a: tuple[int, ...], sketch_b: tuple[int, ...]) -> float:
+    """Estimates the Jaccard similarity of two signatures (0.0 if either is empty)."""
+    if not sketch_a or not sketch_b:
+        return 0.0
+    return sum(1 for x, y in zip(sketch_a, sketch_b) if x == y) / NUM_PERMUTATIONS
+
+
+def _bands(sketch: tuple[int, ...]):
+    for band in range(LSH_BANDS):
+        yield band, sketch[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+
+
+def new_diversity_counters() -> dict:
+    """Returns an empty metrics record for a session's diversity filtering."""
+    return {
+        "sets_checked": 0,       # Suggestion/ending sets that went through the filter
+        "duplicates_dropped": 0, # Individual near-duplicates removed
+        "topped_up": 0,          # Replacements taken from extra candidates
+        "rerolls_avoided": 0,    # Sets that had duplicates but were fully repaired locally
+        "unresolved": 0,         # Sets that still had to show a duplicate
+    }
+
+
+class SketchIndex:
+    """
+    Per-session index of recent story segment sketches with LSH banding. Add each
+    new story_log segment with add(); the oldest entries are evicted past capacity.
+    """
+
+    def __init__(self, capacity: int = MAX_INDEXED_SEGMENTS, threshold: float = DUPLICATE_THRESHOLD):
+        self.capacity = capacity
+        self.threshold = threshold
+        self._next_id = 0
+        self._sketches: dict[int, tuple[int, ...]] = {}
+        self._order = deque()
+        self._buckets: dict[tuple, set[int]] = {}
+        self.counters = new_diversity_counters()
+
+    def __len__(self):
+        return len(self._sketches)
+
+    def add(self, text: str) -> int:
+        """Indexes a story segment and returns its id (-1 if the text has no words)."""
+        return self.add_sketch(minhash(text))
+
+    def add_sketch(self, sketch: tuple[int, ...]) -> int:
+        """Indexes a segment whose sketch was already computed (e.g. once for a whole room)."""
+        if not sketch:
+            return -1
+        entry_id = self._next_id
+        self._next_id += 1
+        self._sketches[entry_id] = sketch
+        self._order.append(entry_id)
+        for band in _bands(sketch):
+            self._buckets.setdefault(band, set()).add(entry_id)
+        while len(self._order) > self.capacity:
+            self._remove(self._order.popleft())
+        return entry_id
+
+    def _remove(self, entry_id: int):
+        sketch = self._sketches.pop(entry_id)
+        for band in _bands(sketch):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band]
+
+    def best_match(self, sketch: tuple[int, ...]) -> float:
+        """Returns the highest estimated similarity between a sketch and any indexed segment."""
+        candidates = set()
+        for band in _bands(sketch):
+            candidates.update(self._buckets.get(band, ()))
+        return max((similarity(sketch, self._sketches[c]) for c in candidates), default=0.0)
+
+    def is_near_duplicate(self, text: str) -> bool:
+        """True if text is a near-duplicate of a recent story segment."""
+        sketch = minhash(text)
+        return bool(sketch) and self.best_match(sketch) >= self.threshold
+
+
+def pick_diverse(candidates: list, want: int, index: SketchIndex | None = None, key=lambda candidate: candidate, threshold: float = DUPLICATE_THRESHOLD) -> tuple[list, int]:
+    """
+    Greedily keeps candidates (in preference order) that are not near-duplicates of
+    each other or of the indexed story segments, up to `want` of them. If too few
+    survive, the least similar rejects are used to fill the set.
+
+    Args:
+        candidates (list): Candidates, best first (primary candidate's items, then extras).
+        want (int): How many to return.
+        index (SketchIndex): Optional session index of recent story segments.
+        key (callable): Extracts the text from a candidate (e.g. lambda t: t[0] for tuples).
+        threshold (float): Similarity at/above which a candidate is a duplicate.
+
+    Returns:
+        tuple[list, int]: (chosen candidates, number of near-duplicates that had to be kept).
+    """
+    chosen = []
+    chosen_sketches = []
+    rejects = []
+    for candidate in candidates:
+        if len(chosen) == want:
+            break
+        sketch = minhash(key(candidate))
+        score = max((similarity(sketch, other) for other in chosen_sketches), default=0.0)
+        if index is not None and sketch:
+            score = max(score, index.best_match(sketch))
+        if score >= threshold:
+            rejects.append((score, candidate))
+            continue
+        chosen.append(candidate)
+        chosen_sketches.append(sketch)
+
+    kept_duplicates = 0
+    for _, candidate in sorted(rejects, key=lambda item: item[0]):
+        if len(chosen) == want:
+            break
+        chosen.append(candidate)
+        kept_duplicates += 1
+    return chosen, kept_duplicates
+
+
+def _record_filtering(index: SketchIndex | None, shown: int, primary_count: int, kept_duplicates: int, primary_kept: int):
+    """Updates the session counters after filtering one set."""
+    if index is None:
+        return
+    counters = index.counters
+    counters["sets_checked"] += 1
+    dropped = primary_count - primary_kept
+    if dropped <= 0:
+        return
+    counters["duplicates_dropped"] += dropped
+    counters["topped_up"] += max(0, shown - primary_kept - kept_duplicates)
+    if kept_duplicates:
+        counters["unresolved"] += 1
+    else:
+        counters["rerolls_avoided"] += 1
+
+
+def diversify_suggestions(primary: list[tuple[str, str]], alternates: list[list[tuple[str, str]]], index: SketchIndex | None = None, want: int = 3) -> list[tuple[str, str]]:
+    """
+    Replaces near-duplicate continuations in a parsed suggestion set with distinct
+    ones from the alternate candidates. Bonus Idea and Visual Concept tuples keep
+    their place after the continuations.
+
+    Args:
+        primary (list[tuple[str, str]]): Parsed (unpadded) suggestions of the displayed candidate.
+        alternates (list[list[tuple[str, str]]]): Parsed suggestions of the other candidates.
+        index (SketchIndex): Optional session index of recent story segments.
+        want (int): Continuations to keep.
+
+    Returns:
+        list[tuple[str, str]]: The suggestion set with diverse continuations.
+    """
+    def is_continuation(item: tuple[str, str]) -> bool:
+        return not item[0].startswith(("Bonus Idea:", "Visual Concept:"))
+
+    primary_continuations = [item for item in primary if is_continuation(item)]
+    others = [item for item in primary if not is_continuation(item)]
+    pool = primary_continuations + [item for alternate in alternates for item in alternate if is_continuation(item)]
+    chosen, kept_duplicates = pick_diverse(pool, want, index, key=lambda item: item[0])
+
+    primary_kept = sum(1 for item in chosen if item in primary_continuations)
+    _record_filtering(index, len(chosen), min(want, len(primary_continuations)), kept_duplicates, primary_kept)
+    return chosen + others
+
+
+def diversify_endings(endings: list[str], index: SketchIndex | None = None, want: int = 3) -> list[str]:
+    """
+    Orders endings so the first `want` are distinct from each other and from the
+    story, keeping the rest (for the ending pool) after them.
+
+    Args:
+        endings (list[str]): Ending candidates, best first.
+        index (SketchIndex): Optional session index of recent story segments.
+        want (int): Endings shown per roll.
+
+    Returns:
+        list[str]: Distinct endings first, followed by the remaining ones.
+    """
+    chosen, kept_duplicates = pick_diverse(endings, want, index)
+    primary = endings[:want]
+    primary_kept = sum(1 for ending in chosen if ending in primary)
+    _record_filtering(index, len(chosen), len(primary), kept_duplicates, primary_kept)
+    return chosen + [ending for ending in endings if ending not in chosen]
+
+
+def rerolls_avoided_rate(counters: dict) -> float:
+    """Share of checked sets that would otherwise have shown a duplicate but were repaired."""
+    affected = counters.get("rerolls_avoided", 0) + counters.get("unresolved", 0)
+    return counters.get("rerolls_avoided", 0) / affected if affected else 0.0
@@ -0,0 +1,69 @@
+### COVER VARIANTS TESTS ###
+# Variant prompts and their progressive, capped generation (cover_variants.py),
+# with the Imagen requests replaced by fakes.
+#
+# Usage: python -m pytest test_cover_variants.py
+
+import asyncio
+
+from cover_variants import generate_variants, poster_style, variant_prompts
+
+
+def test_prompts_dress_the_concept_in_the_format_and_era():
+    variants = variant_prompts("A lighthouse at dusk.", "🎭 **Broadway Poster**: spotlight", "1940s Noir", count=4)
+
+    assert poster_style("🎭 **Broadway Poster**: spotlight") == "Broadway Poster: spotlight"
+    assert [variant["label"] for variant in variants] == ["As described", "Poster", "1940s Noir", "Close-up"]
+    assert variants[0]["prompt"] == "A lighthouse at dusk"
+    assert variants[1]["prompt"] == "A lighthouse at dusk. Cover art styled as a Broadway Poster: spotlight"
+    assert variant_prompts("A lighthouse", count=2, include_described=False)[0]["label"] == "Close-up"
+
+
+def test_styles_arrive_as_they_finish_under_the_concurrency_cap():
+    in_flight, peak = 0, 0
+
+    async def run_image(prompt: str) -> str:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05 if prompt == "A lighthouse at dusk" else 0.01) # "As described" is slowest
+        in_flight -= 1
+        return f"url:{prompt}"
+
+    async def collect():
+        return [variant async for variant in generate_variants(run_image, None, "A lighthouse at dusk", count=4, concurrency=2)]
+
+    variants = asyncio.run(collect())
+
+    assert len(variants) == 4 and peak == 2
+    assert variants[-1] == (0, "As described", "url:A lighthouse at dusk")
+    assert sorted(index for index, _, _ in variants) == [0, 1, 2, 3]
+
+
+def test_samples_come_from_one_request_and_stopping_early_cancels_the_rest():
+    cancelled = []
+
+    async def run_samples(prompt: str, count: int) -> list[str]:
+        return [f"sample:{number}" for number in range(count)]
+
+    async def run_image(prompt: str) -> str:
+        try:
+            await asyncio.sleep(0 if prompt.endswith("Close-up, dramatic lighting, shallow depth of field") else 10)
+        except asyncio.CancelledError:
+            cancelled.append(prompt)
+            raise
+        return "url:close-up"
+
+    async def drive():
+        samples = [variant async for variant in generate_variants(None, run_samples, "A lighthouse", count=3, mode="samples")]
+        variants = generate_variants(run_image, None, "A lighthouse", count=3)
+        first = await variants.__anext__()
+        await variants.aclose() # e.g. the deadline ran out
+        await asyncio.sleep(0)
+        return samples, first
+
+    samples, first = asyncio.run(drive())
+
+    assert samples == [(0, "Sample 1", "sample:0"), (1, "Sample 2", "sample:1"), (2, "Sample 3", "sample:2")]
+    assert first == (1, "Close-up", "url:close-up")
+    assert sorted(cancelled) == ["A lighthouse", "A lighthouse. Wide establishing shot, atmospheric"]
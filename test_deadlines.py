@@ -0,0 +1,64 @@
+### LATENCY BUDGET TESTS ###
+# Deadlines across phases and processes, how the engine degrades to meet them, and
+# the deadline log report (deadlines.py).
+#
+# Usage: python -m pytest test_deadlines.py
+
+import time
+
+from deadlines import Deadline, deadline_phase, summarize_deadlines
+from story_co_writer_ai import _fit_to_deadline
+
+STORY_CONTEXT = "Main character: Ada the pilot.\nCurrent story progress:\n" + "The engines hummed in the dark hangar. " * 800
+
+
+def test_first_phase_past_the_deadline_is_the_miss(tmp_path):
+    log = str(tmp_path / "deadlines.jsonl")
+    deadline = Deadline("round", budget=0.05)
+
+    with deadline.phase("prompt"):
+        pass
+    with deadline.phase("gemini"):
+        time.sleep(0.06)
+    with deadline_phase(deadline, "parse"):
+        pass
+    deadline.degrade("image_skipped")
+    deadline.degrade("image_skipped")
+    missed = deadline.finish(session="alpha", path=log)
+    on_time = Deadline("round", budget=5.0).finish(path=log)
+
+    assert (missed["missed"], missed["missed_in"], missed["degraded"]) == (True, "gemini", ["image_skipped"])
+    assert missed["phases_ms"]["gemini"] >= 60 and set(missed["phases_ms"]) == {"prompt", "gemini", "parse"}
+    assert (on_time["missed"], on_time["missed_in"]) == (False, "")
+    [row] = summarize_deadlines(log)
+    assert (row["requests"], row["miss_rate"], row["missed_in"], row["degraded"]) == (2, 0.5, {"gemini": 1}, {"image_skipped": 1})
+
+
+def test_deadline_crosses_into_a_worker_and_its_phases_come_back():
+    deadline = Deadline("endings", budget=10.0)
+    payload = {"story_context": STORY_CONTEXT, "deadline": deadline.to_payload()}
+
+    worker = Deadline.from_payload(payload, "endings")
+    with worker.phase("gemini"):
+        worker.degrade("gemini_timeout")
+    deadline.merge(worker.report())
+    deadline.merge(None)
+
+    assert Deadline.from_payload({"story_context": STORY_CONTEXT}) is None
+    assert worker.expires_at == deadline.expires_at and 9.0 < worker.remaining() <= 10.0
+    assert set(deadline.phases) == {"gemini"} and deadline.degraded == ["gemini_timeout"]
+
+
+def test_time_left_decides_context_cache_and_gemini():
+    cache = object()
+
+    plenty = Deadline("round", budget=30.0)
+    short = Deadline("round", budget=5.0)
+    spent = Deadline("round", budget=0.5)
+
+    assert _fit_to_deadline(STORY_CONTEXT, "English", cache, None) == (STORY_CONTEXT, cache, True)
+    assert _fit_to_deadline(STORY_CONTEXT, "English", cache, plenty) == (STORY_CONTEXT, cache, True)
+    context, short_cache, call = _fit_to_deadline(STORY_CONTEXT, "English", cache, short)
+    assert len(context) < len(STORY_CONTEXT) and short_cache is None and call
+    assert _fit_to_deadline(STORY_CONTEXT, "English", cache, spent) == (STORY_CONTEXT, None, False)
+    assert (plenty.degraded, short.degraded, spent.degraded) == ([], ["short_context"], ["offline"])
@@ -0,0 +1,72 @@
+### MEMORY DIAGNOSTICS TESTS ###
+# Session sizing, heap samples with their baseline, and the offline trend (diagnostics.py).
+#
+# Usage: python -m pytest test_diagnostics.py
+
+import sys
+import json
+import tracemalloc
+
+from diagnostics import MemoryDiagnostics, deep_size, summarize_trend
+
+_leak = [] # What the "leaking" code keeps alive
+
+
+def test_session_state_is_sized_per_key_and_shared_objects_once():
+    image = "x" * 100_000
+    state = {"images": [image, image], "story_log": [{"text": "The ship woke."}]}
+    diagnostics = MemoryDiagnostics(dump_path="")
+
+    diagnostics.observe_session("token-alpha", state)
+    state["images"].append("y" * 500_000)
+    diagnostics.observe_session("token-alpha", state) # Throttled: not measured again yet
+
+    entry = diagnostics.sessions["token-alpha"]
+    assert list(entry["keys"]) == ["images", "story_log"]
+    assert sys.getsizeof(image) < entry["keys"]["images"] < 2 * sys.getsizeof(image)
+    assert entry["total_bytes"] == deep_size(state["images"][:2]) + deep_size(state["story_log"])
+
+
+def test_samples_show_growth_and_rebase_an_old_baseline(tmp_path):
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(1)
+    try:
+        diagnostics = MemoryDiagnostics(dump_path=str(tmp_path / "diagnostics.jsonl"), baseline_max_age=3600)
+        diagnostics.reset_baseline()
+        _leak.append(bytearray(2_000_000))
+        grown = diagnostics.sample()
+        diagnostics.baseline_max_age = 0 # The baseline is now too old
+        rebased = diagnostics.sample()
+        after = diagnostics.sample()
+    finally:
+        _leak.clear()
+        if started:
+            tracemalloc.stop()
+
+    top = grown["growth_since_start"][0]
+    assert top["site"].startswith(__file__) and top["growth_bytes"] >= 2_000_000
+    assert rebased["baseline_ts"] >= grown["baseline_ts"]
+    assert all(site["growth_bytes"] < 2_000_000 for site in after["growth_since_start"])
+    assert len(diagnostics.history) == 3 and len((tmp_path / "diagnostics.jsonl").read_text().splitlines()) == 3
+
+
+def test_trend_reports_growth_and_persistent_sites(tmp_path):
+    dump = tmp_path / "diagnostics.jsonl"
+
+    def sample(hour: int, sites: list[str]) -> dict:
+        return {"ts": hour * 3600.0, "rss_bytes": 100_000_000 + hour * 1_000_000, "traced_bytes": 50_000_000 + hour * 500_000,
+                "sessions": 3 + hour, "tasks": {"live_tasks": 10 + hour},
+                "growth_since_last": [{"site": site, "growth_bytes": 4096} for site in sites]}
+
+    with open(dump, "w", encoding="utf-8") as f:
+        for hour, sites in enumerate([["cache.py:10", "log.py:5"], ["cache.py:10"], ["cache.py:10", "once.py:1"], []]):
+            f.write(json.dumps(sample(hour, sites)) + "\n")
+        f.write("{half a line")
+
+    trend = summarize_trend(str(dump))
+
+    assert (trend["samples"], trend["hours"]) == (4, 3.0)
+    assert (trend["rss_growth_bytes"], trend["traced_growth_bytes"]) == (3_000_000, 1_500_000)
+    assert (trend["sessions_first"], trend["sessions_last"], trend["tasks_last"]) == (3, 6, 13)
+    assert trend["persistent_sites"] == ["cache.py:10"]
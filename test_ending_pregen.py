@@ -0,0 +1,60 @@
+### ENDING PRE-GENERATION TESTS ###
+# When endings are pre-generated and the background loop that runs them (ending_pregen.py).
+#
+# Usage: python -m pytest test_ending_pregen.py
+
+import asyncio
+from concurrent.futures import CancelledError
+
+import pytest
+
+from ending_pregen import CLIMAX_MIN_ROUNDS, BackgroundLoop, climax_score, should_pregenerate
+
+
+def _log(*texts: str) -> list[dict]:
+    return [{"text": text} for text in texts]
+
+
+def test_long_stories_always_pregenerate():
+    quiet = _log(*["The ship drifted on."] * 7)
+
+    assert not should_pregenerate(quiet, after_rounds=8)
+    assert should_pregenerate(quiet + _log("Still drifting."), after_rounds=8)
+    assert not should_pregenerate([], after_rounds=8)
+
+
+def test_climax_only_counts_the_recent_window_after_the_minimum_round():
+    climax = "At last Ada faced the truth! There was no turning back."
+    early = _log("The ship woke.", climax)
+    late = _log(*["The ship drifted on."] * (CLIMAX_MIN_ROUNDS - 1), climax)
+    faded = _log(climax, "Tea was served.", "The crew slept.")
+
+    assert climax_score(_log(climax)) == 3.5 # "At last", "truth", "no turning back" and one "!"
+    assert not should_pregenerate(early, after_rounds=8)
+    assert should_pregenerate(late, after_rounds=8)
+    assert climax_score(faded) == 0.0 and not should_pregenerate(faded + faded, after_rounds=8)
+
+
+def test_background_loop_outlives_the_submitting_loop_and_cancels():
+    background = BackgroundLoop(name="test-background")
+    release = asyncio.Event()
+
+    async def ending() -> str:
+        await asyncio.sleep(0.01)
+        return "It ended in the stars."
+
+    async def blocked():
+        await release.wait()
+
+    try:
+        async def submit_and_leave():
+            return background.submit(ending()), background.submit(blocked())
+
+        finished, pending = asyncio.run(submit_and_leave()) # The caller's loop is closed here
+        assert finished.result(timeout=5) == "It ended in the stars."
+        assert pending.cancel()
+        with pytest.raises(CancelledError):
+            pending.result(timeout=5)
+    finally:
+        background.shutdown()
+    assert not background._thread.is_alive()
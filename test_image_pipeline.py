@@ -0,0 +1,55 @@
+### IMAGE PIPELINE TESTS ###
+# Concept keys and the rendition cache for generated images (image_pipeline.py).
+# The images are opaque bytes, which pass through unchanged with or without Pillow.
+#
+# Usage: python -m pytest test_image_pipeline.py
+
+import os
+import base64
+
+from image_pipeline import ImagePipeline, cover_cache_key, normalize_concept
+
+
+def _image_url(payload: bytes) -> str:
+    return "data:image/png;base64," + base64.b64encode(payload).decode("ascii")
+
+
+def test_near_identical_concepts_share_a_key_within_a_story():
+    key = cover_cache_key("Visual Concept: A lone lighthouse at dusk.", "Novel", "Victorian")
+
+    assert normalize_concept("Visual Concept: A lone lighthouse at dusk.") == "dusk lighthouse lone"
+    assert normalize_concept("lighthouses, lone, at DUSK") == "dusk lighthouse lone"
+    assert cover_cache_key("lone lighthouse at dusk", " novel ", "victorian") == key
+    assert cover_cache_key("lone lighthouse at dusk", "Screenplay", "Victorian") != key
+    assert normalize_concept("a glass of moss") == "glass moss" # "ss" is not a plural
+
+
+def test_stored_image_is_found_again_by_a_new_process(tmp_path):
+    url = _image_url(b"generated image bytes")
+    pipeline = ImagePipeline(str(tmp_path))
+
+    assert pipeline.lookup("A lone lighthouse at dusk.", "Novel") is None
+    stored = pipeline.store("A lone lighthouse at dusk.", url, "Novel")
+    restarted = ImagePipeline(str(tmp_path))
+    found = restarted.lookup("lone lighthouse, dusk", "Novel")
+
+    assert found == stored and set(found) == {"display", "cover"}
+    assert base64.b64decode(found["cover"].split(",", 1)[1]) == b"generated image bytes"
+    assert (pipeline.stats()["misses"], restarted.stats()["hits"], restarted.stats()["hit_rate"]) == (1, 1, 1.0)
+
+
+def test_placeholders_are_not_cached_and_old_images_are_evicted(tmp_path):
+    pipeline = ImagePipeline(str(tmp_path), max_images=2)
+
+    placeholder = pipeline.store("A storm", "https://placehold.co/600x400?text=Image")
+    for number, concept in enumerate(["A storm", "A harbour", "A comet"]):
+        pipeline.store(concept, _image_url(f"image {number}".encode()))
+        stamp = 1_000_000 + number
+        for name in os.listdir(tmp_path):
+            if name.startswith(cover_cache_key(concept)):
+                os.utime(tmp_path / name, (stamp, stamp))
+
+    assert placeholder == {"display": "https://placehold.co/600x400?text=Image", "cover": "https://placehold.co/600x400?text=Image"}
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".display")) == sorted(
+        f"{cover_cache_key(concept)}.display" for concept in ["A harbour", "A comet"])
+    assert ImagePipeline(str(tmp_path)).lookup("A storm") is None
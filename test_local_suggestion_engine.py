@@ -0,0 +1,61 @@
+### LOCAL SUGGESTION ENGINE TESTS ###
+# Incremental training of the offline trigram model (local_suggestion_engine.py).
+#
+# Usage: python -m pytest test_local_suggestion_engine.py
+
+import os
+import json
+
+from local_suggestion_engine import train, LocalSuggestionModel, ModelBuilder, bucket_names
+
+
+def _write_log(path, texts: list[str], mtime_ns: int | None = None):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{"text": text, "contributor": "AI", "type": "Continuation"} for text in texts], f)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _words(model_path) -> set[str]:
+    """The words the model counted in any continuation."""
+    model = LocalSuggestionModel(model_path)
+    try:
+        builder = ModelBuilder.from_model(model)
+    finally:
+        model.close()
+    counted = set()
+    for successors in builder.buckets.get(bucket_names("continuation", "", "")[-1], {}).values():
+        counted.update(builder.words[word_id] for word_id in successors)
+    return counted
+
+
+def test_appended_segments_are_counted_once(tmp_path):
+    log, model_path = tmp_path / "story.json", str(tmp_path / "model.svlm")
+    _write_log(log, ["The harbour lights went out."], mtime_ns=1_000_000_000_000_000_000)
+    assert train(model_path, [str(log)])["segments"] == 1
+
+    _write_log(log, ["The harbour lights went out.", "A bell rang twice."], mtime_ns=1_000_000_100_000_000_000)
+    stats = train(model_path, [str(log)])
+    assert (stats["files"], stats["segments"], stats["rebuilt"]) == (1, 1, False)
+
+    stats = train(model_path, [str(log)]) # Untouched: not read again
+    assert (stats["files"], stats["skipped"]) == (0, 1)
+    assert {"harbour", "bell"} <= _words(model_path)
+
+
+def test_rewritten_story_rebuilds_the_model(tmp_path):
+    log, other, model_path = tmp_path / "my_story_log.json", tmp_path / "other.json", str(tmp_path / "model.svlm")
+    _write_log(log, ["Dragons circled the tower.", "The knight waited."], mtime_ns=1_000_000_000_000_000_000)
+    _write_log(other, ["Rain fell on the lighthouse."])
+    train(model_path, [str(log), str(other)])
+
+    # save_story_to_file overwrites the log with the next story, longer than the first
+    _write_log(log, ["A detective lit a cigarette.", "The phone rang.", "Nobody answered."], mtime_ns=1_000_000_100_000_000_000)
+    stats = train(model_path, [str(log)])
+
+    assert stats["rebuilt"] and stats["files"] == 2
+    words = _words(model_path)
+    assert {"detective", "phone", "lighthouse"} <= words
+    assert not {"Dragons", "knight"} & words
+    with open(model_path + ".manifest.json", "r", encoding="utf-8") as f:
+        assert json.load(f)["files"][str(log)]["segments"] == 3
@@ -0,0 +1,80 @@
+### MODEL ROUTER TESTS ###
+# Routing rules, budget caps, health step-down and the decision log (model_router.py).
+#
+# Usage: python -m pytest test_model_router.py
+
+import json
+
+from pytest import approx
+
+from model_router import DEFAULT_POLICY, ModelRouter, summarize_decisions
+from token_accounting import OFFLINE_MODEL, model_cost, record_model_tokens
+
+
+def _router(tmp_path) -> ModelRouter:
+    return ModelRouter(json.loads(json.dumps(DEFAULT_POLICY)), log_path=str(tmp_path / "routing.jsonl"))
+
+
+def _call(usage: dict, model: str, succeeded: bool = True) -> tuple[dict, dict]:
+    """One upstream call on `usage`; a failed call counts the request but no model tokens."""
+    before = dict(usage)
+    usage["gemini_calls"] = usage.get("gemini_calls", 0) + 1
+    if succeeded:
+        record_model_tokens(usage, model, input_tokens=1000, output_tokens=200)
+    return before, dict(usage)
+
+
+def test_rules_and_budget_choose_the_tier(tmp_path):
+    router = _router(tmp_path)
+
+    picks = {
+        "endings": router.route("endings", round_number=5),
+        "reroll": router.route("endings_reroll", round_number=5),
+        "early": router.route("round", round_number=1),
+        "later": router.route("round", round_number=5),
+        "long": router.route("round", round_number=5, prompt_tokens=7000),
+        "economy": router.route("endings", round_number=5, budget_status="economy"),
+        "offline": router.route("round", round_number=5, budget_status="offline"),
+        "offline_image": router.route("image", round_number=5, budget_status="offline"),
+    }
+
+    assert {name: pick["model"] for name, pick in picks.items()} == {
+        "endings": "gemini-2.5-pro", "reroll": "gemini-2.0-flash-lite", "early": "gemini-2.0-flash-lite",
+        "later": "gemini-2.0-flash", "long": "gemini-2.5-pro", "economy": "gemini-2.0-flash-lite",
+        "offline": OFFLINE_MODEL, "offline_image": "",
+    }
+    assert picks["economy"]["reason"] == "budget economy"
+    assert picks["offline"]["tier"] == "offline"
+
+
+def test_slow_model_steps_down_a_tier_once_it_has_enough_samples(tmp_path):
+    router = _router(tmp_path)
+    usage = {}
+    for _ in range(DEFAULT_POLICY["min_samples"]):
+        decision = router.route("endings", round_number=5)
+        assert decision["model"] == "gemini-2.5-pro"
+        router.record_outcome(decision, 60.0, *_call(usage, "gemini-2.5-pro"))
+
+    stepped = router.route("endings", round_number=5)
+
+    assert (stepped["tier"], stepped["model"]) == ("standard", "gemini-2.0-flash")
+    assert stepped["reason"].endswith("; gemini-2.5-pro unhealthy")
+    assert router.route("round", round_number=5)["model"] == "gemini-2.0-flash" # Other tiers are unaffected
+
+
+def test_outcomes_are_logged_with_their_cost(tmp_path):
+    router = _router(tmp_path)
+    usage = {}
+    decision = router.route("round", round_number=5)
+
+    ok = router.record_outcome(decision, 1.5, *_call(usage, decision["model"]))
+    error = router.record_outcome(decision, 3.0, *_call(usage, decision["model"], succeeded=False))
+    cached = router.record_outcome(decision, 0.01, dict(usage), dict(usage))
+
+    assert [ok["outcome"], error["outcome"], cached["outcome"]] == ["ok", "error", "cached"]
+    assert (ok["input_tokens"], ok["output_tokens"]) == (1000, 200)
+    assert ok["cost_usd"] == approx(model_cost("gemini-2.0-flash", {"input_tokens": 1000, "output_tokens": 200}))
+    assert error["cost_usd"] == cached["cost_usd"] == 0
+    assert router.health["gemini-2.0-flash"]["samples"] == 2 # Cached answers say nothing about the model
+    [row] = summarize_decisions(str(tmp_path / "routing.jsonl"))
+    assert (row["requests"], row["errors"], row["p50_ms"]) == (3, 1, 1500.0)
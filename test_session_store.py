@@ -0,0 +1,81 @@
+### SESSION STORE TESTS ###
+# Snapshot files of resumable sessions (session_store.py).
+#
+# Usage: python -m pytest test_session_store.py
+
+import os
+import time
+import base64
+
+from session_store import SessionStore, new_resume_token, COMPACT_AFTER_DELTAS
+
+IMAGE_URL = "data:image/png;base64," + base64.b64encode(b"\x89PNG not really").decode("ascii")
+
+
+def _state(segments: int) -> dict:
+    return {
+        "story_log": [{"round": n, "text": f"Segment {n}.", "contributor": "AI", "type": "Continuation"} for n in range(segments)],
+        "suggestions_with_commentary": [("Open the door.", "Tension."), ("Visual Concept: A door", "Mood.")],
+        "generated_image_url": IMAGE_URL,
+        "story_genre": "Mystery",
+        "round_number": segments,
+        "api_usage": {"gemini_calls": segments},
+    }
+
+
+def test_snapshot_round_trip_with_deltas(tmp_path):
+    store, token = SessionStore(str(tmp_path)), new_resume_token()
+    state = _state(1)
+    assert store.save(token, state)
+    assert not store.save(token, state) # Nothing changed
+    for segments in range(2, COMPACT_AFTER_DELTAS + 5): # Through a compaction
+        state = _state(segments)
+        store.save(token, state)
+
+    restored = {}
+    assert SessionStore(str(tmp_path)).restore(token, restored)
+    assert restored["story_log"] == state["story_log"]
+    assert restored["suggestions_with_commentary"] == state["suggestions_with_commentary"]
+    assert restored["round_number"] == state["round_number"]
+    assert restored["api_usage"] == state["api_usage"]
+    assert restored["generated_image_url"].startswith("blob:")
+    assert store.resolve_image(restored["generated_image_url"]) == base64.b64decode(IMAGE_URL.split(",", 1)[1])
+
+
+def test_edit_before_the_end_is_not_saved_as_an_append(tmp_path):
+    store, token = SessionStore(str(tmp_path)), new_resume_token()
+    state = _state(3)
+    store.save(token, state)
+    state["story_log"] = [dict(segment) for segment in state["story_log"]]
+    state["story_log"][1]["text"] = "Segment 1, rewritten." # The last item is unchanged
+    state["story_log"].append({"round": 3, "text": "Segment 3.", "contributor": "User", "type": "User Input"})
+    store.save(token, state)
+
+    assert SessionStore(str(tmp_path)).load(token)["story_log"] == state["story_log"]
+
+
+def test_torn_final_frame_keeps_earlier_frames(tmp_path):
+    store, token = SessionStore(str(tmp_path)), new_resume_token()
+    store.save(token, _state(1))
+    store.save(token, _state(2))
+    with open(os.path.join(tmp_path, f"{token}.svs"), "ab") as f:
+        f.write(b"\x40\x00\x00\x00\x01partial")
+    assert len(store.load(token)["story_log"]) == 2
+
+
+def test_cleanup_removes_expired_sessions_and_their_blobs(tmp_path):
+    store = SessionStore(str(tmp_path))
+    expired, live = new_resume_token(), new_resume_token()
+    store.save(expired, _state(1))
+    store.save(live, {**_state(1), "generated_image_url": "https://example.com/door.png"})
+    old = time.time() - 30 * 24 * 3600
+    os.utime(os.path.join(tmp_path, f"{expired}.svs"), (old, old))
+    for sha in os.listdir(store.blob_directory):
+        os.utime(os.path.join(store.blob_directory, sha), (old, old))
+
+    assert store.cleanup() == 1
+    assert store.load(expired) is None and store.load(live) is not None
+    assert not store.exists(expired) and store.exists(live)
+    assert os.listdir(store.blob_directory) == []
+    assert store.save(expired, _state(2)) # Starts a fresh file, not a delta on the deleted one
+    assert len(store.load(expired)["story_log"]) == 2
@@ -0,0 +1,82 @@
+### SHARED STORE TESTS ###
+# Purging the shared store (shared_store.py) and the per-session state a job
+# worker keeps (worker_pool.py).
+#
+# Usage: python -m pytest test_shared_store.py
+
+import asyncio
+
+import worker_pool
+from shared_store import SharedStore
+from worker_pool import JobWorker
+
+
+def _table_sizes(store: SharedStore) -> tuple[int, int]:
+    connection = store._connection()
+    return (connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0],
+            connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0])
+
+
+def test_purge_drops_expired_cache_entries_and_old_jobs(tmp_path):
+    store = SharedStore(str(tmp_path / "shared.db"))
+    store.cache_put("job_results", "stale", b"{}", ttl_seconds=-1)
+    store.cache_put("job_results", "fresh", b"{}", ttl_seconds=60)
+    finished = store.submit_job("image", {"prompt": "a door"})
+    store.complete_job(finished, {"value": "data:image/png;base64,AA=="})
+    queued = store.submit_job("image", {"prompt": "a window"})
+
+    assert store.purge(finished_older_than=3600) == 1 # Only the expired entry
+    assert store.purge(finished_older_than=-1) == 1   # Now the finished job too
+    assert store.get_job(finished) is None
+    assert store.get_job(queued)["status"] == "queued"
+    assert store.cache_get("job_results", "fresh") == b"{}"
+
+
+def test_serving_worker_keeps_the_store_bounded(tmp_path, monkeypatch):
+    async def handle_echo(payload, usage, context_cache, sketch_index, deadline=None):
+        return payload["n"]
+
+    monkeypatch.setitem(worker_pool.JOB_HANDLERS, "echo", handle_echo)
+    monkeypatch.setattr(worker_pool, "PURGE_EVERY_SECONDS", 0.0)
+    worker = JobWorker(str(tmp_path / "shared.db"), job_retention=-1)
+    store = worker.store
+
+    async def drive():
+        serving = asyncio.create_task(worker.serve())
+        largest = 0
+        for n in range(200):
+            store.submit_job("echo", {"n": n})
+            if n % 20 == 19:
+                await asyncio.sleep(0.05)
+                largest = max(largest, _table_sizes(store)[0])
+        while worker.completed < 200:
+            await asyncio.sleep(0.01)
+        worker.stop()
+        await serving
+        return largest
+
+    largest = asyncio.run(drive())
+    assert largest < 100
+    assert _table_sizes(store) == (0, 0) # serve() purges once more on the way out
+    assert worker.purged == 200
+
+
+def test_worker_closes_least_recently_used_context_caches(tmp_path):
+    worker = JobWorker(str(tmp_path / "shared.db"), max_context_caches=2)
+    closed = []
+
+    async def drive():
+        caches = {session: worker._context_cache(session) for session in ("a", "b")}
+        for session, cache in caches.items():
+            async def close(session=session):
+                closed.append(session)
+            cache.close = close
+        worker._context_cache("a") # "b" is now the least recently used
+        worker._context_cache("c")
+        await asyncio.sleep(0)
+        return caches
+
+    caches = asyncio.run(drive())
+    assert closed == ["b"]
+    assert list(worker.context_caches) == ["a", "c"]
+    assert worker.context_caches["a"][0] is caches["a"]
@@ -0,0 +1,67 @@
+### STORY ANALYTICS TESTS ###
+# Type normalisation and the numpy / plain-Python reports of the analytics
+# table (story_analytics.py).
+#
+# Usage: python -m pytest test_story_analytics.py
+
+import json
+
+import pytest
+
+import story_analytics
+from story_analytics import StoryTable
+
+# A bare non-AI log (lower-case types, no contributors) and a GUI record
+NON_AI_LOG = [
+    {"text": "The lighthouse went dark.", "round": 0},
+    {"type": "continuation", "text": "A shadow crossed the rocks."},
+    {"type": "plot_twist", "text": "The keeper had been gone for years."},
+    {"type": "free_form", "text": "Someone lit the lamp anyway."},
+]
+GUI_RECORD = {"story_genre": "Mystery", "story_format": "Novel", "story_log": [
+    {"round": 1, "text": "Rain on the window.", "contributor": "AI", "type": "Continuation"},
+    {"round": 2, "text": "A second letter arrived.", "contributor": "AI", "type": "Bonus Idea"},
+    {"round": 3, "text": "I opened it.", "contributor": "User", "type": "User Input"},
+    {"round": 4, "text": "It was signed by her.", "contributor": "AI", "type": "Story Ending"},
+]}
+
+
+@pytest.fixture
+def library(tmp_path) -> str:
+    with open(tmp_path / "my_story_log.json", "w", encoding="utf-8") as f:
+        json.dump(NON_AI_LOG, f)
+    with open(tmp_path / "record.json", "w", encoding="utf-8") as f:
+        json.dump(GUI_RECORD, f)
+    return str(tmp_path)
+
+
+def _table(library: str) -> StoryTable:
+    table = StoryTable()
+    table.update([library], genre="Fantasy")
+    return table
+
+
+def test_legacy_types_take_the_gui_names(library):
+    table = _table(library)
+    assert set(table.values["type"]) == {"User Input", "Continuation", "Plot Twist", "Bonus Idea", "Story Ending"}
+    assert set(table.values["contributor"]) == {"User", "AI"}
+    fantasy, = table.summarize(["genre"], {"genre": "Fantasy"})
+    assert (fantasy["user_input"], fantasy["continuation"], fantasy["ai"], fantasy["user"]) == (2, 1, 2, 2)
+
+
+def test_report_survives_a_save_and_load(library, tmp_path):
+    table, path = _table(library), str(tmp_path / "analytics.storycol")
+    table.save(path)
+    loaded = StoryTable.load(path)
+    assert loaded.paths == table.paths
+    assert loaded.summarize(["genre", "type"]) == table.summarize(["genre", "type"])
+
+
+@pytest.mark.skipif(story_analytics.np is None, reason="needs numpy")
+def test_numpy_and_plain_reports_agree(library, monkeypatch):
+    groupings = ([], ["genre"], ["rounds", "type"])
+    table = _table(library)
+    by_numpy = [table.summarize(by, {"contributor": "AI"}) for by in groupings]
+    monkeypatch.setattr(story_analytics, "np", None)
+    table = _table(library)
+    assert [table.summarize(by, {"contributor": "AI"}) for by in groupings] == by_numpy
@@ -0,0 +1,188 @@
+### STORY API SERVER TESTS ###
+# Requests, streamed and single-flight suggestions, and eviction of the headless API
+# (story_api_server.py), with the engine's upstream calls replaced by counting fakes.
+#
+# Usage: python -m pytest test_story_api_server.py
+
+import json
+import asyncio
+
+import httpx
+
+import story_api_server
+import story_co_writer_ai
+from story_api_server import StoryApiServer
+from session_store import SessionStore
+
+SETUP = {"main_character_name": "Ada", "main_character_role": "pilot", "story_language": "English",
+         "story_genre": "Sci-Fi", "story_format": "Narrative"}
+
+
+def _server(tmp_path, monkeypatch, **kwargs) -> StoryApiServer:
+    monkeypatch.chdir(tmp_path) # The usage ledger, routing and deadline logs
+    return StoryApiServer(SessionStore(str(tmp_path / "sessions")), **kwargs)
+
+
+async def _serving(server_state: StoryApiServer):
+    server = await server_state.start("127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+
+async def _stopped(server_state: StoryApiServer, server):
+    server_state.shutdown()
+    server.close()
+    await server.wait_closed()
+
+
+def _events(text: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class _FakeCache:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def test_story_round_trip_over_http(tmp_path, monkeypatch):
+    server_state = _server(tmp_path, monkeypatch)
+
+    async def drive():
+        server, url = await _serving(server_state)
+        async with httpx.AsyncClient(base_url=url, timeout=10) as client:
+            created = await client.post("/stories", json={**SETUP, "opening": "The ship woke."})
+            story_id = created.json()["story_id"]
+            appended = await client.post(f"/stories/{story_id}/segments", json={"text": "Ada stirred.", "expected_version": 1})
+            stale = await client.post(f"/stories/{story_id}/segments", json={"text": "Too late.", "expected_version": 1})
+            since = await client.get(f"/stories/{story_id}", params={"since": 1})
+            missing = await client.get("/stories/no-such-story")
+        await _stopped(server_state, server)
+        return created, appended, stale, since, missing
+
+    created, appended, stale, since, missing = asyncio.run(drive())
+
+    assert created.status_code == 201 and created.json()["version"] == 1
+    assert appended.status_code == 200 and appended.json()["version"] == 2
+    assert stale.status_code == 409 and stale.json()["version"] == 2
+    assert [segment["text"] for segment in since.json()["segments"]] == ["Ada stirred."]
+    assert missing.status_code == 404
+
+
+def test_stream_and_posts_share_one_generation(tmp_path, monkeypatch):
+    server_state = _server(tmp_path, monkeypatch)
+    calls = []
+
+    async def fake_run_job(kind, payload, **kwargs):
+        calls.append(kind)
+        return {"suggestions": [("A round suggestion.", "")], "endings": []}
+
+    async def fake_stream(prompt_text, usage=None, model="", deadline=None):
+        calls.append("stream")
+        yield "1. The hatch opened onto "
+        await gate.wait() # Until the POST requests have joined
+        yield "a silent deck.\nCommentary: Quiet dread.\n"
+
+    monkeypatch.setattr(story_api_server, "run_job", fake_run_job)
+    monkeypatch.setattr(story_co_writer_ai, "stream_gemini_api", fake_stream)
+
+    async def drive():
+        nonlocal gate
+        gate = asyncio.Event()
+        server, url = await _serving(server_state)
+        async with httpx.AsyncClient(base_url=url, timeout=10) as client:
+            story_id = (await client.post("/stories", json={**SETUP, "opening": "The ship woke."})).json()["story_id"]
+
+            async def stream() -> str:
+                async with client.stream("GET", f"/stories/{story_id}/suggestions/stream") as response:
+                    return (await response.aread()).decode("utf-8")
+
+            streaming = asyncio.create_task(stream())
+            while not calls:
+                await asyncio.sleep(0.01)
+            posts = [asyncio.create_task(client.post(f"/stories/{story_id}/suggestions")) for _ in range(2)]
+            await asyncio.sleep(0.1)
+            gate.set()
+            text = await streaming
+            answers = [(await post).json() for post in posts]
+        await _stopped(server_state, server)
+        return text, answers
+
+    gate = None
+    text, answers = asyncio.run(drive())
+
+    events = _events(text)
+    assert calls == ["stream"]
+    assert [name for name, _ in events] == ["chunk", "chunk", "suggestions", "done"]
+    streamed = events[2][1]
+    assert streamed["suggestions"][0]["text"].startswith("The hatch opened onto a silent deck.")
+    assert all(answer["suggestions"] == streamed["suggestions"] for answer in answers)
+
+
+def test_failed_stream_ends_with_an_error_event(tmp_path, monkeypatch):
+    server_state = _server(tmp_path, monkeypatch)
+
+    async def failing_stream(prompt_text, usage=None, model="", deadline=None):
+        yield "1. The hatch"
+        raise RuntimeError("upstream went away")
+
+    monkeypatch.setattr(story_co_writer_ai, "stream_gemini_api", failing_stream)
+
+    async def drive():
+        server, url = await _serving(server_state)
+        async with httpx.AsyncClient(base_url=url, timeout=10) as client:
+            story_id = (await client.post("/stories", json={**SETUP, "opening": "The ship woke."})).json()["story_id"]
+            async with client.stream("GET", f"/stories/{story_id}/suggestions/stream") as response:
+                text = (await response.aread()).decode("utf-8")
+            health = await client.get("/health")
+        await _stopped(server_state, server)
+        return story_id, text, health
+
+    story_id, text, health = asyncio.run(drive())
+
+    assert [name for name, _ in _events(text)] == ["chunk", "error"]
+    assert health.status_code == 200 # The server kept serving
+    live = server_state.stories[story_id]
+    assert live.busy == 0 and live.generation is None
+
+
+def test_busy_story_is_kept_and_evicted_story_closes_its_cache(tmp_path, monkeypatch):
+    server_state = _server(tmp_path, monkeypatch, evict_after=0.0)
+
+    async def slow_run_job(kind, payload, **kwargs):
+        await released.wait()
+        return ["It ended in the hangar.", "It ended in the stars."]
+
+    monkeypatch.setattr(story_api_server, "run_job", slow_run_job)
+
+    async def drive():
+        nonlocal released
+        released = asyncio.Event()
+        ids = []
+        for _ in range(2):
+            created = await server_state.dispatch("POST", "/stories", {}, json.dumps({**SETUP, "opening": "The ship woke."}).encode())
+            ids.append(json.loads(created.body)["story_id"])
+        busy_id, idle_id = ids
+        idle_cache = server_state.stories[idle_id].state["context_cache"] = _FakeCache()
+        rolling = asyncio.create_task(server_state.dispatch("POST", f"/stories/{busy_id}/endings", {}, b""))
+        await asyncio.sleep(0.05)
+        server_state._evict()
+        live_while_busy = set(server_state.stories)
+        await asyncio.sleep(0) # Let the eviction close the cache
+        released.set()
+        endings = json.loads((await rolling).body)["endings"]
+        reloaded = json.loads((await server_state.dispatch("GET", f"/stories/{idle_id}", {}, b"")).body)
+        return busy_id, idle_id, live_while_busy, idle_cache, endings, reloaded
+
+    released = None
+    busy_id, idle_id, live_while_busy, idle_cache, endings, reloaded = asyncio.run(drive())
+
+    assert live_while_busy == {busy_id}
+    assert idle_cache.closed
+    assert endings == ["It ended in the hangar.", "It ended in the stars."]
+    assert [segment["text"] for segment in reloaded["segments"]] == ["The ship woke."]
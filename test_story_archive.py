@@ -0,0 +1,52 @@
+### STORY ARCHIVE TESTS ###
+# Lossless round trips through the story archive format (story_archive.py).
+#
+# Usage: python -m pytest test_story_archive.py
+
+import json
+
+from story_archive import write_archive, read_archive, pack_json, unpack_archive, StoryArchive, BLOCK_SIZE
+
+
+def _story_log(segments: int) -> list[dict]:
+    return [{"round": n, "text": f"Segment {n}: the tide turned — café, 東京, 🌊.", "contributor": "AI" if n % 3 else "User",
+             "type": "Continuation" if n % 3 else "User Input"} for n in range(segments)]
+
+
+def test_record_round_trip_keeps_every_field_and_key_order(tmp_path):
+    story_log = _story_log(50)
+    story_log[7] = {"type": "plot_twist", "text": "Keys in another order."}      # Another shape
+    story_log[8] = {"text": "x" * (BLOCK_SIZE + 10), "round": 8}                    # Larger than a block
+    story_log[9] = {"text": "Odd fields", "round": "9", "mood": ["tense"]}          # Stored verbatim
+    story_log[10] = "not even a segment"
+    record = {"main_character_name": "Ada", "story_log": story_log, "story_genre": "Mystery", "story_concluded": True}
+    path = str(tmp_path / "story.storyarc")
+    write_archive(record, path)
+
+    restored = read_archive(path)
+    assert restored == record
+    assert list(restored) == list(record)
+    assert [list(segment) for segment in restored["story_log"] if isinstance(segment, dict)] == \
+           [list(segment) for segment in story_log if isinstance(segment, dict)]
+
+
+def test_random_access_matches_the_story_log(tmp_path):
+    story_log = _story_log(5000)
+    path = str(tmp_path / "long.storyarc")
+    write_archive(story_log, path)
+    with StoryArchive(path) as archive:
+        assert len(archive) == 5000
+        assert archive.segment(4321) == story_log[4321]
+        assert archive.segment(-1) == story_log[-1]
+        assert archive.rounds(120, 140) == story_log[120:141]
+        assert archive.info()["rounds_sorted"]
+
+
+def test_pack_and_unpack_json(tmp_path):
+    json_path = tmp_path / "my_story_log.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(_story_log(20), f, indent=4)
+    archive_path = pack_json(str(json_path))
+    unpacked = unpack_archive(archive_path, str(tmp_path / "unpacked.json"))
+    with open(unpacked, "r", encoding="utf-8") as f:
+        assert json.load(f) == _story_log(20)
@@ -0,0 +1,64 @@
+### STORY CO-WRITER AI TESTS ###
+# Parsing of model output (story_co_writer_ai.py), including the malformed
+# responses a model sometimes returns.
+#
+# Usage: python -m pytest test_story_co_writer_ai.py
+
+from story_co_writer_ai import parse_suggestions, parse_endings
+
+WELL_FORMED = """1. The door creaked open.
+Commentary: Builds tension.
+2. A cat leapt from the shelf.
+Commentary: Comic relief.
+3. The lights went out.
+Commentary: Raises the stakes.
+Bonus Idea: The butler was a twin.
+Commentary: A twist.
+Visual Concept: A dim hallway lit by one candle
+"""
+
+
+def test_well_formed_suggestions():
+    suggestions = parse_suggestions(WELL_FORMED)
+    assert suggestions[0] == ("The door creaked open.", "Builds tension.")
+    assert suggestions[3] == ("Bonus Idea: The butler was a twin.", "A twist.")
+    assert suggestions[4] == ("Visual Concept: A dim hallway lit by one candle", "No commentary provided.")
+
+
+def test_suggestions_without_commentary_or_with_chatter():
+    raw = "Sure! Here are some ideas:\n\n1. The door creaked open.\n\n2) Not numbered right\n2. A cat leapt.\nbonus idea: Twins.\nThanks!"
+    suggestions = parse_suggestions(raw, pad=False)
+    assert suggestions == [("The door creaked open.", "No commentary provided."),
+                           ("A cat leapt.", "No commentary provided."),
+                           ("Bonus Idea: Twins.", "No commentary provided.")]
+
+
+def test_malformed_suggestions_are_padded_to_five():
+    for raw in ("", "I cannot help with that.", "Commentary: orphaned commentary", "1.", "\n\n   \n"):
+        suggestions = parse_suggestions(raw)
+        assert len(suggestions) == 5
+        assert all(isinstance(text, str) and isinstance(commentary, str) for text, commentary in suggestions)
+        assert suggestions[4][0].startswith("Visual Concept:")
+
+
+def test_truncated_response_keeps_what_was_parsed():
+    suggestions = parse_suggestions(WELL_FORMED[:60])
+    assert suggestions[0] == ("The door creaked open.", "Builds tension.")
+    assert len(suggestions) == 5
+
+
+def test_combined_response_separates_suggestions_and_endings():
+    raw = WELL_FORMED + "Endings:\nEnding 1: She walked into the sea.\nEnding 2: The letter burned.\n"
+    assert [text for text, _ in parse_suggestions(raw)][:3] == ["The door creaked open.", "A cat leapt from the shelf.", "The lights went out."]
+    assert parse_endings(raw, combined=True) == ["She walked into the sea.", "The letter burned."]
+
+
+def test_malformed_endings():
+    assert parse_endings("1. She walked into the sea.\n2.   \n3. The letter burned.") == ["She walked into the sea.", "The letter burned."]
+    assert parse_endings("ending 1. Lowercase and a dot.") == ["Lowercase and a dot."]
+    assert parse_endings("") == []
+    assert parse_endings("No endings today, sorry.") == []
+    # A batched response without an endings section: its numbered continuations are not endings
+    assert parse_endings(WELL_FORMED, combined=True) == []
+    # An endings heading with a plain numbered list under it
+    assert parse_endings(WELL_FORMED + "ENDINGS:\n1. The end.\n", combined=True) == ["The end."]
@@ -0,0 +1,92 @@
+### TERMINAL CO-WRITER TESTS ###
+# Suggestion prefetching, backends and round numbering of the terminal co-writer
+# (story_co_writer_non_ai_foundation.py), with scripted answers instead of stdin.
+#
+# Usage: python -m pytest test_story_co_writer_non_ai_foundation.py
+
+import asyncio
+
+import pytest
+
+from story_co_writer_non_ai_foundation import (StaticBackend, SuggestionBackend, SuggestionPrefetcher, print_latency_report,
+                                               run_story_session, save_story_to_file)
+
+
+class _ScriptedStdin:
+    """Answers each prompt with the next scripted line, after a moment of "typing"."""
+
+    def __init__(self, *answers: str):
+        self.answers = list(answers)
+
+    async def readline(self, prompt: str = "") -> str:
+        if not self.answers:
+            raise EOFError
+        await asyncio.sleep(0.01) # Prefetches run meanwhile
+        return self.answers.pop(0)
+
+
+class _RecordingBackend(StaticBackend):
+    """Static suggestions that record which rounds were generated and which speculations were cancelled."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.rounds = []
+        self.cancelled = []
+
+    async def suggest(self, story_log, round_num, on_text=None):
+        self.rounds.append(round_num)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(story_log[-1]["text"])
+            raise
+        return await super().suggest(story_log, round_num, on_text)
+
+
+def test_prefetched_choice_is_a_hit_and_free_text_is_a_miss(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    backend = _RecordingBackend()
+    stdin = _ScriptedStdin("n", "The ship woke.", "1", "Ada wrote her own line.", "2")
+
+    story_log, stats = asyncio.run(run_story_session(backend, stdin, num_rounds=3, prefetch_width=2))
+
+    assert [segment["round"] for segment in story_log] == [0, 1, 2, 3]
+    assert story_log[2] == {"text": "Ada wrote her own line.", "contributor": "User", "type": "free_form", "round": 2}
+    assert (stats["first_round"], stats["prefetch_hits"], stats["prefetch_misses"]) == (1, 1, 1)
+    assert backend.rounds == [1, 2, 2, 3, 3, 3] # Round 3 was generated again after the miss
+    assert len(stats["latencies"]) == 3
+
+
+def test_taking_a_choice_cancels_the_other_speculations():
+    backend = _RecordingBackend(delay=10.0)
+    suggestions = [{"type": "continuation", "text": text} for text in ("Left.", "Right.", "Up.")]
+
+    async def choose():
+        prefetcher = SuggestionPrefetcher(backend, width=2)
+        prefetcher.start([{"text": "The ship woke."}], suggestions, 1)
+        await asyncio.sleep(0)
+        unchosen = prefetcher.take("Up.") # Never speculated on
+        await asyncio.sleep(0)
+        return prefetcher, unchosen
+
+    prefetcher, unchosen = asyncio.run(choose())
+
+    assert unchosen is None and not prefetcher.tasks
+    assert sorted(backend.cancelled) == ["Left.", "Right."]
+    assert (prefetcher.hits, prefetcher.misses) == (0, 1)
+
+
+def test_loaded_story_continues_its_round_numbers(monkeypatch, tmp_path, capsys):
+    monkeypatch.chdir(tmp_path)
+    save_story_to_file([{"text": "The ship woke.", "contributor": "User", "round": 0},
+                        {"text": "Ada stirred.", "contributor": "AI", "type": "continuation", "round": 1}])
+    with pytest.raises(TypeError): # suggest() is abstract
+        SuggestionBackend()
+
+    story_log, stats = asyncio.run(run_story_session(StaticBackend(), _ScriptedStdin("y", "1"), num_rounds=1))
+    capsys.readouterr()
+    print_latency_report(stats)
+
+    assert story_log[-1]["round"] == 2 and stats["first_round"] == 2
+    report = capsys.readouterr().out
+    assert "Round 2:" in report and "Round 1:" not in report
@@ -0,0 +1,56 @@
+### STORY EXPORT TESTS ###
+# Manuscript layouts and the cached export pipeline (story_export.py).
+#
+# Usage: python -m pytest test_story_export.py
+
+import zipfile
+
+from story_export import ExportPipeline, render_export
+from story_records import build_story_record
+
+SETUP = {"main_character_name": "Ada", "main_character_role": "pilot", "story_language": "English", "story_genre": "Sci-Fi"}
+
+
+def _record(story_format: str) -> dict:
+    story_log = [
+        {"text": "INT. HANGAR - NIGHT\nAda checks the engine.\nADA: We go now.", "contributor": "AI", "type": "Continuation", "round": 1},
+        {"text": "Tom & Jerry <ran>.", "contributor": "User", "type": "User Input", "round": 2},
+    ]
+    return build_story_record(story_log, {**SETUP, "story_format": story_format})
+
+
+def test_screenplay_places_headings_cues_and_dialogue(tmp_path):
+    path = render_export(_record("Screenplay"), "screenplay", str(tmp_path / "story.txt"))
+
+    lines = open(path, encoding="utf-8").read().splitlines()
+    assert "FADE IN:" in lines and "INT. HANGAR - NIGHT" in lines
+    cue = next(line for line in lines if line.strip() == "ADA")
+    dialogue = next(line for line in lines if line.strip() == "We go now.")
+    assert len(cue) - len(cue.lstrip()) > len(dialogue) - len(dialogue.lstrip()) > 0
+    assert lines.index(dialogue) == lines.index(cue) + 1
+
+
+def test_epub_is_a_valid_container_with_escaped_text(tmp_path):
+    path = render_export(_record("Novel"), "epub", str(tmp_path / "story.epub"))
+
+    with zipfile.ZipFile(path) as book:
+        first = book.infolist()[0]
+        assert (first.filename, first.compress_type) == ("mimetype", zipfile.ZIP_STORED)
+        assert book.read("mimetype") == b"application/epub+zip"
+        chapter = book.read("OEBPS/chapter_001.xhtml").decode("utf-8")
+    assert "Tom &amp; Jerry &lt;ran&gt;." in chapter
+
+
+def test_pipeline_renders_once_then_serves_the_cached_artifact(tmp_path):
+    pipeline = ExportPipeline(str(tmp_path), max_workers=1)
+    try:
+        path = pipeline.submit(_record("Play"), "pdf").result(timeout=120)
+        again = pipeline.submit(_record("Play"), "pdf").result(timeout=5)
+    finally:
+        pipeline.shutdown()
+
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data.startswith(b"%PDF-") and data.rstrip().endswith(b"%%EOF")
+    assert again == path
+    assert pipeline.counters["cache_hits"] == 1
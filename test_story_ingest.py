@@ -0,0 +1,99 @@
+### STORY INGEST TESTS ###
+# Resume and rewrite behaviour of the bulk ingest (story_ingest.py).
+#
+# Usage: python -m pytest test_story_ingest.py
+
+import os
+import glob
+import json
+
+from story_ingest import ingest_library, load_manifest, MANIFEST_NAME
+
+
+def _write_log(path, texts: list[str], mtime_ns: int | None = None):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{"text": text, "contributor": "AI", "type": "continuation", "round": position}
+                   for position, text in enumerate(texts, 1)], f)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _read_rows(output_directory, pattern: str) -> list[dict]:
+    rows = []
+    for path in sorted(glob.glob(os.path.join(output_directory, pattern))):
+        with open(path, "r", encoding="utf-8") as f:
+            rows.extend(json.loads(line) for line in f)
+    return rows
+
+
+def test_rerun_skips_unchanged_files(tmp_path):
+    library, output = tmp_path / "library", tmp_path / "out"
+    library.mkdir()
+    for number in range(3):
+        _write_log(library / f"story_{number}.json", [f"Story {number} begins.", "It ends."])
+
+    first = ingest_library([str(library)], str(output), shards=2, max_workers=1)
+    second = ingest_library([str(library)], str(output), shards=2, max_workers=1)
+
+    assert first["ingested"] == 3 and first["segments"] == 6
+    assert second["ingested"] == 0 and second["skipped"] == 3
+    assert len(_read_rows(output, "stories-*.jsonl")) == 3
+    assert len(_read_rows(output, "segments-*.jsonl")) == 6
+
+
+def test_rewritten_file_is_ingested_as_a_new_story(tmp_path):
+    library, output = tmp_path / "library", tmp_path / "out"
+    library.mkdir()
+    log = library / "my_story_log.json"
+    _write_log(log, ["The first story."], mtime_ns=1_000_000_000_000_000_000)
+    ingest_library([str(library)], str(output), shards=2, max_workers=1)
+
+    # save_story_to_file overwrites the log with the next story
+    _write_log(log, ["The second story.", "Its ending."], mtime_ns=1_000_000_100_000_000_000)
+    totals = ingest_library([str(library)], str(output), shards=2, max_workers=1)
+
+    assert totals["ingested"] == 1 and totals["changed"] == 1
+    stories = _read_rows(output, "stories-*.jsonl")
+    assert len(stories) == 2 and stories[0]["story"] != stories[1]["story"]
+    texts = {row["story"]: [] for row in stories}
+    for row in _read_rows(output, "segments-*.jsonl"):
+        texts[row["story"]].append(row["text"])
+    assert sorted(texts.values()) == [["The first story."], ["The second story.", "Its ending."]]
+
+    entry = load_manifest(str(output))["files"][str(log)]
+    assert entry["segments"] == 2 and len(entry["earlier"]) == 1
+    assert entry["earlier"][0] != entry["story"]
+
+
+def test_output_appended_after_the_last_commit_is_dropped(tmp_path):
+    library, output = tmp_path / "library", tmp_path / "out"
+    library.mkdir()
+    _write_log(library / "story.json", ["Only segment."])
+    ingest_library([str(library)], str(output), shards=1, max_workers=1)
+    shard = next(glob.iglob(os.path.join(output, "segments-*.jsonl")))
+    with open(shard, "a", encoding="utf-8") as f: # An interrupted run's partial append
+        f.write('{"story": "half')
+
+    totals = ingest_library([str(library)], str(output), shards=1, max_workers=1)
+
+    assert totals["skipped"] == 1
+    assert [row["text"] for row in _read_rows(output, "segments-*.jsonl")] == ["Only segment."]
+    assert os.path.exists(os.path.join(output, MANIFEST_NAME))
+
+
+def test_failed_file_is_tried_again_on_the_next_run(tmp_path):
+    library, output = tmp_path / "library", tmp_path / "out"
+    library.mkdir()
+    path = library / "b.json"
+    valid = json.dumps([{"text": "It worked.", "contributor": "AI", "type": "continuation"}])
+    path.write_text("[" + "x" * (len(valid) - 1), encoding="utf-8") # Same size as the valid file
+    os.utime(path, ns=(1_000_000_000_000_000_000,) * 2)
+    assert ingest_library([str(library)], str(output), shards=1, max_workers=1)["failed"] == 1
+
+    # The same mtime and size, as after a worker crash failed a valid file
+    path.write_text(valid, encoding="utf-8")
+    os.utime(path, ns=(1_000_000_000_000_000_000,) * 2)
+    totals = ingest_library([str(library)], str(output), shards=1, max_workers=1)
+
+    assert (totals["ingested"], totals["skipped"], totals["failed"]) == (1, 0, 0)
+    assert "error" not in load_manifest(str(output))["files"][str(path)]
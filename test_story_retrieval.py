@@ -0,0 +1,49 @@
+### STORY RETRIEVAL TESTS ###
+# Entities, incremental indexing and the retrieved prompt context of long stories
+# (story_retrieval.py).
+#
+# Usage: python -m pytest test_story_retrieval.py
+
+from story_retrieval import GAP_MARKER, StoryRetrievalIndex, extract_entities
+
+
+def _log(*texts: str) -> list[dict]:
+    return [{"text": text} for text in texts]
+
+
+FILLER = [f"Day {day}: the convoy crossed dune after dune, counting water and rationing sleep." for day in range(1, 60)]
+
+
+def test_entities_are_names_places_and_objects():
+    entities = extract_entities("Captain Ada Reyes flew to Lisbon with the lantern. She met Tom there. Nobody spoke.")
+
+    assert entities == [("Captain Ada Reyes", "character"), ("Lisbon", "place"), ("Tom", "character"), ("lantern", "object")]
+    assert extract_entities("The Keeper waited.") == [("Keeper", "character")]
+
+
+def test_long_story_brings_back_the_segment_that_introduced_the_tail_characters():
+    story_log = _log("Marisol Vega grew up in the salt mines of Oruro, where she lost her brother.", *FILLER,
+                     "At the well, Marisol Vega finally spoke of her past.")
+    index = StoryRetrievalIndex()
+
+    assert index.story_context(story_log[:3], budget_bytes=4000) is None # Fits: sent as it is
+    context = index.story_context(story_log, budget_bytes=1200)
+
+    assert index.exceeds(1200) and len(context.encode("utf-8")) <= 1200 + 10 * len(GAP_MARKER)
+    assert context.startswith("Marisol Vega grew up in the salt mines of Oruro")
+    assert context.endswith("At the well, Marisol Vega finally spoke of her past.")
+    assert GAP_MARKER in context and FILLER[10] not in context
+    assert index.entities["marisol vega"]["first"] == 0 and index.entities["marisol vega"]["segments"] == 2
+
+
+def test_sync_indexes_only_new_segments_and_rebuilds_a_replaced_log():
+    index = StoryRetrievalIndex()
+    index.sync(_log("Ada woke in Lisbon.", "Tom waved."))
+    postings_before = index.postings["waved"]
+
+    index.sync(_log("Ada woke in Lisbon.", "Tom waved.", "The lantern flickered."))
+    assert len(index) == 3 and index.postings["waved"] is postings_before
+
+    index.sync(_log("A different story began in Oruro.")) # e.g. a room snapshot replaced the log
+    assert len(index) == 1 and "waved" not in index.postings and "lisbon" not in index.entities
+    assert index.entities["oruro"]["kind"] == "place"
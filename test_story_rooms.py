@@ -0,0 +1,90 @@
+### STORY ROOMS TESTS ###
+# Shared writing rooms: mirrored members, deduplicated generation and waiting for
+# events (story_rooms.py).
+#
+# Usage: python -m pytest test_story_rooms.py
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from story_rooms import RoomRegistry, StoryRoom, apply_room_events
+
+SETUP = {"main_character_name": "Ada", "main_character_role": "pilot", "story_language": "English",
+         "story_genre": "Sci-Fi", "story_format": "Narrative"}
+
+
+def test_members_mirror_the_room_and_a_late_member_gets_a_snapshot():
+    room = StoryRoom("room-alpha", history=3)
+    member = room.subscribe()
+    state = {}
+    room.configure(SETUP)
+    room.append("The ship woke.")
+    apply_room_events(state, member.poll())
+
+    stale = room.append("Too late.", expected_version=0)
+    latecomer = room.subscribe()
+    latecomer.poll()
+    kinds = []
+    for texts in (["Ada stirred", "The hatch opened."], ["Stars.", "Silence."]):
+        for text in texts:
+            room.append(text, contributor="AI", suggestion_type="continuation")
+        events = member.poll()
+        kinds.append([event["kind"] for event in events])
+        apply_room_events(state, events)
+    caught_up = latecomer.poll()
+
+    assert stale is None and room.counters["conflicts"] == 1
+    assert kinds == [["segment", "segment"]] * 2
+    assert [event["kind"] for event in caught_up] == ["snapshot"] # 4 missed events > history of 3
+    assert state["current_story"] == room.snapshot()["current_story"] == "The ship woke.Ada stirred. The hatch opened.Stars.Silence."
+    assert (state["story_version"], state["round_number"], state["main_character_name"]) == (5, 5, "Ada")
+
+
+def test_members_share_one_generation_per_version():
+    room = StoryRoom("room-alpha")
+    room.append("The ship woke.")
+    started = []
+
+    def start() -> Future:
+        started.append(room.story_version)
+        return Future()
+
+    first, first_pays = room.generation_for(1, start)
+    second, second_pays = room.generation_for(1, start)
+    first.set_result({"suggestions": [("The hatch opened.", "Tension")], "endings": ["It ended."]})
+    cached, cached_pays = room.generation_for(1, start)
+    stale = room.generation_for(0, start)
+
+    failing, _ = room.generation_for(room.append("Ada stirred.")["version"], start)
+    failing.set_exception(RuntimeError("upstream went away"))
+    retried, retry_pays = room.generation_for(2, start)
+
+    assert second is first and (first_pays, second_pays, cached_pays) == (True, False, False)
+    assert cached.result() == {"suggestions": [("The hatch opened.", "Tension")], "endings": ["It ended."]}
+    assert stale == (None, False)
+    assert retried is not failing and retry_pays
+    assert started == [1, 2, 2]
+    assert room.publish_suggestions(1, [("Old.", "")]) is None # For a version that has moved on
+
+
+def test_waiting_member_is_woken_by_another_thread_and_bad_ids_are_refused():
+    registry = RoomRegistry()
+    room = registry.open("room-alpha")
+    member = room.subscribe()
+    member.poll()
+
+    async def wait_for_events():
+        quiet = await member.wait(timeout=0.01)
+        threading.Timer(0.05, room.append, ["The ship woke."]).start()
+        return quiet, await member.wait(timeout=5)
+
+    quiet, events = asyncio.run(wait_for_events())
+
+    assert quiet == []
+    assert [event["kind"] for event in events] == ["segment"] and events[0]["segment"]["text"] == "The ship woke."
+    assert registry.open("room-alpha") is room and registry.stats()["members"] == 1
+    with pytest.raises(ValueError):
+        registry.open("../etc")
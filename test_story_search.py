@@ -0,0 +1,94 @@
+### STORY SEARCH TESTS ###
+# The story search index (story_search.py): its file format and incremental
+# re-indexing.
+#
+# Usage: python -m pytest test_story_search.py
+
+import os
+import json
+
+from story_search import StorySearchIndex
+
+
+def _write_record(path, genre: str, texts: list[str], mtime_ns: int | None = None):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"story_genre": genre, "story_format": "Novel", "era_style": "1940s Noir", "story_log": [
+            {"round": n, "text": text, "contributor": "AI", "type": "Continuation"} for n, text in enumerate(texts, 1)
+        ]}, f)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _paths(result: dict) -> set[str]:
+    return {os.path.basename(hit["path"]) for hit in result["hits"]}
+
+
+def test_index_round_trip(tmp_path):
+    _write_record(tmp_path / "harbour.json", "Mystery", ["The librarian hid the ledger.", "Fog rolled over the harbour."])
+    _write_record(tmp_path / "tower.json", "Fantasy", ["A dragon guarded the librarian's tower."])
+    index = StorySearchIndex()
+    index.update([str(tmp_path)])
+    path = str(tmp_path / "stories.idx")
+    index.save(path)
+
+    loaded = StorySearchIndex.load(path)
+    for query, filters in (("librarian", None), ("librarian", {"genre": "Mystery"}), ("", {"era": "noir"})):
+        assert loaded.search(query, filters) == index.search(query, filters)
+    assert loaded.update([str(tmp_path)])["unchanged"] == 2
+
+
+def test_incremental_update_reindexes_only_changed_files(tmp_path):
+    harbour, tower = tmp_path / "harbour.json", tmp_path / "tower.json"
+    _write_record(harbour, "Mystery", ["The librarian hid the ledger."], mtime_ns=1_000_000_000_000_000_000)
+    _write_record(tower, "Fantasy", ["A dragon guarded the tower."])
+    index = StorySearchIndex()
+    assert index.update([str(tmp_path)])["indexed"] == 2
+
+    os.utime(harbour, ns=(1_000_000_100_000_000_000,) * 2) # Touched, same content
+    assert index.update([str(tmp_path)]) == {"indexed": 0, "unchanged": 2, "removed": 0, "failed": 0, "segments": 0}
+
+    _write_record(harbour, "Mystery", ["The keeper burned the ledger.", "Ash drifted out to sea."])
+    stats = index.update([str(tmp_path)])
+    assert (stats["indexed"], stats["segments"]) == (1, 2)
+    assert index.search("librarian")["total"] == 0
+    assert _paths(index.search("ledger")) == {"harbour.json"}
+
+
+def test_compact_drops_paths_of_removed_files(tmp_path):
+    for number in range(5):
+        _write_record(tmp_path / f"story_{number}.json", "Mystery", [f"Clue number {number} was a key."])
+    index = StorySearchIndex()
+    index.update([str(tmp_path)])
+    for number in range(3):
+        os.remove(tmp_path / f"story_{number}.json")
+
+    assert index.update([str(tmp_path)])["removed"] == 3
+    assert not index.deleted # Compacted
+    assert sorted(os.path.basename(path) for path in index.paths) == ["story_3.json", "story_4.json"]
+    assert _paths(index.search("key")) == {"story_3.json", "story_4.json"}
+
+    _write_record(tmp_path / "story_5.json", "Mystery", ["Another key turned."])
+    index.update([str(tmp_path)])
+    assert len(index.paths) == 3
+    assert _paths(index.search("turned")) == {"story_5.json"}
+
+
+def test_deleted_documents_do_not_count_towards_idf(tmp_path):
+    library, fresh = tmp_path / "library", tmp_path / "fresh"
+    library.mkdir()
+    fresh.mkdir()
+    for number in range(10):
+        texts = [f"The key opened door {number}." if number < 5 else f"Rain fell on street {number}."]
+        _write_record(library / f"story_{number}.json", "Mystery", texts)
+        if number != 0:
+            _write_record(fresh / f"story_{number}.json", "Mystery", texts)
+    index = StorySearchIndex()
+    index.update([str(library)])
+    os.remove(library / "story_0.json")
+    index.update([str(library)])
+    rebuilt = StorySearchIndex()
+    rebuilt.update([str(fresh)])
+
+    assert index.deleted # Below the compaction threshold
+    scores = {os.path.basename(hit["path"]): hit["score"] for hit in index.search("key")["hits"]}
+    assert scores == {os.path.basename(hit["path"]): hit["score"] for hit in rebuilt.search("key")["hits"]}
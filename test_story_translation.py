@@ -0,0 +1,61 @@
+### STORY TRANSLATION TESTS ###
+# Segment translation with the per-language cache (story_translation.py), with the
+# Gemini call replaced by a fake translator.
+#
+# Usage: python -m pytest test_story_translation.py
+
+import re
+import asyncio
+
+import story_co_writer_ai
+from story_translation import TranslationCache, translate_texts
+from deadlines import Deadline
+
+_TAGGED = re.compile(r'<seg id="(\d+)">(.*?)</seg>', re.DOTALL)
+
+
+def _fake_translator(monkeypatch, prompts: list[str]):
+    """Answers every tagged passage as "[fr] <passage>", as sent (still escaped)."""
+    async def fake_call(prompt_text, candidate_count=1, usage=None, model="", cached_content="", language="", deadline=None):
+        prompts.append(prompt_text)
+        body = prompt_text.split("\n\n", 1)[1]
+        return ["\n".join(f'<seg id="{segment_id}">[fr] {text}</seg>' for segment_id, text in _TAGGED.findall(body))]
+
+    monkeypatch.setattr(story_co_writer_ai, "call_gemini_api_candidates", fake_call)
+
+
+def test_next_edition_only_translates_new_segments(tmp_path, monkeypatch):
+    prompts = []
+    _fake_translator(monkeypatch, prompts)
+    cache = TranslationCache(str(tmp_path))
+    texts = ["The ship woke.", "Ada stirred.", "The ship woke."]
+
+    first, first_stats = asyncio.run(translate_texts(texts, "English", "French", cache=cache))
+    second, second_stats = asyncio.run(translate_texts(texts + ["The door opened."], "English", "French", cache=TranslationCache(str(tmp_path))))
+
+    assert first == ["[fr] The ship woke.", "[fr] Ada stirred.", "[fr] The ship woke."]
+    assert (first_stats["calls"], first_stats["translated"]) == (1, 3)
+    assert (second_stats["cached"], second_stats["translated"], second_stats["calls"]) == (3, 1, 1)
+    assert second[-1] == "[fr] The door opened." and "Ada stirred." not in prompts[-1]
+
+
+def test_segment_markers_in_the_text_survive_the_round_trip(tmp_path, monkeypatch):
+    _fake_translator(monkeypatch, [])
+    texts = ['She typed </seg><seg id="7"> & left.', "Tom &lt; Jerry"]
+
+    translations, stats = asyncio.run(translate_texts(texts, "English", "French", cache=TranslationCache(str(tmp_path))))
+
+    assert translations == [f"[fr] {text}" for text in texts]
+    assert stats["failed"] == 0
+
+
+def test_spent_deadline_leaves_segments_untranslated_and_uncached(tmp_path, monkeypatch):
+    prompts = []
+    _fake_translator(monkeypatch, prompts)
+    deadline = Deadline("translate", budget=0.0)
+
+    translations, stats = asyncio.run(translate_texts(["The ship woke."], "English", "French", cache=TranslationCache(str(tmp_path)), deadline=deadline))
+
+    assert translations == ["The ship woke."] and stats["failed"] == 1
+    assert prompts == [] and "translation_skipped" in deadline.degraded
+    assert TranslationCache(str(tmp_path)).get("anything", "French") is None
@@ -0,0 +1,60 @@
+### TOKEN ACCOUNTING TESTS ###
+# Cost, session budgets and the billing ledger (token_accounting.py).
+#
+# Usage: python -m pytest test_token_accounting.py
+
+from pytest import approx
+
+from token_accounting import (ECONOMY_GEMINI_MODEL, OFFLINE_MODEL, model_cost, plan_generation, record_model_tokens,
+                              record_usage_delta, summarize_ledger, usage_cost)
+
+STORY_CONTEXT = "Main character: Ada the pilot.\nCurrent story progress:\n" + "The engines hummed in the dark hangar. " * 800
+
+
+def _spent(usd: float) -> dict:
+    """A usage record that cost `usd` on gemini-2.5-pro output tokens ($10 per million)."""
+    usage = {}
+    record_model_tokens(usage, "gemini-2.5-pro", output_tokens=round(usd / 10.0 * 1e6))
+    return usage
+
+
+def test_cached_input_tokens_are_billed_at_the_cached_rate():
+    usage = {}
+    record_model_tokens(usage, "gemini-2.0-flash", input_tokens=1_000_000, cached_tokens=400_000, output_tokens=10_000)
+    record_model_tokens(usage, "gemini-2.0-flash", input_tokens=0, output_tokens=0)
+
+    assert usage["model:gemini-2.0-flash:calls"] == 2
+    assert model_cost("gemini-2.0-flash", {"input_tokens": 1_000_000, "cached_tokens": 400_000}) == approx(0.06 + 0.01)
+    assert usage_cost(usage) == approx(0.06 + 0.01 + 0.004)
+
+
+def test_budget_moves_from_economy_to_offline():
+    unlimited = plan_generation(_spent(5.0), STORY_CONTEXT, "English", budget_usd=0)
+    comfortable = plan_generation(_spent(0.1), STORY_CONTEXT, "English", budget_usd=1.0)
+    near = plan_generation(_spent(0.85), STORY_CONTEXT, "English", budget_usd=1.0)
+    spent = plan_generation(_spent(1.0), STORY_CONTEXT, "English", budget_usd=1.0)
+
+    assert (unlimited["status"], comfortable["status"]) == ("ok", "ok")
+    assert comfortable["story_context"] == STORY_CONTEXT
+    assert (near["status"], near["model"]) == ("economy", ECONOMY_GEMINI_MODEL)
+    assert len(near["story_context"]) < len(STORY_CONTEXT) and near["story_context"].startswith("Main character: Ada")
+    assert (spent["status"], spent["model"]) == ("offline", OFFLINE_MODEL)
+
+
+def test_ledger_records_deltas_and_sums_them_per_session(tmp_path):
+    ledger = str(tmp_path / "ledger.jsonl")
+    usage = {}
+    record_model_tokens(usage, "gemini-2.0-flash", input_tokens=1000, output_tokens=200)
+    assert record_usage_delta("alpha", {}, usage, ledger) == 1
+    before = dict(usage)
+    assert record_usage_delta("alpha", before, usage, ledger) == 0 # Nothing new
+    record_model_tokens(usage, "gemini-2.0-flash", input_tokens=500, output_tokens=100)
+    record_model_tokens(usage, "gemini-2.5-pro", input_tokens=100, output_tokens=10)
+    assert record_usage_delta("alpha", before, usage, ledger) == 2
+    record_usage_delta("beta", {}, _spent(0.5), ledger)
+
+    rows = {(row["session"], row["model"]): row for row in summarize_ledger(ledger, by="session")}
+    flash = rows[("alpha", "gemini-2.0-flash")]
+    assert (flash["calls"], flash["input_tokens"], flash["output_tokens"]) == (2, 1500, 300)
+    assert rows[("beta", "gemini-2.5-pro")]["cost_usd"] == approx(0.5)
+    assert sum(row["cost_usd"] for row in rows.values()) == approx(usage_cost(usage) + 0.5, abs=1e-5)
@@ -0,0 +1,96 @@
+### WARM POOL TESTS ###
+# Demand-driven stock, rate-limited refills and serving of pooled opening rounds
+# (warm_pool.py), on a fake clock with the upstream calls replaced by fakes.
+#
+# Usage: python -m pytest test_warm_pool.py
+
+import asyncio
+
+from warm_pool import (DEMAND_HALF_LIFE_SECONDS, NAME_PLACEHOLDER, REFILL_BURST, ROLE_PLACEHOLDER, SET_TTL_SECONDS,
+                       WarmPool, setup_key)
+
+SETUP = {"main_character_name": "Ada", "main_character_role": "pilot", "story_language": "English",
+         "story_genre": "Sci-Fi", "story_format": "Narrative", "era_style": "", "aesthetic_style": ""}
+OTHER_SETUP = {**SETUP, "story_genre": "Fantasy"}
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _pool(tmp_path, clock, **kwargs) -> WarmPool:
+    return WarmPool(str(tmp_path / "pool"), clock=clock, **kwargs)
+
+
+def _click(pool: WarmPool, setup: dict, times: int):
+    for _ in range(times):
+        pool.take(setup)
+
+
+def test_stock_targets_follow_decaying_demand(tmp_path):
+    clock = _Clock()
+    pool = _pool(tmp_path, clock, max_stock=3, pooled_setups=1)
+
+    _click(pool, SETUP, 6)
+    _click(pool, OTHER_SETUP, 1)
+    assert pool.targets() == {setup_key(SETUP): 3} # Only the most requested setup is stocked
+
+    clock.now += 2 * DEMAND_HALF_LIFE_SECONDS
+    assert round(pool.demand(setup_key(SETUP)), 6) == 1.5
+    assert pool.targets() == {setup_key(SETUP): 1}
+    assert (pool.misses, pool.hits) == (7, 0)
+
+
+def test_refill_respects_the_rate_budget_and_sets_are_personalized(tmp_path):
+    clock = _Clock()
+    pool = _pool(tmp_path, clock, max_stock=5, refills_per_minute=6)
+    _click(pool, SETUP, 20)
+    payloads, prompts = [], []
+
+    async def run_round(payload: dict) -> dict:
+        payloads.append(payload)
+        return {"suggestions": [(f"{NAME_PLACEHOLDER} the {ROLE_PLACEHOLDER} woke.", f"{NAME_PLACEHOLDER} is calm."),
+                                (f"Visual Concept: {NAME_PLACEHOLDER} at the helm.", "")],
+                "endings": [f"{NAME_PLACEHOLDER} flew home."]}
+
+    async def run_image(prompt: str) -> str:
+        prompts.append(prompt)
+        return "data:image/png;base64,AAAA"
+
+    burst = asyncio.run(pool.refill(run_round, run_image))
+    clock.now += 10 # One more token at 6 refills a minute
+    later = asyncio.run(pool.refill(run_round, run_image))
+    served = pool.take(SETUP)
+
+    assert (burst, later, pool.stock(setup_key(SETUP))) == (REFILL_BURST, 1, REFILL_BURST)
+    assert payloads[0]["session"] == "warm-pool" and NAME_PLACEHOLDER in payloads[0]["story_context"]
+    assert prompts[0] == "the main character at the helm."
+    assert served["suggestions"][0] == ("Ada the pilot woke.", "Ada is calm.")
+    assert served["endings"] == ["Ada flew home."] and served["image_url"] == "data:image/png;base64,AAAA"
+
+
+def test_mangled_and_expired_sets_are_not_served_and_stock_survives_a_restart(tmp_path):
+    clock = _Clock()
+    pool = _pool(tmp_path, clock)
+    key = setup_key(SETUP)
+    pool.add(key, [["{{NOMBRE}} despertó.", ""]], []) # The model translated the placeholder
+    clock.now += 1
+    pool.add(key, [[f"{NAME_PLACEHOLDER} woke.", ""]], [])
+    pool.record_latency(True, 0.2)
+    pool.record_latency(False, 3.0)
+
+    restarted = _pool(tmp_path, clock)
+    served = restarted.take(SETUP)
+    restarted.add(key, [[f"{NAME_PLACEHOLDER} woke.", ""]], [])
+    clock.now += SET_TTL_SECONDS + 1
+    stale = restarted.take(SETUP)
+    report = restarted.report()
+
+    assert served["suggestions"] == [("Ada woke.", "")]
+    assert stale is None and restarted.stock(key) == 0
+    assert (report["rejected"], report["expired"], report["hits"], report["misses"]) == (1, 1, 1, 1)
+    assert (report["with_pool"]["p50_ms"], report["without_pool"]["p50_ms"]) == (200.0, 3000.0)
@@ -0,0 +1,367 @@
+### TOKEN ACCOUNTING ###
+# Local token estimates, per-model usage counters, cost, budgets and billing export.
+#   - TokenEstimator counts words/characters per script (Latin, CJK, Indic) with
+#     per-language rates, and calibrates itself against the promptTokenCount that
+#     Gemini reports for uncached prompts.
+#   - Usage records (story_co_writer_ai.new_usage_counters) also carry flat
+#     "model:<name>:<counter>" keys, so per-session and per-model totals travel
+#     wherever the usage record goes (workers, session snapshots).
+#   - plan_generation() enforces a per-session budget: near the limit it trims the
+#     story context and switches to a cheaper model; past it, generation runs offline.
+#   - Usage deltas are appended to a JSONL ledger, and `export` turns it into billing CSV.
+#
+# Usage:
+#   python token_accounting.py estimate "Había una vez..." --language Spanish
+#   python token_accounting.py export --ledger usage_ledger.jsonl --out billing.csv --by session
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+from collections import defaultdict
+
+# --- Models and Prices ---
+# USD per million tokens (input, cached input, output) and per image. Override with
+# STORY_MODEL_PRICES='{"model": {"input": ..., "cached": ..., "output": ..., "image": ...}}'.
+MODEL_PRICES = {
+    "gemini-2.0-flash": {"input": 0.10, "cached": 0.025, "output": 0.40},
+    "gemini-2.0-flash-001": {"input": 0.10, "cached": 0.025, "output": 0.40},
+    "gemini-2.0-flash-lite": {"input": 0.075, "cached": 0.01875, "output": 0.30},
+    "gemini-2.5-pro": {"input": 1.25, "cached": 0.31, "output": 10.00},
+    "imagen-3.0-generate-002": {"image": 0.03},
+    "imagen-3.0-fast-generate-001": {"image": 0.02},
+}
+MODEL_PRICES.update(json.loads(os.getenv("STORY_MODEL_PRICES", "{}")))
+
+ECONOMY_GEMINI_MODEL = "gemini-2.0-flash-lite" # Used when a session nears its budget
+OFFLINE_MODEL = "offline"                      # Past the budget: local suggestion model only
+
+# --- Budgets ---
+SESSION_BUDGET_USD = float(os.getenv("STORY_SESSION_BUDGET_USD", "0")) # 0 = unlimited
+BUDGET_SOFT_RATIO = 0.8           # Economy mode from this share of the budget
+ECONOMY_CONTEXT_TOKENS = 1500     # Story context kept in economy mode
+INSTRUCTION_TOKENS_ESTIMATE = 700 # Prompt template around the story context
+EXPECTED_OUTPUT_TOKENS = 700      # Per candidate, for projecting the next call
+
+USAGE_LEDGER_PATH = os.getenv("STORY_USAGE_LEDGER", "usage_ledger.jsonl")
+
+_MODEL_PREFIX = "model:"
+MODEL_COUNTERS = ("calls", "input_tokens", "cached_tokens", "output_tokens", "images")
+
+
+# --- Token Estimation ---
+
+_LATIN_WORD_RE = re.compile(r"[A-Za-zÀ-ɏ']+")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+_INDIC_RE = re.compile(r"[ऀ-෿]")
+_DIGIT_RE = re.compile(r"\d")
+_SYMBOL_RE = re.compile(r"[^\w\sऀ-෿]")
+
+# Tokens per Latin word, per CJK character, per Indic character, per digit and per symbol
+DEFAULT_RATES = {"word": 1.35, "cjk": 0.9, "indic": 0.5, "digit": 1.0, "symbol": 0.9}
+LANGUAGE_RATES = {
+    "English": {"word": 1.3},
+    "Spanish": {"word": 1.5},
+    "French": {"word": 1.55},
+    "German": {"word": 1.7},
+    "Hindi": {"indic": 0.5},
+    "Chinese": {"cjk": 0.9},
+}
+
+CALIBRATION_ALPHA = 0.2          # Weight of each new observation
+CALIBRATION_MIN_TOKENS = 50      # Ignore tiny prompts (dominated by rounding)
+CALIBRATION_RANGE = (0.5, 2.0)
+
+
+class TokenEstimator:
+    """Fast per-language token estimates, corrected by observed prompt token counts."""
+
+    def __init__(self):
+        self._factors: dict[str, float] = {}   # language -> observed/estimated ratio (EWMA)
+        self._observations: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def raw_estimate(self, text: str, language: str = "") -> float:
+        """The uncalibrated estimate from the per-script rates."""
+        rates = {**DEFAULT_RATES, **LANGUAGE_RATES.get(language, {})}
+        estimate = (
+            len(_LATIN_WORD_RE.findall(text)) * rates["word"]
+            + len(_DIGIT_RE.findall(text)) * rates["digit"]
+            + len(_SYMBOL_RE.findall(text)) * rates["symbol"]
+        )
+        if not text.isascii(): # Most prompts are plain ASCII: skip the other scripts
+            estimate += len(_CJK_RE.findall(text)) * rates["cjk"] + len(_INDIC_RE.findall(text)) * rates["indic"]
+        return estimate
+
+    def estimate(self, text: str, language: str = "") -> int:
+        """
+        Estimates the tokens Gemini will count for text.
+
+        Args:
+            text (str): Prompt or story text.
+            language (str): Story language (e.g. "Spanish"); "" uses the defaults.
+
+        Returns:
+            int: Estimated token count.
+        """
+        if not text:
+            return 0
+        return max(1, round(self.raw_estimate(text, language) * self._factors.get(language, 1.0)))
+
+    def observe(self, text: str, language: str, actual_tokens: int):
+        """Folds one (prompt, promptTokenCount) pair into the language's calibration."""
+        if actual_tokens < CALIBRATION_MIN_TOKENS:
+            return
+        raw = self.raw_estimate(text, language)
+        if raw <= 0:
+            return
+        low, high = CALIBRATION_RANGE
+        ratio = min(high, max(low, actual_tokens / raw))
+        with self._lock:
+            previous = self._factors.get(language)
+            self._factors[language] = ratio if previous is None else previous + CALIBRATION_ALPHA * (ratio - previous)
+            self._observations[language] += 1
+
+    def calibration(self) -> dict:
+        """Returns {language: {"factor", "observations"}} for diagnostics."""
+        return {language: {"factor": round(factor, 3), "observations": self._observations[language]}
+                for language, factor in self._factors.items()}
+
+
+ESTIMATOR = TokenEstimator()
+
+def estimate_tokens(text: str, language: str = "") -> int:
+    """Estimates tokens with the process-wide, calibrated estimator."""
+    return ESTIMATOR.estimate(text, language)
+
+
+# --- Per-Model Counters ---
+
+def _model_key(model: str, counter: str) -> str:
+    return f"{_MODEL_PREFIX}{model}:{counter}"
+
+
+def record_model_tokens(usage: dict | None, model: str, input_tokens: int = 0, cached_tokens: int = 0, output_tokens: int = 0):
+    """Adds one text call to a usage record's per-model counters, if given."""
+    if usage is None:
+        return
+    for counter, value in (("calls", 1), ("input_tokens", input_tokens), ("cached_tokens", cached_tokens), ("output_tokens", output_tokens)):
+        key = _model_key(model, counter)
+        usage[key] = usage.get(key, 0) + value
+
+
+def record_model_images(usage: dict | None, model: str, images: int = 1):
+    """Adds image generations to a usage record's per-model counters, if given."""
+    if usage is None:
+        return
+    for counter, value in (("calls", 1), ("images", images)):
+        key = _model_key(model, counter)
+        usage[key] = usage.get(key, 0) + value
+
+
+def model_breakdown(usage: dict) -> dict:
+    """
+    Collects the per-model counters of a usage record.
+
+    Returns:
+        dict: {model: {"calls", "input_tokens", "cached_tokens", "output_tokens", "images"}}.
+    """
+    models: dict[str, dict] = {}
+    for key, value in usage.items():
+        if not key.startswith(_MODEL_PREFIX):
+            continue
+        model, counter = key[len(_MODEL_PREFIX):].rsplit(":", 1)
+        models.setdefault(model, dict.fromkeys(MODEL_COUNTERS, 0))[counter] = value
+    return models
+
+
+def model_cost(model: str, counters: dict) -> float:
+    """USD cost of one model's counters (cached input tokens billed at the cached rate)."""
+    prices = MODEL_PRICES.get(model, {})
+    cached = counters.get("cached_tokens", 0)
+    return (
+        (counters.get("input_tokens", 0) - cached) * prices.get("input", 0.0) / 1e6
+        + cached * prices.get("cached", prices.get("input", 0.0)) / 1e6
+        + counters.get("output_tokens", 0) * prices.get("output", 0.0) / 1e6
+        + counters.get("images", 0) * prices.get("image", 0.0)
+    )
+
+
+def usage_cost(usage: dict) -> float:
+    """Total USD cost of a usage record."""
+    return sum(model_cost(model, counters) for model, counters in model_breakdown(usage).items())
+
+
+# --- Budgets ---
+
+def trim_story_context(story_context: str, max_tokens: int, language: str = "") -> str:
+    """
+    Shortens a story context (see get_story_context_streamlit) to about max_tokens,
+    keeping the setup lines and the most recent part of the story.
+    """
+    marker = "Current story progress:\n"
+    header, _, progress = story_context.partition(marker)
+    if not progress:
+        header, progress, marker = "", story_context, ""
+    tokens = estimate_tokens(progress, language)
+    if tokens <= max_tokens:
+        return story_context
+    keep = int(len(progress) * max_tokens / tokens)
+    tail = progress[-keep:] if keep > 0 else ""
+    sentence = tail.find(". ")
+    if 0 <= sentence < len(tail) // 3:
+        tail = tail[sentence + 2:] # Start on a sentence boundary
+    return f"{header}{marker}[...] {tail}"
+
+
+def plan_generation(usage: dict, story_context: str, language: str = "", candidate_count: int = 1, budget_usd: float | None = None) -> dict:
+    """
+    Decides how the next generation may run under the session budget.
+
+    Args:
+        usage (dict): The session's usage record.
+        story_context (str): The context about to be sent.
+        language (str): Story language (for the token estimate).
+        candidate_count (int): Candidates the call will request.
+        budget_usd (float): Session budget; defaults to SESSION_BUDGET_USD (0 = unlimited).
+
+    Returns:
+        dict: {
+            "status": "ok" | "economy" | "offline",
+            "model": "" (default model), ECONOMY_GEMINI_MODEL or OFFLINE_MODEL,
+            "story_context": the (possibly trimmed) context to send,
+            "spent_usd": float, "budget_usd": float,
+        }
+    """
+    budget = SESSION_BUDGET_USD if budget_usd is None else budget_usd
+    spent = usage_cost(usage)
+    plan = {"status": "ok", "model": "", "story_context": story_context, "spent_usd": spent, "budget_usd": budget}
+    if budget <= 0:
+        return plan
+
+    def projected(model: str, context: str) -> float:
+        input_tokens = estimate_tokens(context, language) + INSTRUCTION_TOKENS_ESTIMATE
+        return model_cost(model, {"input_tokens": input_tokens, "output_tokens": EXPECTED_OUTPUT_TOKENS * candidate_count})
+
+    import story_co_writer_ai # Deferred: the engine imports this module
+    if spent < budget * BUDGET_SOFT_RATIO and spent + projected(story_co_writer_ai.GEMINI_MODEL, story_context) <= budget:
+        return plan
+    trimmed = trim_story_context(story_context, ECONOMY_CONTEXT_TOKENS, language)
+    if spent + projected(ECONOMY_GEMINI_MODEL, trimmed) <= budget:
+        return {**plan, "status": "economy", "model": ECONOMY_GEMINI_MODEL, "story_context": trimmed}
+    return {**plan, "status": "offline", "model": OFFLINE_MODEL}
+
+
+# --- Billing Ledger ---
+
+_ledger_lock = threading.Lock()
+
+def record_usage_delta(session: str, before: dict, after: dict, path: str = USAGE_LEDGER_PATH) -> int:
+    """
+    Appends the per-model usage added between two snapshots of a session's
+    usage record to the billing ledger (one JSON line per model).
+
+    Returns:
+        int: Lines written.
+    """
+    previous = model_breakdown(before)
+    lines = []
+    now = time.time()
+    for model, counters in model_breakdown(after).items():
+        delta = {counter: counters[counter] - previous.get(model, {}).get(counter, 0) for counter in MODEL_COUNTERS}
+        if not any(delta.values()):
+            continue
+        lines.append(json.dumps({"ts": round(now, 3), "session": session, "model": model, **delta, "cost_usd": round(model_cost(model, delta), 8)}))
+    if lines and path:
+        # One write per batch in append mode, so lines from several processes don't interleave
+        with _ledger_lock, open(path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    return len(lines)
+
+
+def summarize_ledger(path: str, by: str = "session") -> list[dict]:
+    """
+    Aggregates a ledger file.
+
+    Args:
+        path (str): Ledger written by record_usage_delta.
+        by (str): "session", "model" or "day" (rows are further split by model).
+
+    Returns:
+        list[dict]: One row per group with the MODEL_COUNTERS totals and cost_usd.
+    """
+    groups: dict[tuple, dict] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # Torn last line
+            if by == "day":
+                group = time.strftime("%Y-%m-%d", time.gmtime(entry["ts"]))
+            elif by == "model":
+                group = ""
+            else:
+                group = entry["session"]
+            key = (group, entry["model"])
+            row = groups.get(key)
+            if row is None:
+                row = groups[key] = {"model": entry["model"], **dict.fromkeys(MODEL_COUNTERS, 0), "cost_usd": 0.0}
+                if by != "model":
+                    row = groups[key] = {by: group, **row}
+            for counter in MODEL_COUNTERS:
+                row[counter] += entry.get(counter, 0)
+            row["cost_usd"] += entry.get("cost_usd", 0.0)
+    rows = [groups[key] for key in sorted(groups)]
+    for row in rows:
+        row["cost_usd"] = round(row["cost_usd"], 6)
+    return rows
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Estimate tokens and export Story-Verse usage for billing.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    estimate_parser = commands.add_parser("estimate", help="Estimate the tokens of a text or file.")
+    estimate_parser.add_argument("text", help="Text, or @path to read a file.")
+    estimate_parser.add_argument("--language", default="")
+
+    export_parser = commands.add_parser("export", help="Aggregate the usage ledger into CSV.")
+    export_parser.add_argument("--ledger", default=USAGE_LEDGER_PATH)
+    export_parser.add_argument("--out", default="-", help="CSV file ('-' for stdout).")
+    export_parser.add_argument("--by", choices=["session", "day", "model"], default="session")
+
+    args = parser.parse_args(argv)
+    if args.command == "estimate":
+        text = args.text
+        if text.startswith("@"):
+            with open(text[1:], "r", encoding="utf-8") as f:
+                text = f.read()
+        print(estimate_tokens(text, args.language))
+        return 0
+
+    try:
+        rows = summarize_ledger(args.ledger, args.by)
+    except OSError as error:
+        print(f"❌ Could not read ledger '{args.ledger}': {error}")
+        return 1
+    fields = ([] if args.by == "model" else [args.by]) + ["model", *MODEL_COUNTERS, "cost_usd"]
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="", encoding="utf-8")
+    try:
+        writer = csv.DictWriter(out, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if args.out != "-":
+        print(f"✅ {len(rows)} rows, ${sum(row['cost_usd'] for row in rows):.4f} total -> '{args.out}'")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+### WARM POOL ###
+# Ready-made opening rounds. The first "Create Story" click is the slowest moment
+# of a story: a cold Gemini call with no story yet, then Imagen. An opening round
+# depends on little more than the setup buttons (genre x format x language x era,
+# plus the aesthetic), so a small stock of opening sets is kept per popular setup:
+#   - sets are generated with placeholders for the character's name and role,
+#     which are filled in when a set is served,
+#   - each set comes with the image of its visual concept,
+#   - the stock per setup follows demand: every click counts toward its setup,
+#     with older clicks fading (half-life DEMAND_HALF_LIFE_SECONDS), and only the
+#     most requested setups are stocked,
+#   - refills run in the background under a rate budget (REFILLS_PER_MINUTE) and
+#     are billed to their own ledger account (WARM_POOL_SESSION),
+#   - sets older than SET_TTL_SECONDS are discarded.
+# Every opening round records whether it came from the pool and how long it took;
+# the report compares the two:
+#   python warm_pool.py report [--directory .story_warm_pool]
+
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+
+from story_records import build_story_context
+
+WARM_POOL_DIRECTORY = os.getenv("STORY_WARM_POOL", ".story_warm_pool")
+WARM_POOL_SESSION = "warm-pool" # Billing ledger account of refills
+MAX_STOCK = int(os.getenv("STORY_WARM_POOL_MAX_STOCK", "3"))                  # Sets per setup at most
+POOLED_SETUPS = int(os.getenv("STORY_WARM_POOL_SETUPS", "24"))                # Most requested setups kept stocked
+REFILLS_PER_MINUTE = float(os.getenv("STORY_WARM_POOL_REFILLS_PER_MINUTE", "6"))
+REFILL_BURST = 3                    # Refills allowed back to back after a quiet spell
+DEMAND_HALF_LIFE_SECONDS = 6 * 3600
+DEMAND_PER_EXTRA_SET = 2.0          # Recent clicks a setup needs per stocked set beyond the first
+MIN_DEMAND = 0.5                    # Setups below this are not stocked
+SET_TTL_SECONDS = 24 * 3600
+LATENCY_SAMPLES = 1000              # Opening round times kept per source
+NAME_PLACEHOLDER = "{{NAME}}"
+ROLE_PLACEHOLDER = "{{ROLE}}"
+PLACEHOLDER_NOTE = (f"Write the main character's name as {NAME_PLACEHOLDER} and their role as {ROLE_PLACEHOLDER}, "
+                    "exactly as written here, in every language; they are filled in later.\n")
+
+
+def setup_key(setup) -> str:
+    """The pool key of a story setup (any mapping holding story_records.STORY_METADATA_KEYS)."""
+    return "|".join(setup.get(name, "") or "" for name in ("story_genre", "story_format", "story_language", "era_style", "aesthetic_style"))
+
+
+def opening_payload(key: str) -> dict:
+    """The "round" job payload that generates an opening set for a setup key, with placeholders."""
+    genre, story_format, language, era_style, aesthetic_style = key.split("|")
+    story_context = PLACEHOLDER_NOTE + build_story_context({
+        "main_character_name": NAME_PLACEHOLDER, "main_character_role": ROLE_PLACEHOLDER,
+        "story_genre": genre, "story_format": story_format, "aesthetic_style": aesthetic_style,
+        "era_style": era_style, "current_story": "",
+    })
+    return {
+        "session": WARM_POOL_SESSION, "story_context": story_context, "language": language, "genre": genre,
+        "story_format": story_format, "aesthetic_style": aesthetic_style, "era_style": era_style,
+        "recent_segments": [],
+        "roll": uuid.uuid4().hex, # Every refill is a new set, never the job store's previous one
+    }
+
+
+def _fill(text: str, name: str, role: str) -> str:
+    return text.replace(NAME_PLACEHOLDER, name).replace(ROLE_PLACEHOLDER, role)
+
+
+def personalize(entry: dict, name: str, role: str) -> dict | None:
+    """
+    Fills a pooled set in for one writer.
+
+    Returns:
+        dict | None: {"suggestions", "endings", "image_url"}, or None when the model
+                     mangled a placeholder (e.g. translated it) and the set is unusable.
+    """
+    suggestions = [(_fill(text, name, role), _fill(commentary, name, role)) for text, commentary in entry["suggestions"]]
+    endings = [_fill(ending, name, role) for ending in entry["endings"]]
+    if any("{{" in text for pair in suggestions for text in pair) or any("{{" in ending for ending in endings):
+        return None
+    return {"suggestions": suggestions, "endings": endings, "image_url": entry.get("image_url", "")}
+
+
+def _percentiles(values: list[float]) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"rounds": 0, "p50_ms": 0.0, "p95_ms": 0.0}
+    return {
+        "rounds": len(values),
+        "p50_ms": round(values[len(values) // 2] * 1000, 1),
+        "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 1),
+    }
+
+
+class WarmPool:
+    """Opening-set stock of a server process; sets live as one JSON file each under `directory`."""
+
+    def __init__(self, directory: str = WARM_POOL_DIRECTORY, max_stock: int = MAX_STOCK, pooled_setups: int = POOLED_SETUPS,
+                 refills_per_minute: float = REFILLS_PER_MINUTE, clock=time.time):
+        self.directory = directory
+        self.max_stock = max_stock
+        self.pooled_setups = pooled_setups
+        self.refills_per_minute = refills_per_minute
+        self.clock = clock
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stock: dict[str, list[tuple[float, str]]] = {} # key -> [(created, path)], oldest first
+        self._demand: dict[str, tuple[float, float]] = {}    # key -> (decayed clicks, as of)
+        self._latency: dict[str, list[float]] = {"pool": [], "live": []}
+        self._tokens = float(REFILL_BURST)
+        self._tokens_at = clock()
+        self._refilling = False
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0 # Served sets with a mangled placeholder
+        self.expired = 0
+        self.refills = 0
+        self._load()
+
+    # --- Persistence ---
+
+    @property
+    def _state_path(self) -> str:
+        return os.path.join(self.directory, "pool_state.json")
+
+    def _load(self):
+        try:
+            with open(self._state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self._demand = {key: tuple(value) for key, value in state.get("demand", {}).items()}
+            self._latency = {source: state.get("latency", {}).get(source, []) for source in ("pool", "live")}
+            for name, value in state.get("counters", {}).items():
+                setattr(self, name, value)
+        except (OSError, ValueError):
+            pass
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".set.json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                self._stock.setdefault(entry["key"], []).append((entry["created"], path))
+            except (OSError, ValueError, KeyError):
+                print(f"Warning: skipping unreadable warm pool set '{path}'.")
+        for entries in self._stock.values():
+            entries.sort()
+
+    def _save_state(self):
+        temp_path = self._state_path + ".tmp"
+        with self._lock:
+            counters = {name: getattr(self, name) for name in ("hits", "misses", "rejected", "expired", "refills")}
+            state = {"demand": self._demand, "latency": self._latency, "counters": counters}
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(temp_path, self._state_path)
+
+    # --- Demand and Stock Levels ---
+
+    def demand(self, key: str) -> float:
+        """Recent clicks on a setup, each halved in weight every DEMAND_HALF_LIFE_SECONDS."""
+        value, as_of = self._demand.get(key, (0.0, 0.0))
+        return value * 0.5 ** ((self.clock() - as_of) / DEMAND_HALF_LIFE_SECONDS)
+
+    def targets(self) -> dict[str, int]:
+        """Sets to keep per setup: the most requested setups only, more sets for more demand."""
+        demand = {key: self.demand(key) for key in self._demand}
+        popular = sorted((key for key in demand if demand[key] >= MIN_DEMAND), key=lambda key: -demand[key])[:self.pooled_setups]
+        return {key: min(self.max_stock, 1 + int(demand[key] / DEMAND_PER_EXTRA_SET)) for key in popular}
+
+    def stock(self, key: str) -> int:
+        with self._lock:
+            return len(self._stock.get(key, []))
+
+    def _deficits(self) -> list[str]:
+        """Setups below their target, the highest demand per stocked set first."""
+        targets = self.targets()
+        short = [key for key, target in targets.items() if self.stock(key) < target]
+        return sorted(short, key=lambda key: -self.demand(key) / (self.stock(key) + 1))
+
+    def needs_refill(self) -> bool:
+        return not self._refilling and bool(self._deficits())
+
+    def _take_token(self) -> bool:
+        """The rate budget: a token bucket of REFILL_BURST refills, topped up at refills_per_minute."""
+        now = self.clock()
+        with self._lock:
+            self._tokens = min(REFILL_BURST, self._tokens + (now - self._tokens_at) * self.refills_per_minute / 60)
+            self._tokens_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    # --- Serving ---
+
+    def take(self, setup) -> dict | None:
+        """
+        Serves a pooled opening set for a setup, filled in with its character, and
+        counts the click toward the setup's demand.
+
+        Args:
+            setup: Any mapping holding story_records.STORY_METADATA_KEYS (e.g. st.session_state).
+
+        Returns:
+            dict | None: {"suggestions", "endings", "image_url"}, or None when the pool has no usable set.
+        """
+        key = setup_key(setup)
+        with self._lock:
+            value = self.demand(key)
+            self._demand[key] = (value + 1, self.clock())
+        served = None
+        while served is None:
+            with self._lock:
+                entries = self._stock.get(key)
+                if not entries:
+                    self.misses += 1
+                    break
+                created, path = entries.pop(0)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                os.remove(path)
+            except (OSError, ValueError):
+                continue
+            if self.clock() - created > SET_TTL_SECONDS:
+                self.expired += 1
+                continue
+            served = personalize(entry, setup.get("main_character_name", ""), setup.get("main_character_role", ""))
+            if served is None:
+                self.rejected += 1
+        if served is not None:
+            self.hits += 1
+        self._save_state()
+        return served
+
+    def add(self, key: str, suggestions: list, endings: list, image_url: str = ""):
+        """Stocks a generated opening set (with placeholders) for a setup key."""
+        created = self.clock()
+        path = os.path.join(self.directory, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}-{uuid.uuid4().hex[:8]}.set.json")
+        entry = {"key": key, "created": created, "suggestions": suggestions, "endings": endings,
+                 "image_url": image_url if image_url.startswith("data:") else ""}
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._stock.setdefault(key, []).append((created, path))
+            self.refills += 1
+
+    def _drop_expired(self):
+        now = self.clock()
+        with self._lock:
+            stale = [(key, item) for key, entries in self._stock.items() for item in entries if now - item[0] > SET_TTL_SECONDS]
+            for key, item in stale:
+                self._stock[key].remove(item)
+                self.expired += 1
+        for _, (_, path) in stale:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def refill(self, run_round, run_image, max_sets: int | None = None) -> int:
+        """
+        Generates sets for the setups below their target while the rate budget allows.
+        Only one refill runs at a time; a second call returns 0 at once.
+
+        Args:
+            run_round: async (payload) -> a "round" job result, or None when the upstream did not answer.
+            run_image: async (prompt) -> image URL.
+            max_sets (int | None): Stop after this many sets.
+
+        Returns:
+            int: Sets added.
+        """
+        with self._lock:
+            if self._refilling:
+                return 0
+            self._refilling = True
+        added = 0
+        try:
+            self._drop_expired()
+            while max_sets is None or added < max_sets:
+                deficits = self._deficits()
+                if not deficits or not self._take_token():
+                    break
+                key = deficits[0]
+                result = await run_round(opening_payload(key))
+                if not result:
+                    break # The upstream is struggling; try again on the next refill
+                concept = next((text for text, _ in result["suggestions"] if text.startswith("Visual Concept:")), "")
+                image_url = ""
+                if concept:
+                    neutral = concept.replace("Visual Concept:", "").replace(NAME_PLACEHOLDER, "the main character").replace(ROLE_PLACEHOLDER, "")
+                    image_url = await run_image(neutral.strip())
+                self.add(key, [list(pair) for pair in result["suggestions"]], result["endings"], image_url)
+                added += 1
+        finally:
+            self._refilling = False
+        return added
+
+    # --- Latency Report ---
+
+    def record_latency(self, pooled: bool, seconds: float):
+        """Records how long an opening round took to show, and whether the pool served it."""
+        with self._lock:
+            samples = self._latency["pool" if pooled else "live"]
+            samples.append(round(seconds, 4))
+            del samples[:-LATENCY_SAMPLES]
+        self._save_state()
+
+    def report(self) -> dict:
+        """Opening round times with and without the pool, hit statistics and stock levels."""
+        targets = self.targets()
+        with self._lock:
+            stocked = {key: len(entries) for key, entries in self._stock.items() if entries}
+            latency = {source: _percentiles(samples) for source, samples in self._latency.items()}
+        lookups = self.hits + self.misses
+        return {
+            "with_pool": latency["pool"],
+            "without_pool": latency["live"],
+            "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+            "rejected": self.rejected, "expired": self.expired, "refills": self.refills,
+            "setups": [{"setup": key, "demand": round(self.demand(key), 2), "target": targets.get(key, 0), "stock": stocked.get(key, 0)}
+                       for key in sorted(set(targets) | set(stocked), key=lambda key: -self.demand(key))],
+        }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect the warm pool of opening rounds.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report_parser = commands.add_parser("report", help="Opening round times with and without the pool, and stock per setup.")
+    report_parser.add_argument("--directory", default=WARM_POOL_DIRECTORY)
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        print(f"❌ No warm pool at '{args.directory}'.")
+        return 1
+    report = WarmPool(args.directory).report()
+    for label, source in (("with pool", "with_pool"), ("without pool", "without_pool")):
+        row = report[source]
+        print(f"Opening rounds {label:<13} {row['rounds']:>6} rounds   p50 {row['p50_ms']:>8.0f} ms   p95 {row['p95_ms']:>8.0f} ms")
+    print(f"Stocked sets: {sum(row['stock'] for row in report['setups'])}; "
+          f"{report['rejected']} rejected for mangled placeholders, {report['expired']} expired.")
+    print(f"\n{'setup (genre|format|language|era|aesthetic)':<60} {'demand':>7} {'target':>7} {'stock':>6}")
+    for row in report["setups"]:
+        print(f"{row['setup']:<60} {row['demand']:>7.2f} {row['target']:>7} {row['stock']:>6}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,342 @@
+### WORKER POOL ###
+# Scale-out mode: several Streamlit app processes and several generation worker
+# processes share one SharedStore (shared_store.py). App processes submit
+# long-running generation jobs (suggestion rounds, endings, images, translations)
+# to the job store; workers claim them, call Gemini/Imagen and write results
+# back. Session state lives in the shared session directory (session_store.py),
+# so a session can reconnect to any app process with its resume token.
+#
+# Without STORY_SHARED_STORE, run_job() simply runs the job in-process, so the
+# GUI uses the same code path in single-process mode.
+#
+# Usage:
+#   python worker_pool.py work --workers 4                       # job workers only
+#   python worker_pool.py serve --app-workers 4 --job-workers 4  # apps + workers
+
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import asyncio
+import hashlib
+import argparse
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+
+import story_co_writer_ai
+from story_co_writer_ai import new_usage_counters
+from context_cache import StoryContextCache, CACHE_TTL_SECONDS
+from suggestion_diversity import SketchIndex
+from shared_store import get_shared_store, JOB_RETENTION_SECONDS
+from story_translation import translate_record
+from deadlines import Deadline
+
+WORKER_CONCURRENCY = 8          # Jobs in flight per worker process (they are I/O bound)
+JOB_TIMEOUT_SECONDS = 180.0
+DEADLINE_GRACE_SECONDS = 2.0    # Extra wait for a job with a deadline, whose worker gives up at it
+RESULT_CACHE_SECONDS = 300      # Identical jobs within this window reuse the stored result
+# Endings are rolled repeatedly on purpose, so only these kinds reuse results
+CACHEABLE_KINDS = {"round", "suggestions", "image"}
+IDLE_POLL_SECONDS = 0.02
+PURGE_EVERY_SECONDS = 60.0      # How often each worker drops expired cache rows and old finished jobs
+MAX_CONTEXT_CACHES = 256        # Sessions whose context cache a worker keeps; least recently used are closed
+
+
+# --- Job Handlers ---
+# Each handler takes the JSON payload plus the session helpers (usage record,
+# context cache, sketch index, deadline) and returns a JSON-safe value.
+
+async def _handle_round(payload: dict, usage: dict, context_cache, sketch_index, deadline=None):
+    return await story_co_writer_ai.generate_gemini_round(
+        payload["story_context"], payload["language"], payload["genre"], payload["story_format"],
+        payload.get("tone_command", ""), payload.get("aesthetic_style", ""), payload.get("era_style", ""),
+        usage=usage, context_cache=context_cache, sketch_index=sketch_index,
+        model=payload.get("model", ""), deadline=deadline
+    )
+
+
+async def _handle_suggestions(payload: dict, usage: dict, context_cache, sketch_index, deadline=None):
+    return await story_co_writer_ai.generate_gemini_suggestions(
+        payload["story_context"], payload["language"], payload["genre"], payload["story_format"],
+        payload.get("tone_command", ""), payload.get("aesthetic_style", ""), payload.get("era_style", ""),
+        usage=usage, context_cache=context_cache, sketch_index=sketch_index,
+        model=payload.get("model", ""), deadline=deadline
+    )
+
+
+async def _handle_endings(payload: dict, usage: dict, context_cache, sketch_index, deadline=None):
+    return await story_co_writer_ai.generate_gemini_endings(
+        payload["story_context"], payload["language"], payload["genre"], payload["story_format"],
+        payload.get("aesthetic_style", ""), payload.get("era_style", ""),
+        candidate_count=payload.get("candidate_count", 1), usage=usage, sketch_index=sketch_index,
+        model=payload.get("model", ""), deadline=deadline
+    )
+
+
+async def _handle_image(payload: dict, usage: dict, context_cache, sketch_index, deadline=None):
+    return await story_co_writer_ai.call_imagen_api(payload["prompt"], usage=usage, model=payload.get("model", ""), deadline=deadline)
+
+
+async def _handle_image_samples(payload: dict, usage: dict, context_cache, sketch_index, deadline=None):
+    return await story_co_writer_ai.call_imagen_api_samples(
+        payload["prompt"], payload.get("sample_count", 1), usage=usage, model=payload.get("model", ""), deadline=deadline
+    )
+
+
+async def _handle_translate(payload: dict, usage: dict, context_cache, sketch_index, deadline=None):
+    record, stats = await translate_record(payload["record"], payload["target_language"], usage=usage, model=payload.get("model", ""), deadline=deadline)
+    return {"record": record, "stats": stats}
+
+
+JOB_HANDLERS = {
+    "round": _handle_round,
+    "suggestions": _handle_suggestions,
+    "endings": _handle_endings,
+    "image": _handle_image,
+    "image_samples": _handle_image_samples,
+    "translate": _handle_translate,
+}
+
+
+def _restore_tuples(kind: str, value):
+    """JSON turns (suggestion, commentary) tuples into lists; turn them back."""
+    if kind == "suggestions":
+        return [tuple(item) for item in value]
+    if kind == "round":
+        value["suggestions"] = [tuple(item) for item in value["suggestions"]]
+        value["alternates"] = [[tuple(item) for item in alternate] for alternate in value["alternates"]]
+    return value
+
+
+def _job_fingerprint(kind: str, payload: dict) -> str:
+    """Identifies identical jobs (same kind and same inputs, excluding the session and deadline)."""
+    stable = {key: value for key, value in payload.items() if key not in ("session", "deadline")}
+    return hashlib.sha256(f"{kind}|{json.dumps(stable, sort_keys=True)}".encode("utf-8")).hexdigest()
+
+
+def _merge_counters(target: dict | None, source: dict | None):
+    if target is None or not source:
+        return
+    for key, value in source.items():
+        target[key] = target.get(key, 0) + value
+
+
+# --- Client Side (app processes) ---
+
+async def run_job(kind: str, payload: dict, usage: dict | None = None, context_cache=None, sketch_index=None, store=None, deadline=None):
+    """
+    Runs a generation job: offloaded to the worker pool when a shared store is
+    configured, otherwise in this process with the session's own helpers.
+
+    Args:
+        kind (str): One of JOB_HANDLERS.
+        payload (dict): JSON-safe inputs. Include "session" (resume token) so a worker can
+                        keep that session's context cache, "recent_segments" for
+                        duplicate filtering in another process, and "deadline"
+                        (Deadline.to_payload()) so a worker keeps to the action's budget.
+        usage (dict): The session's usage record; the job's usage is added to it.
+        context_cache (StoryContextCache): Used only in-process.
+        sketch_index (SketchIndex): Used in-process; when offloaded, its counters are updated.
+        store (SharedStore): Overrides the configured shared store.
+        deadline (Deadline): The action's latency budget; phases timed by a worker are added to it.
+
+    Returns:
+        The handler's value (e.g. a round dict, a list of endings, an image URL).
+
+    Raises:
+        RuntimeError: If the offloaded job fails or times out.
+    """
+    store = store or get_shared_store()
+    if store is None:
+        return await JOB_HANDLERS[kind](payload, usage, context_cache, sketch_index, deadline or Deadline.from_payload(payload, kind))
+
+    fingerprint = _job_fingerprint(kind, payload)
+    cached = store.cache_get("job_results", fingerprint) if kind in CACHEABLE_KINDS else None
+    if cached is not None:
+        return _restore_tuples(kind, json.loads(cached)["value"]) # Usage was paid by the first run
+
+    job_id = store.submit_job(kind, payload, dedupe_key=fingerprint)
+    timeout = JOB_TIMEOUT_SECONDS
+    if deadline is not None:
+        timeout = min(timeout, deadline.remaining() + DEADLINE_GRACE_SECONDS)
+    job = await store.wait_for_job(job_id, timeout=timeout)
+    if job["status"] != "done":
+        raise RuntimeError(f"{kind} job {job_id} {job['status']}: {job.get('error')}")
+    result = job["result"]
+    _merge_counters(usage, result.get("usage"))
+    if deadline is not None:
+        deadline.merge(result.get("deadline"))
+    if sketch_index is not None:
+        _merge_counters(sketch_index.counters, result.get("diversity"))
+    return _restore_tuples(kind, result["value"])
+
+
+# --- Worker Side ---
+
+class JobWorker:
+    """One worker process: claims jobs from the shared store and runs them concurrently."""
+
+    def __init__(self, store_path: str, worker_id: str = "", concurrency: int = WORKER_CONCURRENCY,
+                 job_retention: float = JOB_RETENTION_SECONDS, max_context_caches: int = MAX_CONTEXT_CACHES,
+                 context_cache_idle_seconds: float = CACHE_TTL_SECONDS):
+        self.store = get_shared_store(store_path)
+        self.worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.job_retention = job_retention
+        self.max_context_caches = max_context_caches
+        self.context_cache_idle_seconds = context_cache_idle_seconds # By then the upstream cache has lapsed anyway
+        # session token -> (cache, last used), least recently used first
+        self.context_caches: OrderedDict[str, tuple[StoryContextCache, float]] = OrderedDict()
+        self._closing: set[asyncio.Task] = set()
+        self.stopping = False
+        self.completed = 0
+        self.purged = 0
+
+    def _context_cache(self, session: str) -> StoryContextCache:
+        """The session's context cache; closes caches idle too long and the least recently used beyond the cap."""
+        now = time.monotonic()
+        cache = self.context_caches.pop(session, (StoryContextCache(), now))[0]
+        cutoff = now - self.context_cache_idle_seconds
+        while self.context_caches:
+            _, (oldest, used) = next(iter(self.context_caches.items()))
+            if len(self.context_caches) < self.max_context_caches and used >= cutoff:
+                break
+            self.context_caches.popitem(last=False)
+            task = asyncio.create_task(oldest.close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        self.context_caches[session] = (cache, now)
+        return cache
+
+    async def _run(self, job: dict):
+        payload = job["payload"]
+        usage = new_usage_counters()
+        sketch_index = None
+        if "recent_segments" in payload:
+            sketch_index = SketchIndex()
+            for text in payload["recent_segments"]:
+                sketch_index.add(text)
+        context_cache = None
+        if payload.get("session"):
+            context_cache = self._context_cache(payload["session"])
+        deadline = Deadline.from_payload(payload, job["kind"])
+        try:
+            value = await JOB_HANDLERS[job["kind"]](payload, usage, context_cache, sketch_index, deadline)
+        except Exception as error:
+            self.store.fail_job(job["id"], f"{type(error).__name__}: {error}")
+            return
+        result = {"value": value, "usage": usage, "diversity": sketch_index.counters if sketch_index else {},
+                  "deadline": deadline.report() if deadline else None}
+        self.store.complete_job(job["id"], result)
+        if job["kind"] in CACHEABLE_KINDS:
+            self.store.cache_put("job_results", _job_fingerprint(job["kind"], payload), json.dumps({"value": value}).encode("utf-8"), RESULT_CACHE_SECONDS)
+        self.completed += 1
+
+    async def serve(self):
+        """Claims and runs jobs until stop() is called."""
+        running: set[asyncio.Task] = set()
+        kinds = list(JOB_HANDLERS)
+        next_purge = 0.0 # Purge at startup, then every PURGE_EVERY_SECONDS
+        while not self.stopping:
+            if time.monotonic() >= next_purge:
+                self.purged += self.store.purge(self.job_retention)
+                next_purge = time.monotonic() + PURGE_EVERY_SECONDS
+            if len(running) >= self.concurrency:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            job = self.store.claim_job(self.worker_id, kinds)
+            if job is None:
+                await asyncio.sleep(IDLE_POLL_SECONDS)
+                continue
+            task = asyncio.create_task(self._run(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if running:
+            await asyncio.wait(running)
+        self.purged += self.store.purge(self.job_retention) # Covers the jobs that finished since the last one
+        for cache, _ in self.context_caches.values():
+            await cache.close()
+        if self._closing:
+            await asyncio.wait(self._closing)
+
+    def stop(self, *_):
+        self.stopping = True
+
+
+def worker_main(store_path: str, concurrency: int = WORKER_CONCURRENCY):
+    """Entry point of one worker process."""
+    worker = JobWorker(store_path, concurrency=concurrency)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    asyncio.run(worker.serve())
+
+
+def start_workers(count: int, store_path: str, concurrency: int = WORKER_CONCURRENCY) -> list[multiprocessing.Process]:
+    """Starts `count` worker processes and returns them."""
+    processes = []
+    for _ in range(count):
+        process = multiprocessing.Process(target=worker_main, args=(store_path, concurrency), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def stop_workers(processes: list[multiprocessing.Process], timeout: float = 10.0):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(timeout)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Run Story-Verse in multi-worker mode.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    work_parser = commands.add_parser("work", help="Run generation workers against the shared store.")
+    work_parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    work_parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+
+    serve_parser = commands.add_parser("serve", help="Run several Streamlit app processes plus workers.")
+    serve_parser.add_argument("--app-workers", type=int, default=2)
+    serve_parser.add_argument("--job-workers", type=int, default=2)
+    serve_parser.add_argument("--base-port", type=int, default=8501)
+    serve_parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+
+    for sub in (work_parser, serve_parser):
+        sub.add_argument("--store", default=os.getenv("STORY_SHARED_STORE", "story_shared.db"))
+
+    args = parser.parse_args(argv)
+    store_path = os.path.abspath(args.store)
+    get_shared_store(store_path) # Create the schema once before the processes race for it
+
+    job_count = args.workers if args.command == "work" else args.job_workers
+    processes = start_workers(job_count, store_path, args.concurrency)
+    apps = []
+    if args.command == "serve":
+        environment = dict(os.environ, STORY_SHARED_STORE=store_path)
+        environment.setdefault("STORY_SESSION_DIR", os.path.abspath(".story_sessions"))
+        for i in range(args.app_workers):
+            port = args.base_port + i
+            apps.append(subprocess.Popen(
+                [sys.executable, "-m", "streamlit", "run", "story_verse_gui.py", "--server.port", str(port), "--server.headless", "true"],
+                env=environment
+            ))
+            print(f"App worker {i + 1} on http://localhost:{port}")
+    print(f"✅ {job_count} job workers running against '{store_path}'. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for app in apps:
+            app.terminate()
+        stop_workers(processes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())